@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+ANN 索引 recall / 延遲基準：以 Flat（精確）為基準，比較 IVF（不同 nprobe）與 HNSW（不同 efSearch），
+以及量化（sq8 / pq，含原始向量重新排序）的向量記憶體與 recall。
+
+向量來源與 load_test_server.py 相同走「假 embedding」路線（不載入 BGE 模型），但該伺服器的
+_FakeEmbeddings 回傳常數向量、無法衡量 recall，因此這裡改以文字雜湊決定的分群向量模擬：
+同主題的 chunk 彼此相近，查詢為某個 chunk 加上雜訊，貼近真實知識庫的分布。
+
+執行：
+    cd backend
+    python load_tests/benchmark_ann.py
+    python load_tests/benchmark_ann.py --sizes 20000,100000 --queries 200 --nprobe 8,16,32 --ef 32,64,128
+    python load_tests/benchmark_ann.py --sizes 50000 --quantization sq8,pq --rerank 1,4,8
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import importlib.util
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+BACKEND_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(BACKEND_ROOT))
+
+EMBED_DIM = 768  # 與 load_test_server.py / BGE 相同維度
+
+
+def _load_faiss_index_module():
+    # 直接以檔案載入，避免 services/__init__ 連帶載入 LLM / 向量相關重型依賴
+    path = BACKEND_ROOT / "services" / "faiss_index.py"
+    spec = importlib.util.spec_from_file_location("faiss_index_bench", path)
+    if spec is None or spec.loader is None:
+        raise RuntimeError(f"Cannot load module from {path}")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+fi = _load_faiss_index_module()
+
+
+class _HashedFakeEmbeddings:
+    """以文字雜湊決定主題中心 + 個別偏移的假 embedding（可重現）。"""
+
+    def __init__(self, dim: int = EMBED_DIM, topics: int = 512, spread: float = 0.35):
+        rng = np.random.default_rng(42)
+        self.dim = dim
+        self.centers = rng.standard_normal((topics, dim)).astype(np.float32)
+        self.spread = spread
+
+    def _vector(self, text: str) -> np.ndarray:
+        seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:8], "little")
+        rng = np.random.default_rng(seed)
+        center = self.centers[seed % len(self.centers)]
+        vec = center + self.spread * rng.standard_normal(self.dim).astype(np.float32)
+        return vec / np.linalg.norm(vec)
+
+    def embed_documents(self, texts):
+        return np.stack([self._vector(t) for t in texts]).astype(np.float32)
+
+
+def _corpus(n: int, embeddings: _HashedFakeEmbeddings) -> np.ndarray:
+    return embeddings.embed_documents([f"chunk-{i}" for i in range(n)])
+
+
+def _queries(vectors: np.ndarray, count: int) -> np.ndarray:
+    rng = np.random.default_rng(7)
+    picks = vectors[rng.choice(len(vectors), size=count, replace=False)]
+    noisy = picks + 0.05 * rng.standard_normal(picks.shape).astype(np.float32)
+    return (noisy / np.linalg.norm(noisy, axis=1, keepdims=True)).astype(np.float32)
+
+
+def _search(index, queries: np.ndarray, k: int):
+    latencies = []
+    results = []
+    for q in queries:
+        t0 = time.perf_counter()
+        _, ids = index.search(q.reshape(1, -1), k)
+        latencies.append((time.perf_counter() - t0) * 1000.0)
+        results.append(ids[0])
+    return np.stack(results), latencies
+
+
+def _recall(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(set(f.tolist()) & set(t.tolist())) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def _row(name: str, build_s: float, latencies, recall: float) -> str:
+    p50 = statistics.median(latencies)
+    p95 = sorted(latencies)[int(0.95 * (len(latencies) - 1))]
+    return f"  {name:<28} build={build_s:7.2f}s  p50={p50:7.3f}ms  p95={p95:7.3f}ms  recall@k={recall:.4f}"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="20000,100000", help="逗號分隔的 chunk 數")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5, help="與 llm_service 檢索 top-k 相同量級")
+    parser.add_argument("--nprobe", default="4,16,64")
+    parser.add_argument("--ef", default="16,64,128")
+    parser.add_argument("--dim", type=int, default=EMBED_DIM)
+    parser.add_argument("--quantization", default="sq8,pq", help="逗號分隔；空字串略過量化比較")
+    parser.add_argument("--rerank", default="1,4", help="VECTOR_RERANK_FACTOR（1 = 不重排）")
+    args = parser.parse_args()
+
+    embeddings = _HashedFakeEmbeddings(dim=args.dim)
+    for size in [int(s) for s in args.sizes.split(",") if s.strip()]:
+        vectors = _corpus(size, embeddings)
+        queries = _queries(vectors, min(args.queries, size))
+        print(f"\n=== chunks={size} dim={args.dim} queries={len(queries)} k={args.k} ===")
+
+        t0 = time.perf_counter()
+        flat = fi.build_index("flat", vectors, args.dim)
+        flat_build = time.perf_counter() - t0
+        truth, flat_lat = _search(flat, queries, args.k)
+        print(_row("flat (exact)", flat_build, flat_lat, 1.0))
+
+        t0 = time.perf_counter()
+        ivf = fi.build_index("ivf", vectors, args.dim)
+        ivf_build = time.perf_counter() - t0
+        for nprobe in [int(x) for x in args.nprobe.split(",") if x.strip()]:
+            os.environ["VECTOR_IVF_NPROBE"] = str(nprobe)
+            fi.apply_search_params(ivf)
+            found, lat = _search(ivf, queries, args.k)
+            print(_row(f"ivf nlist={fi.ivf_nlist(size)} nprobe={nprobe}", ivf_build, lat, _recall(found, truth)))
+
+        t0 = time.perf_counter()
+        hnsw = fi.build_index("hnsw", vectors, args.dim)
+        hnsw_build = time.perf_counter() - t0
+        for ef in [int(x) for x in args.ef.split(",") if x.strip()]:
+            os.environ["VECTOR_HNSW_EF_SEARCH"] = str(ef)
+            fi.apply_search_params(hnsw)
+            found, lat = _search(hnsw, queries, args.k)
+            print(_row(f"hnsw efSearch={ef}", hnsw_build, lat, _recall(found, truth)))
+
+        for quantization in [q.strip() for q in args.quantization.split(",") if q.strip()]:
+            mode = fi.effective_quantization(quantization, size)
+            t0 = time.perf_counter()
+            quantized = fi.build_index("flat", vectors, args.dim, mode)
+            build = time.perf_counter() - t0
+            code_bytes = size * fi.vector_code_size(quantized)
+            print(f"  {mode}: vectors {vectors.nbytes / 2**20:.1f}MB → {code_bytes / 2**20:.1f}MB")
+            for factor in [int(x) for x in args.rerank.split(",") if x.strip()]:
+                os.environ["VECTOR_RERANK_FACTOR"] = str(factor)
+                index = fi.with_reranking(quantized, lambda labels: vectors[labels])
+                found, lat = _search(index, queries, args.k)
+                print(_row(f"{mode} rerank={factor}", build, lat, _recall(found, truth)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+BM25 檢索延遲基準：合成語料 1k ~ 200k chunks，比較
+  - maxscore : BM25Index.search(prune=True)（正式路徑）
+  - postings : BM25Index.search(prune=False)（走訪查詢詞全部 postings）
+  - sparse   : BM25Index.search(backend="sparse")（NumPy CSR 向量化計分）
+  - legacy   : 舊版每回合重新切詞整個語料並逐筆計分（僅小語料執行）
+
+執行：
+    cd backend
+    python load_tests/benchmark_bm25.py
+    python load_tests/benchmark_bm25.py --sizes 1000,10000 --queries 200
+"""
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import math
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+BACKEND_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(BACKEND_ROOT))
+
+
+def _load_bm25_module():
+    # 直接以檔案載入，避免 services/__init__ 連帶載入 LLM / 向量相關重型依賴
+    path = BACKEND_ROOT / "services" / "bm25_index.py"
+    spec = importlib.util.spec_from_file_location("bm25_index_bench", path)
+    if spec is None or spec.loader is None:
+        raise RuntimeError(f"Cannot load module from {path}")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+bm25 = _load_bm25_module()
+
+# 常用中文字 + 少量英文詞，以 Zipf 分佈抽樣，模擬中文知識庫 chunk（約 300 字）
+_CJK = [chr(c) for c in range(0x4E00, 0x4E00 + 3000)]
+_WORDS = [f"item{i}" for i in range(2000)]
+_VOCAB = _CJK + _WORDS
+_ZIPF_WEIGHTS = [1.0 / (rank + 1) ** 1.05 for rank in range(len(_VOCAB))]
+
+
+def _make_corpus(size: int, rng: random.Random, chunk_tokens: int) -> list[tuple[str, str]]:
+    corpus = []
+    for i in range(size):
+        toks = rng.choices(_VOCAB, weights=_ZIPF_WEIGHTS, k=chunk_tokens)
+        corpus.append((f"doc-{i}", " ".join(toks)))
+    return corpus
+
+
+def _make_queries(corpus: list[tuple[str, str]], rng: random.Random, count: int, query_tokens: int) -> list[str]:
+    queries = []
+    for _ in range(count):
+        _, text = rng.choice(corpus)
+        toks = text.split()
+        start = rng.randrange(0, max(1, len(toks) - query_tokens))
+        queries.append(" ".join(toks[start:start + query_tokens]))
+    return queries
+
+
+def _legacy_search(corpus: list[tuple[str, str]], query: str, top_k: int):
+    tokenized = [bm25.tokenize_for_bm25(text) for _, text in corpus]
+    n = len(tokenized)
+    avgdl = sum(len(t) for t in tokenized) / max(1, n)
+    df: dict[str, int] = {}
+    for toks in tokenized:
+        for t in set(toks):
+            df[t] = df.get(t, 0) + 1
+    idf = {t: math.log(1.0 + (n - f + 0.5) / (f + 0.5)) for t, f in df.items()}
+    query_tokens = bm25.tokenize_for_bm25(query)
+    scored = [
+        (doc_id, bm25.bm25_score(query_tokens, toks, idf, avgdl))
+        for (doc_id, _), toks in zip(corpus, tokenized)
+    ]
+    scored = [x for x in scored if x[1] > 0]
+    scored.sort(key=lambda x: x[1], reverse=True)
+    return scored[:top_k]
+
+
+def _percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[idx]
+
+
+def _time_queries(fn, queries: list[str]) -> list[float]:
+    samples = []
+    for q in queries:
+        t0 = time.perf_counter()
+        fn(q)
+        samples.append((time.perf_counter() - t0) * 1000.0)
+    return samples
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="BM25 倒排索引查詢延遲基準")
+    parser.add_argument("--sizes", default="1000,10000,50000,200000")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--top-k", type=int, default=20)
+    parser.add_argument("--chunk-tokens", type=int, default=150)
+    parser.add_argument("--query-tokens", type=int, default=8)
+    parser.add_argument("--legacy-max", type=int, default=10000, help="舊版全量掃描只跑到此語料大小")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+
+    print(f"{'chunks':>8} {'build_s':>8} {'mode':>9} {'p50_ms':>9} {'p95_ms':>9} {'mean_ms':>9}")
+    for size in sizes:
+        corpus = _make_corpus(size, rng, args.chunk_tokens)
+        queries = _make_queries(corpus, rng, args.queries, args.query_tokens)
+
+        t0 = time.perf_counter()
+        index = bm25.BM25Index.from_documents(corpus)
+        build_s = time.perf_counter() - t0
+
+        # 首次查詢會填入各詞分數上界快取與 CSR 矩陣，先預熱一輪
+        for q in queries:
+            index.search(q, args.top_k)
+        index.search(queries[0], args.top_k, backend="sparse")
+
+        modes = [
+            ("maxscore", lambda q: index.search(q, args.top_k, prune=True)),
+            ("postings", lambda q: index.search(q, args.top_k, prune=False)),
+            ("sparse", lambda q: index.search(q, args.top_k, backend="sparse")),
+        ]
+        if size <= args.legacy_max:
+            legacy_queries = queries[: max(1, min(len(queries), 10))]
+            modes.append(("legacy", lambda q: _legacy_search(corpus, q, args.top_k)))
+        else:
+            legacy_queries = []
+
+        for mode, fn in modes:
+            samples = _time_queries(fn, legacy_queries if mode == "legacy" else queries)
+            print(
+                f"{size:>8} {build_s:>8.2f} {mode:>9} "
+                f"{_percentile(samples, 50):>9.2f} {_percentile(samples, 95):>9.2f} "
+                f"{statistics.mean(samples):>9.2f}"
+            )
+
+        # 剪枝結果必須與全量計分一致
+        for q in queries[:20]:
+            pruned = index.search(q, args.top_k, prune=True)
+            full = index.search(q, args.top_k, prune=False)
+            if [round(s, 9) for _, s in pruned] != [round(s, 9) for _, s in full]:
+                raise AssertionError(f"MaxScore 結果與全量計分不一致 size={size} query={q!r}")
+
+
+if __name__ == "__main__":
+    main()
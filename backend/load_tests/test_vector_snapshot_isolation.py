@@ -0,0 +1,490 @@
+"""
+驗證 vector_service 的 copy-on-write 快照：寫入進行中（尚未發布）時，持有舊快照的查詢
+得到的向量與 BM25 結果都不變；發布後新快照同時換上新向量與新 BM25。
+查詢端自磁碟載入不持寫入鎖：寫入 / 合併進行中仍立即讀到最後一次提交的內容。
+
+需要實際的 faiss / langchain（embedding 以雜湊假向量取代，不載入模型）。
+
+執行：
+    cd backend
+    python load_tests/test_vector_snapshot_isolation.py
+"""
+from __future__ import annotations
+
+import atexit
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import numpy as np
+
+BACKEND_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(BACKEND_ROOT))
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ["INGEST_PROCESS_WORKERS"] = "0"
+os.environ["INGEST_BATCH_CHUNKS"] = "2"
+WORK_DIR = tempfile.mkdtemp(prefix="vector-snapshot-")
+atexit.register(shutil.rmtree, WORK_DIR, ignore_errors=True)
+os.chdir(WORK_DIR)
+
+DIM = 32
+
+
+def _install_import_stubs() -> None:
+    # 以下模組只用於摘要 / 語言偵測 / token 計數，與快照無關
+    for name in ("transformers", "rake_nltk", "langid"):
+        sys.modules.setdefault(name, MagicMock())
+    encoding = types.SimpleNamespace(encode=lambda text: list(text))
+    sys.modules["tiktoken"] = types.SimpleNamespace(get_encoding=lambda _name: encoding)
+
+
+class _HashEmbeddings:
+    """同一文字永遠得到同一向量的假 embedding。"""
+
+    def _vector(self, text: str) -> list[float]:
+        seed = int(hashlib.md5(text.encode("utf-8")).hexdigest()[:8], 16)
+        return np.random.default_rng(seed).standard_normal(DIM).astype("float32").tolist()
+
+    def embed_documents(self, texts):
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text):
+        return self._vector(text)
+
+    def __call__(self, text):
+        return self.embed_query(text)
+
+
+_install_import_stubs()
+from services import vector_segments  # noqa: E402
+from services import vector_service as vsm  # noqa: E402
+
+vsm._bge_embeddings = _HashEmbeddings()
+
+
+def _write_text(name: str, paragraphs: list[str]) -> tuple[str, str]:
+    content = "\n\n".join(paragraphs)
+    path = os.path.join(WORK_DIR, name)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+    return path, content
+
+
+def _vector_hits(store, query: str) -> list[str]:
+    return [doc.page_content for doc in store.similarity_search(query, k=1)]
+
+
+def _bm25_hits(store, bm25, query: str) -> list[str]:
+    return [store.docstore.search(doc_id).page_content for doc_id, _ in bm25.search(query, 5)]
+
+
+class _PausedPublish:
+    """寫入完成、發布前暫停，讓測試在「寫入進行中」的時間點查詢。"""
+
+    def __init__(self) -> None:
+        self.reached = threading.Event()
+        self.release = threading.Event()
+        self._publish = vsm._publish_vector_store
+
+    def __enter__(self):
+        def _paused(aid, vs):
+            self.reached.set()
+            self.release.wait(30)
+            self._publish(aid, vs)
+
+        vsm._publish_vector_store = _paused
+        return self
+
+    def __exit__(self, *args):
+        vsm._publish_vector_store = self._publish
+        self.release.set()
+        return False
+
+
+def test_reader_keeps_old_vectors_and_bm25_during_write() -> None:
+    aid = 910001
+    old_text, new_text = "蘋果 香蕉 橘子", "火車 飛機 輪船"
+    path, content = _write_text("old.txt", [old_text])
+    created = vsm._update_knowledge_base_heavy_sync(aid, path, "kb.txt", content, [], None)
+    old_ids = created["doc_ids_string"].split(", ")
+
+    old = vsm.get_vector_store(aid)
+    old_bm25 = vsm.get_bm25_index(aid, old)
+    assert _vector_hits(old, old_text) == [old_text]
+    assert _bm25_hits(old, old_bm25, "蘋果") == [old_text]
+
+    path, content = _write_text("new.txt", [new_text])
+    result: dict = {}
+    with _PausedPublish() as paused:
+        writer = threading.Thread(
+            target=lambda: result.update(vsm._update_knowledge_base_heavy_sync(aid, path, "kb.txt", content, old_ids, old))
+        )
+        writer.start()
+        assert paused.reached.wait(30), "寫入未進入發布階段"
+
+        # 草稿已刪除舊向量、寫入新內容，但尚未發布
+        assert vsm.get_vector_store(aid) is old
+        assert vsm.get_bm25_index(aid, old) is old_bm25
+        assert _vector_hits(old, old_text) == [old_text]
+        assert _bm25_hits(old, old_bm25, "蘋果") == [old_text]
+        assert _bm25_hits(old, old_bm25, "火車") == []
+
+        paused.release.set()
+        writer.join(30)
+
+    new = vsm.get_vector_store(aid)
+    new_bm25 = vsm.get_bm25_index(aid, new)
+    assert new is result["vs"] and new is not old
+    assert _vector_hits(new, new_text) == [new_text]
+    assert _bm25_hits(new, new_bm25, "火車") == [new_text]
+    assert _bm25_hits(new, new_bm25, "蘋果") == []
+    # 發布後，仍持有舊快照的查詢看到的也還是舊內容
+    assert _bm25_hits(old, old_bm25, "蘋果") == [old_text]
+    assert len(old_bm25) == old.index.ntotal == 1
+    print("PASS: 寫入進行中舊快照的向量與 BM25 不變，發布後一起切換")
+
+
+class _PausedIngest:
+    """串流上傳寫入第 pause_at 批之前暫停（或改為拋出例外），此時前幾批已加入草稿的向量與 BM25。"""
+
+    def __init__(self, pause_at: int, fail: bool = False) -> None:
+        self.pause_at = pause_at
+        self.fail = fail
+        self.calls = 0
+        self.reached = threading.Event()
+        self.release = threading.Event()
+        self._write = vsm._write_ingested_batch
+
+    def __enter__(self):
+        def _paused(*args):
+            self.calls += 1
+            if self.calls == self.pause_at:
+                if self.fail:
+                    raise RuntimeError("ingest failed")
+                self.reached.set()
+                self.release.wait(30)
+            return self._write(*args)
+
+        vsm._write_ingested_batch = _paused
+        return self
+
+    def __exit__(self, *args):
+        vsm._write_ingested_batch = self._write
+        self.release.set()
+        return False
+
+
+def test_streaming_reupload_keeps_published_bm25_until_publish() -> None:
+    aid = 910003
+    old_paragraphs = [f"蘋果 第{i}段 " + "果園" * 150 for i in range(4)]
+    new_paragraphs = [f"火車 第{i}段 " + "鐵道" * 150 for i in range(4)]
+    path, _ = _write_text("stream-old.txt", old_paragraphs)
+    created = vsm._process_and_store_file_heavy_sync(aid, path, "kb.txt", "txt", None)
+    old = vsm.get_vector_store(aid)
+    old_bm25 = vsm.get_bm25_index(aid, old)
+    old_apple = _bm25_hits(old, old_bm25, "蘋果")
+    assert old_apple and len(old_bm25) == old.index.ntotal
+
+    path, _ = _write_text("stream-new.txt", new_paragraphs)
+    result: dict = {}
+    with _PausedIngest(pause_at=2) as paused:
+        writer = threading.Thread(target=lambda: result.update(vsm._process_and_store_file_heavy_sync(
+            aid, path, "kb.txt", "txt", old, created["doc_ids"]
+        )))
+        writer.start()
+        assert paused.reached.wait(30), "上傳未進入第二批"
+
+        # 第一批已刪除舊 chunk、加入新 chunk（皆只在草稿上）
+        assert vsm.get_vector_store(aid) is old
+        assert vsm.get_bm25_index(aid, old) is old_bm25
+        assert _bm25_hits(old, old_bm25, "蘋果") == old_apple
+        assert _bm25_hits(old, old_bm25, "火車") == []
+
+        paused.release.set()
+        writer.join(30)
+
+    new = vsm.get_vector_store(aid)
+    new_bm25 = vsm.get_bm25_index(aid, new)
+    assert new is result["vs"]
+    assert _bm25_hits(new, new_bm25, "蘋果") == []
+    assert _bm25_hits(new, new_bm25, "火車") and len(new_bm25) == new.index.ntotal
+    assert _bm25_hits(old, old_bm25, "蘋果") == old_apple
+
+    # 上傳中途失敗：已發布的快照與磁碟上的 BM25 都不變
+    path, _ = _write_text("stream-bad.txt", [f"輪船 第{i}段 " + "港口" * 150 for i in range(4)])
+    with _PausedIngest(pause_at=2, fail=True):
+        try:
+            vsm._process_and_store_file_heavy_sync(aid, path, "bad.txt", "txt", new)
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError("預期上傳失敗")
+    # 成功的上傳可能已排程背景合併（內容不變、快照物件可能被替換），因此比對內容而非物件
+    current = vsm.get_vector_store(aid)
+    current_bm25 = vsm.get_bm25_index(aid, current)
+    assert current._disk_generation == new._disk_generation
+    assert len(current_bm25) == current.index.ntotal == new.index.ntotal
+    assert _bm25_hits(current, current_bm25, "輪船") == [] and _bm25_hits(new, new_bm25, "輪船") == []
+    vsm.invalidate_vector_store_cache(aid)
+    reloaded = vsm.get_vector_store(aid)
+    reloaded_bm25 = vsm.get_bm25_index(aid, reloaded)
+    assert len(reloaded_bm25) == reloaded.index.ntotal == new.index.ntotal
+    assert _bm25_hits(reloaded, reloaded_bm25, "輪船") == []
+    print("PASS: 串流上傳各批只寫入草稿的 BM25，發布前舊快照不變，失敗時直接丟棄")
+
+
+def test_bm25_reloads_from_disk_with_its_snapshot() -> None:
+    aid = 910002
+    path, content = _write_text("disk.txt", ["資料庫 索引 查詢", "網路 封包 路由"])
+    vsm._update_knowledge_base_heavy_sync(aid, path, "kb.txt", content, [], None)
+    vsm.invalidate_vector_store_cache(aid)
+
+    store = vsm.get_vector_store(aid)
+    assert getattr(store, "_bm25_index", None) is None
+    bm25 = vsm.get_bm25_index(aid, store)
+    assert bm25.generation == store._disk_generation
+    assert len(bm25) == store.index.ntotal
+    hits = _bm25_hits(store, bm25, "封包")
+    assert hits and all("封包" in text for text in hits)
+    assert _bm25_hits(store, bm25, "飛機") == []
+    print("PASS: BM25 檔案帶版本 token，與同版本的快照一起載回")
+
+
+def _call_in_thread(fn, timeout: float = 10.0):
+    """在另一執行緒呼叫 fn；逾時代表被寫入鎖擋住。"""
+    result: dict = {}
+    worker = threading.Thread(target=lambda: result.update(value=fn()), daemon=True)
+    worker.start()
+    worker.join(timeout)
+    assert not worker.is_alive(), "讀取被寫入中的上傳阻塞"
+    return result["value"]
+
+
+def test_readers_load_committed_files_without_the_write_lock() -> None:
+    aid = 910004
+    path, _ = _write_text("lockfree-old.txt", [f"蘋果 第{i}段 " + "果園" * 150 for i in range(4)])
+    created = vsm._process_and_store_file_heavy_sync(aid, path, "kb.txt", "txt", None)
+    committed = vsm.get_vector_store(aid)
+
+    path, _ = _write_text("lockfree-new.txt", [f"火車 第{i}段 " + "鐵道" * 150 for i in range(4)])
+    with _PausedIngest(pause_at=3) as paused:
+        writer = threading.Thread(target=lambda: vsm._process_and_store_file_heavy_sync(
+            aid, path, "kb.txt", "txt", committed, created["doc_ids"]
+        ))
+        writer.start()
+        assert paused.reached.wait(30), "上傳未進入第三批"
+
+        # 寫入端持有 faiss_disk_lock 且已寫入未提交的增量區段 / 墓碑；清除快照後自磁碟重新載入
+        vsm.invalidate_vector_store_cache(aid)
+        store = _call_in_thread(lambda: vsm.get_vector_store(aid))
+        bm25 = _call_in_thread(lambda: vsm.get_bm25_index(aid, store))
+        assert store.index.ntotal == len(store.index_to_docstore_id) == committed.index.ntotal
+        assert set(store.index_to_docstore_id.values()) == set(committed.index_to_docstore_id.values())
+        assert _bm25_hits(store, bm25, "蘋果") and _bm25_hits(store, bm25, "火車") == []
+
+        paused.release.set()
+        writer.join(30)
+    print("PASS: 上傳進行中，查詢端不等寫入鎖即載入最後一次提交的向量庫與 BM25")
+
+
+def test_new_store_is_invisible_until_published() -> None:
+    aid = 910005
+    path, _ = _write_text("fresh.txt", [f"輪船 第{i}段 " + "港口" * 150 for i in range(4)])
+    result: dict = {}
+    with _PausedIngest(pause_at=3) as paused:
+        writer = threading.Thread(
+            target=lambda: result.update(vsm._process_and_store_file_heavy_sync(aid, path, "kb.txt", "txt", None))
+        )
+        writer.start()
+        assert paused.reached.wait(30), "上傳未進入第三批"
+
+        # 前兩批已寫成增量區段，但主檔尚未寫入
+        assert not vsm.disk_vector_store_exists(aid)
+        assert _call_in_thread(lambda: vsm.get_vector_store(aid)) is None
+
+        paused.release.set()
+        writer.join(30)
+
+    vsm.invalidate_vector_store_cache(aid)
+    store = vsm.get_vector_store(aid)
+    assert store.index.ntotal == len(result["doc_ids"])
+    assert sorted(store.index_to_docstore_id.values()) == sorted(result["doc_ids"])
+    print("PASS: 新向量庫的主檔於發布前才寫入，上傳中查詢端看不到一半的內容")
+
+
+def _make_legacy_store(aid: int) -> None:
+    """改寫成系列變更之前的格式：沒有 segments.json，chunk 檔 header 沒有 base_seq / base_id。"""
+    from services.chunk_store import MmapDocstore, write_chunk_store
+
+    prefix = vsm._vector_store_prefix(aid)
+    chunk_path = vector_segments.base_chunks_path(prefix)
+    docstore = MmapDocstore.open(chunk_path)
+    items = [(doc_id, docstore.search(doc_id)) for doc_id in docstore.iter_ids()]
+    docstore.close()
+    write_chunk_store(chunk_path, items)
+    os.remove(vector_segments.manifest_path(prefix))
+    vsm.invalidate_vector_store_cache(aid)
+
+
+def test_failed_upload_on_legacy_store_is_not_replayed() -> None:
+    aid = 910007
+    path, _ = _write_text("legacy-old.txt", [f"蘋果 第{i}段 " + "果園" * 150 for i in range(4)])
+    created = vsm._process_and_store_file_heavy_sync(aid, path, "kb.txt", "txt", None)
+    _make_legacy_store(aid)
+    prefix = vsm._vector_store_prefix(aid)
+    # 修正前失敗的上傳留下的區段：沒有 manifest 時不是已提交的內容
+    stray_doc = created["vs"].docstore.search(created["doc_ids"][0])
+    vector_segments.write_delta(prefix, 1, np.ones((1, DIM), dtype=np.float32), [("stray", stray_doc)])
+
+    path, _ = _write_text("legacy-bad.txt", [f"輪船 第{i}段 " + "港口" * 150 for i in range(6)])
+    with _PausedIngest(pause_at=3, fail=True) as ingest:
+        try:
+            vsm._process_and_store_file_heavy_sync(aid, path, "bad.txt", "txt", None)
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError("預期上傳失敗")
+    assert ingest.calls == 3
+
+    # 持鎖寫入前已補寫初始 manifest；失敗的上傳寫入的區段已清除
+    manifest = vector_segments.read_manifest(prefix)
+    assert manifest.base_id is not None and manifest.last_seq == 0
+    assert vector_segments.list_deltas(prefix) == []
+    vsm.invalidate_vector_store_cache(aid)
+    store = vsm.get_vector_store(aid)
+    assert store.docstore.base_id == manifest.base_id
+    assert sorted(store.index_to_docstore_id.values()) == sorted(created["doc_ids"])
+    print("PASS: 舊版向量庫補寫初始 manifest，失敗上傳的增量區段不會在重新載入時重播")
+
+
+def test_legacy_store_is_loaded_under_the_lock_until_stamped() -> None:
+    aid = 910008
+    path, _ = _write_text("legacy-read.txt", [f"蘋果 第{i}段 " + "果園" * 150 for i in range(4)])
+    created = vsm._process_and_store_file_heavy_sync(aid, path, "kb.txt", "txt", None)
+    _make_legacy_store(aid)
+    prefix = vsm._vector_store_prefix(aid)
+
+    # 無 manifest / base_id：不走不持鎖的讀取，持鎖載入時補寫初始 manifest
+    store = vsm._read_committed_vector_store(aid)
+    manifest = vector_segments.read_manifest(prefix)
+    assert manifest.base_id is not None and store.docstore.base_id == manifest.base_id
+    assert sorted(store.index_to_docstore_id.values()) == sorted(created["doc_ids"])
+
+    _make_legacy_store(aid)
+    path, _ = _write_text("legacy-new.txt", [f"火車 第{i}段 " + "鐵道" * 150 for i in range(6)])
+    with _PausedIngest(pause_at=3) as paused:
+        writer = threading.Thread(target=lambda: vsm._process_and_store_file_heavy_sync(
+            aid, path, "new.txt", "txt", None
+        ))
+        writer.start()
+        assert paused.reached.wait(30), "上傳未進入第三批"
+
+        # 寫入端已補寫 manifest 並寫入兩批未提交的增量區段：查詢端不持鎖讀到的仍是原本的內容
+        assert len(vector_segments.list_deltas(prefix)) == 2
+        store = _call_in_thread(lambda: vsm._read_committed_vector_store(aid))
+        assert store.docstore.base_id == vector_segments.read_manifest(prefix).base_id
+        assert sorted(store.index_to_docstore_id.values()) == sorted(created["doc_ids"])
+
+        paused.release.set()
+        writer.join(30)
+    print("PASS: 舊版向量庫先持鎖載入並補寫 manifest，之後不持鎖的讀取看不到進行中的上傳")
+
+
+def test_rerun_removes_chunks_published_by_an_interrupted_job() -> None:
+    aid = 910009
+    path, _ = _write_text("kept.txt", [f"蘋果 第{i}段 " + "果園" * 150 for i in range(2)])
+    kept = vsm._process_and_store_file_heavy_sync(aid, path, "kept.txt", "txt", None)
+    path, _ = _write_text("job.txt", [f"火車 第{i}段 " + "鐵道" * 150 for i in range(4)])
+    # 第一次執行已發布，但 doc_id 未記入 pending_doc_ids（發布後當機 / 取消後執行緒仍完成發布）
+    first = vsm._process_and_store_file_heavy_sync(aid, path, "job.txt", "txt", None, [], None, None, "job-1")
+    assert all(
+        first["vs"].docstore.search(did).metadata[vsm.UPLOAD_JOB_METADATA_KEY] == "job-1" for did in first["doc_ids"]
+    )
+
+    vsm.invalidate_vector_store_cache(aid)
+    second = vsm._process_and_store_file_heavy_sync(aid, path, "job.txt", "txt", None, [], None, None, "job-1")
+
+    store = second["vs"]
+    assert sorted(store.index_to_docstore_id.values()) == sorted(kept["doc_ids"] + second["doc_ids"])
+    assert store.index.ntotal == len(kept["doc_ids"]) + len(second["doc_ids"])
+    print("PASS: 重跑上傳工作時刪除前次執行已發布、未記錄 doc_id 的 chunk")
+
+
+def test_lock_free_reads_stay_consistent_during_writes_and_compaction() -> None:
+    aid = 910006
+    path, content = _write_text("compact.txt", [f"第{i}段 主題{i % 3} " + "內容" * 150 for i in range(6)])
+    vsm._update_knowledge_base_heavy_sync(aid, path, "a.txt", content, [], None)
+    committed: list = []
+    old_ids: list[str] = []
+
+    def _replace_b(round_no: int) -> None:
+        # 以增量區段 + 墓碑取代 b.txt；提交後的內容記入 committed（不會出現「b.txt 被刪除而未加入」的狀態）
+        nonlocal old_ids
+        path, content = _write_text("compact-more.txt", [f"補充{round_no} 第{i}段 " + "資料" * 150 for i in range(3)])
+        result = vsm._update_knowledge_base_heavy_sync(aid, path, "b.txt", content, old_ids, vsm.get_vector_store(aid))
+        old_ids = result["doc_ids_string"].split(", ")
+        committed.append(frozenset(result["vs"].index_to_docstore_id.values()))
+
+    _replace_b(0)
+    stop = threading.Event()
+    errors: list = []
+
+    def _write_and_compact() -> None:
+        try:
+            for round_no in range(1, 13):
+                if stop.is_set():
+                    break
+                _replace_b(round_no)
+                if round_no % 2:
+                    vsm.compact_vector_store(aid, force=True)
+        except Exception as e:  # noqa: BLE001
+            errors.append(e)
+
+    # 提交前稍作停頓，放大「檔案已替換 / 已追加、manifest 尚未提交」的時間窗
+    write_manifest = vector_segments.write_manifest
+
+    def _slow_write_manifest(prefix, manifest):
+        time.sleep(0.05)
+        write_manifest(prefix, manifest)
+
+    vector_segments.write_manifest = _slow_write_manifest
+    writer = threading.Thread(target=_write_and_compact)
+    writer.start()
+    loaded = []
+    try:
+        while writer.is_alive():
+            store = vsm._read_committed_vector_store(aid)
+            ids = list(store.index_to_docstore_id.values())
+            assert store.index.ntotal == len(ids) == len(set(ids)), "讀到混合兩次提交的檔案"
+            loaded.append(frozenset(ids))
+    finally:
+        stop.set()
+        writer.join(60)
+        vector_segments.write_manifest = write_manifest
+    assert not errors, errors
+    assert all(ids in committed for ids in loaded), "讀到未提交的內容"
+    print(f"PASS: 寫入 / 合併進行中，不持鎖的讀取每次都得到某一次完整的提交（reads={len(loaded)}）")
+
+
+def main() -> None:
+    test_reader_keeps_old_vectors_and_bm25_during_write()
+    test_streaming_reupload_keeps_published_bm25_until_publish()
+    test_bm25_reloads_from_disk_with_its_snapshot()
+    test_readers_load_committed_files_without_the_write_lock()
+    test_new_store_is_invisible_until_published()
+    test_failed_upload_on_legacy_store_is_not_replayed()
+    test_legacy_store_is_loaded_under_the_lock_until_stamped()
+    test_rerun_removes_chunks_published_by_an_interrupted_job()
+    test_lock_free_reads_stay_consistent_during_writes_and_compaction()
+    print("\n全部向量庫快照隔離測試通過")
+
+
+if __name__ == "__main__":
+    main()
@@ -25,9 +25,10 @@ from models.database import (
     Base,
     engine,
     ensure_conversations_client_ip_column,
+    ensure_knowledge_base_summary_columns,
     ensure_users_name_column,
 )
-from models.models import AssistantNotebook, SpeechCorrectionRule  # noqa: F401 — register tables before create_all
+from models.models import AssistantNotebook, SpeechCorrectionRule, UploadJob  # noqa: F401 — register tables before create_all
 from services.assistant_prompt_storage import ensure_description_use_file_column
 from middleware.request_audit import RequestAuditMiddleware
 from utils.logger import setup_logging, get_logger
@@ -41,6 +42,7 @@ Base.metadata.create_all(bind=engine)
 ensure_description_use_file_column(engine)
 ensure_conversations_client_ip_column(engine)
 ensure_users_name_column(engine)
+ensure_knowledge_base_summary_columns(engine)
 
 app = FastAPI()
 
@@ -71,6 +73,14 @@ def startup_event():
     except Exception as e:
         logger.warning("Prewarm STT model failed (continuing): %s", e)
 
+    # 背景預熱最近活躍助理的向量庫；不等待完成，服務立即就緒
+    try:
+        from services.vector_warmup import start_vector_warmup
+
+        start_vector_warmup()
+    except Exception as e:
+        logger.warning("Start vector store warm-up failed (continuing): %s", e)
+
 
 @app.on_event("startup")
 async def startup_stt_queue_event():
@@ -102,6 +112,48 @@ async def startup_rag_queue_event():
         logger.warning("Start RAG queue failed (continuing): %s", e)
 
 
+@app.on_event("startup")
+async def startup_upload_jobs_event():
+    # 上傳背景工作的心跳與復原（接手已停止 worker 未完成的工作）
+    try:
+        from services.upload_jobs import start_upload_jobs
+
+        start_upload_jobs()
+    except Exception as e:
+        logger.warning("Start upload jobs failed (continuing): %s", e)
+
+
+@app.on_event("startup")
+async def startup_knowledge_summary_event():
+    # 延後產生的知識庫摘要：補做上次行程結束前未完成的摘要
+    try:
+        from services.knowledge_summary import start_knowledge_summary
+
+        start_knowledge_summary()
+    except Exception as e:
+        logger.warning("Start knowledge summary worker failed (continuing): %s", e)
+
+
+@app.on_event("shutdown")
+async def shutdown_knowledge_summary_event():
+    try:
+        from services.knowledge_summary import stop_knowledge_summary
+
+        await stop_knowledge_summary()
+    except Exception as e:
+        logger.warning("Stop knowledge summary worker failed (continuing): %s", e)
+
+
+@app.on_event("shutdown")
+async def shutdown_upload_jobs_event():
+    try:
+        from services.upload_jobs import stop_upload_jobs
+
+        await stop_upload_jobs()
+    except Exception as e:
+        logger.warning("Stop upload jobs failed (continuing): %s", e)
+
+
 @app.on_event("shutdown")
 async def shutdown_rag_queue_event():
     try:
@@ -111,6 +163,56 @@ async def shutdown_rag_queue_event():
     except Exception as e:
         logger.warning("Stop RAG queue failed (continuing): %s", e)
 
+
+@app.on_event("shutdown")
+def shutdown_ingest_pool_event():
+    try:
+        from services.document_ingest import shutdown_ingest_pool
+
+        shutdown_ingest_pool()
+    except Exception as e:
+        logger.warning("Stop ingest process pool failed (continuing): %s", e)
+
+
+@app.on_event("shutdown")
+def shutdown_ingest_pipeline_event():
+    try:
+        from services.ingest_pipeline import shutdown_ingest_pipeline
+
+        shutdown_ingest_pipeline()
+    except Exception as e:
+        logger.warning("Stop ingest pipeline failed (continuing): %s", e)
+
+
+@app.on_event("shutdown")
+async def shutdown_llm_client_pool_event():
+    try:
+        from services.llm_client_pool import aclose_all
+
+        await aclose_all()
+    except Exception as e:
+        logger.warning("Close LLM client pool failed (continuing): %s", e)
+
+
+@app.on_event("shutdown")
+def shutdown_vector_warmup_event():
+    try:
+        from services.vector_warmup import stop_vector_warmup
+
+        stop_vector_warmup()
+    except Exception as e:
+        logger.warning("Stop vector store warm-up failed (continuing): %s", e)
+
+
+@app.on_event("shutdown")
+def shutdown_query_embedding_cache_event():
+    try:
+        from services.vector_service import save_query_embedding_cache
+
+        save_query_embedding_cache()
+    except Exception as e:
+        logger.warning("Save query embedding cache failed (continuing): %s", e)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
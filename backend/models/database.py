@@ -100,3 +100,23 @@ def ensure_users_name_column(engine: Engine) -> None:
                 conn.commit()
             except Exception:
                 conn.rollback()
+
+
+def ensure_knowledge_base_summary_columns(engine: Engine) -> None:
+    """啟動時補上 knowledge_base.content_hash / summary_status / 摘要認領欄位（舊列視為摘要已完成）。"""
+    url = str(engine.url).lower()
+    if "sqlite" not in url and "mysql" not in url:
+        return
+    statements = (
+        "ALTER TABLE knowledge_base ADD COLUMN content_hash VARCHAR(64) NULL",
+        "ALTER TABLE knowledge_base ADD COLUMN summary_status VARCHAR(16) NOT NULL DEFAULT 'done'",
+        "ALTER TABLE knowledge_base ADD COLUMN summary_worker VARCHAR(128) NULL",
+        "ALTER TABLE knowledge_base ADD COLUMN summary_heartbeat_at DATETIME NULL",
+    )
+    with engine.connect() as conn:
+        for statement in statements:
+            try:
+                conn.execute(text(statement))
+                conn.commit()
+            except Exception:
+                conn.rollback()
@@ -114,6 +114,13 @@ class KnowledgeBase(Base):
     comment = Column(String(255), nullable=True)
     token_count = Column(Integer, nullable=False)
     upload_date = Column(DateTime, default=datetime.utcnow)
+    # 內容的 SHA-256；重新上傳 / 編輯後內容相同時沿用既有摘要（services.knowledge_summary）
+    content_hash = Column(String(64), nullable=True)
+    # 摘要於向量寫入後延後產生：pending / running / done / failed
+    summary_status = Column(String(16), nullable=False, default="done")
+    # running 時產生摘要的行程與其心跳；心跳逾時由其他 worker 以條件式 UPDATE 認領
+    summary_worker = Column(String(128), nullable=True)
+    summary_heartbeat_at = Column(DateTime, nullable=True)
 
     # 關聯至助理
     assistant = relationship("AIAssistant", back_populates="knowledges")
@@ -172,3 +179,35 @@ class SpeechCorrectionRule(Base):
 
     assistant = relationship("AIAssistant", back_populates="speech_correction_rules")
     creator = relationship("User", foreign_keys=[created_by])
+
+
+class UploadJob(Base):
+    """知識庫檔案上傳的背景工作（services.upload_jobs）；處理完成時與 knowledge_base 同一交易提交。"""
+
+    __tablename__ = "upload_jobs"
+
+    job_id = Column(String(64), primary_key=True)
+    assistant_id = Column(
+        Integer, ForeignKey("assistants.assistant_id"), nullable=False, index=True
+    )
+    file_name = Column(String(255), nullable=False)
+    file_path = Column(String(512), nullable=False)  # 暫存檔路徑，完成後移至正式路徑
+    status = Column(String(20), nullable=False, default="queued", index=True)  # queued / running / done / failed
+    stage = Column(String(32), nullable=False, default="queued")
+    percent = Column(Integer, nullable=False, default=0)
+    chunks_embedded = Column(Integer, nullable=False, default=0)
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(Text, nullable=True)
+    # 已寫入向量庫、尚未提交至 knowledge_base 的 doc_id；重新執行時先刪除
+    pending_doc_ids = Column(Text, nullable=True)
+    knowledge_id = Column(Integer, nullable=True)
+    worker_id = Column(String(128), nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = Column(
+        DateTime,
+        default=datetime.utcnow,
+        onupdate=datetime.utcnow,
+        nullable=False,
+    )
+    finished_at = Column(DateTime, nullable=True)
@@ -8,14 +8,13 @@ from sqlalchemy.orm import Session
 from models.database import get_db
 from models.models import AIAssistant, User
 from services.vector_service import (
-    process_and_store_file,
     list_knowledge,
     get_knowledge_content,
     update_knowledge_base_item,
     delete_knowledge_base_item,
 )
 from services.auth_service import verify_token
-from services import assistant_notebook_service, jarvis_knowledge_client
+from services import assistant_notebook_service, jarvis_knowledge_client, upload_jobs, upload_progress
 from models.schemas import (
     AssistantCreate,
     Assistant,
@@ -235,19 +234,53 @@ def create_assistant(  # assistant_data: AssistantCreate,
     }
 
 
-@router.post("/assistant/{assistant_id}/upload")
+@router.post("/assistant/{assistant_id}/upload", status_code=202)
 async def upload_file(
     assistant_id: int,
     file: UploadFile = File(...),
+    job_id: Optional[str] = Form(None),  # 選填：前端自行產生的工作 ID
     assistant: AIAssistant = Depends(get_owned_assistant),
     db: Session = Depends(get_db),
 ):
+    if job_id and not upload_progress.valid_job_id(job_id):
+        raise HTTPException(status_code=422, detail="job_id must be 8-64 characters of [A-Za-z0-9_-]")
+
+    # 寫入暫存檔並建立背景工作後立即返回；embedding 與寫入知識庫於背景進行
+    try:
+        job = await upload_jobs.submit_upload(assistant_id, file, db, job_id=job_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return {
+        "message": "檔案已接收，正在背景寫入向量資料庫。",
+        "job_id": job.job_id,
+        "status_url": f"/assistant/{assistant_id}/uploads/{job.job_id}",
+        "data": upload_jobs.job_to_dict(job),
+    }
+
+
+@router.get("/assistant/{assistant_id}/uploads")
+def list_upload_jobs(
+    assistant_id: int,
+    assistant: AIAssistant = Depends(get_owned_assistant),
+    db: Session = Depends(get_db),
+):
+    """此助理最近的上傳工作與進度（新到舊）。"""
+    return {"status": "success", "data": upload_jobs.list_jobs(db, assistant_id)}
 
-    # 處理上傳的檔案，產生嵌入並儲存至向量資料庫
-    result = await process_and_store_file(assistant_id, file, db)
-    print(type(result), result)
 
-    return {"message": "檔案上傳完成，並已儲存至向量資料庫。", "data": result["km"]}
+@router.get("/assistant/{assistant_id}/uploads/{job_id}")
+def get_upload_job(
+    assistant_id: int,
+    job_id: str,
+    assistant: AIAssistant = Depends(get_owned_assistant),
+    db: Session = Depends(get_db),
+):
+    """單一上傳工作的狀態（status / stage / percent / chunks_embedded / knowledge_id / error）。"""
+    job = upload_jobs.get_job(db, assistant_id, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Upload job not found")
+    return {"status": "success", "data": upload_jobs.job_to_dict(job)}
 
 
 @router.get("/assistant/{assistant_id}/knowledge")
@@ -307,6 +340,8 @@ async def update_knowledge_item(
         return {"status": "success", "message": "知識庫已更新", "data": updated_record}
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"更新知識庫失敗: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -324,6 +359,8 @@ async def delete_knowledge_item(
         return {"status": "success", "message": "知識庫已刪除", "data": result}
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         logger.exception("delete_knowledge_item failed assistant_id=%s knowledge_id=%s", assistant_id, knowledge_id)
         raise HTTPException(status_code=500, detail=str(e))
@@ -270,3 +270,152 @@ def count_messages_by_taipei_date_range(
         .count()
     )
     return IntegrationMessageCount(start_date=start, end_date=end, count=count)
+
+
+@router.get("/integration/llm/pool-stats")
+def get_llm_pool_stats(
+    _: None = Depends(require_integration_api_key),
+):
+    """維運用：LLM 共用 client 連線池統計（請求數、新建 / 重用連線數；需 X-API-Key）。"""
+    from services.llm_client_pool import get_pool_metrics
+
+    return get_pool_metrics()
+
+
+@router.get("/integration/llm/answer-cache-stats")
+def get_answer_cache_stats(
+    _: None = Depends(require_integration_api_key),
+):
+    """維運用：回覆快取命中率與筆數（精確 / 語意命中、未命中、淘汰；需 X-API-Key）。"""
+    from services.answer_cache import answer_cache
+
+    return answer_cache.stats()
+
+
+@router.get("/integration/rag/query-embedding-cache-stats")
+def get_query_embedding_cache_stats(
+    _: None = Depends(require_integration_api_key),
+):
+    """維運用：BGE 查詢向量快取命中率與記憶體用量（需 X-API-Key）；模型尚未載入時回傳空物件。"""
+    from services import vector_service
+    from services.query_embedding_cache import CachedQueryEmbeddings
+
+    embeddings = getattr(vector_service, "_bge_embeddings", None)
+    if not isinstance(embeddings, CachedQueryEmbeddings):
+        return {}
+    return embeddings.cache.stats()
+
+
+@router.get("/integration/rag/embedding-batcher-stats")
+def get_embedding_batcher_stats(
+    _: None = Depends(require_integration_api_key),
+):
+    """維運用：BGE 嵌入微批次統計（批次數、平均批量、佇列中句數；需 X-API-Key）；未啟用時回傳空物件。"""
+    from services import vector_service
+    from services.embedding_batcher import BatchingEmbeddings
+
+    embeddings = getattr(vector_service, "_bge_embeddings", None)
+    batching = getattr(embeddings, "base", None)
+    if not isinstance(batching, BatchingEmbeddings):
+        return {}
+    return batching.batcher.stats()
+
+
+@router.get("/integration/rag/vector-store-cache-stats")
+def get_vector_store_cache_stats(
+    _: None = Depends(require_integration_api_key),
+):
+    """維運用：常駐記憶體的向量庫（估算位元組、命中、載入/淘汰次數）與記憶體預算（需 X-API-Key）。"""
+    from services import vector_service
+
+    return vector_service.vector_store.stats()
+
+
+@router.get("/integration/rag/vector-warmup-status")
+def get_vector_warmup_status(
+    _: None = Depends(require_integration_api_key),
+):
+    """維運用：啟動後向量庫背景預熱的進度（排序後的助理、已載入 / 已快取 / 失敗數；需 X-API-Key）。"""
+    from services.vector_warmup import warmup_status
+
+    return warmup_status()
+
+
+@router.get("/integration/rag/queue-stats")
+def get_rag_queue_stats(
+    _: None = Depends(require_integration_api_key),
+):
+    """維運用：RAG 佇列全體與逐租戶的排隊深度、執行中件數與等待時間（需 X-API-Key）；佇列未啟動時回傳空物件。"""
+    from services.rag_queue import rag_queue_stats
+
+    return rag_queue_stats()
+
+
+@router.get("/integration/rag/pipeline-stats")
+def get_rag_pipeline_stats(
+    _: None = Depends(require_integration_api_key),
+):
+    """
+    維運用：上傳管線各階段（embed / index-write / summarize）的並行上限、執行中數量與累計等待 / 執行時間，
+    以及延後摘要的佇列與批次統計（需 X-API-Key）。
+    """
+    from services.ingest_pipeline import pipeline_stats
+    from services.knowledge_summary import summary_stats
+
+    return {**pipeline_stats(), "deferred_summaries": summary_stats()}
+
+
+@router.get("/integration/rag/shared-vector-index-stats")
+def get_shared_vector_index_stats(
+    _: None = Depends(require_integration_api_key),
+):
+    """維運用：共用向量池（VECTOR_SHARED_INDEX）的分片、助理數與向量數（需 X-API-Key）。"""
+    from services.shared_vector_index import shared_index_pool
+
+    return shared_index_pool.stats()
+
+
+@router.post("/integration/rag/vector-index/{assistant_id}/rebuild")
+def rebuild_vector_index(
+    assistant_id: int,
+    _: None = Depends(require_integration_api_key),
+):
+    """
+    維運用：合併增量區段並依目前設定（VECTOR_INDEX_TYPE / VECTOR_QUANTIZATION 與逐助理 OVERRIDES）
+    重建索引（需 X-API-Key）。
+    """
+    from services import vector_service
+    from services.faiss_index import index_kind, index_quantization
+
+    if not vector_service.compact_vector_store(assistant_id, force=True):
+        raise HTTPException(status_code=404, detail="Vector store not found")
+    vs = vector_service.get_vector_store(assistant_id)
+    return {
+        "assistant_id": assistant_id,
+        "index_type": index_kind(vs.index),
+        "quantization": index_quantization(vs.index),
+        "vectors": int(vs.index.ntotal),
+    }
+
+
+@router.get("/integration/rag/vector-index/{assistant_id}/quantization-report")
+def get_vector_quantization_report(
+    assistant_id: int,
+    quantization: Optional[str] = Query(None, description="sq8 | pq | none；未帶則為目前設定的模式"),
+    k: int = Query(5, ge=1, le=100, description="recall@k 的 k"),
+    queries: int = Query(200, ge=1, le=2000, description="抽樣查詢數"),
+    _: None = Depends(require_integration_api_key),
+):
+    """
+    維運用：以助理現有向量試算量化模式（sq8 / pq / none；預設為目前設定）的向量記憶體節省量與
+    recall@k 損失，不變更索引（需 X-API-Key）。
+    """
+    from services import vector_service
+    from services.faiss_index import QUANTIZATIONS
+
+    if quantization is not None and quantization not in QUANTIZATIONS:
+        raise HTTPException(status_code=400, detail=f"quantization must be one of {', '.join(QUANTIZATIONS)}")
+    report = vector_service.vector_store_quantization_report(assistant_id, quantization, k=k, queries=queries)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Vector store not found")
+    return report
@@ -3,7 +3,11 @@ import json
 import time
 
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
-from services.llm_service import process_message_through_llm, _is_llm_connection_error
+from services.llm_service import (
+    process_message_through_llm,
+    stream_message_through_llm,
+    _is_llm_connection_error,
+)
 from models.database import SessionLocal
 from models.models import Conversation, Message, AIAssistant
 from services.assistant_prompt_storage import get_effective_description
@@ -44,6 +48,20 @@ manager = ConnectionManager()
 
 setting = {}
 
+# 串流訊框協定版本：連線時帶 ?protocol=2 才啟用；未帶者維持舊的 @@@ / ### 純文字流程
+# 訊框為 JSON：{"v": 2, "channel": "chat", "type": "start"|"delta"|"end"|"error", "text": "..."}
+# 每回合：一個 start、零或多個 delta，最後恰好一個終止訊框——成功為 end（text 為回覆全文），
+# 失敗為 error（text 為 noidea 或預設的錯誤訊息，取代 end，不會兩者都送）
+WS_PROTOCOL_LEGACY = 1
+WS_PROTOCOL_STREAM = 2
+
+
+def _frame(frame_type: str, text: str = "") -> str:
+    return json.dumps(
+        {"v": WS_PROTOCOL_STREAM, "channel": "chat", "type": frame_type, "text": text},
+        ensure_ascii=False,
+    )
+
 
 def read_json_file(file_path: str) -> dict:
     try:
@@ -60,6 +78,7 @@ async def websocket_endpoint(
         websocket: WebSocket,
         assistant_uuid: str,
         customer_id: str,
+        protocol: int = WS_PROTOCOL_LEGACY,
 ):
     global setting
 
@@ -84,8 +103,8 @@ async def websocket_endpoint(
         db.close()
     t_setting_s = time.perf_counter() - t_setting_start
     logger.info(
-        "WebSocket session: assistant_uuid=%s customer_id=%s model=%s lang=%s (查詢助理與設定耗時=%.3f s)",
-        assistant_uuid, customer_id, model, lang, t_setting_s
+        "WebSocket session: assistant_uuid=%s customer_id=%s model=%s lang=%s protocol=%s (查詢助理與設定耗時=%.3f s)",
+        assistant_uuid, customer_id, model, lang, protocol, t_setting_s
     )
 
     await manager.connect(websocket, assistant_uuid, customer_id)
@@ -117,6 +136,7 @@ async def websocket_endpoint(
                 await _handle_one_turn(
                     websocket, assistant_uuid, customer_id, conversation_id,
                     lang, model, welcome, noidea,
+                    protocol=protocol,
                 )
             except WebSocketDisconnect:
                 raise
@@ -127,9 +147,12 @@ async def websocket_endpoint(
                 )
                 fallback = noidea or "抱歉，服務暫時無法回應，請稍後再試。"
                 try:
-                    await manager.send_message("###", assistant_uuid, customer_id)
-                    await asyncio.sleep(0.1)
-                    await manager.send_message(fallback, assistant_uuid, customer_id)
+                    if protocol >= WS_PROTOCOL_STREAM:
+                        await manager.send_message(_frame("error", fallback), assistant_uuid, customer_id)
+                    else:
+                        await manager.send_message("###", assistant_uuid, customer_id)
+                        await asyncio.sleep(0.1)
+                        await manager.send_message(fallback, assistant_uuid, customer_id)
                 except Exception as send_err:
                     logger.warning("無法回傳錯誤訊息至前端: %s", send_err)
 
@@ -150,6 +173,7 @@ async def _handle_one_turn(
         model: str,
         welcome: str,
         noidea: str,
+        protocol: int = WS_PROTOCOL_LEGACY,
 ):
     t_recv_start = time.perf_counter()
     data = await websocket.receive_text()
@@ -160,9 +184,13 @@ async def _handle_one_turn(
     )
     logger.debug("[收到對話] 原始內容: %s", (data or "")[:500])
 
+    streaming = protocol >= WS_PROTOCOL_STREAM
     t_indicator_start = time.perf_counter()
-    await manager.send_message("@@@", assistant_uuid, customer_id)
-    await asyncio.sleep(0.1)
+    if streaming:
+        await manager.send_message(_frame("start"), assistant_uuid, customer_id)
+    else:
+        await manager.send_message("@@@", assistant_uuid, customer_id)
+        await asyncio.sleep(0.1)
     t_indicator_s = time.perf_counter() - t_indicator_start
     logger.debug("已發送思考中指標 @@@ (耗時=%.3f s)", t_indicator_s)
 
@@ -186,17 +214,38 @@ async def _handle_one_turn(
     logger.info("已寫入用戶訊息至 DB (耗時=%.3f s)", t_save_user_s)
 
     t_llm_start = time.perf_counter()
+    t_first_delta_s = None
+    terminal = "end"
     try:
-        response = await process_message_through_llm(
-            data,
-            assistant_uuid,
-            customer_id,
-            lang,
-            model,
-            assistant_description,
-            welcome,
-            noidea,
-        )
+        if streaming:
+            # 逐段轉送 token；回覆全文於結束後一次寫入 DB
+            parts = []
+            async for delta in stream_message_through_llm(
+                data,
+                assistant_uuid,
+                customer_id,
+                lang,
+                model,
+                assistant_description,
+                welcome,
+                noidea,
+            ):
+                if t_first_delta_s is None:
+                    t_first_delta_s = time.perf_counter() - t_llm_start
+                parts.append(delta)
+                await manager.send_message(_frame("delta", delta), assistant_uuid, customer_id)
+            response = "".join(parts)
+        else:
+            response = await process_message_through_llm(
+                data,
+                assistant_uuid,
+                customer_id,
+                lang,
+                model,
+                assistant_description,
+                welcome,
+                noidea,
+            )
     except Exception as e:
         if _is_llm_connection_error(e):
             logger.error(
@@ -204,12 +253,15 @@ async def _handle_one_turn(
                 assistant_uuid, e,
             )
             response = noidea or "抱歉，AI 推論服務暫時無法連線，請稍後再試。"
+            # 串流時以 error 作為本回合唯一的終止訊框（寫入 DB 後送出，取代 end）
+            terminal = "error"
         else:
             raise
     t_llm_s = time.perf_counter() - t_llm_start
     logger.info(
-        "[LLM 完成] assistant_uuid=%s 回覆長度=%d (LLM 總耗時=%.3f s)",
-        assistant_uuid, len(response or ""), t_llm_s
+        "[LLM 完成] assistant_uuid=%s 回覆長度=%d (LLM 總耗時=%.3f s 首段=%s)",
+        assistant_uuid, len(response or ""), t_llm_s,
+        "%.3f s" % t_first_delta_s if t_first_delta_s is not None else "-",
     )
     logger.debug("[LLM 回覆預覽] %s", (response or "")[:300])
 
@@ -229,9 +281,13 @@ async def _handle_one_turn(
     logger.info("已寫入助理回覆至 DB (耗時=%.3f s)", t_save_assistant_s)
 
     t_send_start = time.perf_counter()
-    await manager.send_message("###", assistant_uuid, customer_id)
-    await asyncio.sleep(0.1)
-    await manager.send_message(response, assistant_uuid, customer_id)
+    if streaming:
+        # end 訊框附帶全文，前端可用來校正累積的 delta；LLM 無法連線時改送 error
+        await manager.send_message(_frame(terminal, response), assistant_uuid, customer_id)
+    else:
+        await manager.send_message("###", assistant_uuid, customer_id)
+        await asyncio.sleep(0.1)
+        await manager.send_message(response, assistant_uuid, customer_id)
     t_send_s = time.perf_counter() - t_send_start
     logger.info(
         "[對話回合完成] conversation_id=%s 總耗時=%.3f s (接收=%.3f 存用戶=%.3f LLM=%.3f 存助理=%.3f 回傳=%.3f)",
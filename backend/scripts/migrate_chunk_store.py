@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+將舊版 pickle docstore（assistant_{id}_metadata.pkl）批次轉為 mmap chunk 檔（assistant_{id}_chunks.bin）。
+
+伺服器也會在助理第一次載入時自動轉換；此工具用於部署前一次轉完，避免冷啟動時才付出轉換成本。
+每個助理轉換時持有與後端相同的檔案鎖（assistant_{id}.lock），可在服務運行中執行。
+轉換後的 chunk 檔 header 與新寫入的 segments.json 記錄同一個 base_id（與伺服器端轉換相同），
+查詢端即可不持鎖讀取；舊版向量庫沒有已提交的增量區段，殘留的區段 / 墓碑檔一併刪除。
+
+執行：
+    cd backend
+    python scripts/migrate_chunk_store.py --dry-run
+    python scripts/migrate_chunk_store.py --vector-dir ./vector_stores --remove-pickle
+"""
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import os
+import re
+import sys
+import time
+import uuid
+from pathlib import Path
+
+from filelock import FileLock
+
+BACKEND_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(BACKEND_ROOT))
+
+_METADATA_RE = re.compile(r"^assistant_(\d+)_metadata\.pkl$")
+
+
+def _load_service_module(name: str):
+    # 直接以檔案載入，避免 services/__init__ 連帶載入 LLM / 向量相關重型依賴
+    path = BACKEND_ROOT / "services" / f"{name}.py"
+    spec = importlib.util.spec_from_file_location(f"{name}_migrate", path)
+    if spec is None or spec.loader is None:
+        raise RuntimeError(f"Cannot load module from {path}")
+    module = importlib.util.module_from_spec(spec)
+    # dataclass 需由 sys.modules 取得模組
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Migrate pickle docstores to mmap chunk stores")
+    parser.add_argument("--vector-dir", default="./vector_stores", help="FAISS 向量庫目錄")
+    parser.add_argument("--remove-pickle", action="store_true", help="轉換成功後刪除舊 metadata.pkl")
+    parser.add_argument("--dry-run", action="store_true", help="只列出待轉換的助理")
+    parser.add_argument("--lock-timeout", type=float, default=300.0, help="等待檔案鎖秒數")
+    args = parser.parse_args()
+
+    chunk_store = _load_service_module("chunk_store")
+    vector_segments = _load_service_module("vector_segments")
+    pending = []
+    for name in sorted(os.listdir(args.vector_dir)):
+        match = _METADATA_RE.match(name)
+        if not match:
+            continue
+        aid = match.group(1)
+        chunk_path = os.path.join(args.vector_dir, f"assistant_{aid}_chunks.bin")
+        if not os.path.exists(chunk_path):
+            pending.append((aid, os.path.join(args.vector_dir, name), chunk_path))
+
+    print(f"待轉換助理：{len(pending)}")
+    if args.dry_run:
+        for aid, metadata_path, _ in pending:
+            print(f"  assistant_id={aid} {metadata_path}")
+        return 0
+
+    failed = 0
+    for aid, metadata_path, chunk_path in pending:
+        lock_path = os.path.join(args.vector_dir, f"assistant_{aid}.lock")
+        t0 = time.perf_counter()
+        try:
+            with FileLock(lock_path, timeout=args.lock_timeout):
+                if os.path.exists(chunk_path):
+                    print(f"  assistant_id={aid} 已由服務轉換，略過")
+                    continue
+                prefix = os.path.join(args.vector_dir, f"assistant_{aid}")
+                manifest = vector_segments.read_manifest(prefix)
+                if not os.path.exists(vector_segments.manifest_path(prefix)):
+                    vector_segments.remove_segments(prefix)
+                manifest.base_id = uuid.uuid4().hex
+                count = chunk_store.migrate_pickle_metadata(
+                    metadata_path, chunk_path, remove_pickle=args.remove_pickle,
+                    header={"base_seq": manifest.base_seq, "base_id": manifest.base_id},
+                )
+                if manifest.tombstone_bytes is None:
+                    manifest.tombstone_bytes = vector_segments.tombstone_size(prefix)
+                vector_segments.write_manifest(prefix, manifest)
+        except Exception as e:
+            failed += 1
+            print(f"  assistant_id={aid} 失敗：{e}", file=sys.stderr)
+            continue
+        print(f"  assistant_id={aid} chunks={count} 耗時={time.perf_counter() - t0:.3f}s")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+將既有 assistant_{id}.index 轉換為量化索引（sq8 / pq），或轉回 float32（none），並列出
+向量記憶體節省量與 recall@k 損失。
+
+轉換只改寫主檔索引（位置順序不變，chunk 檔與增量區段不需變動），量化時另寫入
+assistant_{id}_vectors.npy（依位置排列的原始向量，供查詢重新排序與之後的重建）。
+量化模式寫入索引檔後，之後的合併 / 全量寫入會沿用（VECTOR_QUANTIZATION 未設定時）。
+
+服務運行中的 worker 仍持有舊的記憶體快取，合併時會以快取的模式寫回；服務運行中請改設
+VECTOR_QUANTIZATION_OVERRIDES 後呼叫 POST /integration/rag/vector-index/{id}/rebuild，
+本工具供停機維護或部署前批次轉換（仍持有與後端相同的檔案鎖 assistant_{id}.lock）。
+
+執行：
+    cd backend
+    python scripts/quantize_vector_stores.py --mode pq --report-only
+    python scripts/quantize_vector_stores.py --mode sq8 --assistant-ids 12,34
+"""
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import os
+import re
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from filelock import FileLock
+
+BACKEND_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(BACKEND_ROOT))
+
+_INDEX_RE = re.compile(r"^assistant_(\d+)\.index$")
+
+
+def _load_faiss_index_module():
+    # 直接以檔案載入，避免 services/__init__ 連帶載入 LLM / 向量相關重型依賴
+    path = BACKEND_ROOT / "services" / "faiss_index.py"
+    spec = importlib.util.spec_from_file_location("faiss_index_quantize", path)
+    if spec is None or spec.loader is None:
+        raise RuntimeError(f"Cannot load module from {path}")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _replace_file(path: str, write) -> None:
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _save_vectors(path: str, vectors: np.ndarray) -> None:
+    with open(path, "wb") as f:
+        np.save(f, np.ascontiguousarray(vectors, dtype=np.float32))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _mb(value) -> str:
+    return f"{int(value) / (1024 * 1024):.1f}MB"
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Quantize FAISS vector stores")
+    parser.add_argument("--mode", required=True, choices=["sq8", "pq", "none"], help="目標量化模式")
+    parser.add_argument("--vector-dir", default="./vector_stores", help="FAISS 向量庫目錄")
+    parser.add_argument("--assistant-ids", default="", help="逗號分隔；未指定則轉換全部")
+    parser.add_argument("--report-only", action="store_true", help="只試算節省量與 recall，不寫檔")
+    parser.add_argument("--k", type=int, default=5, help="recall@k 的 k")
+    parser.add_argument("--queries", type=int, default=200, help="抽樣查詢數")
+    parser.add_argument("--lock-timeout", type=float, default=300.0, help="等待檔案鎖秒數")
+    args = parser.parse_args()
+
+    fi = _load_faiss_index_module()
+    wanted = {int(x) for x in args.assistant_ids.split(",") if x.strip().isdigit()}
+    targets = []
+    for name in sorted(os.listdir(args.vector_dir)):
+        match = _INDEX_RE.match(name)
+        if match and (not wanted or int(match.group(1)) in wanted):
+            targets.append(int(match.group(1)))
+
+    print(f"目標模式：{args.mode}  助理數：{len(targets)}")
+    failed = 0
+    for aid in targets:
+        prefix = os.path.join(args.vector_dir, f"assistant_{aid}")
+        index_path = f"{prefix}.index"
+        vectors_path = f"{prefix}_vectors.npy"
+        t0 = time.perf_counter()
+        try:
+            with FileLock(f"{prefix}.lock", timeout=args.lock_timeout):
+                index = fi.faiss.read_index(index_path)
+                kind = fi.index_kind(index)
+                current = fi.index_quantization(index)
+                vectors = None
+                if current != "none" and os.path.exists(vectors_path):
+                    vectors = np.load(vectors_path)
+                    if len(vectors) != index.ntotal:
+                        vectors = None
+                if vectors is None:
+                    if current != "none":
+                        print(f"  assistant_id={aid} 缺少原始向量檔，以 {current} 解碼值轉換", file=sys.stderr)
+                    vectors = fi.extract_vectors(index)
+                mode = fi.effective_quantization(args.mode, len(vectors))
+                converted = fi.build_index(kind, vectors, index.d, mode) if mode != current else index
+                report = fi.quantization_report(vectors, kind, mode, k=args.k, queries=args.queries, index=converted)
+                if not args.report_only and mode != current:
+                    if mode != "none":
+                        _replace_file(vectors_path, lambda p: _save_vectors(p, vectors))
+                    _replace_file(index_path, lambda p: fi.faiss.write_index(converted, p))
+                    if mode == "none" and os.path.exists(vectors_path):
+                        os.remove(vectors_path)
+        except Exception as e:
+            failed += 1
+            print(f"  assistant_id={aid} 失敗：{e}", file=sys.stderr)
+            continue
+        action = "試算" if args.report_only or mode == current else "已轉換"
+        print(
+            f"  assistant_id={aid} {action} {kind}/{current} → {kind}/{mode} vectors={report['vectors']} "
+            f"float32={_mb(report['float32_bytes'])} quantized={_mb(report['quantized_bytes'])} "
+            f"recall@{report['k']}={report.get('recall_at_k', 1.0)} "
+            f"(不重排 {report.get('recall_at_k_without_rerank', 1.0)}) 耗時={time.perf_counter() - t0:.2f}s"
+        )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
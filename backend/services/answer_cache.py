@@ -0,0 +1,209 @@
+"""助理回覆快取：同一助理反覆被問到的問題直接回傳先前的答案，略過檢索與 vLLM 生成。
+
+兩層查詢：
+  1. 精確層：以正規化後的問題文字（NFKC、小寫、合併空白、去除結尾標點）為 key。
+  2. 語意層（選用）：重用 FAISS 檢索已算好的 BGE 查詢向量，與快取問題向量的 cosine
+     相似度 >= ANSWER_CACHE_SEMANTIC_THRESHOLD 即視為同一問題；設 0 關閉。
+
+失效條件：
+  - 知識庫版本號（vector_service.get_knowledge_generation）與寫入時不同；
+  - 助理 description / 語言 / 模型的指紋不同；
+  - 超過 TTL，或每助理筆數超過上限時依 LRU 淘汰。
+
+環境變數：
+  ANSWER_CACHE_ENABLED              true（預設）| false
+  ANSWER_CACHE_MAX_ENTRIES          每助理最多快取筆數（預設 256）
+  ANSWER_CACHE_TTL_SECONDS          存活秒數（預設 3600）
+  ANSWER_CACHE_SEMANTIC_THRESHOLD   語意層 cosine 門檻（預設 0 = 關閉，建議 0.92~0.97）
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_TRAILING_PUNCT = "?？!！。.~～,，、;；:： "
+
+
+def normalize_query(text: str) -> str:
+    """問題正規化：全半形統一、小寫、合併空白、去除結尾標點。"""
+    norm = unicodedata.normalize("NFKC", text or "").lower()
+    norm = _WHITESPACE_RE.sub(" ", norm).strip()
+    return norm.rstrip(_TRAILING_PUNCT)
+
+
+def assistant_fingerprint(description: Optional[str], lang: Optional[str], model: Optional[str]) -> str:
+    """影響回覆內容的助理設定指紋；任一項變動即視為不同快取版本。"""
+    raw = "\x1f".join((description or "", lang or "", model or ""))
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class _Entry:
+    answer: str
+    generation: int
+    fingerprint: str
+    expires_at: float
+    embedding: Optional[np.ndarray] = None
+
+
+class AnswerCache:
+    """每助理一個 LRU（OrderedDict）；執行緒安全，可由事件迴圈與檢索執行緒同時使用。"""
+
+    def __init__(self, *, max_entries: int = 256, ttl_seconds: float = 3600.0, semantic_threshold: float = 0.0):
+        self.max_entries = max(1, int(max_entries))
+        self.ttl_seconds = max(0.0, float(ttl_seconds))
+        self.semantic_threshold = float(semantic_threshold)
+        self._lock = threading.Lock()
+        self._entries: Dict[int, "OrderedDict[str, _Entry]"] = {}
+        self._stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    @property
+    def semantic_enabled(self) -> bool:
+        return self.semantic_threshold > 0.0
+
+    def _valid(self, entry: _Entry, generation: int, fingerprint: str, now: float) -> bool:
+        return entry.generation == generation and entry.fingerprint == fingerprint and entry.expires_at > now
+
+    def lookup(self, assistant_id: int, query: str, *, generation: int, fingerprint: str) -> Optional[str]:
+        """精確層查詢；未命中不計入 misses（語意層或最終呼叫 LLM 時才計）。"""
+        key = normalize_query(query)
+        if not key:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._entries.get(assistant_id)
+            entry = bucket.get(key) if bucket else None
+            if entry is None:
+                return None
+            if not self._valid(entry, generation, fingerprint, now):
+                del bucket[key]
+                return None
+            bucket.move_to_end(key)
+            self._stats["exact_hits"] += 1
+            return entry.answer
+
+    def lookup_semantic(
+        self,
+        assistant_id: int,
+        embedding: Sequence[float],
+        *,
+        generation: int,
+        fingerprint: str,
+    ) -> Optional[Tuple[str, float]]:
+        """語意層查詢：回傳 (answer, cosine)；未啟用或無相似問題時回傳 None。"""
+        if not self.semantic_enabled or embedding is None:
+            return None
+        vec = _unit(embedding)
+        if vec is None:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._entries.get(assistant_id)
+            if not bucket:
+                return None
+            keys = []
+            vectors = []
+            for key, entry in bucket.items():
+                if entry.embedding is not None and self._valid(entry, generation, fingerprint, now):
+                    keys.append(key)
+                    vectors.append(entry.embedding)
+            if not vectors:
+                return None
+            sims = np.stack(vectors) @ vec
+            best = int(np.argmax(sims))
+            score = float(sims[best])
+            if score < self.semantic_threshold:
+                return None
+            bucket.move_to_end(keys[best])
+            self._stats["semantic_hits"] += 1
+            return bucket[keys[best]].answer, score
+
+    def record_miss(self) -> None:
+        with self._lock:
+            self._stats["misses"] += 1
+
+    def store(
+        self,
+        assistant_id: int,
+        query: str,
+        answer: str,
+        *,
+        generation: int,
+        fingerprint: str,
+        embedding: Optional[Sequence[float]] = None,
+    ) -> None:
+        key = normalize_query(query)
+        if not key or not answer:
+            return
+        entry = _Entry(
+            answer=answer,
+            generation=generation,
+            fingerprint=fingerprint,
+            expires_at=time.monotonic() + self.ttl_seconds,
+            embedding=_unit(embedding) if embedding is not None and self.semantic_enabled else None,
+        )
+        with self._lock:
+            bucket = self._entries.setdefault(assistant_id, OrderedDict())
+            bucket[key] = entry
+            bucket.move_to_end(key)
+            self._stats["stores"] += 1
+            while len(bucket) > self.max_entries:
+                bucket.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def invalidate(self, assistant_id: int) -> None:
+        with self._lock:
+            self._entries.pop(assistant_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["assistants"] = len(self._entries)
+            stats["entries"] = sum(len(b) for b in self._entries.values())
+        hits = stats["exact_hits"] + stats["semantic_hits"]
+        total = hits + stats["misses"]
+        stats["hit_rate"] = round(hits / total, 4) if total else 0.0
+        stats["semantic_threshold"] = self.semantic_threshold
+        return stats
+
+
+def _unit(embedding: Sequence[float]) -> Optional[np.ndarray]:
+    vec = np.asarray(embedding, dtype=np.float32).ravel()
+    norm = float(np.linalg.norm(vec))
+    if not norm:
+        return None
+    return vec / norm
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def answer_cache_enabled() -> bool:
+    raw = (os.getenv("ANSWER_CACHE_ENABLED") or "true").strip().lower()
+    return raw not in {"0", "false", "no", "off"}
+
+
+answer_cache = AnswerCache(
+    max_entries=int(_env_float("ANSWER_CACHE_MAX_ENTRIES", 256)),
+    ttl_seconds=_env_float("ANSWER_CACHE_TTL_SECONDS", 3600),
+    semantic_threshold=_env_float("ANSWER_CACHE_SEMANTIC_THRESHOLD", 0.0),
+)
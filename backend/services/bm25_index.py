@@ -0,0 +1,352 @@
+"""
+每個助理的 BM25 倒排索引（postings / doc 長度 / 預先計算 IDF）。
+
+由上傳、更新、刪除知識庫時增量維護，並與 FAISS 索引一同存放於
+./vector_stores/assistant_{id}_bm25.pkl；查詢時只走訪查詢詞的 postings，
+不再於每次對話重新切詞整個語料。
+已發布的索引不再變動：寫入路徑以 copy() 取得複本修改，隨向量庫快照一起發布（見 vector_service）。
+"""
+import heapq
+import math
+import os
+import pickle
+import re
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+BM25_INDEX_FORMAT_VERSION = 1
+BM25_K1 = 1.5
+BM25_B = 0.75
+# postings：純 Python 倒排（MaxScore 剪枝）；sparse：NumPy CSR 詞-文件矩陣
+BM25_BACKENDS = ("postings", "sparse")
+
+
+def tokenize_for_bm25(text: str) -> List[str]:
+    """簡單中文/英文混合 tokenizer，供 BM25 使用。"""
+    raw = (text or "").lower()
+    return re.findall(r"[\u4e00-\u9fff]|[a-z0-9_]+", raw)
+
+
+def bm25_score(query_tokens: List[str], doc_tokens: List[str], idf: Dict[str, float], avgdl: float, *, k1: float = BM25_K1, b: float = BM25_B) -> float:
+    """純 Python BM25 分數計算，避免額外依賴。"""
+    if not query_tokens or not doc_tokens:
+        return 0.0
+
+    tf: Dict[str, int] = {}
+    for tok in doc_tokens:
+        tf[tok] = tf.get(tok, 0) + 1
+
+    dl = max(1, len(doc_tokens))
+    score = 0.0
+    for q in query_tokens:
+        freq = tf.get(q, 0)
+        if freq <= 0:
+            continue
+        denom = freq + k1 * (1.0 - b + b * dl / max(1e-9, avgdl))
+        score += idf.get(q, 0.0) * (freq * (k1 + 1.0)) / max(1e-9, denom)
+    return score
+
+
+def _idf(doc_count: int, doc_freq: int) -> float:
+    return math.log(1.0 + (doc_count - doc_freq + 0.5) / (doc_freq + 0.5))
+
+
+class SparseBM25Matrix:
+    """
+    CSR 格式的詞-文件矩陣（列為詞、欄為文件），data 直接存 BM25 權重
+    idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * dl / avgdl))。
+    查詢 = 取查詢詞對應列的切片，以 bincount 累加成文件分數，再 argpartition 取前 k。
+    """
+
+    def __init__(self, doc_ids: List[str], term_rows: Dict[str, int], indptr, indices, data):
+        self.doc_ids = doc_ids
+        self.term_rows = term_rows
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+
+    @classmethod
+    def from_index(cls, index: "BM25Index") -> "SparseBM25Matrix":
+        doc_ids = list(index.doc_lengths.keys())
+        doc_pos = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+        dl = np.fromiter((max(1, index.doc_lengths[d]) for d in doc_ids), dtype=np.float64, count=len(doc_ids))
+        norm = index.k1 * (1.0 - index.b + index.b * dl / max(1e-9, index.avgdl))
+
+        term_rows: Dict[str, int] = {}
+        indptr = np.zeros(len(index.postings) + 1, dtype=np.int64)
+        nnz = sum(len(plist) for plist in index.postings.values())
+        indices = np.empty(nnz, dtype=np.int32)
+        tfs = np.empty(nnz, dtype=np.float64)
+        idfs = np.empty(len(index.postings), dtype=np.float64)
+        cursor = 0
+        for row, (term, plist) in enumerate(index.postings.items()):
+            term_rows[term] = row
+            idfs[row] = index.idf.get(term, 0.0)
+            n = len(plist)
+            indices[cursor:cursor + n] = [doc_pos[d] for d in plist.keys()]
+            tfs[cursor:cursor + n] = list(plist.values())
+            cursor += n
+            indptr[row + 1] = cursor
+
+        row_of_entry = np.repeat(np.arange(len(idfs)), np.diff(indptr))
+        data = idfs[row_of_entry] * tfs * (index.k1 + 1.0) / np.maximum(1e-9, tfs + norm[indices])
+        return cls(doc_ids, term_rows, indptr, indices, data)
+
+    def search(self, weights: Dict[str, int], top_k: int) -> List[Tuple[str, float]]:
+        rows = [(self.term_rows[t], w) for t, w in weights.items() if t in self.term_rows]
+        if not rows or not self.doc_ids:
+            return []
+        slices = [slice(self.indptr[r], self.indptr[r + 1]) for r, _ in rows]
+        idx = np.concatenate([self.indices[sl] for sl in slices])
+        vals = np.concatenate([self.data[sl] * w for sl, (_, w) in zip(slices, rows)])
+        scores = np.bincount(idx, weights=vals, minlength=len(self.doc_ids))
+
+        hits = int(np.count_nonzero(scores > 0))
+        k = min(top_k, hits)
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(self.doc_ids[i], float(scores[i])) for i in top]
+
+
+class BM25Index:
+    """
+    倒排索引：term -> {doc_id: tf}。doc_id 即 FAISS docstore 的 id（metadata.doc_id）。
+    增刪文件後重算 IDF；查詢成本只與查詢詞的 postings 長度有關。
+    """
+
+    def __init__(self, *, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.doc_lengths: Dict[str, int] = {}
+        self.total_length = 0
+        self.idf: Dict[str, float] = {}
+        self._term_ub: Dict[str, float] = {}
+        self._sparse: Optional[SparseBM25Matrix] = None
+        self._lock = threading.RLock()
+        # 對應的向量庫磁碟版本 token（發布時標記）；載入時與快照不同代表檔案屬於其他版本
+        self.generation: Optional[str] = None
+
+    @classmethod
+    def from_documents(cls, items: Iterable[Tuple[str, str]]) -> "BM25Index":
+        """items 為 (doc_id, text)；一次建好 postings 與 IDF。"""
+        index = cls()
+        index.add_documents(items)
+        return index
+
+    @classmethod
+    def from_docstore(cls, docstore) -> "BM25Index":
+        """由 LangChain docstore 重建（舊助理尚無 BM25 檔時使用）。"""
+        docs_dict = getattr(docstore, "_dict", {}) if docstore is not None else {}
+        return cls.from_documents(
+            (str(doc_id), getattr(doc, "page_content", "") or "")
+            for doc_id, doc in docs_dict.items()
+        )
+
+    def copy(self) -> "BM25Index":
+        """寫入用複本：postings 逐詞複製，之後的增刪不影響原索引（查詢中的舊快照）。"""
+        with self._lock:
+            clone = type(self)(k1=self.k1, b=self.b)
+            clone.postings = {tok: dict(plist) for tok, plist in self.postings.items()}
+            clone.doc_lengths = dict(self.doc_lengths)
+            clone.total_length = self.total_length
+            clone.idf = dict(self.idf)
+            clone.generation = self.generation
+        return clone
+
+    @property
+    def doc_count(self) -> int:
+        return len(self.doc_lengths)
+
+    @property
+    def avgdl(self) -> float:
+        return self.total_length / max(1, len(self.doc_lengths))
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def add_documents(self, items: Iterable[Tuple[str, str]]) -> int:
+        """新增（或覆寫同 id）文件，回傳新增筆數。"""
+        added = 0
+        with self._lock:
+            for doc_id, text in items:
+                doc_id = str(doc_id)
+                if doc_id in self.doc_lengths:
+                    self._remove_one(doc_id)
+                tokens = tokenize_for_bm25(text)
+                tf: Dict[str, int] = {}
+                for tok in tokens:
+                    tf[tok] = tf.get(tok, 0) + 1
+                for tok, freq in tf.items():
+                    self.postings.setdefault(tok, {})[doc_id] = freq
+                self.doc_lengths[doc_id] = len(tokens)
+                self.total_length += len(tokens)
+                added += 1
+            if added:
+                self._refresh_idf()
+        return added
+
+    def remove_documents(self, doc_ids: Iterable[str]) -> int:
+        """依 doc_id 移除文件，回傳實際移除筆數。"""
+        targets = {str(d) for d in doc_ids if str(d) in self.doc_lengths}
+        if not targets:
+            return 0
+        with self._lock:
+            empty_terms = []
+            for tok, plist in self.postings.items():
+                for doc_id in targets.intersection(plist.keys()):
+                    del plist[doc_id]
+                if not plist:
+                    empty_terms.append(tok)
+            for tok in empty_terms:
+                del self.postings[tok]
+            for doc_id in targets:
+                self.total_length -= self.doc_lengths.pop(doc_id, 0)
+            self._refresh_idf()
+        return len(targets)
+
+    def _remove_one(self, doc_id: str) -> None:
+        for tok in list(self.postings.keys()):
+            plist = self.postings[tok]
+            if plist.pop(doc_id, None) is not None and not plist:
+                del self.postings[tok]
+        self.total_length -= self.doc_lengths.pop(doc_id, 0)
+
+    def _refresh_idf(self) -> None:
+        n = len(self.doc_lengths)
+        self._term_ub = {}
+        self._sparse = None
+        self.idf = {tok: _idf(n, len(plist)) for tok, plist in self.postings.items()}
+
+    def _term_upper_bound(self, term: str) -> float:
+        """term 在任一文件可貢獻的最大分數（MaxScore 剪枝用），增刪文件後重算。"""
+        ub = self._term_ub.get(term)
+        if ub is not None:
+            return ub
+        plist = self.postings.get(term)
+        if not plist:
+            return 0.0
+        k1, b = self.k1, self.b
+        avgdl = max(1e-9, self.avgdl)
+        best = 0.0
+        for doc_id, freq in plist.items():
+            dl = max(1, self.doc_lengths[doc_id])
+            part = (freq * (k1 + 1.0)) / max(1e-9, freq + k1 * (1.0 - b + b * dl / avgdl))
+            if part > best:
+                best = part
+        ub = self.idf.get(term, 0.0) * best
+        self._term_ub[term] = ub
+        return ub
+
+    def search(self, query: str, top_k: int, *, prune: bool = True, backend: str = "postings") -> List[Tuple[str, float]]:
+        """
+        只走訪查詢詞的 postings，回傳分數 > 0 的 (doc_id, score)，依分數遞減。
+        backend="sparse" 改用快取的 CSR 矩陣向量化計分（增刪文件後首次查詢時重建）。
+
+        prune=True 時採 MaxScore（term-at-a-time）：依各詞分數上界由大到小處理，
+        一旦剩餘詞上界總和低於目前第 k 名分數，後續詞只替既有候選補分，
+        不再走訪其（通常很長的）postings；結果與全量計分相同。
+        """
+        query_tokens = tokenize_for_bm25(query)
+        if not query_tokens or top_k <= 0:
+            return []
+        weights: Dict[str, int] = {}
+        for q in query_tokens:
+            weights[q] = weights.get(q, 0) + 1
+
+        with self._lock:
+            if not self.doc_lengths:
+                return []
+            if backend == "sparse":
+                if self._sparse is None:
+                    self._sparse = SparseBM25Matrix.from_index(self)
+                return self._sparse.search(weights, top_k)
+            k1, b = self.k1, self.b
+            avgdl = max(1e-9, self.avgdl)
+            terms = [t for t in weights if t in self.postings]
+            bounds = {t: weights[t] * self._term_upper_bound(t) for t in terms}
+            terms.sort(key=lambda t: bounds[t], reverse=True)
+            remaining_ub = sum(bounds.values())
+
+            scores: Dict[str, float] = {}
+            closed = False
+            for term in terms:
+                plist = self.postings[term]
+                weight = weights[term] * self.idf.get(term, 0.0)
+                new_doc_ub = remaining_ub
+                remaining_ub -= bounds[term]
+                if prune and not closed and len(scores) >= top_k:
+                    # 剩餘上界只會遞減、第 k 名分數只會遞增，一旦關閉即不再重算
+                    closed = new_doc_ub < self._kth_score(scores, top_k)
+                if closed:
+                    # 新文件即使命中剩餘所有詞也進不了前 k 名：只替既有候選補分
+                    for doc_id in scores:
+                        freq = plist.get(doc_id)
+                        if freq:
+                            scores[doc_id] += self._term_score(freq, doc_id, weight, k1, b, avgdl)
+                    continue
+                for doc_id, freq in plist.items():
+                    scores[doc_id] = scores.get(doc_id, 0.0) + self._term_score(freq, doc_id, weight, k1, b, avgdl)
+        return heapq.nlargest(top_k, scores.items(), key=lambda x: x[1])
+
+    def _term_score(self, freq: int, doc_id: str, weight: float, k1: float, b: float, avgdl: float) -> float:
+        dl = max(1, self.doc_lengths[doc_id])
+        denom = freq + k1 * (1.0 - b + b * dl / avgdl)
+        return weight * (freq * (k1 + 1.0)) / max(1e-9, denom)
+
+    @staticmethod
+    def _kth_score(scores: Dict[str, float], k: int) -> float:
+        if len(scores) < k:
+            return 0.0
+        return heapq.nlargest(k, scores.values())[-1]
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "version": BM25_INDEX_FORMAT_VERSION,
+                "k1": self.k1,
+                "b": self.b,
+                "postings": self.postings,
+                "doc_lengths": self.doc_lengths,
+                "generation": self.generation,
+            }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BM25Index":
+        index = cls(k1=float(data.get("k1", BM25_K1)), b=float(data.get("b", BM25_B)))
+        index.postings = data.get("postings") or {}
+        index.doc_lengths = data.get("doc_lengths") or {}
+        index.total_length = sum(index.doc_lengths.values())
+        index.generation = data.get("generation")
+        index._refresh_idf()
+        return index
+
+    def save(self, path: str) -> None:
+        """先寫暫存檔再 os.replace，避免讀到寫一半的檔案；暫存檔名依 process / 執行緒區分，不需持鎖。"""
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(self.to_dict(), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["BM25Index"]:
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rb") as f:
+                data = pickle.load(f)
+        except Exception as e:
+            logger.warning("[BM25] 讀取索引失敗，將重建 path=%s error=%s", path, e)
+            return None
+        if not isinstance(data, dict) or data.get("version") != BM25_INDEX_FORMAT_VERSION:
+            logger.warning("[BM25] 索引版本不符，將重建 path=%s", path)
+            return None
+        return cls.from_dict(data)
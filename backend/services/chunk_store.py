@@ -0,0 +1,429 @@
+"""記憶體映射（mmap）chunk 儲存：取代以 pickle 整包序列化的 LangChain docstore。
+
+舊格式 assistant_{id}_metadata.pkl 需在第一次查詢前把所有 chunk 文字反序列化成 Python 物件；
+大型助理冷啟動需數秒，且常駐記憶體與 chunk 數成正比。新格式 assistant_{id}_chunks.bin：
+
+    [UTF-8 文字 blob][padding][offsets: (n+1) x uint64][header JSON][trailer]
+
+  - offsets[i]:offsets[i+1] 為第 i 個 chunk 在 blob 中的位元組範圍；
+  - header JSON：ids（依 FAISS index 位置排序，即 index_to_docstore_id）與欄式 metadata
+    {key: [value_0, ..., value_{n-1}]}（該 chunk 無此 key 時為 null），以及呼叫端附加欄位（如 base_seq）；
+  - trailer：offsets 起點、header 起點、header 長度、magic。
+
+檔案以 mmap 開啟，offsets 直接映射為 NumPy 陣列，只有被檢索命中（top-k）的 chunk 才會
+解碼成 Document。寫入時先寫文字 blob 再寫索引，整個過程為串流、不需先把全部文字載入記憶體。
+
+一個 MmapDocstore 可依序掛載多個檔案（主檔 + 增量區段，見 services.vector_segments）；
+新增 / 刪除 chunk（FAISS.add_documents / delete）記錄在記憶體覆蓋層，寫回磁碟時合併。
+每個檔案可另外掛載同順序的原始向量 .npy（mmap），供量化索引重新排序（見 services.faiss_index）。
+"""
+
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import struct
+import sys
+from collections.abc import Mapping
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from utils.logger import get_logger
+
+try:
+    from langchain_community.docstore.base import AddableMixin, Docstore  # pyright: ignore[reportMissingImports]
+    from langchain_core.documents import Document  # pyright: ignore[reportMissingImports]
+except ImportError:
+    class Docstore:  # type: ignore[no-redef]
+        pass
+
+    class AddableMixin:  # type: ignore[no-redef]
+        pass
+
+    Document = None  # type: ignore[assignment, misc]
+
+logger = get_logger(__name__)
+
+CHUNK_STORE_MAGIC = b"CBCHUNK1"
+CHUNK_STORE_FORMAT_VERSION = 1
+_TRAILER = struct.Struct("<QQQ8s")
+
+
+class _Segment:
+    """唯讀的已映射檔案；開啟後不再變動，可由多個執行緒同時讀取。"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        size = len(self._mm)
+        if size < _TRAILER.size:
+            raise ValueError(f"chunk store too small: {path}")
+        offsets_pos, header_pos, header_len, magic = _TRAILER.unpack_from(self._mm, size - _TRAILER.size)
+        if magic != CHUNK_STORE_MAGIC:
+            raise ValueError(f"not a chunk store file: {path}")
+        header = json.loads(self._mm[header_pos:header_pos + header_len].decode("utf-8"))
+        if header.get("version") != CHUNK_STORE_FORMAT_VERSION:
+            raise ValueError(f"unsupported chunk store version {header.get('version')}: {path}")
+        self.header = {k: v for k, v in header.items() if k not in ("ids", "columns")}
+        self.ids: List[str] = header["ids"]
+        self.columns: Dict[str, List[Any]] = header.get("columns", {})
+        self.offsets = np.frombuffer(self._mm, dtype="<u8", count=len(self.ids) + 1, offset=offsets_pos)
+        self.positions: Dict[str, int] = {doc_id: i for i, doc_id in enumerate(self.ids)}
+        self.vectors: Optional[np.ndarray] = None
+
+    def attach_vectors(self, path: str, vectors: Optional[np.ndarray] = None) -> None:
+        """以 mmap 掛載與 ids 同順序的原始向量（float32 .npy，可傳入已開啟的陣列）；筆數不符時不採用。"""
+        if vectors is None:
+            vectors = np.load(path, mmap_mode="r")
+        if vectors.ndim != 2 or vectors.shape[0] != len(self.ids):
+            logger.warning(
+                "[Chunk 儲存] 原始向量筆數與 chunk 檔不符，略過 path=%s vectors=%s chunks=%d",
+                path, vectors.shape, len(self.ids),
+            )
+            return
+        self.vectors = vectors
+
+    def text(self, pos: int) -> str:
+        start, end = int(self.offsets[pos]), int(self.offsets[pos + 1])
+        return self._mm[start:end].decode("utf-8")
+
+    def metadata(self, pos: int) -> Dict[str, Any]:
+        return {key: values[pos] for key, values in self.columns.items() if values[pos] is not None}
+
+    def memory_bytes(self) -> int:
+        """常駐 Python 物件（ids / 欄式 metadata / 反查表）的估計大小；文字與 offsets 位於 page cache 不計入。"""
+        total = sys.getsizeof(self.ids) + sys.getsizeof(self.positions)
+        total += sum(sys.getsizeof(doc_id) for doc_id in self.ids)
+        for values in self.columns.values():
+            total += sys.getsizeof(values) + sum(sys.getsizeof(v) for v in values if v is not None)
+        return total
+
+    def close(self) -> None:
+        self.offsets = None
+        self.vectors = None
+        try:
+            self._mm.close()
+        except BufferError:
+            # 仍有 NumPy view 指向此 mmap 時無法關閉，交由 GC 回收
+            pass
+
+
+class _DocView(Mapping):
+    """唯讀 Mapping：相容既有 `docstore._dict` 用法（BM25 重建、列出 chunk）；取值時才解碼。"""
+
+    def __init__(self, store: "MmapDocstore"):
+        self._store = store
+
+    def __getitem__(self, doc_id: str):
+        doc = self._store.search(doc_id)
+        if isinstance(doc, str):
+            raise KeyError(doc_id)
+        return doc
+
+    def __iter__(self) -> Iterator[str]:
+        return self._store.iter_ids()
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+
+class MmapDocstore(Docstore, AddableMixin):
+    """LangChain Docstore 介面（search / add / delete），底層為 mmap chunk 檔 + 記憶體覆蓋層。"""
+
+    def __init__(self, segments: Optional[List[_Segment]] = None):
+        self._segments: List[_Segment] = list(segments or [])
+        self._added: Dict[str, Any] = {}
+        self._deleted: set = set()
+
+    @classmethod
+    def open(cls, path: str, vectors_path: Optional[str] = None) -> "MmapDocstore":
+        return cls([_open_segment(path, vectors_path)])
+
+    @property
+    def path(self) -> Optional[str]:
+        return self._segments[0].path if self._segments else None
+
+    @property
+    def base_seq(self) -> int:
+        """主檔寫入時已併入的增量區段序號（見 services.vector_segments）。"""
+        return int(self._segments[0].header.get("base_seq", 0)) if self._segments else 0
+
+    @property
+    def base_id(self) -> Optional[str]:
+        """主檔識別碼；與 manifest 相同代表 chunk 檔與 manifest 屬於同一次提交。"""
+        return self._segments[0].header.get("base_id") if self._segments else None
+
+    @property
+    def segment_count(self) -> int:
+        return len(self._segments)
+
+    @property
+    def _dict(self) -> _DocView:
+        return _DocView(self)
+
+    def _in_segment(self, doc_id: str) -> bool:
+        if doc_id in self._deleted:
+            return False
+        return any(doc_id in seg.positions for seg in self._segments)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._added or self._in_segment(doc_id)
+
+    def __len__(self) -> int:
+        base = sum(len(seg.ids) for seg in self._segments) - len(self._deleted)
+        return base + len(self._added)
+
+    def iter_ids(self) -> Iterator[str]:
+        deleted = self._deleted
+        for seg in list(self._segments):
+            for doc_id in seg.ids:
+                if doc_id not in deleted:
+                    yield doc_id
+        yield from list(self._added)
+
+    def iter_metadata(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """逐筆 (doc_id, metadata)，不解碼 chunk 文字（列出檔案清單等只需 metadata 的用途）。"""
+        deleted = self._deleted
+        for seg in list(self._segments):
+            for pos, doc_id in enumerate(seg.ids):
+                if doc_id not in deleted:
+                    yield doc_id, seg.metadata(pos)
+        for doc_id, doc in list(self._added.items()):
+            yield doc_id, getattr(doc, "metadata", None) or {}
+
+    def ids_with_metadata(self, key: str, value: Any) -> List[str]:
+        """metadata[key] == value 的 doc_id；直接比對欄式 metadata，不解碼文字。"""
+        deleted = self._deleted
+        ids: List[str] = []
+        for seg in list(self._segments):
+            values = seg.columns.get(key)
+            if values is not None:
+                ids.extend(doc_id for doc_id, v in zip(seg.ids, values) if v == value and doc_id not in deleted)
+        for doc_id, doc in list(self._added.items()):
+            if (getattr(doc, "metadata", None) or {}).get(key) == value:
+                ids.append(doc_id)
+        return ids
+
+    def search(self, search: str):
+        """回傳 Document；找不到時依 LangChain 慣例回傳說明字串。"""
+        doc = self._added.get(search)
+        if doc is not None:
+            return doc
+        if search not in self._deleted:
+            for seg in self._segments:
+                pos = seg.positions.get(search)
+                if pos is not None:
+                    return _make_document(seg.text(pos), seg.metadata(pos))
+        return f"ID {search} not found."
+
+    def add(self, texts: Dict[str, Any]) -> None:
+        overlapping = [doc_id for doc_id in texts if doc_id in self]
+        if overlapping:
+            raise ValueError(f"Tried to add ids that already exist: {overlapping}")
+        for doc_id, doc in texts.items():
+            self._deleted.discard(doc_id)
+            self._added[doc_id] = doc
+
+    def delete(self, ids: List) -> None:
+        missing = [doc_id for doc_id in ids if doc_id not in self]
+        if missing:
+            raise ValueError(f"Tried to delete ids that does not exist: {missing}")
+        for doc_id in ids:
+            if self._added.pop(doc_id, None) is None:
+                self._deleted.add(doc_id)
+
+    def raw_vector(self, doc_id: Optional[str]) -> Optional[np.ndarray]:
+        """該 chunk 的原始向量（mmap 唯讀 view）；覆蓋層或未掛載向量檔時回傳 None。"""
+        if doc_id is None or doc_id in self._deleted:
+            return None
+        for seg in self._segments:
+            pos = seg.positions.get(doc_id)
+            if pos is not None:
+                return None if seg.vectors is None else seg.vectors[pos]
+        return None
+
+    def raw_vectors(self, doc_ids: Iterable[Optional[str]]) -> Optional[np.ndarray]:
+        """多筆原始向量（float32 複本）；任一筆缺少時回傳 None。"""
+        rows = []
+        for doc_id in doc_ids:
+            row = self.raw_vector(doc_id)
+            if row is None:
+                return None
+            rows.append(row)
+        if not rows:
+            return None
+        return np.array(rows, dtype=np.float32)
+
+    def copy(self) -> "MmapDocstore":
+        """淺複製：共用已映射的唯讀檔案，只複製覆蓋層（copy-on-write 寫入用，原物件不受後續修改影響）。"""
+        clone = MmapDocstore(self._segments)
+        clone._added = dict(self._added)
+        clone._deleted = set(self._deleted)
+        return clone
+
+    def reload(self, path: str, vectors_path: Optional[str] = None) -> None:
+        """寫回磁碟後改為映射新檔並清空覆蓋層（新檔已包含覆蓋層內容）。"""
+        segment = _open_segment(path, vectors_path)
+        self._segments, self._added, self._deleted = [segment], {}, set()
+
+    def attach(self, path: str, vectors_path: Optional[str] = None) -> List[str]:
+        """掛載增量區段：其中的 chunk 若仍在覆蓋層則移出（改由 mmap 提供）；回傳區段內 ids（依 index 位置）。"""
+        segment = _open_segment(path, vectors_path)
+        self._segments = self._segments + [segment]
+        for doc_id in segment.ids:
+            self._added.pop(doc_id, None)
+        return list(segment.ids)
+
+    def memory_bytes(self) -> int:
+        total = sum(seg.memory_bytes() for seg in self._segments)
+        for doc in self._added.values():
+            total += sys.getsizeof(getattr(doc, "page_content", "") or "")
+        return total
+
+    def close(self) -> None:
+        """關閉映射；copy() 產生的複本共用同一批檔案，仍有複本在使用時不可呼叫。"""
+        for seg in self._segments:
+            seg.close()
+
+
+def _open_segment(path: str, vectors_path: Optional[str]) -> _Segment:
+    # 先開啟原始向量檔再開 chunk 檔：全量寫入先替換 chunk 檔，不持鎖讀取時讀到新向量檔即必然讀到新 chunk 檔
+    vectors = None
+    if vectors_path and os.path.exists(vectors_path):
+        vectors = np.load(vectors_path, mmap_mode="r")
+    segment = _Segment(path)
+    if vectors is not None:
+        segment.attach_vectors(vectors_path, vectors)
+    return segment
+
+
+def _make_document(text: str, metadata: Dict[str, Any]):
+    return Document(page_content=text, metadata=metadata)
+
+
+def _json_value(value: Any) -> Any:
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_json_value(v) for v in value]
+    if isinstance(value, dict):
+        return {str(k): _json_value(v) for k, v in value.items()}
+    return str(value)
+
+
+def write_chunk_store(
+    path: str,
+    items: Iterable[Tuple[str, Any]],
+    *,
+    header: Optional[Dict[str, Any]] = None,
+) -> int:
+    """串流寫入 (doc_id, Document) 序列（需依 FAISS index 位置排序）；先寫 .tmp 再 os.replace，回傳筆數。"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    ids: List[str] = []
+    offsets: List[int] = [0]
+    columns: Dict[str, List[Any]] = {}
+    try:
+        with open(tmp_path, "wb") as f:
+            for n, (doc_id, doc) in enumerate(items):
+                data = (getattr(doc, "page_content", "") or "").encode("utf-8")
+                f.write(data)
+                offsets.append(offsets[-1] + len(data))
+                ids.append(str(doc_id))
+                metadata = getattr(doc, "metadata", None) or {}
+                for key in metadata:
+                    if key not in columns:
+                        columns[key] = [None] * n
+                for key, values in columns.items():
+                    values.append(_json_value(metadata.get(key)))
+            offsets_pos = offsets[-1] + (-offsets[-1] % 8)
+            f.write(b"\0" * (offsets_pos - offsets[-1]))
+            f.write(np.asarray(offsets, dtype="<u8").tobytes())
+            header_bytes = json.dumps(
+                {**(header or {}), "version": CHUNK_STORE_FORMAT_VERSION, "ids": ids, "columns": columns},
+                ensure_ascii=False,
+            ).encode("utf-8")
+            header_pos = offsets_pos + 8 * len(offsets)
+            f.write(header_bytes)
+            f.write(_TRAILER.pack(offsets_pos, header_pos, len(header_bytes), CHUNK_STORE_MAGIC))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return len(ids)
+
+
+def update_chunk_store_header(path: str, header: Dict[str, Any]) -> None:
+    """
+    更新 chunk 檔 header 的附加欄位（如 base_id），文字 blob 與 offsets 原樣複製；先寫 .tmp 再 os.replace，
+    已開啟舊檔的讀取端不受影響。
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(path, "rb") as src:
+            src.seek(-_TRAILER.size, os.SEEK_END)
+            offsets_pos, header_pos, header_len, magic = _TRAILER.unpack(src.read(_TRAILER.size))
+            if magic != CHUNK_STORE_MAGIC:
+                raise ValueError(f"not a chunk store file: {path}")
+            src.seek(header_pos)
+            current = json.loads(src.read(header_len).decode("utf-8"))
+            header_bytes = json.dumps({**current, **header}, ensure_ascii=False).encode("utf-8")
+            src.seek(0)
+            with open(tmp_path, "wb") as dst:
+                remaining = header_pos
+                while remaining > 0:
+                    data = src.read(min(remaining, 1 << 20))
+                    if not data:
+                        raise ValueError(f"truncated chunk store file: {path}")
+                    dst.write(data)
+                    remaining -= len(data)
+                dst.write(header_bytes)
+                dst.write(_TRAILER.pack(offsets_pos, header_pos, len(header_bytes), CHUNK_STORE_MAGIC))
+                dst.flush()
+                os.fsync(dst.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def ordered_documents(docstore, index_to_docstore_id: Mapping) -> Iterator[Tuple[str, Any]]:
+    """依 FAISS index 位置 0..n-1 逐筆取出 (doc_id, Document)，供 write_chunk_store 串流寫入。"""
+    for pos in range(len(index_to_docstore_id)):
+        doc_id = index_to_docstore_id[pos]
+        doc = docstore.search(doc_id)
+        if isinstance(doc, str):
+            raise ValueError(f"docstore missing id {doc_id} at index position {pos}")
+        yield doc_id, doc
+
+
+def index_to_docstore_id_from(docstore: MmapDocstore) -> Dict[int, str]:
+    """chunk 檔 ids 即依 index 位置排序，直接還原 FAISS 的 index_to_docstore_id。"""
+    return dict(enumerate(docstore.iter_ids()))
+
+
+def migrate_pickle_metadata(
+    metadata_path: str,
+    chunk_path: str,
+    *,
+    remove_pickle: bool = False,
+    header: Optional[Dict[str, Any]] = None,
+) -> int:
+    """將舊版 assistant_{id}_metadata.pkl 轉為 chunk 檔（header 為附加欄位，如 base_id）；回傳筆數。需安裝 langchain 以反序列化舊檔。"""
+    import pickle
+
+    with open(metadata_path, "rb") as f:
+        metadata = pickle.load(f)
+    count = write_chunk_store(
+        chunk_path, ordered_documents(metadata["docstore"], metadata["index_to_docstore_id"]), header=header
+    )
+    if remove_pickle:
+        os.remove(metadata_path)
+    return count
@@ -0,0 +1,348 @@
+"""上傳文件的串流解析：分段寫入磁碟、逐頁載入、逐頁切 chunk，以固定大小的批次交給 embedding 與索引。
+
+舊流程 `await file.read()` 把整個檔案讀進記憶體，loader.load() 再一次產生所有頁面、切塊後所有 chunk
+同時存在；300 MB 的 PDF 會讓 worker RSS 暴增數 GB。此模組讓每個階段只持有一小段資料：
+
+  - spool_upload：以 UPLOAD_SPOOL_CHUNK_BYTES 為單位讀取 UploadFile 寫入暫存檔，完成後才改名為正式檔名；
+  - iter_source_pages：PDF 直接以 pypdf 逐頁擷取（PyPDFParser.lazy_parse 實際上會先把所有頁面做成 list）；
+    DOCX 使用 loader.lazy_load()；txt 以 INGEST_TEXT_BLOCK_CHARS 字元為一段讀取，於段落 / 換行處切開
+    （與整檔切塊的差異只在段落邊界，切塊器本來就會在此切開）；on_progress 回報已解析的來源比例（0~1）；
+  - iter_chunk_batches：逐頁切 chunk，累積到 INGEST_BATCH_CHUNKS 筆即交出一批；
+  - iter_source_chunk_batches：heavy 路徑的入口。解析 / 切塊 / token 計數是純 CPU 工作，在 RAG 佇列的
+    執行緒中受 GIL 限制（同時 5 個上傳幾乎只用到一個核心，也拖慢 event loop 的執行緒），因此預設交給
+    spawn 的子行程池（INGEST_PROCESS_WORKERS）：PDF 每 INGEST_PDF_PAGES_PER_TASK 頁一個工作、
+    txt 每段一個工作、DOCX 整份一個工作，依序取回 chunk 列表（最多預先送出 workers + 1 個工作，記憶體有界）；
+    子行程只回傳 (文字, metadata, token 數)，embedding 與 FAISS 寫入仍在本行程；
+  - embed_in_batches：每批再以 UPLOAD_EMBED_BATCH_SIZE 筆為單位呼叫 embed_documents，逐段回報進度；
+  - file_sha256：分段計算內容雜湊，內容未變的重新上傳沿用既有摘要。
+
+embedding、加入 FAISS 與寫入增量區段由 vector_service 逐批處理，chunk 文字寫入區段後即改由 mmap 提供。
+
+環境變數：
+  UPLOAD_SPOOL_CHUNK_BYTES   上傳寫檔每次讀取的位元組數（預設 1048576）
+  INGEST_TEXT_BLOCK_CHARS    txt 每段讀取的字元數（預設 1000000）
+  INGEST_BATCH_CHUNKS        每批 embedding + 寫入索引的 chunk 數（預設 1024）
+  UPLOAD_EMBED_BATCH_SIZE    上傳時每次 embed_documents 的 chunk 數（預設 128；影響進度回報粒度與吞吐）
+  INGEST_PROCESS_WORKERS     解析 / 切塊子行程數（預設 min(4, CPU 數 - 1)，至少 1；0 = 在 RAG 執行緒中處理）
+  INGEST_PDF_PAGES_PER_TASK  PDF 每個子行程工作的頁數（預設 20）
+"""
+
+from __future__ import annotations
+
+import hashlib
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Deque, Iterable, Iterator, List, Optional, Tuple
+
+from utils import document_chunking
+from utils.logger import get_logger
+
+try:
+    from langchain_core.documents import Document  # pyright: ignore[reportMissingImports]
+except ImportError:
+    Document = None  # type: ignore[assignment, misc]
+
+logger = get_logger(__name__)
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+class ChunkBatch(list):
+    """一批 chunk Document；token_count 由子行程預先算好時不為 None。"""
+
+    token_count: Optional[int] = None
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def spool_chunk_bytes() -> int:
+    return max(64 * 1024, _env_int("UPLOAD_SPOOL_CHUNK_BYTES", 1024 * 1024))
+
+
+def text_block_chars() -> int:
+    return max(10_000, _env_int("INGEST_TEXT_BLOCK_CHARS", 1_000_000))
+
+
+def ingest_batch_chunks() -> int:
+    return max(1, _env_int("INGEST_BATCH_CHUNKS", 1024))
+
+
+def embed_batch_size() -> int:
+    return max(1, _env_int("UPLOAD_EMBED_BATCH_SIZE", 128))
+
+
+def ingest_process_workers() -> int:
+    default = max(1, min(4, (os.cpu_count() or 2) - 1))
+    return max(0, _env_int("INGEST_PROCESS_WORKERS", default))
+
+
+def pdf_pages_per_task() -> int:
+    return max(1, _env_int("INGEST_PDF_PAGES_PER_TASK", 20))
+
+
+async def spool_upload(file, path: str, chunk_bytes: int | None = None) -> int:
+    """分段讀取上傳內容寫入 path（先寫暫存檔再改名，中斷時不留下半個檔案）；回傳位元組數。"""
+    chunk_bytes = chunk_bytes or spool_chunk_bytes()
+    tmp_path = f"{path}.{os.getpid()}.part"
+    size = 0
+    try:
+        with open(tmp_path, "wb") as f:
+            while True:
+                block = await file.read(chunk_bytes)
+                if not block:
+                    break
+                f.write(block)
+                size += len(block)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return size
+
+
+def file_sha256(path: str, chunk_bytes: int | None = None) -> str:
+    """分段讀取計算檔案內容的 SHA-256（knowledge_base.content_hash）。"""
+    chunk_bytes = chunk_bytes or spool_chunk_bytes()
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_bytes), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def iter_text_pages(
+    path: str,
+    block_chars: int | None = None,
+    encoding: str = "utf-8",
+    on_progress: Optional[Callable[[float], None]] = None,
+) -> Iterator[Any]:
+    """逐段讀取文字檔，每段於最後一個段落（或換行）邊界切開，其餘留給下一段。"""
+    block_chars = block_chars or text_block_chars()
+    total_bytes = os.path.getsize(path) or 1
+    read_bytes = 0
+    carry = ""
+    with open(path, "r", encoding=encoding) as f:
+        while True:
+            block = f.read(block_chars)
+            if not block:
+                break
+            text = carry + block
+            cut = text.rfind("\n\n")
+            if cut < len(text) // 2:
+                cut = text.rfind("\n")
+            if cut < len(text) // 2:
+                # 整段沒有可用的換行：直接在段尾切開
+                cut = len(text)
+            carry = text[cut:]
+            if on_progress is not None:
+                read_bytes += len(text[:cut].encode(encoding))
+                on_progress(min(1.0, read_bytes / total_bytes))
+            yield Document(page_content=text[:cut], metadata={"source": path})
+    if carry.strip():
+        yield Document(page_content=carry, metadata={"source": path})
+    if on_progress is not None:
+        on_progress(1.0)
+
+
+def iter_pdf_pages(path: str, on_progress: Optional[Callable[[float], None]] = None) -> Iterator[Any]:
+    """以 pypdf 逐頁擷取文字（metadata 與 PyPDFLoader 相同），同一時間只持有一頁的文字。"""
+    import pypdf  # pyright: ignore[reportMissingImports]
+
+    with open(path, "rb") as f:
+        reader = pypdf.PdfReader(f)
+        total_pages = len(reader.pages) or 1
+        for page_number, page in enumerate(reader.pages):
+            if on_progress is not None:
+                on_progress((page_number + 1) / total_pages)
+            yield Document(page_content=page.extract_text(), metadata={"source": path, "page": page_number})
+    if on_progress is not None:
+        on_progress(1.0)
+
+
+def iter_source_pages(
+    file_path: str,
+    file_type: str,
+    loader_factory: Callable[[str, str], Any],
+    on_progress: Optional[Callable[[float], None]] = None,
+    source: Optional[str] = None,
+) -> Iterator[Any]:
+    """
+    依檔案類型逐頁產生 Document；其他類型 loader 不支援 lazy_load 時退回 load()。
+    source：從暫存檔解析時，metadata["source"] 改記為檔案最終的路徑。
+    """
+    if file_type == "txt":
+        pages = iter_text_pages(file_path, on_progress=on_progress)
+    elif file_type == "pdf":
+        pages = iter_pdf_pages(file_path, on_progress=on_progress)
+    else:
+        loader = loader_factory(file_path, file_type)
+        lazy_load = getattr(loader, "lazy_load", None)
+        pages = lazy_load() if callable(lazy_load) else loader.load()
+    for page in pages:
+        if source is not None:
+            page.metadata["source"] = source
+        yield page
+    if on_progress is not None:
+        on_progress(1.0)
+
+
+def iter_chunk_batches(pages: Iterable[Any], splitter, batch_size: int | None = None) -> Iterator[List[Any]]:
+    """逐頁切 chunk，每累積 batch_size 筆交出一批（最後一批可能較少）；全部頁面皆無內容時不交出任何批次。"""
+    batch_size = batch_size or ingest_batch_chunks()
+    batch: List[Any] = []
+    for page in pages:
+        batch.extend(splitter.split_documents([page]))
+        while len(batch) >= batch_size:
+            yield ChunkBatch(batch[:batch_size])
+            batch = batch[batch_size:]
+    if batch:
+        yield ChunkBatch(batch)
+
+
+def _get_pool() -> Optional[ProcessPoolExecutor]:
+    """延遲建立子行程池（spawn：避免 fork 已載入模型與多執行緒的行程）；INGEST_PROCESS_WORKERS=0 時為 None。"""
+    global _pool
+    workers = ingest_process_workers()
+    if workers == 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            logger.info("[文件解析子行程] 啟動 workers=%d", workers)
+        return _pool
+
+
+def _discard_pool(pool: ProcessPoolExecutor) -> None:
+    """子行程異常結束（例如 OOM）後池不可再用：丟棄，下次使用時重建。"""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_ingest_pool() -> None:
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+        logger.info("[文件解析子行程] 已關閉")
+
+
+def _submit_chunk_tasks(
+    pool: ProcessPoolExecutor, file_path: str, file_type: str, source: str
+) -> Iterator[Tuple[Future, float]]:
+    """依來源順序送出子行程工作，產生 (future, 完成後的來源比例)；由呼叫端逐一取用以限制預先送出的數量。"""
+    if file_type == "txt":
+        fraction = [0.0]
+        for page in iter_text_pages(file_path, on_progress=lambda f: fraction.__setitem__(0, f)):
+            yield pool.submit(document_chunking.split_pages, [(page.page_content, {"source": source})]), fraction[0]
+    elif file_type == "pdf":
+        total = document_chunking.pdf_page_count(file_path)
+        step = pdf_pages_per_task()
+        for start in range(0, total, step):
+            end = min(start + step, total)
+            yield pool.submit(document_chunking.chunk_pdf_range, file_path, start, end, source), end / total
+    elif file_type == "docx":
+        yield pool.submit(document_chunking.chunk_docx, file_path, source), 1.0
+    else:
+        raise ValueError("Unsupported file type")
+
+
+def _iter_pool_chunk_batches(
+    pool: ProcessPoolExecutor,
+    file_path: str,
+    file_type: str,
+    on_progress: Optional[Callable[[float], None]],
+    source: str,
+    batch_size: int,
+) -> Iterator[ChunkBatch]:
+    tasks = _submit_chunk_tasks(pool, file_path, file_type, source)
+    window: Deque[Tuple[Future, float]] = deque()
+    prefetch = ingest_process_workers() + 1
+    batch = ChunkBatch()
+    batch.token_count = 0
+    try:
+        while True:
+            while len(window) < prefetch:
+                task = next(tasks, None)
+                if task is None:
+                    break
+                window.append(task)
+            if not window:
+                break
+            future, fraction = window.popleft()
+            try:
+                chunks, token_counts = future.result()
+            except BrokenProcessPool:
+                _discard_pool(pool)
+                raise
+            if on_progress is not None:
+                on_progress(fraction)
+            for (text, metadata), n_tokens in zip(chunks, token_counts):
+                batch.append(Document(page_content=text, metadata=metadata))
+                batch.token_count += n_tokens
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = ChunkBatch()
+                    batch.token_count = 0
+        if batch:
+            yield batch
+        if on_progress is not None:
+            on_progress(1.0)
+    finally:
+        for future, _ in window:
+            future.cancel()
+        tasks.close()
+
+
+def iter_source_chunk_batches(
+    file_path: str,
+    file_type: str,
+    loader_factory: Callable[[str, str], Any],
+    on_progress: Optional[Callable[[float], None]] = None,
+    source: Optional[str] = None,
+    batch_size: int | None = None,
+) -> Iterator[ChunkBatch]:
+    """
+    解析 → 切塊 → 每 batch_size 筆交出一批（ChunkBatch）。有子行程池時解析 / 切塊 / token 計數在子行程執行
+    （token_count 已算好），否則在目前執行緒逐頁處理。
+    """
+    batch_size = batch_size or ingest_batch_chunks()
+    try:
+        pool = _get_pool()
+    except (OSError, ValueError) as e:
+        logger.warning("[文件解析子行程] 無法啟動，改在目前執行緒處理：%s", e)
+        pool = None
+    if pool is None:
+        pages = iter_source_pages(file_path, file_type, loader_factory, on_progress=on_progress, source=source)
+        yield from iter_chunk_batches(pages, document_chunking.build_text_splitter(), batch_size)
+        return
+    yield from _iter_pool_chunk_batches(pool, file_path, file_type, on_progress, source or file_path, batch_size)
+
+
+def embed_in_batches(
+    embeddings,
+    texts: List[str],
+    batch_size: int | None = None,
+    on_batch: Optional[Callable[[int], None]] = None,
+) -> List[List[float]]:
+    """以 batch_size 筆為單位呼叫 embeddings.embed_documents；每段完成後以累計筆數呼叫 on_batch。"""
+    batch_size = batch_size or embed_batch_size()
+    vectors: List[List[float]] = []
+    for start in range(0, len(texts), batch_size):
+        vectors.extend(embeddings.embed_documents(texts[start:start + batch_size]))
+        if on_batch is not None:
+            on_batch(len(vectors))
+    return vectors
@@ -0,0 +1,192 @@
+"""行程內嵌入微批次：同時到達的 embed 請求合併為一次 BGE batched forward。
+
+多個對話同時提問時，各執行緒分別呼叫 embed_query 會在同一批 CPU 核心上平行跑 batch=1 的 forward、
+互相搶資源。此模組以單一背景執行緒持有模型，收集數毫秒內的請求後一次送入 embed_documents，
+結果再分送回各等待中的呼叫端。
+
+- 查詢（embed_query）優先於上傳切塊（embed_documents），大量上傳時聊天查詢不會排在整批文件後面；
+- 上傳文件依 EMBEDDING_BATCH_MAX_SIZE 切段送入，與查詢交錯執行。
+
+環境變數：
+  EMBEDDING_BATCH_ENABLED      true（預設）| false
+  EMBEDDING_BATCH_MAX_SIZE     每批最多句數（預設 32）
+  EMBEDDING_BATCH_MAX_WAIT_MS  收集等待上限毫秒（預設 5）
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+from utils.logger import get_logger
+
+try:
+    from langchain_core.embeddings import Embeddings  # pyright: ignore[reportMissingImports]
+except ImportError:
+    Embeddings = object  # type: ignore[misc, assignment]
+
+logger = get_logger(__name__)
+
+
+@dataclass
+class _Request:
+    texts: List[str]
+    future: Future
+
+
+class EmbeddingBatcher:
+    """背景執行緒依序執行 embed_fn(texts)；submit 回傳 concurrent.futures.Future。"""
+
+    def __init__(
+        self,
+        embed_fn: Callable[[List[str]], List[List[float]]],
+        *,
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+    ):
+        self._embed_fn = embed_fn
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait_s = max(0.0, float(max_wait_ms)) / 1000.0
+        self._cond = threading.Condition()
+        self._queries: Deque[_Request] = deque()
+        self._documents: Deque[_Request] = deque()
+        self._pending_texts = 0
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self._stats = {"batches": 0, "texts": 0, "query_requests": 0, "document_requests": 0, "max_batch": 0}
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="embed-batcher", daemon=True)
+            self._thread.start()
+
+    def submit(self, texts: List[str], *, query: bool = False) -> Future:
+        future: Future = Future()
+        if not texts:
+            future.set_result([])
+            return future
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("EmbeddingBatcher is closed")
+            self._ensure_thread()
+            (self._queries if query else self._documents).append(_Request(list(texts), future))
+            self._pending_texts += len(texts)
+            self._stats["query_requests" if query else "document_requests"] += 1
+            self._cond.notify()
+        return future
+
+    def embed(self, texts: List[str], *, query: bool = False) -> List[List[float]]:
+        """同步介面：文件依 max_batch_size 切段送出，依原順序合併結果。"""
+        if query:
+            return self.submit(texts, query=True).result()
+        futures = [
+            self.submit(texts[i:i + self.max_batch_size])
+            for i in range(0, len(texts), self.max_batch_size)
+        ]
+        results: List[List[float]] = []
+        for future in futures:
+            results.extend(future.result())
+        return results
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            stats = dict(self._stats)
+            stats["pending_texts"] = self._pending_texts
+        stats["avg_batch"] = round(stats["texts"] / stats["batches"], 2) if stats["batches"] else 0.0
+        stats["max_batch_size"] = self.max_batch_size
+        return stats
+
+    def _take_batch(self) -> List[_Request]:
+        """呼叫端需持有 _cond：查詢優先，其次文件；單一請求不拆開。"""
+        batch: List[_Request] = []
+        size = 0
+        for queue in (self._queries, self._documents):
+            while queue and (not batch or size + len(queue[0].texts) <= self.max_batch_size):
+                req = queue.popleft()
+                batch.append(req)
+                size += len(req.texts)
+            if size >= self.max_batch_size:
+                break
+        self._pending_texts -= size
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending_texts and not self._closed:
+                    self._cond.wait()
+                if self._closed and not self._pending_texts:
+                    return
+                # 收集窗口：湊不滿一批時最多再等 max_wait_s，讓同時到達的查詢併入同一次 forward
+                deadline = time.monotonic() + self.max_wait_s
+                while self._pending_texts < self.max_batch_size and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._take_batch()
+
+            texts = [t for req in batch for t in req.texts]
+            try:
+                vectors = self._embed_fn(texts)
+            except BaseException as e:
+                for req in batch:
+                    req.future.set_exception(e)
+                continue
+            with self._cond:
+                self._stats["batches"] += 1
+                self._stats["texts"] += len(texts)
+                self._stats["max_batch"] = max(self._stats["max_batch"], len(texts))
+            offset = 0
+            for req in batch:
+                n = len(req.texts)
+                req.future.set_result(list(vectors[offset:offset + n]))
+                offset += n
+
+
+class BatchingEmbeddings(Embeddings):
+    """包裝 HuggingFaceEmbeddings：embed_query / embed_documents 都經由 EmbeddingBatcher 執行。"""
+
+    def __init__(self, base, batcher: EmbeddingBatcher):
+        self.base = base
+        self.batcher = batcher
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.batcher.embed([text], query=True)[0]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.batcher.embed(list(texts))
+
+    def __call__(self, text: str) -> List[float]:
+        return self.embed_query(text)
+
+
+def embedding_batching_enabled() -> bool:
+    raw = (os.getenv("EMBEDDING_BATCH_ENABLED") or "true").strip().lower()
+    return raw not in {"0", "false", "no", "off"}
+
+
+def build_batching_embeddings(base) -> BatchingEmbeddings:
+    try:
+        max_batch_size = int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", "32"))
+    except ValueError:
+        max_batch_size = 32
+    try:
+        max_wait_ms = float(os.getenv("EMBEDDING_BATCH_MAX_WAIT_MS", "5"))
+    except ValueError:
+        max_wait_ms = 5.0
+    batcher = EmbeddingBatcher(base.embed_documents, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+    logger.info("[嵌入微批次] 啟用 max_batch_size=%d max_wait_ms=%.1f", batcher.max_batch_size, max_wait_ms)
+    return BatchingEmbeddings(base, batcher)
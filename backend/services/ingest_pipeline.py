@@ -0,0 +1,180 @@
+"""上傳 heavy 路徑的分段管線：parse → embed → index-write → summarize，階段之間以有界佇列銜接，各自限制並行數。
+
+原本一個 RAG 佇列 worker 依序做完解析、embedding、寫入 FAISS、token 計數與 LLM 摘要；vLLM 摘要一慢，
+這個「GPU」slot 就整段閒置，其他上傳的 embedding 只能排隊，向量也要等摘要完成才算上傳完成。拆成：
+
+  - parse：services.document_ingest 的子行程池（INGEST_PROCESS_WORKERS），最多預先送出 workers + 1 個工作；
+  - embed：每個上傳一條背景執行緒（pipelined），解析結果與 embedding 結果經 RAG_PIPELINE_QUEUE_BATCHES
+    批的有界佇列傳遞；跨上傳同時 embedding 的批次數上限 RAG_EMBED_CONCURRENCY；
+  - index-write：RAG 佇列 worker 本身持有 faiss_disk_lock 依序寫入，與下一批的 embedding 重疊；
+    同時寫入索引的批次數上限 RAG_INDEX_WRITE_CONCURRENCY；
+  - summarize：向量發布（已可搜尋）且 RAG 佇列 slot 釋放後，才在獨立執行緒池產生摘要（run_summary），
+    並行數 RAG_SUMMARY_CONCURRENCY，排隊上限 RAG_SUMMARY_QUEUE_MAX（超過時呼叫端等待）。
+
+各階段的執行中數量、完成批次與累計等待 / 執行時間見 pipeline_stats()。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, TypeVar
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+RAG_EMBED_CONCURRENCY = int(os.getenv("RAG_EMBED_CONCURRENCY", os.getenv("RAG_GPU_CONCURRENCY", "5")))
+RAG_INDEX_WRITE_CONCURRENCY = int(os.getenv("RAG_INDEX_WRITE_CONCURRENCY", "2"))
+RAG_PIPELINE_QUEUE_BATCHES = int(os.getenv("RAG_PIPELINE_QUEUE_BATCHES", "2"))
+RAG_SUMMARY_CONCURRENCY = int(os.getenv("RAG_SUMMARY_CONCURRENCY", "2"))
+RAG_SUMMARY_QUEUE_MAX = int(os.getenv("RAG_SUMMARY_QUEUE_MAX", "100"))
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class StageSlots:
+    """以號誌限制某階段的並行數（跨執行緒），並累計等待 / 執行時間。"""
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = max(1, limit)
+        self._sem = threading.BoundedSemaphore(self.limit)
+        self._lock = threading.Lock()
+        self.active = 0
+        self.completed = 0
+        self.wait_s = 0.0
+        self.busy_s = 0.0
+
+    @contextmanager
+    def slot(self):
+        t_wait = time.perf_counter()
+        self._sem.acquire()
+        t_start = time.perf_counter()
+        with self._lock:
+            self.active += 1
+            self.wait_s += t_start - t_wait
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.active -= 1
+                self.completed += 1
+                self.busy_s += time.perf_counter() - t_start
+            self._sem.release()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "limit": self.limit,
+                "active": self.active,
+                "completed": self.completed,
+                "wait_s": round(self.wait_s, 3),
+                "busy_s": round(self.busy_s, 3),
+            }
+
+
+embed_stage = StageSlots("embed", RAG_EMBED_CONCURRENCY)
+index_write_stage = StageSlots("index_write", RAG_INDEX_WRITE_CONCURRENCY)
+summary_stage = StageSlots("summarize", RAG_SUMMARY_CONCURRENCY)
+
+_DONE = object()
+
+
+def pipelined(
+    items: Iterable[T],
+    fn: Callable[[T], R],
+    depth: Optional[int] = None,
+    name: str = "ingest",
+) -> Iterator[R]:
+    """
+    在背景執行緒對 items 逐一套用 fn，結果經長度 depth 的有界佇列依序交給呼叫端，
+    讓 fn（embedding）與呼叫端的處理（寫入索引）重疊。fn 或 items 的例外在呼叫端重新拋出；
+    呼叫端提前結束時通知背景執行緒停止、關閉 items 並等待其結束。
+    """
+    out: "queue.Queue" = queue.Queue(maxsize=max(1, depth or RAG_PIPELINE_QUEUE_BATCHES))
+    stop = threading.Event()
+
+    def _put(item) -> bool:
+        while not stop.is_set():
+            try:
+                out.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce() -> None:
+        iterator = iter(items)
+        try:
+            for item in iterator:
+                if stop.is_set() or not _put((True, fn(item))):
+                    return
+            _put((True, _DONE))
+        except BaseException as e:
+            _put((False, e))
+        finally:
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+
+    thread = threading.Thread(target=_produce, name=f"{name}-pipeline", daemon=True)
+    thread.start()
+    try:
+        while True:
+            ok, value = out.get()
+            if not ok:
+                raise value
+            if value is _DONE:
+                return
+            yield value
+    finally:
+        stop.set()
+        thread.join()
+
+
+_summary_executor: Optional[ThreadPoolExecutor] = None
+_summary_slots: Optional[asyncio.Semaphore] = None
+_summary_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _run_in_summary_stage(fn, *args):
+    with summary_stage.slot():
+        return fn(*args)
+
+
+async def run_summary(fn, *args):
+    """摘要階段：於獨立執行緒池執行 fn(*args)，不佔用 RAG 佇列 slot；排隊已滿時等待。"""
+    global _summary_executor, _summary_slots, _summary_loop
+    loop = asyncio.get_running_loop()
+    if _summary_executor is None:
+        _summary_executor = ThreadPoolExecutor(
+            max_workers=summary_stage.limit, thread_name_prefix="rag-summary"
+        )
+    if _summary_loop is not loop:
+        _summary_slots = asyncio.Semaphore(summary_stage.limit + max(0, RAG_SUMMARY_QUEUE_MAX))
+        _summary_loop = loop
+    async with _summary_slots:
+        return await loop.run_in_executor(_summary_executor, _run_in_summary_stage, fn, *args)
+
+
+def shutdown_ingest_pipeline() -> None:
+    global _summary_executor
+    if _summary_executor is not None:
+        _summary_executor.shutdown(wait=False, cancel_futures=True)
+        _summary_executor = None
+        logger.info("[上傳管線] 摘要執行緒池已關閉")
+
+
+def pipeline_stats() -> Dict[str, Any]:
+    return {
+        "queue_batches": max(1, RAG_PIPELINE_QUEUE_BATCHES),
+        "summary_queue_max": RAG_SUMMARY_QUEUE_MAX,
+        "stages": {stage.name: stage.stats() for stage in (embed_stage, index_write_stage, summary_stage)},
+    }
@@ -106,41 +106,40 @@ def list_notebooks(email: str) -> List[Dict[str, Any]]:
     return []
 
 
-def search_knowledge(notebook_ids: List[int], ask: str) -> List[Dict[str, Any]]:
-    """POST /api/integration/knowledge/search — body: notebook_ids + ask + top。"""
+def _prepare_search(notebook_ids: List[int], ask: str) -> Optional[Dict[str, Any]]:
+    """整理 search payload；無需呼叫 Jarvis 時回傳 None。"""
     ids = [int(x) for x in notebook_ids if x is not None]
     ask = (ask or "").strip()
     if not ids or not ask:
-        return []
-
+        return None
     top_k = max(1, int(os.getenv("RAG_TOP_K", "3")))
-
-    if _mode() != "http":
-        logger.info(
-            "[Jarvis] mock search_knowledge notebook_ids=%s ask_len=%d top=%d",
-            ids,
-            len(ask),
-            top_k,
-        )
-        return [
-            {
-                "id": 1,
-                "text": "這是模擬的知識片段回傳，實作應呼叫 Jarvis API。",
-                "score": 1.0,
-            }
-        ]
-
+    return {"notebook_ids": ids, "ask": ask, "top_k": top_k}
+
+
+def _mock_search_results(payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+    logger.info(
+        "[Jarvis] mock search_knowledge notebook_ids=%s ask_len=%d top=%d",
+        payload["notebook_ids"],
+        len(payload["ask"]),
+        payload["top_k"],
+    )
+    return [
+        {
+            "id": 1,
+            "text": "這是模擬的知識片段回傳，實作應呼叫 Jarvis API。",
+            "score": 1.0,
+        }
+    ]
+
+
+def _search_url() -> str:
     base = _base_url()
     if not base:
         raise RuntimeError("JARVIS_BASE_URL is not configured")
+    return f"{base}/api/integration/knowledge/search"
 
-    url = f"{base}/api/integration/knowledge/search"
-    payload = {"notebook_ids": ids, "ask": ask, "top_k": top_k}
-    with httpx.Client(timeout=_timeout(), verify=False) as client:
-        resp = client.post(url, json=payload, headers=_headers())
-        resp.raise_for_status()
-        data = resp.json()
 
+def _parse_search_results(data: Any) -> List[Dict[str, Any]]:
     results = data.get("results") if isinstance(data, dict) else None
     if not isinstance(results, list):
         logger.warning("[Jarvis] unexpected search payload type=%s", type(data).__name__)
@@ -148,6 +147,38 @@ def search_knowledge(notebook_ids: List[int], ask: str) -> List[Dict[str, Any]]:
     return results
 
 
+def search_knowledge(notebook_ids: List[int], ask: str) -> List[Dict[str, Any]]:
+    """POST /api/integration/knowledge/search — body: notebook_ids + ask + top。"""
+    payload = _prepare_search(notebook_ids, ask)
+    if payload is None:
+        return []
+    if _mode() != "http":
+        return _mock_search_results(payload)
+
+    url = _search_url()
+    with httpx.Client(timeout=_timeout(), verify=False) as client:
+        resp = client.post(url, json=payload, headers=_headers())
+        resp.raise_for_status()
+        data = resp.json()
+    return _parse_search_results(data)
+
+
+async def asearch_knowledge(notebook_ids: List[int], ask: str) -> List[Dict[str, Any]]:
+    """search_knowledge 的非同步版（httpx.AsyncClient），供聊天流程在事件迴圈上直接 await。"""
+    payload = _prepare_search(notebook_ids, ask)
+    if payload is None:
+        return []
+    if _mode() != "http":
+        return _mock_search_results(payload)
+
+    url = _search_url()
+    async with httpx.AsyncClient(timeout=_timeout(), verify=False) as client:
+        resp = await client.post(url, json=payload, headers=_headers())
+        resp.raise_for_status()
+        data = resp.json()
+    return _parse_search_results(data)
+
+
 def format_search_results_as_context(results: List[Dict[str, Any]]) -> Optional[str]:
     chunks: List[str] = []
     for item in results:
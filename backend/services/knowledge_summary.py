@@ -0,0 +1,307 @@
+"""知識庫摘要 / 關鍵字的延後、批次產生。
+
+原本每次上傳與文字編輯都在關鍵路徑上同步呼叫一次 vLLM 產生摘要，上傳 / 編輯要等摘要完成才結束。改為：
+  - 向量寫入並提交 knowledge_base（summary_status=running、summary_worker 為本行程、摘要暫為空字串）後
+    上傳 / 編輯即完成；
+  - schedule_summary 把 (knowledge_id, content_hash, 來源文字) 放入本行程佇列，背景 worker 累積至多
+    KNOWLEDGE_SUMMARY_BATCH_SIZE 筆或等待 KNOWLEDGE_SUMMARY_BATCH_WAIT_MS 毫秒後，以一次
+    generate_summaries_and_keywords（llm.batch）送出，於 services.ingest_pipeline 的摘要階段執行；
+  - 寫回時只更新 content_hash 仍相同的紀錄；期間被刪除或內容又變更的略過（新內容已另排摘要）；
+  - content_hash 與既有紀錄相同且摘要已完成時（重新上傳同一檔案、編輯後內容未變）沿用既有摘要，不呼叫 LLM；
+  - 心跳：擁有者每 KNOWLEDGE_SUMMARY_STALE_SECONDS / 3 秒更新本行程佇列中紀錄的 summary_heartbeat_at；
+  - 補做：啟動時與每次心跳後，以條件式 UPDATE 認領 pending（無擁有者）或 running 且心跳逾
+    KNOWLEDGE_SUMMARY_STALE_SECONDS 秒（擁有者在摘要完成前結束）的紀錄，多 worker 同時檢查時只有一個成功，
+    不會重複送出同一批摘要；來源文字直接由磁碟上已提交的 chunk 檔重建，不載入向量庫、不佔用向量庫快取。
+
+環境變數：
+  KNOWLEDGE_SUMMARY_BATCH_SIZE     每次送出的摘要數上限（預設 8）
+  KNOWLEDGE_SUMMARY_BATCH_WAIT_MS  第一筆到達後等待湊批的毫秒數（預設 500）
+  KNOWLEDGE_SUMMARY_STALE_SECONDS  心跳逾時即視為擁有者已停止、可由其他 worker 認領（預設 300）
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import socket
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+KNOWLEDGE_SUMMARY_BATCH_SIZE = max(1, int(os.getenv("KNOWLEDGE_SUMMARY_BATCH_SIZE", "8")))
+KNOWLEDGE_SUMMARY_BATCH_WAIT_MS = max(0.0, float(os.getenv("KNOWLEDGE_SUMMARY_BATCH_WAIT_MS", "500")))
+KNOWLEDGE_SUMMARY_STALE_SECONDS = max(10.0, float(os.getenv("KNOWLEDGE_SUMMARY_STALE_SECONDS", "300")))
+KNOWLEDGE_SUMMARY_HEARTBEAT_SECONDS = KNOWLEDGE_SUMMARY_STALE_SECONDS / 3
+
+SUMMARY_PENDING = "pending"
+SUMMARY_RUNNING = "running"
+SUMMARY_DONE = "done"
+SUMMARY_FAILED = "failed"
+SUMMARY_UNAVAILABLE = "Summary generation unavailable"
+
+MAX_SUMMARY_LEN = 10000
+MAX_KEYWORDS_LEN = 1000
+_RECOVER_SOURCE_CHARS = 20000
+# 每次補做檢查最多認領的紀錄數
+_CLAIM_BATCH = 50
+
+_WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+@dataclass
+class SummaryRequest:
+    knowledge_id: int
+    content_hash: Optional[str]
+    text: str
+
+
+_queue: Optional[asyncio.Queue] = None
+_worker: Optional[asyncio.Task] = None
+_recovery: Optional[asyncio.Task] = None
+_loop: Optional[asyncio.AbstractEventLoop] = None
+# 本行程已排入、尚未寫回的 knowledge_id（補做時略過）
+_inflight: set = set()
+_stats = {"batches": 0, "summarized": 0, "failed": 0, "skipped": 0, "reused": 0}
+
+
+def clip_summary(summary: str, keyword_lines: str) -> Tuple[str, str]:
+    if len(summary) > MAX_SUMMARY_LEN:
+        logger.warning("[知識庫摘要] Summary 過長 (%d chars)，進行截斷。", len(summary))
+        summary = summary[:MAX_SUMMARY_LEN] + "...(truncated)"
+    if len(keyword_lines) > MAX_KEYWORDS_LEN:
+        logger.warning("[知識庫摘要] Keywords 過長 (%d chars)，進行截斷。", len(keyword_lines))
+        keyword_lines = keyword_lines[:MAX_KEYWORDS_LEN]
+    return summary, keyword_lines
+
+
+def reusable_summary(entry, content_hash: Optional[str]) -> Optional[Tuple[str, str]]:
+    """既有紀錄內容未變且摘要已完成時回傳 (summary, keywords)，否則 None。"""
+    if entry is None or not content_hash or entry.content_hash != content_hash:
+        return None
+    if entry.summary_status != SUMMARY_DONE:
+        return None
+    _stats["reused"] += 1
+    logger.info("[知識庫摘要] 內容未變更，沿用既有摘要 knowledge_id=%s", entry.id)
+    return entry.summary, entry.keywords
+
+
+def claim_entry(entry) -> None:
+    """由本行程產生摘要：清空舊摘要並標為 running（與 knowledge_base 的變更同一交易提交，之後呼叫 schedule_summary）。"""
+    entry.summary, entry.keywords = "", ""
+    entry.summary_status = SUMMARY_RUNNING
+    entry.summary_worker = _WORKER_ID
+    entry.summary_heartbeat_at = datetime.utcnow()
+
+
+def _ensure_started() -> None:
+    global _queue, _worker, _loop
+    loop = asyncio.get_running_loop()
+    if _loop is loop and _worker is not None and not _worker.done():
+        return
+    _loop = loop
+    _queue = asyncio.Queue()
+    _inflight.clear()
+    _worker = loop.create_task(_summary_worker())
+
+
+def schedule_summary(knowledge_id: int, content_hash: Optional[str], text: str) -> None:
+    """排入延後摘要（於 event loop 中呼叫，通常在 knowledge_base 提交之後）。"""
+    _ensure_started()
+    _inflight.add(knowledge_id)
+    _queue.put_nowait(SummaryRequest(knowledge_id, content_hash, text))
+    logger.info("[知識庫摘要] 排入 knowledge_id=%s queued=%d", knowledge_id, _queue.qsize())
+
+
+async def _next_batch() -> List[SummaryRequest]:
+    batch = [await _queue.get()]
+    deadline = time.monotonic() + KNOWLEDGE_SUMMARY_BATCH_WAIT_MS / 1000
+    while len(batch) < KNOWLEDGE_SUMMARY_BATCH_SIZE:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(await asyncio.wait_for(_queue.get(), timeout=remaining))
+        except asyncio.TimeoutError:
+            break
+    return batch
+
+
+async def _summary_worker() -> None:
+    while True:
+        batch = await _next_batch()
+        try:
+            await _summarize_batch(batch)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # 紀錄維持 running，心跳停止後由定期補做認領
+            logger.exception("[知識庫摘要] 批次失敗 size=%d error=%s", len(batch), e)
+        finally:
+            for req in batch:
+                _inflight.discard(req.knowledge_id)
+                _queue.task_done()
+
+
+async def _summarize_batch(batch: List[SummaryRequest]) -> None:
+    from services import vector_service
+    from services.ingest_pipeline import run_summary
+
+    t_start = time.perf_counter()
+    results = await run_summary(vector_service.generate_summaries_and_keywords, [req.text for req in batch])
+    _stats["batches"] += 1
+    logger.info("[知識庫摘要] 批次完成 size=%d (耗時=%.3f s)", len(batch), time.perf_counter() - t_start)
+    _write_back(batch, results)
+
+
+def _write_back(batch: List[SummaryRequest], results) -> None:
+    from models.database import SessionLocal
+    from models.models import KnowledgeBase
+
+    db = SessionLocal()
+    try:
+        for req, result in zip(batch, results):
+            entry = db.get(KnowledgeBase, req.knowledge_id)
+            if entry is None or entry.content_hash != req.content_hash:
+                _stats["skipped"] += 1
+                logger.info("[知識庫摘要] 紀錄已刪除或內容已變更，略過 knowledge_id=%s", req.knowledge_id)
+                continue
+            if result is None:
+                _stats["failed"] += 1
+                entry.summary, entry.keywords = SUMMARY_UNAVAILABLE, ""
+                entry.summary_status = SUMMARY_FAILED
+            else:
+                _stats["summarized"] += 1
+                entry.summary, entry.keywords = clip_summary(*result)
+                entry.summary_status = SUMMARY_DONE
+        db.commit()
+    finally:
+        db.close()
+
+
+def _recover_source_text(entry) -> str:
+    """由磁碟上已提交的 chunk 檔重建摘要來源文字（與上傳時相同：依 doc_ids 順序取前段），不經向量庫快取。"""
+    from services import vector_service
+
+    doc_ids = [did.strip() for did in (entry.doc_ids or "").split(",") if did.strip()]
+    texts = vector_service.read_committed_chunk_texts(entry.assistant_id, doc_ids, _RECOVER_SOURCE_CHARS)
+    return " ".join(texts)[:_RECOVER_SOURCE_CHARS]
+
+
+def _heartbeat(db, knowledge_ids) -> None:
+    """更新本行程佇列中（尚未寫回）紀錄的心跳。"""
+    from models.models import KnowledgeBase
+
+    if not knowledge_ids:
+        return
+    db.query(KnowledgeBase).filter(
+        KnowledgeBase.id.in_(list(knowledge_ids)),
+        KnowledgeBase.summary_status == SUMMARY_RUNNING,
+        KnowledgeBase.summary_worker == _WORKER_ID,
+    ).update({KnowledgeBase.summary_heartbeat_at: datetime.utcnow()}, synchronize_session=False)
+    db.commit()
+
+
+def claim_stale_summaries(db, stale_seconds: float = KNOWLEDGE_SUMMARY_STALE_SECONDS, exclude=()) -> List[int]:
+    """以條件式 UPDATE 認領無擁有者或擁有者心跳逾時的未完成摘要（多 worker 同時檢查時只有一個成功）。"""
+    from sqlalchemy import and_, or_  # pyright: ignore[reportMissingImports]
+
+    from models.models import KnowledgeBase
+
+    cutoff = datetime.utcnow() - timedelta(seconds=stale_seconds)
+    claimable = or_(
+        KnowledgeBase.summary_status == SUMMARY_PENDING,
+        and_(
+            KnowledgeBase.summary_status == SUMMARY_RUNNING,
+            or_(KnowledgeBase.summary_heartbeat_at.is_(None), KnowledgeBase.summary_heartbeat_at < cutoff),
+        ),
+    )
+    candidates = [
+        row.id
+        for row in db.query(KnowledgeBase.id).filter(claimable).order_by(KnowledgeBase.id).limit(_CLAIM_BATCH).all()
+        if row.id not in exclude
+    ]
+    claimed: List[int] = []
+    for knowledge_id in candidates:
+        updated = db.query(KnowledgeBase).filter(KnowledgeBase.id == knowledge_id, claimable).update(
+            {
+                KnowledgeBase.summary_status: SUMMARY_RUNNING,
+                KnowledgeBase.summary_worker: _WORKER_ID,
+                KnowledgeBase.summary_heartbeat_at: datetime.utcnow(),
+            },
+            synchronize_session=False,
+        )
+        db.commit()
+        if updated:
+            claimed.append(knowledge_id)
+    return claimed
+
+
+def _heartbeat_and_claim(stale_seconds: float, inflight) -> List[Tuple[int, Optional[str], str]]:
+    from models.database import SessionLocal
+    from models.models import KnowledgeBase
+
+    db = SessionLocal()
+    try:
+        _heartbeat(db, inflight)
+        claimed = []
+        for knowledge_id in claim_stale_summaries(db, stale_seconds, exclude=inflight):
+            entry = db.get(KnowledgeBase, knowledge_id)
+            claimed.append((entry.id, entry.content_hash, _recover_source_text(entry)))
+        return claimed
+    finally:
+        db.close()
+
+
+async def recover_pending_summaries(stale_seconds: float = KNOWLEDGE_SUMMARY_STALE_SECONDS) -> int:
+    """更新本行程摘要的心跳，並認領、補做其他（或已結束的）行程未完成的摘要；回傳排入的筆數。"""
+    claimed = await asyncio.to_thread(_heartbeat_and_claim, stale_seconds, frozenset(_inflight))
+    for knowledge_id, content_hash, text in claimed:
+        schedule_summary(knowledge_id, content_hash, text)
+    if claimed:
+        logger.info("[知識庫摘要] 認領並補做未完成的摘要 count=%d", len(claimed))
+    return len(claimed)
+
+
+async def _recovery_loop() -> None:
+    while True:
+        try:
+            await recover_pending_summaries()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("[知識庫摘要] 心跳 / 補做檢查失敗（稍後重試）: %s", e)
+        await asyncio.sleep(KNOWLEDGE_SUMMARY_HEARTBEAT_SECONDS)
+
+
+def start_knowledge_summary() -> None:
+    """啟動批次 worker 與定期補做未完成的摘要（於 event loop 中呼叫）。"""
+    global _recovery
+    _ensure_started()
+    if _recovery is None or _recovery.done():
+        _recovery = asyncio.get_running_loop().create_task(_recovery_loop())
+
+
+async def stop_knowledge_summary() -> None:
+    """停止 worker；佇列中尚未完成的紀錄維持 running，心跳逾時後由其他（或重啟後的）worker 認領。"""
+    global _queue, _worker, _recovery, _loop
+    tasks = [task for task in (_worker, _recovery) if task is not None]
+    for task in tasks:
+        task.cancel()
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+    _queue = _worker = _recovery = _loop = None
+
+
+def summary_stats() -> Dict[str, Any]:
+    return {
+        "queued": _queue.qsize() if _queue is not None else 0,
+        "batch_size": KNOWLEDGE_SUMMARY_BATCH_SIZE,
+        "batch_wait_ms": KNOWLEDGE_SUMMARY_BATCH_WAIT_MS,
+        **_stats,
+    }
@@ -0,0 +1,201 @@
+"""共用 LLM client 登錄表：依 (base_url, model, temperature, top_p) 重用 ChatOpenAI，底層 HTTP 連線池共用。
+
+每回合重新建立 ChatOpenAI 會連帶建立新的 OpenAI / httpx client，等於每次都重新 TCP/TLS 握手。
+此模組讓同一 base_url 的所有模型共用一組 keep-alive 連線池（同步 + 非同步各一），
+並以 httpcore trace 統計新建與重用的連線數。
+
+環境變數：
+  LLM_HTTP_MAX_CONNECTIONS   連線池總連線上限（預設 100）
+  LLM_HTTP_MAX_KEEPALIVE     閒置 keep-alive 連線上限（預設 20）
+  LLM_HTTP_KEEPALIVE_EXPIRY  閒置連線保留秒數（預設 30）
+  LLM_HTTP2                  auto（預設，有安裝 h2 才啟用）| true | false
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+import openai
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return max(1, int(os.getenv(name, str(default))))
+    except ValueError:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return max(0.0, float(os.getenv(name, str(default))))
+    except ValueError:
+        return default
+
+
+def _http2_enabled() -> bool:
+    raw = (os.getenv("LLM_HTTP2") or "auto").strip().lower()
+    if raw in {"0", "false", "no", "off"}:
+        return False
+    try:
+        import h2  # noqa: F401  # pyright: ignore[reportMissingImports]
+    except ImportError:
+        if raw in {"1", "true", "yes", "on"}:
+            logger.warning("[LLM 連線池] LLM_HTTP2=%s 但未安裝 h2（pip install httpx[http2]），改用 HTTP/1.1", raw)
+        return False
+    return True
+
+
+def _pool_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=_env_int("LLM_HTTP_MAX_CONNECTIONS", 100),
+        max_keepalive_connections=_env_int("LLM_HTTP_MAX_KEEPALIVE", 20),
+        keepalive_expiry=_env_float("LLM_HTTP_KEEPALIVE_EXPIRY", 30.0),
+    )
+
+
+@dataclass
+class _PoolStats:
+    requests: int = 0
+    connections_created: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def on_request(self) -> None:
+        with self._lock:
+            self.requests += 1
+
+    def on_connect(self) -> None:
+        with self._lock:
+            self.connections_created += 1
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "connections_created": self.connections_created,
+                # 未觸發 TCP 連線的請求即為重用 keep-alive 連線
+                "connections_reused": max(0, self.requests - self.connections_created),
+            }
+
+
+class _HttpPool:
+    """同一 (base_url, api_key) 共用的 OpenAI 同步/非同步 client 與其 httpx 連線池。"""
+
+    def __init__(self, base_url: str, api_key: str):
+        self.base_url = base_url
+        self.stats = _PoolStats()
+        limits = _pool_limits()
+        http2 = _http2_enabled()
+        stats = self.stats
+
+        def _trace(event_name: str, info: Dict[str, Any]) -> None:
+            if event_name == "connection.connect_tcp.complete":
+                stats.on_connect()
+
+        async def _atrace(event_name: str, info: Dict[str, Any]) -> None:
+            _trace(event_name, info)
+
+        def _on_request(request: httpx.Request) -> None:
+            stats.on_request()
+            request.extensions["trace"] = _trace
+
+        async def _aon_request(request: httpx.Request) -> None:
+            stats.on_request()
+            request.extensions["trace"] = _atrace
+
+        self.http_client = httpx.Client(
+            limits=limits, http2=http2, event_hooks={"request": [_on_request]}
+        )
+        self.async_http_client = httpx.AsyncClient(
+            limits=limits, http2=http2, event_hooks={"request": [_aon_request]}
+        )
+        self.client = openai.OpenAI(api_key=api_key, base_url=base_url, http_client=self.http_client)
+        self.async_client = openai.AsyncOpenAI(
+            api_key=api_key, base_url=base_url, http_client=self.async_http_client
+        )
+        logger.info(
+            "[LLM 連線池] 建立 base_url=%s http2=%s max_connections=%s max_keepalive=%s",
+            base_url, http2, limits.max_connections, limits.max_keepalive_connections,
+        )
+
+
+_lock = threading.Lock()
+_pools: Dict[Tuple[str, str], _HttpPool] = {}
+_chat_models: Dict[Tuple[str, str, float, Optional[float]], Any] = {}
+
+
+def _get_pool(base_url: str, api_key: str) -> _HttpPool:
+    key = (base_url, api_key)
+    pool = _pools.get(key)
+    if pool is None:
+        pool = _HttpPool(base_url, api_key)
+        _pools[key] = pool
+    return pool
+
+
+def get_chat_model(
+    *,
+    base_url: str,
+    api_key: str,
+    model: str,
+    temperature: float,
+    top_p: Optional[float] = None,
+):
+    """取得共用的 ChatOpenAI；相同 (base_url, model, temperature, top_p) 回傳同一實例（執行緒安全，可並行使用）。"""
+    key = (base_url, model, float(temperature), top_p)
+    llm = _chat_models.get(key)
+    if llm is not None:
+        return llm
+    with _lock:
+        llm = _chat_models.get(key)
+        if llm is not None:
+            return llm
+        from langchain_community.chat_models import ChatOpenAI  # pyright: ignore[reportMissingImports]
+
+        pool = _get_pool(base_url, api_key)
+        llm = ChatOpenAI(
+            openai_api_key=api_key,
+            base_url=base_url,
+            model=model,
+            temperature=temperature,
+            model_kwargs={"top_p": top_p} if top_p is not None else {},
+            client=pool.client.chat.completions,
+            async_client=pool.async_client.chat.completions,
+        )
+        _chat_models[key] = llm
+        logger.info(
+            "[LLM 連線池] 新增 client base_url=%s model=%s temperature=%s top_p=%s",
+            base_url, model, temperature, top_p,
+        )
+        return llm
+
+
+def get_pool_metrics() -> Dict[str, Any]:
+    """各 base_url 連線池的請求數、新建/重用連線數。"""
+    with _lock:
+        pools = list(_pools.values())
+        client_count = len(_chat_models)
+    per_pool = [{"base_url": p.base_url, **p.stats.snapshot()} for p in pools]
+    totals = {k: sum(p[k] for p in per_pool) for k in ("requests", "connections_created", "connections_reused")}
+    return {"clients": client_count, **totals, "pools": per_pool}
+
+
+async def aclose_all() -> None:
+    """關閉所有連線池（應用程式關閉時呼叫）。"""
+    with _lock:
+        pools = list(_pools.values())
+        _pools.clear()
+        _chat_models.clear()
+    for pool in pools:
+        try:
+            pool.http_client.close()
+            await pool.async_http_client.aclose()
+        except Exception as e:
+            logger.warning("[LLM 連線池] 關閉失敗 base_url=%s error=%s", pool.base_url, e)
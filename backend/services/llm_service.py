@@ -1,16 +1,23 @@
 from langchain_community.chat_models import ChatOpenAI  # pyright: ignore[reportMissingImports]
 from langchain_core.messages import HumanMessage, SystemMessage  # pyright: ignore[reportMissingImports]
-from services.vector_service import get_vector_store
+from services.vector_service import (
+    get_bm25_index,
+    get_knowledge_generation,
+    get_vector_store,
+    normalize_assistant_id,
+)
+from services.bm25_index import BM25_BACKENDS, BM25Index, bm25_score, tokenize_for_bm25
+from services.llm_client_pool import get_chat_model
+from services.answer_cache import answer_cache, answer_cache_enabled, assistant_fingerprint
 
 from dotenv import load_dotenv  # pyright: ignore[reportMissingImports]
 import os
 import time
-import math
 import re
 
 from utils.logger import get_logger
-from utils.chinese_convert import to_traditional_tw
-from typing import List, Optional, Dict, Any
+from utils.chinese_convert import IncrementalTraditionalConverter, to_traditional_tw
+from typing import AsyncIterator, Callable, List, NamedTuple, Optional, Dict, Any, Tuple
 
 try:
     from openai import APIConnectionError as OpenAIAPIConnectionError
@@ -18,10 +25,6 @@ except ImportError:
     OpenAIAPIConnectionError = ()  # type: ignore[misc, assignment]
 
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
-
-# Create a thread pool for LLM operations
-executor = ThreadPoolExecutor(max_workers=10)
 
 load_dotenv()  # 載入 .env 檔案中的環境變數
 
@@ -29,9 +32,21 @@ api_key = os.getenv("OPENAI_API_KEY")
 VLLM_API_KEY = os.getenv("VLLM_API_KEY", "EMPTY")
 VLLM_BASE_URL = os.getenv("VLLM_BASE_URL", "http://127.0.0.1:8000/v1")
 VLLM_MODEL = (os.getenv("VLLM_MODEL") or "Qwen/Qwen2.5-7B-Instruct-AWQ").strip()
+# 同時送往 vLLM 的請求上限（依 vLLM max_num_seqs / GPU 容量調整），超過者在 semaphore 排隊
+LLM_MAX_CONCURRENCY = max(1, int(os.getenv("LLM_MAX_CONCURRENCY", "16")))
 
 logger = get_logger(__name__)
 
+_llm_semaphore: Optional[asyncio.Semaphore] = None
+
+
+def _get_llm_semaphore() -> asyncio.Semaphore:
+    # 延遲建立：需在事件迴圈內首次使用時才建立
+    global _llm_semaphore
+    if _llm_semaphore is None:
+        _llm_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    return _llm_semaphore
+
 
 def _is_llm_connection_error(exc: BaseException) -> bool:
     """判斷是否為無法連線 vLLM / OpenAI 相容端點（含 DNS 解析失敗）。"""
@@ -60,30 +75,9 @@ STRICT_ENGLISH_SYSTEM_PROMPT = (
 )
 
 
-def _tokenize_for_bm25(text: str) -> List[str]:
-    """簡單中文/英文混合 tokenizer，供 BM25 使用。"""
-    raw = (text or "").lower()
-    return re.findall(r"[\u4e00-\u9fff]|[a-z0-9_]+", raw)
-
-
-def _bm25_score(query_tokens: List[str], doc_tokens: List[str], idf: Dict[str, float], avgdl: float, *, k1: float = 1.5, b: float = 0.75) -> float:
-    """純 Python BM25 分數計算，避免額外依賴。"""
-    if not query_tokens or not doc_tokens:
-        return 0.0
-
-    tf: Dict[str, int] = {}
-    for tok in doc_tokens:
-        tf[tok] = tf.get(tok, 0) + 1
-
-    dl = max(1, len(doc_tokens))
-    score = 0.0
-    for q in query_tokens:
-        freq = tf.get(q, 0)
-        if freq <= 0:
-            continue
-        denom = freq + k1 * (1.0 - b + b * dl / max(1e-9, avgdl))
-        score += idf.get(q, 0.0) * (freq * (k1 + 1.0)) / max(1e-9, denom)
-    return score
+# 保留舊名稱供既有呼叫端使用；實作移至 services.bm25_index
+_tokenize_for_bm25 = tokenize_for_bm25
+_bm25_score = bm25_score
 
 
 def _doc_key(doc) -> str:
@@ -95,19 +89,38 @@ def _doc_key(doc) -> str:
     return str(hash(((doc.page_content or "")[:500], tuple(sorted(md.items())))))
 
 
-def _hybrid_retrieve(vector_store, query: str) -> List[Any]:
+def _index_bm25_rank(vector_store, bm25_index, query: str, bm25_fetch_k: int):
+    """以倒排索引查詢（RAG_BM25_BACKEND 選擇計分後端），doc_id 對回 docstore 取得 Document。"""
+    docstore = getattr(vector_store, "docstore", None)
+    ranked = []
+    backend = (os.getenv("RAG_BM25_BACKEND") or "postings").strip().lower()
+    if backend not in BM25_BACKENDS:
+        backend = "postings"
+    for doc_id, score in bm25_index.search(query, bm25_fetch_k, backend=backend):
+        doc = docstore.search(doc_id) if docstore is not None else None
+        if doc is None or isinstance(doc, str):
+            continue
+        ranked.append((doc, score))
+    return ranked, len(bm25_index)
+
+
+def _hybrid_retrieve(vector_store, query: str, bm25_index=None, query_embedding=None) -> List[Any]:
     """
     向量 + BM25 混合檢索，回傳依混合分數排序的文件列表。
+    bm25_index: 助理的 BM25Index；未提供時由 docstore 臨時建立（涵蓋全部 chunk）。
+    query_embedding: 已算好的查詢向量（與回覆快取語意層共用）；未提供時由 vector_store 自行嵌入。
     """
     top_k = max(1, int(os.getenv("RAG_TOP_K", "3")))
     vector_fetch_k = max(top_k, int(os.getenv("RAG_VECTOR_FETCH_K", "20")))
-    bm25_corpus_limit = max(vector_fetch_k, int(os.getenv("RAG_BM25_CORPUS_LIMIT", "1500")))
     bm25_fetch_k = max(top_k, int(os.getenv("RAG_BM25_FETCH_K", "20")))
     hybrid_alpha = float(os.getenv("RAG_HYBRID_ALPHA", "0.7"))
     hybrid_alpha = max(0.0, min(1.0, hybrid_alpha))
 
     # 1) 向量候選（FAISS distance 越小越好，轉成 similarity）
-    vector_candidates = vector_store.similarity_search_with_score(query, k=vector_fetch_k)
+    if query_embedding is not None:
+        vector_candidates = vector_store.similarity_search_with_score_by_vector(query_embedding, k=vector_fetch_k)
+    else:
+        vector_candidates = vector_store.similarity_search_with_score(query, k=vector_fetch_k)
     vector_map: Dict[str, Dict[str, Any]] = {}
     for doc, distance in vector_candidates or []:
         key = _doc_key(doc)
@@ -118,35 +131,10 @@ def _hybrid_retrieve(vector_store, query: str) -> List[Any]:
             "bm25_score": 0.0,
         }
 
-    # 2) BM25 候選語料：從 FAISS docstore 擷取
-    docstore = getattr(vector_store, "docstore", None)
-    docs_dict = getattr(docstore, "_dict", {}) if docstore is not None else {}
-    corpus_items: List[Any] = list(docs_dict.values())[:bm25_corpus_limit]
-    query_tokens = _tokenize_for_bm25(query)
-
-    bm25_ranked: List[Any] = []
-    if query_tokens and corpus_items:
-        tokenized_docs = [_tokenize_for_bm25(d.page_content or "") for d in corpus_items]
-        doc_count = len(tokenized_docs)
-        avgdl = sum(len(toks) for toks in tokenized_docs) / max(1, doc_count)
-
-        df: Dict[str, int] = {}
-        for toks in tokenized_docs:
-            for t in set(toks):
-                df[t] = df.get(t, 0) + 1
-
-        idf = {
-            t: math.log(1.0 + (doc_count - freq + 0.5) / (freq + 0.5))
-            for t, freq in df.items()
-        }
-
-        scored_docs = []
-        for doc, toks in zip(corpus_items, tokenized_docs):
-            score = _bm25_score(query_tokens, toks, idf, avgdl)
-            if score > 0:
-                scored_docs.append((doc, score))
-        scored_docs.sort(key=lambda x: x[1], reverse=True)
-        bm25_ranked = scored_docs[:bm25_fetch_k]
+    # 2) BM25 候選：倒排索引涵蓋整個 docstore，僅走訪查詢詞的 postings（MaxScore 剪枝）
+    if bm25_index is None:
+        bm25_index = BM25Index.from_docstore(getattr(vector_store, "docstore", None))
+    bm25_ranked, bm25_corpus_size = _index_bm25_rank(vector_store, bm25_index, query, bm25_fetch_k)
 
     # 3) 合併向量與 BM25
     for doc, bm25_score in bm25_ranked:
@@ -179,7 +167,7 @@ def _hybrid_retrieve(vector_store, query: str) -> List[Any]:
     logger.info(
         "[RAG 混合檢索] vector_candidates=%d bm25_corpus=%d bm25_hits=%d merged=%d top_k=%d alpha=%.2f",
         len(vector_candidates or []),
-        len(corpus_items),
+        bm25_corpus_size,
         len(bm25_ranked),
         len(merged),
         top_k,
@@ -266,17 +254,16 @@ def _extract_llm_text(result) -> str:
     return str(result)
 
 
-def _invoke_chat_text(
-    llm: ChatOpenAI,
+def _build_chat_messages(
     text: str,
     *,
     assistant_uuid,
     lang: str,
     log_branch: str = "",
-) -> str:
+) -> List[Any]:
     """
     LangChain 0.3+ 的 ChatOpenAI 不可再 llm(長字串)：字串會被當成 iterable，逐字變成「訊息」而觸發
-    TypeError: Got unknown type 你。改為 invoke([HumanMessage(...)])。
+    TypeError: Got unknown type 你。改為傳入 [SystemMessage, HumanMessage]。
     """
     total = len(text or "")
     max_chars_raw = os.getenv("LLM_PROMPT_LOG_MAX_CHARS", "24000")
@@ -300,22 +287,57 @@ def _invoke_chat_text(
         f"\n...(以下省略，共 {total} 字元；可調環境變數 LLM_PROMPT_LOG_MAX_CHARS 提高上限)" if truncated else "",
     )
 
-    use_zh_tw = _is_chinese_assistant_lang(lang)
     messages: List[Any] = []
-    if use_zh_tw:
+    if _is_chinese_assistant_lang(lang):
         messages.append(SystemMessage(content=STRICT_TRADITIONAL_CHINESE_SYSTEM_PROMPT))
     else:
         messages.append(SystemMessage(content=STRICT_ENGLISH_SYSTEM_PROMPT))
     messages.append(HumanMessage(content=text))
-    try:
-        result = llm.invoke(messages)
-    except Exception as e:
-        if _is_llm_connection_error(e):
-            logger.error(
-                "[LLM] 無法連線至推論服務 base_url=%s error=%s",
-                VLLM_BASE_URL, e,
+    return messages
+
+
+async def _ainvoke_chat_text(
+    llm: ChatOpenAI,
+    text: str,
+    *,
+    assistant_uuid,
+    lang: str,
+    log_branch: str = "",
+    on_delta: Optional[Callable[[str], None]] = None,
+) -> str:
+    """
+    以 AsyncOpenAI client 呼叫 vLLM（ainvoke / astream），並受 LLM_MAX_CONCURRENCY 限制同時請求數。
+    on_delta 有值時改為串流逐段回呼（已做增量簡轉繁），回傳完整轉換後文字。
+    """
+    messages = _build_chat_messages(text, assistant_uuid=assistant_uuid, lang=lang, log_branch=log_branch)
+    use_zh_tw = _is_chinese_assistant_lang(lang)
+
+    t_wait_start = time.perf_counter()
+    async with _get_llm_semaphore():
+        t_wait_s = time.perf_counter() - t_wait_start
+        if t_wait_s >= 0.05:
+            logger.info(
+                "[LLM] 等待推論名額 assistant_uuid=%s (耗時=%.3f s 上限=%d)",
+                assistant_uuid, t_wait_s, LLM_MAX_CONCURRENCY,
             )
-        raise
+        try:
+            if on_delta is not None:
+                return await _astream_chat_messages(
+                    llm,
+                    messages,
+                    use_zh_tw=use_zh_tw,
+                    assistant_uuid=assistant_uuid,
+                    log_branch=log_branch,
+                    on_delta=on_delta,
+                )
+            result = await llm.ainvoke(messages)
+        except Exception as e:
+            if _is_llm_connection_error(e):
+                logger.error(
+                    "[LLM] 無法連線至推論服務 base_url=%s error=%s",
+                    VLLM_BASE_URL, e,
+                )
+            raise
     raw = _extract_llm_text(result)
     if not use_zh_tw:
         return raw
@@ -331,10 +353,137 @@ def _invoke_chat_text(
     return converted
 
 
-def _synch_process_llm(data, assistant_uuid, customer_unique_id, lang, model, assistant_description, welcome, noidea):
+async def _astream_chat_messages(
+    llm: ChatOpenAI,
+    messages: List[Any],
+    *,
+    use_zh_tw: bool,
+    assistant_uuid,
+    log_branch: str,
+    on_delta: Callable[[str], None],
+) -> str:
+    """llm.astream 逐 token 接收；簡轉繁只在安全邊界（標點/換行）轉換後才回呼 on_delta。"""
+    converter = IncrementalTraditionalConverter(enabled=use_zh_tw)
+    parts: List[str] = []
+    t_first_token_s: Optional[float] = None
+    t_start = time.perf_counter()
+
+    def _emit(text: str) -> None:
+        if text:
+            parts.append(text)
+            on_delta(text)
+
+    async for chunk in llm.astream(messages):
+        piece = _extract_llm_text(chunk)
+        if piece and t_first_token_s is None:
+            t_first_token_s = time.perf_counter() - t_start
+        _emit(converter.feed(piece))
+    _emit(converter.flush())
+    response = "".join(parts)
+    logger.info(
+        "[LLM 串流完成] assistant_uuid=%s branch=%s 回覆長度=%d (首 token=%.3f s 串流總耗時=%.3f s)",
+        assistant_uuid,
+        log_branch,
+        len(response),
+        t_first_token_s if t_first_token_s is not None else -1.0,
+        time.perf_counter() - t_start,
+    )
+    return response
+
+
+def _load_enabled_notebook_ids(assistant_uuid) -> List[int]:
+    from models.database import SessionLocal
+    from services.assistant_notebook_service import list_enabled_notebook_ids
+
+    db = SessionLocal()
+    try:
+        return list_enabled_notebook_ids(db, int(assistant_uuid))
+    finally:
+        db.close()
+
+
+def _load_turn_state(assistant_uuid, with_generation: bool) -> Tuple[List[int], int]:
+    """
+    每回合開頭的同步讀取（DB 與磁碟上的知識庫版本檔），由 _aprocess_llm 以 asyncio.to_thread 一次呼叫，
+    不在 event loop 上做檔案 I/O。回傳 (綁定的 Notebook ID, 知識庫版本號)；
+    有綁定 Notebook（不使用回覆快取）或 with_generation 為 False 時版本號為 0。
+    """
+    notebook_ids: List[int] = []
+    try:
+        notebook_ids = _load_enabled_notebook_ids(assistant_uuid)
+    except Exception as e:
+        logger.exception(
+            "[LLM] 讀取 assistant_notebook 失敗 assistant_uuid=%s error=%s",
+            assistant_uuid,
+            e,
+        )
+    generation = 0
+    if with_generation and not notebook_ids:
+        generation = get_knowledge_generation(normalize_assistant_id(assistant_uuid))
+    return notebook_ids, generation
+
+
+class _Retrieval(NamedTuple):
+    vector_store: Any
+    relevant_docs: List[Any]
+    t_vs_s: float
+    t_retrieve_s: float
+    query_embedding: Optional[List[float]] = None
+    cached_answer: Optional[Tuple[str, float]] = None
+
+
+def _retrieve_from_vector_store(assistant_uuid, data, semantic_lookup=None):
+    """
+    本地 FAISS + BM25 混合檢索（CPU / 嵌入模型，同步）；由 _aprocess_llm 以 asyncio.to_thread 呼叫。
+    semantic_lookup: 回覆快取語意層查詢函式；查詢向量算好後先查快取，命中即略過檢索。
+    回傳 _Retrieval；無向量庫時 vector_store 為 None。
+    """
+    t_vs_start = time.perf_counter()
+    vector_store = get_vector_store(assistant_uuid)
+    t_vs_s = time.perf_counter() - t_vs_start
+    if not vector_store:
+        return _Retrieval(None, [], t_vs_s, 0.0)
+
+    t_retrieve_start = time.perf_counter()
+    query_embedding = None
+    if semantic_lookup is not None:
+        query_embedding = vector_store._embed_query(data)
+        cached = semantic_lookup(query_embedding)
+        if cached is not None:
+            return _Retrieval(
+                vector_store, [], t_vs_s, time.perf_counter() - t_retrieve_start,
+                query_embedding=query_embedding, cached_answer=cached,
+            )
+
+    try:
+        bm25_index = get_bm25_index(assistant_uuid, vector_store)
+    except Exception as e:
+        logger.warning("[LLM] 取得 BM25 索引失敗，改由 docstore 臨時建立 assistant_uuid=%s error=%s", assistant_uuid, e)
+        bm25_index = None
+
+    relevant_docs = _hybrid_retrieve(vector_store, data, bm25_index=bm25_index, query_embedding=query_embedding)
+    return _Retrieval(
+        vector_store, relevant_docs, t_vs_s, time.perf_counter() - t_retrieve_start,
+        query_embedding=query_embedding,
+    )
+
+
+async def _aprocess_llm(
+    data,
+    assistant_uuid,
+    customer_unique_id,
+    lang,
+    model,
+    assistant_description,
+    welcome,
+    noidea,
+    on_delta: Optional[Callable[[str], None]] = None,
+):
     """
-    同步版本的 LLM 處理邏輯，包含向量檢索與單次 LLM 呼叫。
-    此函數將被丟入 ThreadPoolExecutor 中執行，以免阻塞主要 Event Loop。
+    LLM 處理主流程（asyncio 原生），包含向量檢索與單次 LLM 呼叫。
+    DB 查詢與本地檢索以 asyncio.to_thread 執行，Jarvis 與 vLLM 走非同步 HTTP client；
+    同時推論數由 LLM_MAX_CONCURRENCY 控制，不再受執行緒池大小限制。
+    on_delta: 串流模式用，見 _ainvoke_chat_text。
     data: 使用者的問題
     assistant_uuid: 助理 ID
     customer_unique_id: 客戶唯一 ID
@@ -346,7 +495,7 @@ def _synch_process_llm(data, assistant_uuid, customer_unique_id, lang, model, as
     """
     t_total_start = time.perf_counter()
     logger.info(
-        "[LLM thread 開始] assistant_uuid=%s customer_id=%s lang=%s model=%s query_len=%d",
+        "[LLM 開始] assistant_uuid=%s customer_id=%s lang=%s model=%s query_len=%d",
         assistant_uuid, customer_unique_id, lang, model, len(data or "")
     )
 
@@ -355,21 +504,40 @@ def _synch_process_llm(data, assistant_uuid, customer_unique_id, lang, model, as
     t_retrieve_s = 0.0
 
     # Phase 1：有綁定 Jarvis Notebook 時優先走 Knowledge API，略過本地 FAISS
-    notebook_ids: List[int] = []
-    try:
-        from models.database import SessionLocal
-        from services.assistant_notebook_service import list_enabled_notebook_ids
+    cache_enabled = answer_cache_enabled()
+    notebook_ids, cache_generation = await asyncio.to_thread(_load_turn_state, assistant_uuid, cache_enabled)
 
-        db = SessionLocal()
-        try:
-            notebook_ids = list_enabled_notebook_ids(db, int(assistant_uuid))
-        finally:
-            db.close()
-    except Exception as e:
-        logger.exception(
-            "[LLM] 讀取 assistant_notebook 失敗 assistant_uuid=%s error=%s",
-            assistant_uuid,
-            e,
+    runtime_model = VLLM_MODEL or model
+
+    # 回覆快取：綁定 Jarvis Notebook 的助理知識庫在外部變動、無從得知失效時機，不快取
+    use_cache = cache_enabled and not notebook_ids
+    cache_aid = normalize_assistant_id(assistant_uuid)
+    cache_fingerprint = assistant_fingerprint(assistant_description, lang, runtime_model) if use_cache else ""
+    query_embedding = None
+    if use_cache:
+        cached = answer_cache.lookup(
+            cache_aid, data, generation=cache_generation, fingerprint=cache_fingerprint
+        )
+        if cached is not None:
+            logger.info(
+                "[回覆快取] 精確命中 assistant_uuid=%s 回覆長度=%d (總耗時=%.3f s)",
+                assistant_uuid, len(cached), time.perf_counter() - t_total_start,
+            )
+            if on_delta is not None:
+                on_delta(cached)
+            return cached
+
+    def _remember(response: str) -> None:
+        if not use_cache:
+            return
+        answer_cache.record_miss()
+        answer_cache.store(
+            cache_aid,
+            data,
+            response,
+            generation=cache_generation,
+            fingerprint=cache_fingerprint,
+            embedding=query_embedding,
         )
 
     if notebook_ids:
@@ -381,11 +549,11 @@ def _synch_process_llm(data, assistant_uuid, customer_unique_id, lang, model, as
         t_retrieve_start = time.perf_counter()
         try:
             from services.jarvis_knowledge_client import (
+                asearch_knowledge,
                 format_search_results_as_context,
-                search_knowledge,
             )
 
-            results = search_knowledge(notebook_ids, data)
+            results = await asearch_knowledge(notebook_ids, data)
             retrieval_text = format_search_results_as_context(results)
             doc_count = len(results) if results else 0
         except Exception as e:
@@ -405,9 +573,21 @@ def _synch_process_llm(data, assistant_uuid, customer_unique_id, lang, model, as
             t_retrieve_s,
         )
     else:
-        t_vs_start = time.perf_counter()
-        vector_store = get_vector_store(assistant_uuid)
-        t_vs_s = time.perf_counter() - t_vs_start
+        semantic_lookup = None
+        if use_cache and answer_cache.semantic_enabled:
+            def semantic_lookup(embedding):
+                return answer_cache.lookup_semantic(
+                    cache_aid, embedding, generation=cache_generation, fingerprint=cache_fingerprint
+                )
+
+        retrieval = await asyncio.to_thread(
+            _retrieve_from_vector_store, assistant_uuid, data, semantic_lookup
+        )
+        vector_store = retrieval.vector_store
+        relevant_docs = retrieval.relevant_docs
+        t_vs_s = retrieval.t_vs_s
+        t_retrieve_s = retrieval.t_retrieve_s
+        query_embedding = retrieval.query_embedding
 
         if not vector_store:
             logger.warning(
@@ -415,12 +595,21 @@ def _synch_process_llm(data, assistant_uuid, customer_unique_id, lang, model, as
                 assistant_uuid,
                 t_vs_s,
             )
+            if on_delta is not None and noidea:
+                on_delta(noidea)
             return noidea
         logger.info("[LLM] get_vector_store 完成 (耗時=%.3f s)", t_vs_s)
 
-        t_retrieve_start = time.perf_counter()
-        relevant_docs = _hybrid_retrieve(vector_store, data)
-        t_retrieve_s = time.perf_counter() - t_retrieve_start
+        if retrieval.cached_answer is not None:
+            cached, similarity = retrieval.cached_answer
+            logger.info(
+                "[回覆快取] 語意命中 assistant_uuid=%s cosine=%.4f 回覆長度=%d (總耗時=%.3f s)",
+                assistant_uuid, similarity, len(cached), time.perf_counter() - t_total_start,
+            )
+            if on_delta is not None:
+                on_delta(cached)
+            return cached
+
         doc_count = len(relevant_docs) if relevant_docs else 0
         logger.info(
             "[LLM] 混合檢索完成 assistant_uuid=%s 相關文件數=%d (檢索耗時=%.3f s)",
@@ -438,30 +627,30 @@ def _synch_process_llm(data, assistant_uuid, customer_unique_id, lang, model, as
             )
 
     t_llm_init_start = time.perf_counter()
-    runtime_model = VLLM_MODEL or model
-    llm = ChatOpenAI(
-        openai_api_key=VLLM_API_KEY,
+    llm = get_chat_model(
         base_url=VLLM_BASE_URL,
+        api_key=VLLM_API_KEY,
         model=runtime_model,
         temperature=0.3,
-        model_kwargs={"top_p": 0.9},
+        top_p=0.9,
     )
     logger.info("[LLM] provider=vllm base_url=%s model=%s", VLLM_BASE_URL, runtime_model)
 
     user_query = data
     t_llm_init_s = time.perf_counter() - t_llm_init_start
-    logger.debug("[LLM] 建構 user_query 與 LLM 實例 (耗時=%.3f s)", t_llm_init_s)
+    logger.debug("[LLM] 建構 user_query 與取得共用 LLM client (耗時=%.3f s)", t_llm_init_s)
 
     if not retrieval_text:
         logger.info("[LLM] 無相關文件，使用助理 description + 使用者問題呼叫 LLM")
         full_prompt = _build_user_prompt(assistant_description, lang, user_query, retrieval_context=None)
         t_direct_start = time.perf_counter()
-        response = _invoke_chat_text(
+        response = await _ainvoke_chat_text(
             llm,
             full_prompt,
             assistant_uuid=assistant_uuid,
             lang=lang,
             log_branch="無檢索文件",
+            on_delta=on_delta,
         )
         t_direct_s = time.perf_counter() - t_direct_start
         t_total_s = time.perf_counter() - t_total_start
@@ -469,18 +658,20 @@ def _synch_process_llm(data, assistant_uuid, customer_unique_id, lang, model, as
             "[LLM 完成-無文件] assistant_uuid=%s 回覆長度=%d (直接 LLM=%.3f s 總耗時=%.3f s)",
             assistant_uuid, len(response or ""), t_direct_s, t_total_s
         )
+        _remember(response)
         return response
 
     logger.info("[LLM] 有相關文件，使用助理 description + 使用者問題 + 檢索結果呼叫 LLM")
     full_prompt = _build_user_prompt(assistant_description, lang, user_query, retrieval_context=retrieval_text)
 
     t_invoke_start = time.perf_counter()
-    response = _invoke_chat_text(
+    response = await _ainvoke_chat_text(
         llm,
         full_prompt,
         assistant_uuid=assistant_uuid,
         lang=lang,
         log_branch="含檢索結果",
+        on_delta=on_delta,
     )
     t_invoke_s = time.perf_counter() - t_invoke_start
     logger.info(
@@ -495,24 +686,45 @@ def _synch_process_llm(data, assistant_uuid, customer_unique_id, lang, model, as
         assistant_uuid, t_total_s, t_vs_s, t_retrieve_s, t_chain_s, t_invoke_s
     )
     logger.debug("[LLM] 回覆預覽: %s", (response or "")[:200])
+    _remember(response)
     return response
 
 
 async def process_message_through_llm(data, assistant_uuid, customer_unique_id, lang, model, assistant_description, welcome, noidea):
     """
-    非阻塞包裝：在 ThreadPoolExecutor 中執行同步的 LLM 操作，
-    避免長時間運算 (如 150s) 卡住 asyncio 事件迴圈導致 WebSocket 斷線。
+    非阻塞：直接在事件迴圈上 await 非同步 LLM 流程，長時間推論 (如 150s) 不會佔住執行緒，
+    也不會卡住 asyncio 事件迴圈導致 WebSocket 斷線。
     """
-    loop = asyncio.get_running_loop()
-    # 使用 run_in_executor 將同步函式丟到執行緒池
-    return await loop.run_in_executor(
-        executor,
-        _synch_process_llm,
+    return await _aprocess_llm(
         data, assistant_uuid, customer_unique_id, lang, model, assistant_description, welcome, noidea
     )
-    # print("start to send to ws")
-    # 將回覆透過 WebSocket 傳送給客戶
-    # await websocket.send_text(response)
 
-    # print("send ws finish")
-    # 選擇性儲存對話紀錄至資料庫或 Redis（省略）
+
+async def stream_message_through_llm(
+    data, assistant_uuid, customer_unique_id, lang, model, assistant_description, welcome, noidea
+) -> AsyncIterator[str]:
+    """
+    串流版：背景 task 執行 _aprocess_llm，token 經 queue 逐段 yield（已簡轉繁）。
+    消費端中途停止（例如 WebSocket 斷線）時取消 task，連帶中止 vLLM 串流請求。
+    task 內的例外會在所有已產生片段 yield 完後拋出。
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    done = object()
+
+    task = asyncio.create_task(
+        _aprocess_llm(
+            data, assistant_uuid, customer_unique_id, lang, model, assistant_description, welcome, noidea,
+            on_delta=queue.put_nowait,
+        )
+    )
+    task.add_done_callback(lambda _t: queue.put_nowait(done))
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            yield item
+        await task
+    finally:
+        if not task.done():
+            task.cancel()
@@ -0,0 +1,178 @@
+"""查詢向量 LRU 快取：相同查詢字串不再重跑 BGE 模型 forward。
+
+BGE 模型為全域共用（vector_service._bge_embeddings），快取也跨助理共用；
+以 float32 儲存並依位元組數限制記憶體用量，可選擇在關閉時寫入磁碟、啟動時載回（warm restart）。
+
+環境變數：
+  QUERY_EMBEDDING_CACHE_MAX_MB   記憶體上限 MB（預設 64；0 = 關閉快取）
+  QUERY_EMBEDDING_CACHE_PATH     持久化檔案路徑（預設空 = 不持久化），例如 ./vector_stores/query_embedding_cache.pkl
+"""
+
+from __future__ import annotations
+
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from utils.logger import get_logger
+
+try:
+    from langchain_core.embeddings import Embeddings  # pyright: ignore[reportMissingImports]
+except ImportError:
+    Embeddings = object  # type: ignore[misc, assignment]
+
+logger = get_logger(__name__)
+
+QUERY_EMBEDDING_CACHE_FORMAT_VERSION = 1
+# 每筆除向量本身外的估計額外開銷（key 字串、OrderedDict 節點、ndarray header）
+_ENTRY_OVERHEAD_BYTES = 200
+
+
+class QueryEmbeddingCache:
+    """執行緒安全、依位元組上限淘汰的 LRU：text → float32 向量。"""
+
+    def __init__(self, *, max_bytes: int, model_name: str = ""):
+        self.max_bytes = max(0, int(max_bytes))
+        self.model_name = model_name
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def _entry_bytes(text: str, vec: np.ndarray) -> int:
+        return vec.nbytes + len(text.encode("utf-8")) + _ENTRY_OVERHEAD_BYTES
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        with self._lock:
+            vec = self._entries.get(text)
+            if vec is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(text)
+            self._hits += 1
+            return vec
+
+    def put(self, text: str, embedding) -> None:
+        if not self.enabled:
+            return
+        vec = np.asarray(embedding, dtype=np.float32).ravel()
+        size = self._entry_bytes(text, vec)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(text, None)
+            if old is not None:
+                self._bytes -= self._entry_bytes(text, old)
+            self._entries[text] = vec
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                old_text, old_vec = self._entries.popitem(last=False)
+                self._bytes -= self._entry_bytes(old_text, old_vec)
+                self._evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "hit_rate": round(self._hits / total, 4) if total else 0.0,
+            }
+
+    def save(self, path: str) -> int:
+        """寫入 path（先寫 .tmp 再 os.replace）；回傳寫入筆數。"""
+        with self._lock:
+            items = [(text, vec.tobytes()) for text, vec in self._entries.items()]
+            dim = next(iter(self._entries.values())).shape[0] if self._entries else 0
+        payload = {
+            "version": QUERY_EMBEDDING_CACHE_FORMAT_VERSION,
+            "model": self.model_name,
+            "dim": dim,
+            "entries": items,
+        }
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        return len(items)
+
+    def load(self, path: str) -> int:
+        """自 path 載入（模型或格式不符時略過）；回傳載入筆數。"""
+        if not self.enabled or not os.path.isfile(path):
+            return 0
+        with open(path, "rb") as f:
+            payload = pickle.load(f)
+        if (
+            not isinstance(payload, dict)
+            or payload.get("version") != QUERY_EMBEDDING_CACHE_FORMAT_VERSION
+            or payload.get("model") != self.model_name
+        ):
+            logger.info("[查詢向量快取] 持久化檔案版本或模型不符，略過 path=%s", path)
+            return 0
+        # 檔案內為 LRU 順序（舊 → 新），依序 put 可保留順序並套用目前的記憶體上限
+        for text, raw in payload.get("entries", []):
+            self.put(text, np.frombuffer(raw, dtype=np.float32))
+        return len(self._entries)
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """包裝 HuggingFaceEmbeddings：embed_query 走 LRU 快取，embed_documents 直接轉呼叫。"""
+
+    def __init__(self, base, cache: QueryEmbeddingCache):
+        self.base = base
+        self.cache = cache
+
+    def embed_query(self, text: str) -> List[float]:
+        if not self.cache.enabled:
+            return self.base.embed_query(text)
+        cached = self.cache.get(text)
+        if cached is not None:
+            return cached.tolist()
+        embedding = self.base.embed_query(text)
+        self.cache.put(text, embedding)
+        return embedding
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.base.embed_documents(texts)
+
+    def __call__(self, text: str) -> List[float]:
+        return self.embed_query(text)
+
+
+def query_embedding_cache_path() -> str:
+    return (os.getenv("QUERY_EMBEDDING_CACHE_PATH") or "").strip()
+
+
+def build_query_embedding_cache(model_name: str) -> QueryEmbeddingCache:
+    try:
+        max_mb = float(os.getenv("QUERY_EMBEDDING_CACHE_MAX_MB", "64"))
+    except ValueError:
+        max_mb = 64.0
+    cache = QueryEmbeddingCache(max_bytes=int(max_mb * 1024 * 1024), model_name=model_name)
+    path = query_embedding_cache_path()
+    if path and cache.enabled:
+        try:
+            loaded = cache.load(path)
+            if loaded:
+                logger.info("[查詢向量快取] 已載入 %d 筆 path=%s", loaded, path)
+        except Exception as e:
+            logger.warning("[查詢向量快取] 載入失敗，改用空快取 path=%s error=%s", path, e)
+    return cache
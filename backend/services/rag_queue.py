@@ -1,9 +1,24 @@
+"""
+RAG 重工作（解析、embedding、寫入索引；摘要另見 services.ingest_pipeline）的排程佇列，由 RAG_GPU_CONCURRENCY 個 worker 於執行緒池執行。
+
+原本是單一 FIFO：某個租戶一次上傳大量大檔時，其他租戶的小修改要排在後面等數分鐘。改為公平排程：
+  - 每個租戶（呼叫端傳入 tenant，預設以助理擁有者區分）各自一條 FIFO，租戶之間輪流取件（round-robin），
+    大量排隊的租戶只影響自己的等待時間。
+  - 兩條通道：small（知識編輯、刪除、小型 txt）優先於 bulk；bulk 最多同時佔用 RAG_BULK_MAX_CONCURRENCY 個
+    worker（預設 RAG_GPU_CONCURRENCY - 1），保留至少一個 worker 給 small，小工作不必等大檔處理完。
+    small 連續取件 RAG_SMALL_BURST 次（預設 4）後讓 bulk 取一件，避免 bulk 餓死。
+  - 容量：全體排隊數 RAG_QUEUE_MAX_SIZE、單一租戶排隊數 RAG_QUEUE_MAX_PER_TENANT（預設 10）；
+    enqueue_rag 超過任一上限回 429，run_rag_job（背景工作）則等待空位。
+  - 逐租戶統計排隊深度、執行中件數與等待時間（平均 / p95 / 最大），見 rag_queue_stats()。
+"""
+
 import asyncio
 import os
 import time
+from collections import OrderedDict, deque
 from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
-from typing import Any, Optional
+from typing import Any, Deque, Dict, Optional
 
 from fastapi import HTTPException
 
@@ -14,6 +29,18 @@ logger = get_logger(__name__)
 RAG_GPU_CONCURRENCY = int(os.getenv("RAG_GPU_CONCURRENCY", "5"))
 RAG_QUEUE_MAX_SIZE = int(os.getenv("RAG_QUEUE_MAX_SIZE", "50"))
 RAG_QUEUE_TIMEOUT = float(os.getenv("RAG_QUEUE_TIMEOUT", "300"))
+RAG_QUEUE_MAX_PER_TENANT = int(os.getenv("RAG_QUEUE_MAX_PER_TENANT", "10"))
+RAG_BULK_MAX_CONCURRENCY = int(os.getenv("RAG_BULK_MAX_CONCURRENCY", str(max(1, RAG_GPU_CONCURRENCY - 1))))
+RAG_SMALL_BURST = int(os.getenv("RAG_SMALL_BURST", "4"))
+# 公平排程的租戶粒度：owner（同一擁有者的所有助理共用配額）或 assistant
+RAG_QUEUE_TENANT_KEY = os.getenv("RAG_QUEUE_TENANT_KEY", "owner").strip().lower()
+# 不超過此大小的 txt 上傳走 small 通道
+RAG_SMALL_JOB_BYTES = int(os.getenv("RAG_SMALL_JOB_BYTES", str(256 * 1024)))
+
+LANE_SMALL = "small"
+LANE_BULK = "bulk"
+_DEFAULT_TENANT = "default"
+_WAIT_SAMPLES = 200
 
 
 @dataclass
@@ -21,10 +48,191 @@ class RAGJob:
     fn: Any
     args: tuple
     future: asyncio.Future
+    tenant: str = _DEFAULT_TENANT
+    lane: str = LANE_BULK
     created_at: float = field(default_factory=time.perf_counter)
 
 
-_queue: Optional[asyncio.Queue] = None
+class _TenantStats:
+    def __init__(self) -> None:
+        self.queued = {LANE_SMALL: 0, LANE_BULK: 0}
+        self.running = 0
+        self.enqueued = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.cancelled = 0
+        self.max_wait_s = 0.0
+        self._total_wait_s = 0.0
+        self._waited = 0
+        self._recent_waits: Deque[float] = deque(maxlen=_WAIT_SAMPLES)
+
+    def record_wait(self, wait_s: float) -> None:
+        self._waited += 1
+        self._total_wait_s += wait_s
+        self.max_wait_s = max(self.max_wait_s, wait_s)
+        self._recent_waits.append(wait_s)
+
+    def to_dict(self) -> Dict[str, Any]:
+        recent = sorted(self._recent_waits)
+        p95 = recent[min(len(recent) - 1, int(len(recent) * 0.95))] if recent else 0.0
+        return {
+            "queued": self.queued[LANE_SMALL] + self.queued[LANE_BULK],
+            "queued_small": self.queued[LANE_SMALL],
+            "queued_bulk": self.queued[LANE_BULK],
+            "running": self.running,
+            "enqueued": self.enqueued,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "cancelled": self.cancelled,
+            "avg_wait_ms": round(self._total_wait_s / self._waited * 1000, 1) if self._waited else 0.0,
+            "p95_wait_ms": round(p95 * 1000, 1),
+            "max_wait_ms": round(self.max_wait_s * 1000, 1),
+        }
+
+
+class FairScheduler:
+    """
+    租戶輪流取件的雙通道佇列；只在事件迴圈中使用（非執行緒安全）。
+    每條通道是 OrderedDict[tenant, deque]：取件時拿最前面租戶的第一件，該租戶若仍有工作就移到最後。
+    """
+
+    def __init__(
+        self,
+        max_size: int = RAG_QUEUE_MAX_SIZE,
+        max_per_tenant: int = RAG_QUEUE_MAX_PER_TENANT,
+        bulk_max_running: int = RAG_BULK_MAX_CONCURRENCY,
+        small_burst: int = RAG_SMALL_BURST,
+    ):
+        self.max_size = max_size
+        self.max_per_tenant = max_per_tenant
+        self.bulk_max_running = max(1, bulk_max_running)
+        self.small_burst = max(1, small_burst)
+        self._lanes: Dict[str, "OrderedDict[str, Deque[RAGJob]]"] = {
+            LANE_SMALL: OrderedDict(),
+            LANE_BULK: OrderedDict(),
+        }
+        self._size = 0
+        self._running = {LANE_SMALL: 0, LANE_BULK: 0}
+        self._small_streak = 0
+        self._stats: Dict[str, _TenantStats] = {}
+        self._changed = asyncio.Condition()
+
+    def qsize(self) -> int:
+        return self._size
+
+    def _tenant_stats(self, tenant: str) -> _TenantStats:
+        stats = self._stats.get(tenant)
+        if stats is None:
+            stats = self._stats[tenant] = _TenantStats()
+        return stats
+
+    def tenant_queued(self, tenant: str) -> int:
+        stats = self._stats.get(tenant)
+        return sum(stats.queued.values()) if stats else 0
+
+    def _has_room(self, tenant: str) -> bool:
+        return self._size < self.max_size and self.tenant_queued(tenant) < self.max_per_tenant
+
+    def _append(self, job: RAGJob) -> None:
+        self._lanes[job.lane].setdefault(job.tenant, deque()).append(job)
+        self._size += 1
+        stats = self._tenant_stats(job.tenant)
+        stats.queued[job.lane] += 1
+        stats.enqueued += 1
+
+    async def put(self, job: RAGJob, wait: bool = True) -> None:
+        """放入工作；超過全體或租戶上限時，wait=True 等待空位，否則拋出 asyncio.QueueFull。"""
+        async with self._changed:
+            if not self._has_room(job.tenant):
+                if not wait:
+                    self._tenant_stats(job.tenant).rejected += 1
+                    raise asyncio.QueueFull
+                await self._changed.wait_for(lambda: self._has_room(job.tenant))
+            self._append(job)
+            self._changed.notify_all()
+
+    def _pop_lane(self, lane: str) -> Optional[RAGJob]:
+        tenants = self._lanes[lane]
+        if not tenants:
+            return None
+        tenant, jobs = next(iter(tenants.items()))
+        job = jobs.popleft()
+        if jobs:
+            tenants.move_to_end(tenant)
+        else:
+            del tenants[tenant]
+        self._size -= 1
+        self._tenant_stats(tenant).queued[lane] -= 1
+        return job
+
+    def _pick(self) -> Optional[RAGJob]:
+        bulk_ready = bool(self._lanes[LANE_BULK]) and self._running[LANE_BULK] < self.bulk_max_running
+        if self._lanes[LANE_SMALL] and not (bulk_ready and self._small_streak >= self.small_burst):
+            self._small_streak += 1
+            return self._pop_lane(LANE_SMALL)
+        if bulk_ready:
+            self._small_streak = 0
+            return self._pop_lane(LANE_BULK)
+        return None
+
+    async def get(self) -> RAGJob:
+        """取出下一件可執行的工作並計為執行中；呼叫端完成後必須呼叫 done(job, ...)。"""
+        async with self._changed:
+            while True:
+                job = self._pick()
+                if job is None:
+                    await self._changed.wait()
+                    continue
+                self._changed.notify_all()
+                stats = self._tenant_stats(job.tenant)
+                if job.future.done():
+                    # 呼叫端已逾時放棄：不再執行
+                    stats.cancelled += 1
+                    continue
+                stats.record_wait(time.perf_counter() - job.created_at)
+                stats.running += 1
+                self._running[job.lane] += 1
+                return job
+
+    async def done(self, job: RAGJob, ok: bool) -> None:
+        async with self._changed:
+            stats = self._tenant_stats(job.tenant)
+            stats.running -= 1
+            if ok:
+                stats.completed += 1
+            else:
+                stats.failed += 1
+            self._running[job.lane] -= 1
+            self._changed.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self._size,
+            "queued_small": sum(len(q) for q in self._lanes[LANE_SMALL].values()),
+            "queued_bulk": sum(len(q) for q in self._lanes[LANE_BULK].values()),
+            "running_small": self._running[LANE_SMALL],
+            "running_bulk": self._running[LANE_BULK],
+            "max_size": self.max_size,
+            "max_per_tenant": self.max_per_tenant,
+            "bulk_max_running": self.bulk_max_running,
+            "tenants": {tenant: stats.to_dict() for tenant, stats in sorted(self._stats.items())},
+        }
+
+
+def tenant_key(assistant_id: int, owner_id: Optional[int] = None) -> str:
+    """依 RAG_QUEUE_TENANT_KEY 產生租戶鍵；查無擁有者時退回以助理區分。"""
+    if RAG_QUEUE_TENANT_KEY != "assistant" and owner_id is not None:
+        return f"owner:{owner_id}"
+    return f"assistant:{assistant_id}"
+
+
+def is_small_upload(file_extension: str, size_bytes: int) -> bool:
+    return file_extension == "txt" and size_bytes <= RAG_SMALL_JOB_BYTES
+
+
+_queue: Optional[FairScheduler] = None
 _workers: list[asyncio.Task] = []
 _executor: Optional[ThreadPoolExecutor] = None
 
@@ -37,14 +245,15 @@ async def start_rag_queue() -> None:
     global _queue, _executor
     if _is_started():
         return
-    _queue = asyncio.Queue(maxsize=RAG_QUEUE_MAX_SIZE)
+    _queue = FairScheduler()
     _executor = ThreadPoolExecutor(max_workers=RAG_GPU_CONCURRENCY, thread_name_prefix="rag-gpu")
     _workers.clear()
     for i in range(RAG_GPU_CONCURRENCY):
         _workers.append(asyncio.create_task(_rag_worker(i + 1)))
     logger.info(
-        "[RAG Queue] started concurrency=%d max_size=%d timeout=%.1fs",
-        RAG_GPU_CONCURRENCY, RAG_QUEUE_MAX_SIZE, RAG_QUEUE_TIMEOUT,
+        "[RAG Queue] started concurrency=%d bulk_max=%d max_size=%d per_tenant=%d timeout=%.1fs",
+        RAG_GPU_CONCURRENCY, _queue.bulk_max_running, RAG_QUEUE_MAX_SIZE, RAG_QUEUE_MAX_PER_TENANT,
+        RAG_QUEUE_TIMEOUT,
     )
 
 
@@ -62,31 +271,69 @@ async def stop_rag_queue() -> None:
     logger.info("[RAG Queue] stopped")
 
 
-async def enqueue_rag(fn, *args):
+def _make_job(fn, args: tuple, tenant, small: bool) -> RAGJob:
+    loop = asyncio.get_running_loop()
+    return RAGJob(
+        fn=fn,
+        args=args,
+        future=loop.create_future(),
+        tenant=str(tenant) if tenant is not None else _DEFAULT_TENANT,
+        lane=LANE_SMALL if small else LANE_BULK,
+    )
+
+
+async def enqueue_rag(fn, *args, tenant=None, small: bool = False):
+    """
+    請求等待結果：佇列或該租戶已滿時回 429，超過 RAG_QUEUE_TIMEOUT 回 504。
+    tenant：公平排程的租戶鍵（例如 "owner:3"）；small=True 進優先通道（編輯、刪除、小檔）。
+    """
     if not _is_started():
         await start_rag_queue()
 
-    loop = asyncio.get_running_loop()
-    future = loop.create_future()
-    job = RAGJob(fn=fn, args=args, future=future)
-
+    job = _make_job(fn, args, tenant, small)
     try:
-        _queue.put_nowait(job)
+        await _queue.put(job, wait=False)
     except asyncio.QueueFull:
-        logger.warning("[RAG Queue] rejected: queue full size=%d", _queue.qsize())
+        logger.warning(
+            "[RAG Queue] rejected: queue full tenant=%s size=%d tenant_queued=%d",
+            job.tenant, _queue.qsize(), _queue.tenant_queued(job.tenant),
+        )
         raise HTTPException(status_code=429, detail="RAG upload queue is full, please retry later")
 
-    logger.info("[RAG Queue] enqueued size=%d", _queue.qsize())
+    logger.info("[RAG Queue] enqueued tenant=%s lane=%s size=%d", job.tenant, job.lane, _queue.qsize())
 
     try:
-        return await asyncio.wait_for(future, timeout=RAG_QUEUE_TIMEOUT)
+        return await asyncio.wait_for(job.future, timeout=RAG_QUEUE_TIMEOUT)
     except asyncio.TimeoutError:
-        if not future.done():
-            future.cancel()
-        logger.warning("[RAG Queue] timeout after %.1fs", RAG_QUEUE_TIMEOUT)
+        if not job.future.done():
+            job.future.cancel()
+        logger.warning("[RAG Queue] timeout after %.1fs tenant=%s", RAG_QUEUE_TIMEOUT, job.tenant)
         raise HTTPException(status_code=504, detail="RAG upload timed out")
 
 
+async def run_rag_job(fn, *args, tenant=None, small: bool = False):
+    """
+    背景工作（services.upload_jobs）使用：佇列滿時等待空位，不套用 RAG_QUEUE_TIMEOUT。
+    執行緒中的工作無法取消，逾時只會丟失結果、GPU/CPU 仍持續忙碌，因此背景工作一律等到完成。
+    """
+    if not _is_started():
+        await start_rag_queue()
+
+    job = _make_job(fn, args, tenant, small)
+    await _queue.put(job)
+    logger.info(
+        "[RAG Queue] enqueued background job tenant=%s lane=%s size=%d", job.tenant, job.lane, _queue.qsize()
+    )
+    return await job.future
+
+
+def rag_queue_stats() -> Dict[str, Any]:
+    """維運用：全體與逐租戶的排隊深度、執行中件數與等待時間；佇列尚未啟動時回傳空物件。"""
+    if _queue is None:
+        return {}
+    return {"concurrency": RAG_GPU_CONCURRENCY, **_queue.stats()}
+
+
 async def _rag_worker(worker_id: int) -> None:
     loop = asyncio.get_running_loop()
     logger.info("[RAG Queue] worker-%d started", worker_id)
@@ -94,11 +341,13 @@ async def _rag_worker(worker_id: int) -> None:
         job = await _queue.get()
         wait_s = time.perf_counter() - job.created_at
         logger.info(
-            "[RAG Queue] worker-%d processing wait=%.2fs remaining=%d",
-            worker_id, wait_s, _queue.qsize(),
+            "[RAG Queue] worker-%d processing tenant=%s lane=%s wait=%.2fs remaining=%d",
+            worker_id, job.tenant, job.lane, wait_s, _queue.qsize(),
         )
+        ok = False
         try:
             result = await loop.run_in_executor(_executor, job.fn, *job.args)
+            ok = True
             if not job.future.done():
                 job.future.set_result(result)
         except Exception as e:
@@ -106,4 +355,4 @@ async def _rag_worker(worker_id: int) -> None:
             if not job.future.done():
                 job.future.set_exception(e)
         finally:
-            _queue.task_done()
+            await _queue.done(job, ok)
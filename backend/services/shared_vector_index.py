@@ -0,0 +1,412 @@
+"""多助理共用 FAISS 向量池（選用）：小型助理的向量集中在少數共用 Flat 分片，查詢以位置範圍過濾。
+
+數百個小助理各自持有一個 IndexFlatL2 時，每個索引都有固定開銷與各自的記憶體配置。
+啟用 VECTOR_SHARED_INDEX 後，符合條件（flat、未量化、chunk 數 <= VECTOR_SHARED_MAX_VECTORS）的助理
+載入時把向量搬進共用分片，LangChain FAISS 的 vs.index 改為 SharedIndexView：
+
+  - 每個助理在分片中佔一段連續位置 [start, start + n)；
+  - 查詢以 IDSelectorRange(assume_sorted=True) 限定該段，FAISS 只計算這段向量，
+    距離運算與獨立的 IndexFlatL2 完全相同，結果（含同分順序）一致；
+  - 新增 / 刪除時把該段的新內容寫進空閒範圍，再替換該段的指向，舊範圍轉為空閒，不搬動其他助理的區段；
+  - view 被回收（LRU 淘汰、合併後替換）時其區段延後於下次寫入分片時轉為空閒，之後的寫入重複使用；
+    空閒位置超過存活向量時，由寫入端複製存活區段到新索引後整個替換（重整）。
+
+磁碟格式不變（仍為每助理的 index / chunk 檔與增量區段），跨 worker 一致性與寫入流程不受影響；
+上傳 / 刪除走 copy-on-write（vector_service._copy_for_write）：草稿複製為獨立索引，發布時再放入新區段，
+舊快照的 view 回收後釋放舊區段。分片的寫入者彼此串行，向量一律寫在查詢不會讀到的空閒範圍；
+查詢共用讀鎖，寫鎖只用於替換區段指向 / 索引（O(1)），查詢不會等待與分片大小成正比的工作。
+
+環境變數：
+  VECTOR_SHARED_INDEX            true 啟用（預設 false）
+  VECTOR_SHARED_MAX_VECTORS      可放入共用分片的助理 chunk 數上限（預設 5000；超過時於全量寫入改回獨立索引）
+  VECTOR_SHARED_SHARD_VECTORS    每個分片的向量數上限（預設 500000）
+"""
+
+from __future__ import annotations
+
+import bisect
+import itertools
+import os
+import threading
+import weakref
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, List, Tuple
+
+import faiss  # pyright: ignore[reportMissingImports]
+import numpy as np
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 分片容量不足時的最小擴充量；空閒位置超過 max(存活向量, 此值) 時重整
+_MIN_GROW_VECTORS = 1024
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def shared_index_enabled() -> bool:
+    return (os.getenv("VECTOR_SHARED_INDEX") or "false").strip().lower() in {"1", "true", "yes", "on"}
+
+
+def shared_max_vectors() -> int:
+    return max(0, _env_int("VECTOR_SHARED_MAX_VECTORS", 5000))
+
+
+class _ReadWriteLock:
+    """多讀單寫；有寫入者等待時新的讀取者排隊，避免寫入飢餓。"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+class _Shard:
+    """
+    一個共用 IndexFlatL2；blocks: block_id → (start, n)，各段連續且互不重疊；free: 未使用的位置範圍 [start, count]。
+    寫入者之間以 _mutate 串行；區段內容一律先寫進查詢不會讀到的空閒範圍，再於寫鎖內替換 blocks 的指向，
+    寫鎖只持有 O(1) 時間，查詢不會等待與分片大小成正比的搬移（舊作法每次釋放都對整個分片 remove_ids）。
+    """
+
+    def __init__(self, shard_id: int, d: int):
+        self.shard_id = shard_id
+        self.d = d
+        self.index = faiss.IndexFlatL2(d)
+        self.blocks: Dict[int, Tuple[int, int]] = {}
+        self.free: List[List[int]] = []
+        self.live = 0
+        self.lock = _ReadWriteLock()
+        self._mutate = threading.Lock()
+        # view 回收時只登記，於下次寫入分片時釋放（finalizer 可能在任意執行緒 / 持鎖中觸發）
+        self._released: deque = deque()
+
+    @property
+    def capacity(self) -> int:
+        return int(self.index.ntotal)
+
+    @property
+    def free_vectors(self) -> int:
+        return self.capacity - self.live
+
+    # ---- 讀取（讀鎖） ----
+    def size(self, block_id: int) -> int:
+        with self.lock.read():
+            return self.blocks[block_id][1]
+
+    def search(self, block_id: int, x: np.ndarray, k: int):
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        with self.lock.read():
+            start, n = self.blocks[block_id]
+            if n == 0 or k <= 0:
+                return (
+                    np.full((len(x), max(k, 0)), np.inf, dtype=np.float32),
+                    np.full((len(x), max(k, 0)), -1, dtype=np.int64),
+                )
+            selector = faiss.IDSelectorRange(start, start + n, True)
+            distances, labels = self.index.search(x, k, params=faiss.SearchParameters(sel=selector))
+        labels = np.where(labels >= 0, labels - start, labels)
+        return distances, labels
+
+    def reconstruct_n(self, block_id: int, i0: int, count: int) -> np.ndarray:
+        with self.lock.read():
+            start, n = self.blocks[block_id]
+            if i0 < 0 or i0 + count > n:
+                raise IndexError(f"positions {i0}..{i0 + count} out of range (ntotal={n})")
+            if count == 0:
+                return np.empty((0, self.d), dtype=np.float32)
+            return self.index.reconstruct_n(start + i0, count)
+
+    # ---- 寫入（持 _mutate；寫鎖只用於替換指向） ----
+    def _buffer(self, index=None) -> np.ndarray:
+        """索引向量的可寫 NumPy view（不複製）；只寫入空閒範圍，查詢讀取的區段不會被改動。"""
+        index = self.index if index is None else index
+        return faiss.rev_swig_ptr(index.get_xb(), int(index.ntotal) * self.d).reshape(-1, self.d)
+
+    def _release_range(self, start: int, count: int) -> None:
+        """加入空閒範圍（依起點排序，與相鄰範圍合併）。"""
+        if count <= 0:
+            return
+        free = self.free
+        i = bisect.bisect_left(free, [start, count])
+        free.insert(i, [start, count])
+        if i + 1 < len(free) and free[i][0] + free[i][1] == free[i + 1][0]:
+            free[i][1] += free.pop(i + 1)[1]
+        if i > 0 and free[i - 1][0] + free[i - 1][1] == free[i][0]:
+            free[i - 1][1] += free.pop(i)[1]
+
+    def _allocate(self, count: int) -> int:
+        """自空閒範圍取得 count 個連續位置（best-fit）；不足時擴充分片。"""
+        fits = [r for r in self.free if r[1] >= count]
+        if not fits:
+            self._grow(count)
+            fits = [r for r in self.free if r[1] >= count]
+        chosen = min(fits, key=lambda r: r[1])
+        start = chosen[0]
+        if chosen[1] == count:
+            self.free.remove(chosen)
+        else:
+            chosen[0] += count
+            chosen[1] -= count
+        return start
+
+    def _swap_index(self, index, blocks: Dict[int, Tuple[int, int]]) -> None:
+        """於寫鎖內替換索引與區段表（O(1)）；進行中的查詢結束後舊索引即由 GC 回收。"""
+        with self.lock.write():
+            self.index = index
+            self.blocks = blocks
+
+    def _grow(self, count: int) -> None:
+        """在寫鎖外複製為容量更大的新索引（至少增加一半，攤提後每筆向量複製 O(1) 次），再替換。"""
+        old = self.capacity
+        new_capacity = old + max(count, old // 2, _MIN_GROW_VECTORS)
+        index = faiss.IndexFlatL2(self.d)
+        index.codes.resize(new_capacity * self.d * 4)
+        index.ntotal = new_capacity
+        if old:
+            self._buffer(index)[:old] = self._buffer()
+        self._swap_index(index, dict(self.blocks))
+        self._release_range(old, new_capacity - old)
+
+    def _write_block(self, block_id: int, vectors: np.ndarray) -> None:
+        """區段內容改為 vectors：寫入新的空閒範圍後替換指向，舊範圍轉為空閒。"""
+        n = len(vectors)
+        start = self._allocate(n) if n else 0
+        if n:
+            self._buffer()[start:start + n] = vectors
+        with self.lock.write():
+            old = self.blocks.get(block_id)
+            self.blocks[block_id] = (start, n)
+        old_start, old_n = old or (0, 0)
+        self.live += n - old_n
+        self._release_range(old_start, old_n)
+
+    def _block_vectors(self, block_id: int) -> np.ndarray:
+        start, n = self.blocks[block_id]
+        return self._buffer()[start:start + n].copy() if n else np.empty((0, self.d), dtype=np.float32)
+
+    def _drain_released(self) -> None:
+        while self._released:
+            block_id = self._released.popleft()
+            block = self.blocks.pop(block_id, None)
+            if block is not None:
+                # 已無 view 指向此區段，不需等待查詢
+                self.live -= block[1]
+                self._release_range(*block)
+
+    def _defragment(self) -> None:
+        """空閒位置超過存活向量時，依序複製存活區段到新索引（寫鎖外）後替換，回收記憶體。"""
+        index = faiss.IndexFlatL2(self.d)
+        blocks: Dict[int, Tuple[int, int]] = {}
+        if self.live:
+            index.codes.resize(self.live * self.d * 4)
+            index.ntotal = self.live
+            target, source = self._buffer(index), self._buffer()
+            pos = 0
+            for block_id, (start, n) in sorted(self.blocks.items(), key=lambda item: item[1][0]):
+                target[pos:pos + n] = source[start:start + n]
+                blocks[block_id] = (pos, n)
+                pos += n
+        else:
+            blocks = {block_id: (0, 0) for block_id in self.blocks}
+        freed = self.free_vectors
+        self._swap_index(index, blocks)
+        self.free = []
+        logger.info(
+            "[共用向量池] 分片重整 shard_id=%d vectors=%d blocks=%d 釋放=%d",
+            self.shard_id, self.live, len(blocks), freed,
+        )
+
+    def _compact_locked(self) -> None:
+        self._drain_released()
+        if self.free_vectors > max(self.live, _MIN_GROW_VECTORS):
+            self._defragment()
+
+    def append(self, block_id: int, vectors: np.ndarray) -> None:
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.d)
+        with self._mutate:
+            self._drain_released()
+            if block_id in self.blocks:
+                vectors = np.concatenate([self._block_vectors(block_id), vectors])
+            self._write_block(block_id, vectors)
+
+    def remove(self, block_id: int, positions: np.ndarray) -> int:
+        with self._mutate:
+            self._drain_released()
+            n = self.blocks[block_id][1]
+            positions = np.unique(positions[(positions >= 0) & (positions < n)])
+            if positions.size == 0:
+                return 0
+            self._write_block(block_id, np.delete(self._block_vectors(block_id), positions, axis=0))
+            return int(positions.size)
+
+    def release(self, block_id: int) -> None:
+        self._released.append(block_id)
+
+    def compact(self) -> None:
+        with self._mutate:
+            self._compact_locked()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._mutate:
+            return {
+                "shard_id": self.shard_id,
+                "dim": self.d,
+                "vectors": self.live,
+                "capacity": self.capacity,
+                "free_vectors": self.free_vectors,
+                "blocks": len(self.blocks),
+                "pending_release": len(self._released),
+                "bytes": self.capacity * self.d * 4,
+            }
+
+
+class SharedIndexView:
+    """
+    單一助理在共用分片中的區段；介面與 IndexFlatL2 相容（LangChain FAISS 使用的
+    search / add / reconstruct / remove_ids / ntotal / d），label 為助理內位置 0..n-1。
+    """
+
+    is_trained = True
+    metric_type = faiss.METRIC_L2
+
+    def __init__(self, shard: _Shard, block_id: int, assistant_id: int):
+        self._shard = shard
+        self._block_id = block_id
+        self.assistant_id = assistant_id
+        self.d = shard.d
+        self.code_size = shard.d * 4
+        weakref.finalize(self, shard.release, block_id)
+
+    @property
+    def ntotal(self) -> int:
+        return self._shard.size(self._block_id)
+
+    @property
+    def shard_id(self) -> int:
+        return self._shard.shard_id
+
+    def search(self, x, k, *args, **kwargs):
+        if args or kwargs:
+            raise TypeError("SharedIndexView.search does not accept extra parameters")
+        return self._shard.search(self._block_id, x, k)
+
+    def add(self, x) -> None:
+        self._shard.append(self._block_id, np.asarray(x, dtype=np.float32).reshape(-1, self.d))
+
+    def reconstruct(self, i: int) -> np.ndarray:
+        return self._shard.reconstruct_n(self._block_id, int(i), 1)[0]
+
+    def reconstruct_n(self, i0: int, n: int) -> np.ndarray:
+        return self._shard.reconstruct_n(self._block_id, int(i0), int(n))
+
+    def remove_ids(self, ids) -> int:
+        """刪除指定位置（與 IndexFlat.remove_ids 相同語意：其後位置往前遞補）。"""
+        return self._shard.remove(self._block_id, np.asarray(ids, dtype=np.int64).reshape(-1))
+
+    def materialize(self):
+        """複製為獨立的 IndexFlatL2（寫檔或移出共用池時使用）。"""
+        index = faiss.IndexFlatL2(self.d)
+        n = self.ntotal
+        if n:
+            index.add(self.reconstruct_n(0, n))
+        return index
+
+
+class SharedIndexPool:
+    """依維度分組的共用分片集合；新助理放入向量數最少且未滿的分片。"""
+
+    def __init__(self, shard_vectors: int):
+        self.shard_vectors = max(1, shard_vectors)
+        self._shards: List[_Shard] = []
+        self._lock = threading.Lock()
+        self._shard_ids = itertools.count(1)
+        self._block_ids = itertools.count(1)
+
+    def _pick_shard(self, d: int, n: int) -> _Shard:
+        """呼叫端需持有 self._lock。"""
+        candidates = [s for s in self._shards if s.d == d and s.live + n <= self.shard_vectors]
+        if candidates:
+            return min(candidates, key=lambda s: s.live)
+        shard = _Shard(next(self._shard_ids), d)
+        self._shards.append(shard)
+        logger.info("[共用向量池] 新增分片 shard_id=%d dim=%d", shard.shard_id, d)
+        return shard
+
+    def adopt(self, assistant_id: int, index) -> SharedIndexView:
+        """將獨立 Flat 索引的向量搬入共用分片，回傳取代 vs.index 的 view（原索引可丟棄）。"""
+        n = int(index.ntotal)
+        vectors = index.reconstruct_n(0, n) if n else np.empty((0, index.d), dtype=np.float32)
+        self.compact()
+        with self._lock:
+            # 選定分片與放入區段需在同一臨界區，避免新分片在放入前被 compact 視為空分片移除
+            shard = self._pick_shard(int(index.d), n)
+            block_id = next(self._block_ids)
+            shard.append(block_id, vectors)
+        return SharedIndexView(shard, block_id, assistant_id)
+
+    def compact(self) -> None:
+        """釋放已回收 view 的區段（空閒過多的分片重整），並移除空分片。"""
+        with self._lock:
+            shards = list(self._shards)
+        for shard in shards:
+            shard.compact()
+        with self._lock:
+            self._shards = [s for s in self._shards if s.blocks]
+
+    def stats(self) -> Dict[str, Any]:
+        self.compact()
+        with self._lock:
+            shards = [s.stats() for s in self._shards]
+        return {
+            "enabled": shared_index_enabled(),
+            "max_assistant_vectors": shared_max_vectors(),
+            "shard_vectors": self.shard_vectors,
+            "shards": shards,
+            "assistants": sum(s["blocks"] for s in shards),
+            "vectors": sum(s["vectors"] for s in shards),
+            "bytes": sum(s["bytes"] for s in shards),
+        }
+
+
+def is_shared_view(index) -> bool:
+    return isinstance(index, SharedIndexView)
+
+
+shared_index_pool = SharedIndexPool(_env_int("VECTOR_SHARED_SHARD_VECTORS", 500000))
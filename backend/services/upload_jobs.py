@@ -0,0 +1,376 @@
+"""知識庫上傳的持久化背景工作：上傳請求只負責寫入暫存檔與建立 upload_jobs 紀錄，立即回 202 與 job_id。
+
+原本 enqueue_rag 讓 HTTP 請求一路等到處理完成或 RAG_QUEUE_TIMEOUT；逾時只取消等待中的 future，
+執行緒仍在跑、結果卻被丟棄。改為：
+  - submit_upload：上傳內容分段寫入 uploaded_files/assistant_{id}/.jobs/{job_id}.{ext}，建立 queued 紀錄；
+  - 工作於本行程背景執行（rag_queue.run_rag_job，佇列滿時等待、不逾時），heavy 完成後才在同一交易中
+    寫入 knowledge_base 並將工作標為 done；向量庫已發布但 DB 尚未提交的 doc_id 先記在 pending_doc_ids；
+    chunk metadata 另記錄 job_id（與向量一起寫入、早於向量庫提交），發布後、記錄 pending_doc_ids 前當機，
+    或行程關閉取消工作而執行緒仍完成發布時，重跑與失敗清除仍找得到這些 chunk；
+  - 心跳：擁有工作的行程每 UPLOAD_JOB_HEARTBEAT_SECONDS 秒更新 heartbeat_at 與進度（其他 worker 也查得到）；
+  - 復原：queued / running 且心跳逾 UPLOAD_JOB_STALE_SECONDS 秒的工作（行程重啟或當機）由任一 worker
+    以條件式 UPDATE 認領後重新執行，重跑時先刪除 pending_doc_ids 與帶有此 job_id 的 chunk，不會留下重複向量；
+    超過 UPLOAD_JOB_MAX_ATTEMPTS 次（例如每次都讓行程 OOM 的檔案）即標為 failed；
+  - 失敗：標為 failed 前先經 RAG 佇列 small 通道刪除已發布、未提交的向量（pending_doc_ids 與帶有此 job_id
+    的 chunk，例如向量發布後 DB 提交失敗），不會留下沒有 knowledge_base 紀錄的向量；刪除本身失敗時工作維持
+    running，心跳逾時後由復原流程重試。
+
+環境變數：
+  UPLOAD_JOB_HEARTBEAT_SECONDS  心跳 / 復原檢查間隔（預設 5）
+  UPLOAD_JOB_STALE_SECONDS      心跳逾時即視為擁有者已停止（預設 60）
+  UPLOAD_JOB_MAX_ATTEMPTS       同一工作最多執行次數（預設 3）
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import or_  # pyright: ignore[reportMissingImports]
+from sqlalchemy.orm import Session  # pyright: ignore[reportMissingImports]
+
+from models.models import UploadJob
+from services import upload_progress
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+UPLOAD_JOB_HEARTBEAT_SECONDS = max(1.0, float(os.getenv("UPLOAD_JOB_HEARTBEAT_SECONDS", "5")))
+UPLOAD_JOB_STALE_SECONDS = max(UPLOAD_JOB_HEARTBEAT_SECONDS * 3, float(os.getenv("UPLOAD_JOB_STALE_SECONDS", "60")))
+UPLOAD_JOB_MAX_ATTEMPTS = max(1, int(os.getenv("UPLOAD_JOB_MAX_ATTEMPTS", "3")))
+
+ACTIVE_STATUSES = ("queued", "running")
+SUPPORTED_EXTENSIONS = ("pdf", "docx", "txt")
+# 每次復原檢查最多認領的工作數
+_CLAIM_BATCH = 20
+
+_WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+_tasks: Dict[str, asyncio.Task] = {}
+_monitor: Optional[asyncio.Task] = None
+
+
+def staging_path(assistant_id: int, job_id: str, file_extension: str) -> str:
+    return os.path.join(f"./uploaded_files/assistant_{assistant_id}", ".jobs", f"{job_id}.{file_extension}")
+
+
+def final_path(assistant_id: int, file_name: str) -> str:
+    return os.path.join(f"./uploaded_files/assistant_{assistant_id}", file_name)
+
+
+def job_to_dict(job: UploadJob) -> Dict[str, Any]:
+    """DB 紀錄；本行程正在執行時以記憶體中的即時進度覆蓋 stage / percent。"""
+    data = {
+        "job_id": job.job_id,
+        "assistant_id": job.assistant_id,
+        "filename": job.file_name,
+        "status": job.status,
+        "stage": job.stage,
+        "percent": job.percent,
+        "chunks_embedded": job.chunks_embedded,
+        "chunks_per_sec": None,
+        "attempts": job.attempts,
+        "error": job.error,
+        "knowledge_id": job.knowledge_id,
+        "created_at": job.created_at,
+        "updated_at": job.updated_at,
+        "finished_at": job.finished_at,
+    }
+    live = upload_progress.get_upload(job.job_id)
+    if live is not None and job.status in ACTIVE_STATUSES:
+        snapshot = live.to_dict()
+        if snapshot["state"] == "running":
+            data.update(
+                stage=snapshot["stage"],
+                percent=max(job.percent, int(snapshot["percent"])),
+                chunks_embedded=snapshot["chunks_embedded"],
+                chunks_per_sec=snapshot["chunks_per_sec"],
+            )
+    return data
+
+
+def get_job(db: Session, assistant_id: int, job_id: str) -> Optional[UploadJob]:
+    return db.query(UploadJob).filter(
+        UploadJob.job_id == job_id,
+        UploadJob.assistant_id == assistant_id,
+    ).first()
+
+
+def list_jobs(db: Session, assistant_id: int, limit: int = 50) -> List[Dict[str, Any]]:
+    jobs = (
+        db.query(UploadJob)
+        .filter(UploadJob.assistant_id == assistant_id)
+        .order_by(UploadJob.created_at.desc())
+        .limit(limit)
+        .all()
+    )
+    return [job_to_dict(job) for job in jobs]
+
+
+async def submit_upload(assistant_id: int, file, db: Session, job_id: Optional[str] = None) -> UploadJob:
+    """寫入暫存檔並建立 queued 工作後立即返回；處理於背景進行。job_id 已存在時拋 ValueError。"""
+    from services.document_ingest import spool_upload
+
+    filename = file.filename or "(unnamed)"
+    file_extension = filename.split(".")[-1].lower() if "." in filename else ""
+    if not file_extension:
+        raise ValueError("File must have an extension")
+    if file_extension not in SUPPORTED_EXTENSIONS:
+        raise ValueError("Unsupported file type")
+    if job_id and db.get(UploadJob, job_id) is not None:
+        raise ValueError(f"Upload job already exists: {job_id}")
+
+    progress = upload_progress.start_upload(assistant_id, filename, job_id)
+    path = staging_path(assistant_id, progress.job_id, file_extension)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        size = await spool_upload(file, path)
+        job = UploadJob(
+            job_id=progress.job_id,
+            assistant_id=assistant_id,
+            file_name=filename,
+            file_path=path,
+            status="queued",
+            stage="queued",
+            worker_id=_WORKER_ID,
+            heartbeat_at=datetime.utcnow(),
+        )
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+    except Exception as e:
+        progress.fail(str(e))
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    progress.set_stage("queued")
+    logger.info(
+        "[上傳工作] 已建立 job_id=%s assistant_id=%s filename=%s size=%d bytes",
+        job.job_id, assistant_id, filename, size,
+    )
+    _start(job.job_id)
+    return job
+
+
+def _start(job_id: str) -> None:
+    if job_id in _tasks:
+        return
+    task = asyncio.create_task(_run_job(job_id))
+    _tasks[job_id] = task
+    task.add_done_callback(lambda _t: _tasks.pop(job_id, None))
+
+
+def _job_source_path(job: UploadJob) -> Optional[str]:
+    """暫存檔；若上次執行已移入正式路徑（向量已發布、DB 未提交）則改用正式路徑。"""
+    if os.path.exists(job.file_path):
+        return job.file_path
+    if job.pending_doc_ids and os.path.exists(final_path(job.assistant_id, job.file_name)):
+        return final_path(job.assistant_id, job.file_name)
+    return None
+
+
+async def _run_job(job_id: str) -> None:
+    from models.database import SessionLocal
+    from services import vector_service
+
+    db = SessionLocal()
+    progress = None
+    # 本次執行已發布的 doc_id（記錄 pending_doc_ids 的提交本身失敗時仍能清除）
+    published_doc_ids: List[str] = []
+    try:
+        job = db.get(UploadJob, job_id)
+        if job is None or job.status not in ACTIVE_STATUSES:
+            return
+        progress = upload_progress.get_upload(job_id) or upload_progress.start_upload(
+            job.assistant_id, job.file_name, job_id
+        )
+        source = _job_source_path(job)
+        if source is None:
+            raise FileNotFoundError(f"Staged upload is missing: {job.file_path}")
+        if job.attempts >= UPLOAD_JOB_MAX_ATTEMPTS:
+            raise RuntimeError(f"Upload job exceeded {UPLOAD_JOB_MAX_ATTEMPTS} attempts")
+        job.status = "running"
+        job.attempts += 1
+        job.worker_id = _WORKER_ID
+        job.heartbeat_at = datetime.utcnow()
+        db.commit()
+        stale_doc_ids = _split_doc_ids(job.pending_doc_ids)
+        logger.info(
+            "[上傳工作] 開始 job_id=%s assistant_id=%s filename=%s attempt=%d stale_doc_ids=%d",
+            job_id, job.assistant_id, job.file_name, job.attempts, len(stale_doc_ids),
+        )
+
+        def _record_pending(doc_ids_string: str) -> None:
+            published_doc_ids.extend(_split_doc_ids(doc_ids_string))
+            job.pending_doc_ids = doc_ids_string
+            job.stage = "saving"
+            db.commit()
+
+        def _complete(entry) -> None:
+            job.status = "done"
+            job.stage = "done"
+            job.percent = 100
+            job.chunks_embedded = len([did for did in (entry.doc_ids or "").split(",") if did.strip()])
+            job.knowledge_id = entry.id
+            job.pending_doc_ids = None
+            job.error = None
+            job.finished_at = datetime.utcnow()
+
+        await vector_service.store_uploaded_file(
+            job.assistant_id, job.file_name, source, db, progress,
+            stale_doc_ids=stale_doc_ids, upload_job_id=job_id,
+            on_vectors_published=_record_pending, before_commit=_complete,
+        )
+        progress.finish()
+        logger.info("[上傳工作] 完成 job_id=%s knowledge_id=%s", job_id, job.knowledge_id)
+    except asyncio.CancelledError:
+        # 行程關閉：保留 running 狀態，由下一個行程於心跳逾時後接手
+        db.rollback()
+        raise
+    except Exception as e:
+        logger.exception("[上傳工作] 失敗 job_id=%s error=%s", job_id, e)
+        db.rollback()
+        error = str(getattr(e, "detail", None) or e)
+        if progress is not None:
+            progress.fail(error)
+        job = db.get(UploadJob, job_id)
+        if job is not None:
+            uncommitted = list(dict.fromkeys(_split_doc_ids(job.pending_doc_ids) + published_doc_ids))
+            # 即使沒有記錄到 doc_id，也以 job_id 清除前次執行已發布的 chunk
+            if not await _remove_uncommitted_vectors(job, uncommitted, db):
+                job.pending_doc_ids = ", ".join(uncommitted)
+                job.error = error[:2000]
+                db.commit()
+                return
+            job.pending_doc_ids = None
+            job.status = "failed"
+            job.error = error[:2000]
+            job.finished_at = datetime.utcnow()
+            db.commit()
+            if os.path.exists(job.file_path):
+                os.remove(job.file_path)
+    finally:
+        db.close()
+
+
+def _split_doc_ids(doc_ids_string: Optional[str]) -> List[str]:
+    return [did.strip() for did in (doc_ids_string or "").split(",") if did.strip()]
+
+
+async def _remove_uncommitted_vectors(job: UploadJob, doc_ids: List[str], db: Session) -> bool:
+    """
+    刪除已發布、未提交至 knowledge_base 的向量（含帶有此 job_id 的 chunk）；
+    失敗時回傳 False（工作維持 running，由復原流程重試）。
+    """
+    from services import vector_service
+
+    try:
+        await vector_service.delete_uncommitted_vectors(job.assistant_id, doc_ids, db, upload_job_id=job.job_id)
+    except Exception as e:
+        logger.warning(
+            "[上傳工作] 清除未提交的向量失敗，保留工作待復原 job_id=%s doc_ids=%d error=%s",
+            job.job_id, len(doc_ids), e,
+        )
+        return False
+    logger.info("[上傳工作] 已清除未提交的向量 job_id=%s doc_ids=%d", job.job_id, len(doc_ids))
+    return True
+
+
+def _heartbeat(db: Session) -> None:
+    """更新本行程執行中工作的心跳與進度。"""
+    now = datetime.utcnow()
+    for job_id in list(_tasks):
+        fields: Dict[str, Any] = {UploadJob.heartbeat_at: now}
+        live = upload_progress.get_upload(job_id)
+        if live is not None:
+            snapshot = live.to_dict()
+            fields.update({
+                UploadJob.stage: snapshot["stage"],
+                UploadJob.percent: int(snapshot["percent"]),
+                UploadJob.chunks_embedded: snapshot["chunks_embedded"],
+            })
+        db.query(UploadJob).filter(
+            UploadJob.job_id == job_id,
+            UploadJob.worker_id == _WORKER_ID,
+            UploadJob.status.in_(ACTIVE_STATUSES),
+        ).update(fields, synchronize_session=False)
+    db.commit()
+
+
+def claim_stale_jobs(db: Session, stale_seconds: float = UPLOAD_JOB_STALE_SECONDS) -> List[str]:
+    """以條件式 UPDATE 認領心跳逾時的未完成工作（多 worker 同時檢查時只有一個成功）。"""
+    cutoff = datetime.utcnow() - timedelta(seconds=stale_seconds)
+    stale = or_(UploadJob.heartbeat_at.is_(None), UploadJob.heartbeat_at < cutoff)
+    candidates = [
+        row.job_id
+        for row in db.query(UploadJob.job_id)
+        .filter(UploadJob.status.in_(ACTIVE_STATUSES), stale)
+        .order_by(UploadJob.created_at)
+        .limit(_CLAIM_BATCH)
+        .all()
+        if row.job_id not in _tasks
+    ]
+    claimed: List[str] = []
+    for job_id in candidates:
+        updated = db.query(UploadJob).filter(
+            UploadJob.job_id == job_id,
+            UploadJob.status.in_(ACTIVE_STATUSES),
+            stale,
+        ).update(
+            {UploadJob.worker_id: _WORKER_ID, UploadJob.heartbeat_at: datetime.utcnow()},
+            synchronize_session=False,
+        )
+        db.commit()
+        if updated:
+            claimed.append(job_id)
+    return claimed
+
+
+def _heartbeat_and_claim() -> List[str]:
+    from models.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        _heartbeat(db)
+        return claim_stale_jobs(db)
+    finally:
+        db.close()
+
+
+async def _monitor_loop() -> None:
+    while True:
+        try:
+            claimed = await asyncio.to_thread(_heartbeat_and_claim)
+            for job_id in claimed:
+                logger.info("[上傳工作] 接手未完成的工作 job_id=%s", job_id)
+                _start(job_id)
+        except Exception as e:
+            logger.warning("[上傳工作] 心跳 / 復原檢查失敗：%s", e)
+        await asyncio.sleep(UPLOAD_JOB_HEARTBEAT_SECONDS)
+
+
+def start_upload_jobs() -> None:
+    """啟動心跳與復原檢查（於 event loop 中呼叫）。"""
+    global _monitor
+    if _monitor is not None and not _monitor.done():
+        return
+    _monitor = asyncio.get_running_loop().create_task(_monitor_loop())
+    logger.info(
+        "[上傳工作] 啟動 worker_id=%s heartbeat=%.0fs stale=%.0fs",
+        _WORKER_ID, UPLOAD_JOB_HEARTBEAT_SECONDS, UPLOAD_JOB_STALE_SECONDS,
+    )
+
+
+async def stop_upload_jobs() -> None:
+    """停止心跳並取消本行程的工作；DB 中維持 running，由其他（或重啟後的）worker 接手。"""
+    global _monitor
+    tasks = ([_monitor] if _monitor is not None else []) + list(_tasks.values())
+    for task in tasks:
+        task.cancel()
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+    _monitor = None
+    _tasks.clear()
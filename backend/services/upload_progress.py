@@ -0,0 +1,157 @@
+"""上傳工作進度：heavy 路徑逐批回報，前端以 job_id 輪詢完成百分比，不必盯著一個持續數分鐘的 HTTP 請求。
+
+進度以階段劃分百分比：
+  uploading（寫入磁碟）0~5 → queued（等待 RAG 佇列）5 → ingesting（解析 + embedding + 寫入索引）5~90
+  → saving（寫入 DB）97 → done 100；failed 保留最後的百分比與錯誤訊息。
+摘要 / 關鍵字於完成後另行產生（services.knowledge_summary），不計入上傳進度。
+ingesting 的比例取自已 embedding 的 chunk 所對應的來源位置（txt 位元組、PDF 頁數），
+每批 embedding 完成後依批次內進度內插，不需預先知道 chunk 總數。
+
+進度只保存在本行程記憶體；多 worker 部署時輪詢請求可能落在其他 worker（查無此工作時回 404）。
+完成 / 失敗的工作保留 UPLOAD_PROGRESS_TTL_SECONDS 秒（預設 3600）後清除。
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+_INGEST_START = 5.0
+_INGEST_END = 90.0
+_STAGE_PERCENT = {
+    "uploading": 0.0,
+    "queued": _INGEST_START,
+    "ingesting": _INGEST_START,
+    "saving": 97.0,
+    "done": 100.0,
+}
+_JOB_ID_RE = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+_jobs: Dict[str, "UploadProgress"] = {}
+_jobs_lock = threading.Lock()
+
+
+def _ttl_seconds() -> float:
+    try:
+        return float(os.getenv("UPLOAD_PROGRESS_TTL_SECONDS", "3600"))
+    except ValueError:
+        return 3600.0
+
+
+def valid_job_id(job_id: str) -> bool:
+    return bool(job_id) and _JOB_ID_RE.match(job_id) is not None
+
+
+class UploadProgress:
+    """單一上傳工作的進度；各方法可由任一執行緒呼叫。"""
+
+    def __init__(self, job_id: str, assistant_id: int, filename: str):
+        self.job_id = job_id
+        self.assistant_id = assistant_id
+        self.filename = filename
+        self._lock = threading.Lock()
+        self.state = "running"
+        self.stage = "uploading"
+        self.percent = 0.0
+        self.chunks_embedded = 0
+        self.chunks_per_sec: Optional[float] = None
+        self.error: Optional[str] = None
+        self.started_at = time.time()
+        self.updated_at = self.started_at
+        self.finished_at: Optional[float] = None
+        # 解析器已讀到的來源比例（領先於 embedding 一批）
+        self._parsed = 0.0
+        self._ingested = 0.0
+
+    def _touch(self) -> None:
+        self.updated_at = time.time()
+
+    def set_stage(self, stage: str) -> None:
+        with self._lock:
+            self.stage = stage
+            self.percent = max(self.percent, _STAGE_PERCENT.get(stage, self.percent))
+            self._touch()
+
+    def set_parsed(self, fraction: float) -> None:
+        """解析器回報已讀取的來源比例（document_ingest 的 on_progress）。"""
+        with self._lock:
+            self._parsed = max(self._parsed, min(1.0, fraction))
+
+    def parsed_fraction(self) -> float:
+        with self._lock:
+            return self._parsed
+
+    def set_ingested(self, fraction: float, chunks_embedded: int, chunks_per_sec: Optional[float] = None) -> None:
+        with self._lock:
+            self._ingested = max(self._ingested, min(1.0, fraction))
+            self.stage = "ingesting"
+            self.percent = max(self.percent, _INGEST_START + (_INGEST_END - _INGEST_START) * self._ingested)
+            self.chunks_embedded = chunks_embedded
+            if chunks_per_sec is not None:
+                self.chunks_per_sec = round(chunks_per_sec, 1)
+            self._touch()
+
+    def finish(self) -> None:
+        with self._lock:
+            self.state = "done"
+            self.stage = "done"
+            self.percent = 100.0
+            self.finished_at = self.updated_at = time.time()
+
+    def fail(self, error: str) -> None:
+        with self._lock:
+            self.state = "failed"
+            self.error = error
+            self.finished_at = self.updated_at = time.time()
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "job_id": self.job_id,
+                "assistant_id": self.assistant_id,
+                "filename": self.filename,
+                "state": self.state,
+                "stage": self.stage,
+                "percent": round(self.percent, 1),
+                "chunks_embedded": self.chunks_embedded,
+                "chunks_per_sec": self.chunks_per_sec,
+                "error": self.error,
+                "started_at": self.started_at,
+                "updated_at": self.updated_at,
+                "finished_at": self.finished_at,
+            }
+
+
+def _prune_locked(now: float) -> None:
+    ttl = _ttl_seconds()
+    expired = [jid for jid, job in _jobs.items() if job.finished_at is not None and now - job.finished_at > ttl]
+    for jid in expired:
+        _jobs.pop(jid, None)
+
+
+def start_upload(assistant_id: int, filename: str, job_id: Optional[str] = None) -> UploadProgress:
+    """建立（或以同一 job_id 取代）上傳進度；job_id 未提供或格式不符時自動產生。"""
+    if not job_id or not valid_job_id(job_id):
+        job_id = uuid.uuid4().hex
+    job = UploadProgress(job_id, assistant_id, filename)
+    with _jobs_lock:
+        _prune_locked(time.time())
+        _jobs[job_id] = job
+    return job
+
+
+def get_upload(job_id: str) -> Optional[UploadProgress]:
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def list_uploads(assistant_id: int) -> List[Dict[str, Any]]:
+    """此助理的上傳工作（新到舊）。"""
+    with _jobs_lock:
+        _prune_locked(time.time())
+        jobs = [job for job in _jobs.values() if job.assistant_id == assistant_id]
+    return [job.to_dict() for job in sorted(jobs, key=lambda j: j.started_at, reverse=True)]
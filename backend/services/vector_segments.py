@@ -0,0 +1,273 @@
+"""向量庫的 append-only 增量區段（delta segment）與刪除墓碑（tombstone）檔案。
+
+每次上傳 / 更新 / 刪除不再重寫整個 assistant_{id}.index 與 chunk 檔，而是：
+  - 新增的 chunk 寫成小型增量區段：
+      assistant_{id}_delta_{seq}.npy          該批原始向量（float32）
+      assistant_{id}_delta_{seq}_chunks.bin   該批 chunk（services.chunk_store 格式）
+  - 刪除的 doc_id 追加到 assistant_{id}_tombstones.log（JSON lines，{"after": seq, "ids": [...]}）；
+  - assistant_{id}_segments.json 記錄 base_seq（已併入主檔的最大序號）與 last_seq。
+    manifest 為唯一的提交紀錄：沒有 manifest 的向量庫（舊版 / 剛由 pickle 轉換）視為沒有已提交的增量區段，
+    vector_service 於持鎖載入時補寫初始 manifest（見 _ensure_segment_manifest）。
+量化索引另有 assistant_{id}_vectors.npy：主檔 chunk 依序對應的原始向量，供重新排序與重建使用。
+
+讀取時依序重播：主檔 → 各增量區段（seq > base_seq），每一步之後套用 after == 該 seq 的墓碑，
+得到與全量寫入完全相同的記憶體向量庫。增量區段或墓碑累積過多時由 vector_service 在背景合併（compaction）
+回主檔。主檔 chunk 檔 header 亦記錄 base_seq，合併中途當機時重播仍以主檔為準，不會重複加入向量。
+
+assistant_{id}.generation 為內容版本 token：每次寫入完成（上傳 / 更新 / 刪除 / 清空）換成新的隨機值，
+多 worker 部署時其他 process 於查詢時比對此檔，只在變動時重新載入該助理（合併不改變內容，token 不變）。
+
+查詢端載入不持鎖：除墓碑（只追加）外，所有檔案皆以 .tmp + os.replace 寫入，manifest 為提交點——
+只採用 seq <= last_seq 的增量區段與 tombstone_bytes 以內的墓碑。全量寫入依 chunk 檔 → 原始向量檔 → index →
+manifest 的順序替換（舊的增量區段於 manifest 之後才刪除），讀取端依相反順序開啟；chunk 檔 header 與 manifest
+記錄同一個 base_id，讀取前後 manifest 相同且 base_id 相符，即代表讀到同一次提交（見 vector_service）。
+
+本模組只處理檔案格式；寫入的呼叫端需持有 faiss_disk_lock。
+"""
+
+from __future__ import annotations
+
+import glob
+import json
+import os
+import re
+import uuid
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+_DELTA_RE = re.compile(r"_delta_(\d+)\.npy$")
+_DELTA_FILE_RE = re.compile(r"_delta_(\d+)(?:\.npy|_chunks\.bin)")
+
+
+@dataclass
+class SegmentManifest:
+    base_seq: int = 0
+    last_seq: int = 0
+    tombstones: int = 0
+    # 主檔（chunk / 原始向量 / index）的識別碼，與 chunk 檔 header 相同；舊版主檔為 None
+    base_id: Optional[str] = None
+    # 已提交的墓碑檔長度（bytes）；None 為舊版 manifest，採用整個墓碑檔
+    tombstone_bytes: Optional[int] = None
+
+    @property
+    def delta_count(self) -> int:
+        return self.last_seq - self.base_seq
+
+
+def manifest_path(prefix: str) -> str:
+    return f"{prefix}_segments.json"
+
+
+def tombstone_path(prefix: str) -> str:
+    return f"{prefix}_tombstones.log"
+
+
+def delta_paths(prefix: str, seq: int) -> Tuple[str, str]:
+    return f"{prefix}_delta_{seq:06d}.npy", f"{prefix}_delta_{seq:06d}_chunks.bin"
+
+
+def base_chunks_path(prefix: str) -> str:
+    return f"{prefix}_chunks.bin"
+
+
+def base_vectors_path(prefix: str) -> str:
+    return f"{prefix}_vectors.npy"
+
+
+def generation_path(prefix: str) -> str:
+    return f"{prefix}.generation"
+
+
+def read_generation(prefix: str) -> Optional[str]:
+    """目前磁碟內容的版本 token；尚未寫過（舊版向量庫）時為 None。整檔原子替換，讀取不需持鎖。"""
+    try:
+        with open(generation_path(prefix), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def new_generation_token() -> str:
+    """隨機版本 token：清空後重建也不會與其他 worker 手上的舊值相同。"""
+    return uuid.uuid4().hex
+
+
+def write_generation(prefix: str, token: Optional[str] = None) -> str:
+    """寫入版本 token（未指定時產生新值）並回傳。"""
+    token = token or new_generation_token()
+    path = generation_path(prefix)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(token)
+    os.replace(tmp_path, path)
+    return token
+
+
+def list_deltas(prefix: str) -> List[Tuple[int, str, str]]:
+    """磁碟上完整的增量區段 (seq, 向量檔, chunk 檔)，依 seq 排序；.npy 最後寫入，缺檔者視為未完成。"""
+    deltas = []
+    for npy_path in glob.glob(f"{glob.escape(prefix)}_delta_*.npy"):
+        match = _DELTA_RE.search(npy_path)
+        if not match:
+            continue
+        seq = int(match.group(1))
+        vectors_path, chunks_path = delta_paths(prefix, seq)
+        if os.path.exists(chunks_path):
+            deltas.append((seq, vectors_path, chunks_path))
+    return sorted(deltas)
+
+
+def read_manifest(prefix: str) -> SegmentManifest:
+    """目前的提交點；尚無 manifest 時 last_seq=0——磁碟上的增量區段都未提交（失敗的上傳留下的），不重播。"""
+    path = manifest_path(prefix)
+    if not os.path.exists(path):
+        return SegmentManifest()
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    tombstone_bytes = data.get("tombstone_bytes")
+    return SegmentManifest(
+        base_seq=int(data.get("base_seq", 0)),
+        last_seq=int(data.get("last_seq", 0)),
+        tombstones=int(data.get("tombstones", 0)),
+        base_id=data.get("base_id"),
+        tombstone_bytes=int(tombstone_bytes) if tombstone_bytes is not None else None,
+    )
+
+
+def write_manifest(prefix: str, manifest: SegmentManifest) -> None:
+    path = manifest_path(prefix)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "base_seq": manifest.base_seq,
+                "last_seq": manifest.last_seq,
+                "tombstones": manifest.tombstones,
+                "base_id": manifest.base_id,
+                "tombstone_bytes": manifest.tombstone_bytes,
+            },
+            f,
+        )
+    os.replace(tmp_path, path)
+
+
+def write_delta(prefix: str, seq: int, vectors: np.ndarray, items: Iterable[Tuple[str, Any]]) -> Tuple[str, str]:
+    """寫入一個增量區段：先 chunk 檔、再向量檔（.npy 存在即代表區段完整）。"""
+    from services.chunk_store import write_chunk_store
+
+    vectors_path, chunks_path = delta_paths(prefix, seq)
+    write_chunk_store(chunks_path, items)
+    write_vectors(vectors_path, vectors)
+    return vectors_path, chunks_path
+
+
+def write_vectors(path: str, vectors: np.ndarray) -> None:
+    """以 .tmp + os.replace 寫入 float32 .npy（讀取端可直接 mmap）。"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, np.ascontiguousarray(vectors, dtype=np.float32))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_delta_vectors(vectors_path: str) -> np.ndarray:
+    return np.ascontiguousarray(np.load(vectors_path), dtype=np.float32)
+
+
+def append_tombstones(prefix: str, after_seq: int, ids: List[str]) -> None:
+    if not ids:
+        return
+    with open(tombstone_path(prefix), "a", encoding="utf-8") as f:
+        f.write(json.dumps({"after": after_seq, "ids": list(ids)}, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def tombstone_size(prefix: str) -> int:
+    path = tombstone_path(prefix)
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+def read_tombstones(prefix: str, limit_bytes: Optional[int] = None) -> Dict[int, List[str]]:
+    """
+    after_seq → 該時間點刪除的 doc_id；截斷的最後一行（寫入中當機）略過。
+    limit_bytes 為 manifest.tombstone_bytes：只讀已提交的部分（寫入中追加、尚未提交的墓碑不套用）。
+    """
+    path = tombstone_path(prefix)
+    result: Dict[int, List[str]] = {}
+    if not os.path.exists(path):
+        return result
+    with open(path, "rb") as f:
+        data = f.read() if limit_bytes is None else f.read(limit_bytes)
+    for line in data.decode("utf-8", errors="ignore").splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            entry = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        result.setdefault(int(entry["after"]), []).extend(entry.get("ids", []))
+    return result
+
+
+def segment_files(prefix: str) -> List[str]:
+    """增量區段與墓碑檔案路徑（含寫入中斷留下的 .tmp）；不含 manifest。"""
+    paths = glob.glob(f"{glob.escape(prefix)}_delta_*")
+    paths.append(tombstone_path(prefix))
+    return sorted(set(paths))
+
+
+def remove_deltas_after(prefix: str, seq: int) -> int:
+    """刪除 seq 之後（未提交）的增量區段檔案（含寫入中斷留下的 .tmp）；呼叫端持有 faiss_disk_lock。回傳刪除的檔案數。"""
+    removed = 0
+    for path in glob.glob(f"{glob.escape(prefix)}_delta_*"):
+        match = _DELTA_FILE_RE.search(path)
+        if match and int(match.group(1)) > seq and os.path.exists(path):
+            os.remove(path)
+            removed += 1
+    return removed
+
+
+def remove_segments(prefix: str) -> None:
+    for path in segment_files(prefix):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def read_committed_texts(prefix: str, doc_ids: Iterable[str], max_chars: Optional[int] = None) -> List[str]:
+    """
+    直接由已提交的 chunk 檔（主檔 + manifest 範圍內的增量區段）依 doc_ids 順序讀取文字，不載入 FAISS index、
+    不經向量庫快取。檔案皆以 .tmp + os.replace 寫入，不需持鎖；讀取期間被合併移除的區段略過。
+    找不到的 doc_id 略過，累積超過 max_chars 即停止。
+    """
+    from services.chunk_store import MmapDocstore
+
+    try:
+        docstore = MmapDocstore.open(base_chunks_path(prefix))
+    except FileNotFoundError:
+        return []
+    try:
+        manifest = read_manifest(prefix)
+        for seq, _, chunks_path in list_deltas(prefix):
+            if docstore.base_seq < seq <= manifest.last_seq:
+                try:
+                    docstore.attach(chunks_path)
+                except FileNotFoundError:
+                    continue
+        texts: List[str] = []
+        total = 0
+        for doc_id in doc_ids:
+            doc = docstore.search(doc_id)
+            if isinstance(doc, str):
+                continue
+            texts.append(doc.page_content)
+            total += len(doc.page_content) + 1
+            if max_chars is not None and total >= max_chars:
+                break
+        return texts
+    finally:
+        docstore.close()
@@ -11,18 +11,19 @@ from langchain_community.vectorstores import FAISS # pyright: ignore[reportMissi
 from langchain_community.document_loaders import TextLoader, PyPDFLoader, UnstructuredWordDocumentLoader # pyright: ignore[reportMissingImports]
 from langchain_text_splitters import RecursiveCharacterTextSplitter # pyright: ignore[reportMissingImports]
 from langchain_core.documents import Document  # pyright: ignore[reportMissingImports]
-from langchain_community.chat_models import ChatOpenAI  # pyright: ignore[reportMissingImports]
 from sqlalchemy.orm import Session  # pyright: ignore[reportMissingImports]
-from fastapi import UploadFile  # pyright: ignore[reportMissingImports]
+from fastapi import HTTPException, UploadFile  # pyright: ignore[reportMissingImports]
 from starlette.concurrency import run_in_threadpool
 from dotenv import load_dotenv  # pyright: ignore[reportMissingImports]
-from models.models import KnowledgeBase  # pyright: ignore[reportMissingImports]
+from models.models import AIAssistant, KnowledgeBase  # pyright: ignore[reportMissingImports]
 from transformers import pipeline  # pyright: ignore[reportMissingImports]
 from rake_nltk import Rake  # pyright: ignore[reportMissingImports]
 from langchain_core.messages import HumanMessage  # pyright: ignore[reportMissingImports]
 import faiss # pyright: ignore[reportMissingImports]
-import pickle
+import numpy as np
 
+import copy
+import hashlib
 import os
 import time
 import tiktoken  # pyright: ignore[reportMissingImports]
@@ -32,6 +33,7 @@ import json
 import re
 
 from utils.logger import get_logger
+from utils.vector_store_cache import VectorStoreCache, vector_store_cache_max_bytes
 
 load_dotenv()  # 載入 .env 檔案中的環境變數
 
@@ -43,12 +45,31 @@ VLLM_BASE_URL = os.getenv("VLLM_BASE_URL", "http://127.0.0.1:8000/v1")
 VLLM_MODEL = (os.getenv("VLLM_MODEL") or "Qwen/Qwen2.5-7B-Instruct-AWQ").strip()
 VLLM_SUMMARY_MODEL = os.getenv("VLLM_SUMMARY_MODEL", "").strip()
 
-# 用於取得向量儲存（key 一律為 int 型別的 assistant_id）
-vector_store = {}
+# 用於取得向量儲存（key 一律為 int 型別的 assistant_id）；依 VECTOR_STORE_CACHE_MAX_MB 做 LRU 淘汰。
+# BM25 倒排索引掛在各快照上（vs._bm25_index），隨快照一起發布與淘汰
+vector_store = VectorStoreCache(max_bytes=vector_store_cache_max_bytes())
+# 每個助理的知識庫版本號：向量庫內容每次變動 +1，供回覆快取等衍生資料判斷是否過期
+knowledge_generations: dict[int, int] = {}
+# 本 worker 最後看到的磁碟版本 token（assistant_{id}.generation）；其他 worker 寫入後不同即失效
+_seen_disk_generations: dict[int, str | None] = {}
 _assistant_vector_write_locks: dict[int, asyncio.Lock] = {}
 _faiss_thread_locks: dict[int, threading.RLock] = {}
 _faiss_thread_locks_guard = threading.Lock()
+# 查詢端載入（不持 faiss_disk_lock）：同一 worker 內同一助理只由一個執行緒讀檔
+_load_locks: dict[int, threading.Lock] = {}
+# 不持鎖讀取時遇到並行提交的重讀次數上限，超過後改為持鎖讀取
+_COMMITTED_READ_ATTEMPTS = 5
 FAISS_FILE_LOCK_TIMEOUT = float(os.getenv("FAISS_FILE_LOCK_TIMEOUT", "300"))
+# 增量持久化：上傳 / 刪除只寫增量區段與墓碑，累積到門檻後於背景合併回主檔（見 services/vector_segments.py）
+VECTOR_STORE_INCREMENTAL = (os.getenv("VECTOR_STORE_INCREMENTAL") or "true").strip().lower() not in {"0", "false", "no", "off"}
+VECTOR_COMPACT_MAX_DELTAS = max(1, int(os.getenv("VECTOR_COMPACT_MAX_DELTAS", "8")))
+VECTOR_COMPACT_TOMBSTONE_RATIO = float(os.getenv("VECTOR_COMPACT_TOMBSTONE_RATIO", "0.2"))
+_compaction_pending: set[int] = set()
+# 摘要 / 語言偵測只需開頭內容（generate_summary_and_keywords 只取前 500 字），串流上傳不保留全文
+_SUMMARY_SOURCE_CHARS = 20000
+# 背景上傳工作（services.upload_jobs）寫入的 chunk metadata：記錄所屬工作，重跑時據此清除前次執行已發布的 chunk
+UPLOAD_JOB_METADATA_KEY = "upload_job_id"
+_compaction_guard = threading.Lock()
 
 
 def normalize_assistant_id(assistant_id) -> int:
@@ -117,15 +138,31 @@ def faiss_disk_lock(assistant_id: int):
             yield
 
 
-def _vector_store_paths(assistant_id: int) -> tuple[str, str]:
+def _vector_store_prefix(assistant_id: int) -> str:
     aid = normalize_assistant_id(assistant_id)
-    base = f"./vector_stores/assistant_{aid}"
+    return f"./vector_stores/assistant_{aid}"
+
+
+def _vector_store_paths(assistant_id: int) -> tuple[str, str]:
+    base = _vector_store_prefix(assistant_id)
     return f"{base}.index", f"{base}_metadata.pkl"
 
 
+def _chunk_store_path(assistant_id: int) -> str:
+    aid = normalize_assistant_id(assistant_id)
+    return f"./vector_stores/assistant_{aid}_chunks.bin"
+
+
+def _bm25_index_path(assistant_id: int) -> str:
+    aid = normalize_assistant_id(assistant_id)
+    return f"./vector_stores/assistant_{aid}_bm25.pkl"
+
+
 def disk_vector_store_exists(assistant_id) -> bool:
     index_path, metadata_path = _vector_store_paths(assistant_id)
-    return os.path.exists(index_path) and os.path.exists(metadata_path)
+    return os.path.exists(index_path) and (
+        os.path.exists(_chunk_store_path(assistant_id)) or os.path.exists(metadata_path)
+    )
 
 
 def invalidate_vector_store_cache(assistant_id) -> None:
@@ -135,31 +172,127 @@ def invalidate_vector_store_cache(assistant_id) -> None:
     vector_store.pop(str(aid), None)
 
 
+def get_knowledge_generation(assistant_id) -> int:
+    aid = normalize_assistant_id(assistant_id)
+    _sync_disk_generation(aid)
+    return knowledge_generations.get(aid, 0)
+
+
+def _disk_generation(aid: int) -> str | None:
+    from services import vector_segments
+
+    return vector_segments.read_generation(_vector_store_prefix(aid))
+
+
+def _sync_disk_generation(aid: int) -> bool:
+    """
+    跨 worker 失效：磁碟版本 token 與本 worker 上次看到的不同（其他 worker 已寫入）時，
+    本地版本號 +1（回覆快取失效）；回傳是否有變動。每次查詢呼叫，成本為讀取一個小檔；
+    會做檔案 I/O，async 呼叫端需經 asyncio.to_thread（見 llm_service._load_turn_state）。
+    """
+    token = _disk_generation(aid)
+    changed = aid in _seen_disk_generations and _seen_disk_generations[aid] != token
+    _seen_disk_generations[aid] = token
+    if changed:
+        bump_knowledge_generation(aid)
+    return changed
+
+
+def _snapshot_is_current(aid: int, vs) -> bool:
+    """快照是否對應磁碟上的最新內容（載入 / 發布時記錄的 token 與磁碟相同）。"""
+    return getattr(vs, "_disk_generation", None) == _disk_generation(aid)
+
+
+def _commit_disk_generation(aid: int, vs=None, token: str | None = None) -> None:
+    """寫入完成（呼叫端持有 faiss_disk_lock）：換新磁碟版本 token，其他 worker 下次查詢時重新載入。"""
+    from services import vector_segments
+
+    token = vector_segments.write_generation(_vector_store_prefix(aid), token)
+    _seen_disk_generations[aid] = token
+    if vs is not None:
+        vs._disk_generation = token
+
+
+def bump_knowledge_generation(assistant_id) -> int:
+    """知識庫內容已變動：版本號 +1，並清除該助理的回覆快取。"""
+    aid = normalize_assistant_id(assistant_id)
+    generation = knowledge_generations.get(aid, 0) + 1
+    knowledge_generations[aid] = generation
+    from services.answer_cache import answer_cache
+
+    answer_cache.invalidate(aid)
+    return generation
+
+
 def set_vector_store_cache(assistant_id, store) -> None:
-    """寫入快取前清除同助理的 int/str 雙 key 殘留。"""
+    """寫入快取前清除同助理的 int/str 雙 key 殘留（BM25 索引掛在快照上，隨快照替換）。"""
     aid = normalize_assistant_id(assistant_id)
-    invalidate_vector_store_cache(aid)
-    if store is not None:
-        vector_store[aid] = store
+    if store is None:
+        invalidate_vector_store_cache(aid)
+        return
+    vector_store.pop(str(aid), None)
+    vector_store[aid] = store
 
 
 def clear_vector_store_files(assistant_id) -> None:
     """刪除磁碟上的 FAISS 索引（例如助理刪除後 ID 重用、或 DB 與磁碟不一致）。"""
     aid = normalize_assistant_id(assistant_id)
-    index_path, metadata_path = _vector_store_paths(aid)
     invalidate_vector_store_cache(aid)
+    bump_knowledge_generation(aid)
     with faiss_disk_lock(aid):
-        for path in (index_path, metadata_path):
-            if os.path.isfile(path):
-                try:
-                    os.remove(path)
-                    logger.info("[向量庫] 已刪除殘留檔案 path=%s", path)
-                except OSError as e:
-                    logger.warning("[向量庫] 刪除檔案失敗 path=%s error=%s", path, e)
+        _remove_vector_store_files(aid)
+
+
+def _remove_vector_store_files(aid: int) -> None:
+    """呼叫端需持有 faiss_disk_lock（FileLock 不可在同一執行緒重入）。"""
+    from services import vector_segments
+
+    index_path, metadata_path = _vector_store_paths(aid)
+    prefix = _vector_store_prefix(aid)
+    vector_segments.remove_segments(prefix)
+    for path in (
+        index_path, metadata_path, _chunk_store_path(aid), _bm25_index_path(aid),
+        vector_segments.manifest_path(prefix), vector_segments.base_vectors_path(prefix),
+    ):
+        if os.path.isfile(path):
+            try:
+                os.remove(path)
+                logger.info("[向量庫] 已刪除殘留檔案 path=%s", path)
+            except OSError as e:
+                logger.warning("[向量庫] 刪除檔案失敗 path=%s error=%s", path, e)
+    # 版本檔保留並換新 token：其他 worker 的快取因此失效，之後重建的向量庫也不會與舊 token 相同
+    _commit_disk_generation(aid)
 
 # 預熱 SentenceTransformer / BGE Embeddings（避免第一次 RAG 卡住造成連帶的 TTS 504）
 BGE_EMBEDDINGS_MODEL_NAME = "BAAI/bge-base-zh-v1.5"
 _bge_embeddings = None
+_bge_embeddings_lock = threading.Lock()
+
+
+def _get_bge_embeddings():
+    """
+    全域共用的 BGE embeddings；首次呼叫時載入模型，之後所有助理的向量庫共用同一實例。
+    包裝順序：查詢向量 LRU 快取（services.query_embedding_cache）→ 微批次（services.embedding_batcher）→ 模型。
+    """
+    global _bge_embeddings
+    from services.embedding_batcher import build_batching_embeddings, embedding_batching_enabled
+    from services.query_embedding_cache import CachedQueryEmbeddings, build_query_embedding_cache
+
+    embeddings = _bge_embeddings
+    if isinstance(embeddings, CachedQueryEmbeddings):
+        return embeddings
+    with _bge_embeddings_lock:
+        if _bge_embeddings is None:
+            logger.info("[BGE] Loading HuggingFaceEmbeddings: %s", BGE_EMBEDDINGS_MODEL_NAME)
+            _bge_embeddings = HuggingFaceEmbeddings(model_name=BGE_EMBEDDINGS_MODEL_NAME)
+        if not isinstance(_bge_embeddings, CachedQueryEmbeddings):
+            base = _bge_embeddings
+            if embedding_batching_enabled():
+                base = build_batching_embeddings(base)
+            _bge_embeddings = CachedQueryEmbeddings(
+                base, build_query_embedding_cache(BGE_EMBEDDINGS_MODEL_NAME)
+            )
+        return _bge_embeddings
 
 
 def prewarm_bge_embeddings():
@@ -167,16 +300,24 @@ def prewarm_bge_embeddings():
     在 server 啟動後（於背景執行緒）預載入 bge-base-zh-v1.5 embeddings，
     使第一次用戶請求不會被 SentenceTransformer 下載/初始化卡住。
     """
-    global _bge_embeddings
-    if _bge_embeddings is not None:
-        return _bge_embeddings
-    logger.info("[Prewarm][BGE] Loading HuggingFaceEmbeddings: %s", BGE_EMBEDDINGS_MODEL_NAME)
-    embeddings = HuggingFaceEmbeddings(model_name=BGE_EMBEDDINGS_MODEL_NAME)
-    # embed_query 會觸發 model/weights 的實際載入與 warmup
-    _ = embeddings.embed_query("預熱")
-    _bge_embeddings = embeddings
+    logger.info("[Prewarm][BGE] Loading embeddings: %s", BGE_EMBEDDINGS_MODEL_NAME)
+    embeddings = _get_bge_embeddings()
+    # 直接呼叫底層模型：embed_query 會觸發 model/weights 的實際載入與 warmup（不經快取）
+    _ = embeddings.base.embed_query("預熱")
     logger.info("[Prewarm][BGE] Embeddings ready.")
-    return _bge_embeddings
+    return embeddings
+
+
+def save_query_embedding_cache() -> None:
+    """有設定 QUERY_EMBEDDING_CACHE_PATH 時將查詢向量快取寫入磁碟（應用程式關閉時呼叫）。"""
+    from services.query_embedding_cache import CachedQueryEmbeddings, query_embedding_cache_path
+
+    path = query_embedding_cache_path()
+    embeddings = _bge_embeddings
+    if not path or not isinstance(embeddings, CachedQueryEmbeddings) or not embeddings.cache.enabled:
+        return
+    count = embeddings.cache.save(path)
+    logger.info("[查詢向量快取] 已寫入 %d 筆 path=%s", count, path)
 
 # 載入預訓練的摘要產生模型（明確指定 model，避免 transformers 啟動警告）
 summarizer = pipeline(
@@ -201,11 +342,12 @@ def process_documents_with_id(documents):
     return documents
 
 
-def generate_summary_and_keywords(text, max_summary_words=150, max_keywords=10):
+def _summary_messages(text, max_summary_words=150):
     """
-    Generate summary and keywords with AGGRESSIVE truncation (First 500 chars).
+    Build the summary prompt with AGGRESSIVE truncation (First 500 chars).
     """
-    
+    from langchain_core.messages import SystemMessage, HumanMessage
+
     # 1. 語言設定
     LANGUAGE_MAP = {
         "en": "English",
@@ -249,62 +391,95 @@ def generate_summary_and_keywords(text, max_summary_words=150, max_keywords=10):
         f"Please output valid JSON only. "
         f"Example: {{\"summary\": \"摘要內容...\", \"keywords\": [\"k1\", \"k2\"]}}"
     )
+    return [
+        SystemMessage(content=system_instruction),
+        HumanMessage(content=user_prompt)
+    ]
+
+
+def _parse_summary_response(result_text, max_summary_words=150):
+    """解析 LLM 輸出的 JSON（失敗時以 regex 擷取），回傳 (summary, keywords_line)。"""
+    logger.info(f"LLM Raw Output (len={len(result_text)}): {result_text[:100]}...")
+
+    summary = ""
+    keywords_line = ""
+
+    try:
+        clean_json = result_text.replace("```json", "").replace("```", "").strip()
+        data = json.loads(clean_json)
+        
+        summary = data.get("summary", "")
+        keywords = data.get("keywords", [])
+        
+        if isinstance(keywords, list):
+            keywords_line = ", ".join([str(k) for k in keywords])
+        else:
+            keywords_line = str(keywords)
+
+    except json.JSONDecodeError:
+        logger.warning("JSON parsing failed, attempting regex fallback.")
+        sum_match = re.search(r'"summary"\s*:\s*"(.*?)"', result_text, re.DOTALL)
+        key_match = re.search(r'"keywords"\s*:\s*\[(.*?)\]', result_text, re.DOTALL)
+        
+        if sum_match:
+            summary = sum_match.group(1)
+        if key_match:
+            keywords_line = key_match.group(1).replace('"', '').replace("'", "")
+        
+        if not summary:
+             summary = result_text[:max_summary_words]
+
+    return summary.strip(), keywords_line.strip()
 
+
+def generate_summaries_and_keywords(texts, max_summary_words=150):
+    """
+    批次產生摘要與關鍵字：以 llm.batch 同時送出（vLLM 於伺服器端合併成同一批推論）。
+    回傳與 texts 等長的 list；單筆失敗為 None。
+    """
+    if not texts:
+        return []
     # 4. 初始化 LLM (啟用 JSON 模式)
     runtime_model = VLLM_SUMMARY_MODEL or VLLM_MODEL or "gpt-oss:20b"
-    llm = ChatOpenAI(
-        openai_api_key=VLLM_API_KEY,
+    from services.llm_client_pool import get_chat_model
+
+    llm = get_chat_model(
         base_url=VLLM_BASE_URL,
+        api_key=VLLM_API_KEY,
         model=runtime_model,
         temperature=0.1,
-        model_kwargs={},
     )
-    
-    try:
-        from langchain_core.messages import SystemMessage, HumanMessage
-        
-        response = llm.invoke([
-            SystemMessage(content=system_instruction),
-            HumanMessage(content=user_prompt)
-        ])
-        
-        result_text = response.content.strip()
-        logger.info(f"LLM Raw Output (len={len(result_text)}): {result_text[:100]}...")
-        
-        # 5. 解析 JSON
-        summary = ""
-        keywords_line = ""
-
-        try:
-            clean_json = result_text.replace("```json", "").replace("```", "").strip()
-            data = json.loads(clean_json)
-            
-            summary = data.get("summary", "")
-            keywords = data.get("keywords", [])
-            
-            if isinstance(keywords, list):
-                keywords_line = ", ".join([str(k) for k in keywords])
-            else:
-                keywords_line = str(keywords)
-
-        except json.JSONDecodeError:
-            logger.warning("JSON parsing failed, attempting regex fallback.")
-            sum_match = re.search(r'"summary"\s*:\s*"(.*?)"', result_text, re.DOTALL)
-            key_match = re.search(r'"keywords"\s*:\s*\[(.*?)\]', result_text, re.DOTALL)
-            
-            if sum_match:
-                summary = sum_match.group(1)
-            if key_match:
-                keywords_line = key_match.group(1).replace('"', '').replace("'", "")
-            
-            if not summary:
-                 summary = result_text[:max_summary_words]
-
-        return summary.strip(), keywords_line.strip()
 
+    try:
+        prompts = [_summary_messages(text, max_summary_words) for text in texts]
+        responses = llm.batch(prompts, config={"max_concurrency": len(prompts)}, return_exceptions=True)
     except Exception as e:
         logger.error(f"Error generating summary: {e}")
+        return [None] * len(texts)
+
+    results = []
+    for response in responses:
+        if isinstance(response, Exception):
+            logger.error(f"Error generating summary: {response}")
+            results.append(None)
+            continue
+        try:
+            # 5. 解析 JSON
+            results.append(_parse_summary_response(response.content.strip(), max_summary_words))
+        except Exception as e:
+            logger.error(f"Error generating summary: {e}")
+            results.append(None)
+    return results
+
+
+def generate_summary_and_keywords(text, max_summary_words=150, max_keywords=10):
+    """
+    Generate summary and keywords with AGGRESSIVE truncation (First 500 chars).
+    """
+    result = generate_summaries_and_keywords([text], max_summary_words)[0]
+    if result is None:
         return "Summary generation unavailable", ""
+    return result
 
 # 計算文件的 token 數量
 def calculate_token_count(documents):
@@ -317,59 +492,818 @@ def calculate_token_count(documents):
 
 # 用於儲存向量資料庫
 def _write_vector_store_to_disk(assistant_id: int, faiss_store) -> None:
+    """
+    全量寫入 FAISS index 與 mmap chunk 檔（同時為增量區段的合併）；寫完後記憶體中的 docstore
+    改為映射新檔（文字不再常駐），既有增量區段與墓碑一併清除。
+    量化索引另寫入依位置排列的原始向量檔，供查詢重新排序與之後的重建。
+    """
+    from services import faiss_index, vector_segments
+    from services.chunk_store import MmapDocstore, ordered_documents, write_chunk_store
+
     aid = normalize_assistant_id(assistant_id)
     save_path, metadata_path = _vector_store_paths(aid)
+    chunk_path = _chunk_store_path(aid)
+    prefix = _vector_store_prefix(aid)
     if not os.path.exists("./vector_stores"):
         os.makedirs("./vector_stores")
-    faiss.write_index(faiss_store.index, save_path)
-    with open(metadata_path, "wb") as f:
-        metadata = {
-            "docstore": faiss_store.docstore,
-            "index_to_docstore_id": faiss_store.index_to_docstore_id,
-        }
-        pickle.dump(metadata, f)
+    # 全量寫入時依 chunk 數 / 設定切換索引類型（Flat ↔ IVF / HNSW）與量化模式，位置與 index_to_docstore_id 不變
+    ntotal = faiss_store.index.ntotal
+    current = (faiss_index.index_kind(faiss_store.index), faiss_index.index_quantization(faiss_store.index))
+    desired = (
+        faiss_index.desired_index_kind(aid, ntotal, current[0]),
+        faiss_index.desired_quantization(aid, ntotal, current[1]),
+    )
+    vectors = None
+    if desired[1] != "none" or desired != current:
+        vectors = _exact_index_vectors(faiss_store)
+    if desired != current:
+        t_rebuild = time.perf_counter()
+        faiss_store.index = faiss_index.ensure_index_kind(faiss_store.index, *desired, vectors=vectors)
+        logger.info(
+            "[向量庫] 索引類型 %s/%s → %s/%s assistant_id=%s vectors=%d (耗時=%.3f s)",
+            *current, faiss_index.index_kind(faiss_store.index), faiss_index.index_quantization(faiss_store.index),
+            aid, ntotal, time.perf_counter() - t_rebuild,
+        )
+    # 主檔涵蓋到目前最後一個增量區段；header 記錄 base_seq，合併中途當機時重播不會重複加入
+    base_seq = vector_segments.read_manifest(prefix).last_seq
+    base_id = uuid.uuid4().hex
+    # 查詢端不持鎖讀取：各檔皆以 .tmp + os.replace 依 chunk → 原始向量 → index → manifest 的順序替換
+    # （讀取端依相反順序開啟，見 _read_committed_vector_store），舊的增量區段於 manifest 提交後才刪除
+    write_chunk_store(
+        chunk_path,
+        ordered_documents(faiss_store.docstore, faiss_store.index_to_docstore_id),
+        header={"base_seq": base_seq, "base_id": base_id},
+    )
+    vectors_path = vector_segments.base_vectors_path(prefix)
+    keep_vectors = faiss_index.index_quantization(faiss_store.index) != "none" and vectors is not None
+    if keep_vectors:
+        vector_segments.write_vectors(vectors_path, vectors)
+    del vectors
+    tmp_path = f"{save_path}.{os.getpid()}.tmp"
+    faiss.write_index(faiss_index.writable_index(faiss_store.index), tmp_path)
+    os.replace(tmp_path, save_path)
+    vector_segments.write_manifest(
+        prefix,
+        vector_segments.SegmentManifest(base_seq=base_seq, last_seq=base_seq, base_id=base_id, tombstone_bytes=0),
+    )
+    if isinstance(faiss_store.docstore, MmapDocstore):
+        faiss_store.docstore.reload(chunk_path, vectors_path if keep_vectors else None)
+    else:
+        faiss_store.docstore = MmapDocstore.open(chunk_path, vectors_path if keep_vectors else None)
+    _attach_reranking(faiss_store)
+    _attach_shared_index(aid, faiss_store)
+    vector_segments.remove_segments(prefix)
+    if not keep_vectors and os.path.exists(vectors_path):
+        os.remove(vectors_path)
+    if os.path.exists(metadata_path):
+        # 舊版 pickle docstore 已由 chunk 檔取代
+        os.remove(metadata_path)
+
+
+def _attach_reranking(vs) -> None:
+    """量化索引包上重新排序：候選 label → doc_id → docstore 掛載的原始向量（mmap）。"""
+    from services import faiss_index
+
+    def _lookup(labels):
+        raw_vectors = getattr(vs.docstore, "raw_vectors", None)
+        if raw_vectors is None:
+            return None
+        vectors = raw_vectors([vs.index_to_docstore_id.get(int(label)) for label in labels])
+        if vectors is not None and getattr(vs, "_normalize_L2", False):
+            faiss.normalize_L2(vectors)
+        return vectors
+
+    vs.index = faiss_index.with_reranking(vs.index, _lookup)
+
+
+def _attach_shared_index(aid: int, vs) -> None:
+    """VECTOR_SHARED_INDEX：小型 Flat 助理的向量移入共用分片；超過上限或類型改變時移回獨立索引。"""
+    from services import faiss_index
+    from services.shared_vector_index import (
+        is_shared_view,
+        shared_index_enabled,
+        shared_index_pool,
+        shared_max_vectors,
+    )
+
+    index = vs.index
+    eligible = (
+        shared_index_enabled()
+        and faiss_index.index_kind(index) == "flat"
+        and faiss_index.index_quantization(index) == "none"
+        and index.ntotal <= shared_max_vectors()
+    )
+    if is_shared_view(index):
+        if not eligible:
+            vs.index = index.materialize()
+            logger.info("[向量庫] 移出共用向量池 assistant_id=%s vectors=%d", aid, vs.index.ntotal)
+        return
+    if eligible:
+        vs.index = shared_index_pool.adopt(aid, index)
+
+
+def _copy_for_write(vs):
+    """
+    copy-on-write：寫入路徑修改的是目前快照的複本，持久化完成後才以 _publish_vector_store 整體替換快取。
+    已發布的快照（index / docstore / index_to_docstore_id）不再變動，查詢不需等待任何鎖；
+    進行中的查詢繼續使用舊快照，直到結束後由 GC 回收。
+    索引為完整複本（寫入期間該助理的向量記憶體暫時加倍）；MmapDocstore 共用唯讀的 mmap 檔，只複製覆蓋層。
+    """
+    from langchain_community.docstore.in_memory import InMemoryDocstore  # pyright: ignore[reportMissingImports]
+    from services import faiss_index
+    from services.chunk_store import MmapDocstore
+
+    draft = copy.copy(vs)
+    draft.index = faiss_index.clone_index(vs.index)
+    if isinstance(vs.docstore, MmapDocstore):
+        draft.docstore = vs.docstore.copy()
+    else:
+        draft.docstore = InMemoryDocstore(dict(vs.docstore._dict))
+    draft.index_to_docstore_id = dict(vs.index_to_docstore_id)
+    # BM25 同樣寫在複本上；尚未載入時由 _apply_bm25_changes 自磁碟取得
+    bm25 = getattr(vs, "_bm25_index", None)
+    draft._bm25_index = bm25.copy() if bm25 is not None else None
+    # 重新排序的 lookup 需對應草稿自己的 docstore / 位置表
+    _attach_reranking(draft)
+    return draft
+
+
+def _publish_vector_store(aid: int, vs) -> None:
+    """
+    發布寫入完成的快照（單一參照替換，向量與其 BM25 索引一起生效）；呼叫端持有 faiss_disk_lock，且向量已寫入磁碟。
+    先以新版本 token 標記並寫入 BM25，再換新磁碟版本 token 通知其他 worker；
+    小型助理放回共用向量池，舊快照的區段於回收後釋放。
+    """
+    from services import vector_segments
+
+    token = vector_segments.new_generation_token()
+    bm25 = getattr(vs, "_bm25_index", None)
+    if bm25 is not None:
+        bm25.generation = token
+        bm25.save(_bm25_index_path(aid))
+    _commit_disk_generation(aid, vs, token)
+    _attach_shared_index(aid, vs)
+    set_vector_store_cache(aid, vs)
+
+
+def _latest_snapshot_for_write(aid: int, vs):
+    """
+    呼叫端持有 faiss_disk_lock：傳入的快照落後於磁碟（其他 worker 已寫入）時改以磁碟內容為準，
+    避免以舊快照寫回而覆蓋其他 worker 的變更；磁碟上已無向量庫時回傳 None。
+    """
+    if not disk_vector_store_exists(aid):
+        return None
+    _ensure_segment_manifest(aid)
+    if vs is not None and _snapshot_is_current(aid, vs):
+        return vs
+    logger.info("[向量庫] 快照落後於磁碟（其他 worker 已寫入），寫入前重新載入 assistant_id=%s", aid)
+    return _read_vector_store_from_disk(aid)
+
+
+def _doc_ids_with_metadata(vs, key: str, value) -> list[str]:
+    """向量庫中 metadata[key] == value 的 doc_id；mmap chunk 檔直接比對欄式 metadata，不解碼文字。"""
+    docstore = vs.docstore
+    if hasattr(docstore, "ids_with_metadata"):
+        return docstore.ids_with_metadata(key, value)
+    return [doc_id for doc_id, doc in docstore._dict.items() if (doc.metadata or {}).get(key) == value]
+
+
+def _exact_index_vectors(vs) -> np.ndarray:
+    """依 index 位置取出精確向量：量化索引優先使用原始向量檔，缺少的列才以解碼近似值補上。"""
+    from services import faiss_index
+
+    if faiss_index.index_quantization(vs.index) == "none":
+        return faiss_index.extract_vectors(vs.index)
+    raw_vector = getattr(vs.docstore, "raw_vector", None)
+    n = int(vs.index.ntotal)
+    rows = [raw_vector(vs.index_to_docstore_id.get(pos)) if raw_vector else None for pos in range(n)]
+    missing = sum(1 for row in rows if row is None)
+    approx = faiss_index.extract_vectors(vs.index) if missing else None
+    if missing:
+        logger.warning("[向量庫] %d / %d 筆缺少原始向量，改用量化解碼值", missing, n)
+    if n == 0:
+        return np.empty((0, vs.index.d), dtype=np.float32)
+    vectors = np.stack([row if row is not None else approx[pos] for pos, row in enumerate(rows)]).astype(np.float32)
+    if getattr(vs, "_normalize_L2", False):
+        faiss.normalize_L2(vectors)
+    return vectors
+
+
+def _add_documents_with_vectors(vs, documents, embeddings, doc_ids: list[str], vectors=None):
+    """同 vs.add_documents（vectors 已算好時不再 embedding），回傳原始向量（float32）供增量區段寫入。"""
+    texts = [doc.page_content for doc in documents]
+    if vectors is None:
+        vectors = embeddings.embed_documents(texts)
+    elif isinstance(vectors, np.ndarray):
+        vectors = vectors.tolist()
+    vs.add_embeddings(
+        list(zip(texts, vectors)),
+        metadatas=[doc.metadata for doc in documents],
+        ids=doc_ids,
+    )
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def _persist_vector_store_changes(
+    assistant_id: int,
+    vs,
+    *,
+    added_ids=(),
+    added_vectors=None,
+    removed_ids=(),
+) -> None:
+    """
+    將一次新增 / 刪除寫入磁碟；呼叫方需已持有 faiss_disk_lock。
+    有主檔時只追加增量區段與墓碑（寫入量與變動大小成正比），否則退回全量寫入。
+    """
+    from services import vector_segments
+
+    aid = normalize_assistant_id(assistant_id)
+    if not _can_write_incrementally(aid, vs) or (added_ids and added_vectors is None):
+        _write_vector_store_to_disk(aid, vs)
+        return
+
+    t_write = time.perf_counter()
+    prefix = _vector_store_prefix(aid)
+    manifest = vector_segments.read_manifest(prefix)
+    after_seq = manifest.last_seq
+    if added_ids:
+        _write_delta_batch(prefix, manifest, vs, added_ids, added_vectors)
+    _commit_segments(aid, vs, manifest, removed_ids=removed_ids, after_seq=after_seq)
+    logger.info(
+        "[向量庫] 增量寫入 assistant_id=%s added=%d removed=%d deltas=%d tombstones=%d (耗時=%.3f s)",
+        aid, len(added_ids), len(removed_ids), manifest.delta_count, manifest.tombstones,
+        time.perf_counter() - t_write,
+    )
+
+
+def _can_write_incrementally(aid: int, vs) -> bool:
+    """已有主檔且 docstore 為 mmap chunk 檔時可只追加增量區段；否則需全量寫入。"""
+    from services.chunk_store import MmapDocstore
+
+    index_path, _ = _vector_store_paths(aid)
+    return (
+        VECTOR_STORE_INCREMENTAL
+        and isinstance(getattr(vs, "docstore", None), MmapDocstore)
+        and os.path.exists(index_path)
+        and os.path.exists(_chunk_store_path(aid))
+    )
+
+
+def _write_delta_batch(prefix: str, manifest, vs, added_ids, added_vectors) -> None:
+    """
+    寫入一個增量區段並掛載到 docstore（覆蓋層的 chunk 改由 mmap 提供，文字不再常駐）。
+    manifest.last_seq 只在記憶體前進；尚未由 _commit_segments 提交前，重播會略過此區段。
+    """
+    from services import vector_segments
+
+    seq = manifest.last_seq + 1
+    items = [(doc_id, vs.docstore.search(doc_id)) for doc_id in added_ids]
+    vectors_path, chunks_path = vector_segments.write_delta(prefix, seq, added_vectors, items)
+    manifest.last_seq = seq
+    vs.docstore.attach(chunks_path, vectors_path)
+
+
+def _commit_segments(aid: int, vs, manifest, *, removed_ids=(), after_seq: int = 0) -> None:
+    """追加墓碑（刪除發生在 after_seq 之後、本次新增之前）並寫入 manifest 提交；累積過多時排程背景合併。"""
+    from services import vector_segments
+
+    prefix = _vector_store_prefix(aid)
+    if removed_ids:
+        vector_segments.append_tombstones(prefix, after_seq, list(removed_ids))
+        manifest.tombstones += len(removed_ids)
+        manifest.tombstone_bytes = vector_segments.tombstone_size(prefix)
+    # manifest 為提交點：重播只採用 seq <= last_seq 的增量區段與 tombstone_bytes 以內的墓碑
+    vector_segments.write_manifest(prefix, manifest)
+    ntotal = max(1, int(vs.index.ntotal))
+    if (
+        manifest.delta_count >= VECTOR_COMPACT_MAX_DELTAS
+        or manifest.tombstones > VECTOR_COMPACT_TOMBSTONE_RATIO * ntotal
+    ):
+        _schedule_vector_store_compaction(aid)
+
+
+def compact_vector_store(assistant_id, *, force: bool = False) -> bool:
+    """
+    將增量區段與墓碑合併回主檔；以磁碟內容為準重新載入，完成後替換記憶體快取。
+    force=True 時即使沒有增量區段也全量重寫（套用新的索引類型設定）。
+    """
+    from services import vector_segments
+
+    aid = normalize_assistant_id(assistant_id)
+    with faiss_disk_lock(aid):
+        if not disk_vector_store_exists(aid):
+            return False
+        _ensure_segment_manifest(aid)
+        manifest = vector_segments.read_manifest(_vector_store_prefix(aid))
+        if not force and manifest.delta_count == 0 and manifest.tombstones == 0:
+            return False
+        t_compact = time.perf_counter()
+        fresh = _read_vector_store_from_disk(aid)
+        _write_vector_store_to_disk(aid, fresh)
+        cached = vector_store.get(aid)
+        if cached is not None:
+            # 合併不改變內容，磁碟版本 token 不變，其他 worker 不需重新載入；已發布的 BM25 不會再變動，可直接沿用
+            if _snapshot_is_current(aid, cached):
+                fresh._bm25_index = getattr(cached, "_bm25_index", None)
+            set_vector_store_cache(aid, fresh)
+    logger.info(
+        "[向量庫] 合併完成 assistant_id=%s deltas=%d tombstones=%d vectors=%d (耗時=%.3f s)",
+        aid, manifest.delta_count, manifest.tombstones, fresh.index.ntotal, time.perf_counter() - t_compact,
+    )
+    return True
+
+
+def _schedule_vector_store_compaction(aid: int) -> None:
+    with _compaction_guard:
+        if aid in _compaction_pending:
+            return
+        _compaction_pending.add(aid)
+
+    def _run() -> None:
+        try:
+            compact_vector_store(aid)
+        except Exception as e:
+            logger.warning("[向量庫] 背景合併失敗 assistant_id=%s error=%s", aid, e)
+        finally:
+            with _compaction_guard:
+                _compaction_pending.discard(aid)
+
+    threading.Thread(target=_run, name=f"faiss-compact-{aid}", daemon=True).start()
+
+
+def vector_store_quantization_report(
+    assistant_id, quantization: str | None = None, *, k: int = 5, queries: int = 200
+):
+    """
+    以此助理的原始向量試算量化模式（預設為目前設定的模式）：向量記憶體節省量與 recall@k 損失。
+    只在記憶體中建立試算索引，不變更磁碟上的索引；無向量庫時回傳 None。
+    """
+    from services import faiss_index
+
+    aid = normalize_assistant_id(assistant_id)
+    vs = get_vector_store(aid)
+    if vs is None:
+        return None
+    with faiss_disk_lock(aid):
+        vectors = _exact_index_vectors(vs)
+        kind = faiss_index.index_kind(vs.index)
+        current = faiss_index.index_quantization(vs.index)
+        current_bytes = len(vectors) * faiss_index.vector_code_size(vs.index)
+    mode = quantization or faiss_index.desired_quantization(aid, len(vectors), current)
+    report = faiss_index.quantization_report(vectors, kind, mode, k=k, queries=queries)
+    report.update(assistant_id=aid, current_quantization=current, current_vector_bytes=current_bytes)
+    return report
 
 
 def save_vector_store(assistant_id: int, faiss_store):
     aid = normalize_assistant_id(assistant_id)
     with faiss_disk_lock(aid):
         _write_vector_store_to_disk(aid, faiss_store)
+        _commit_disk_generation(aid, faiss_store)
+
+
+def _ensure_segment_manifest(aid: int) -> None:
+    """
+    呼叫端持有 faiss_disk_lock：舊版向量庫（無 segments.json，或 manifest 沒有 base_id）升級為目前的提交格式。
+    舊版 metadata.pkl 先轉為 chunk 檔；沒有 manifest 時磁碟上的增量區段與墓碑都是未提交的（失敗的上傳留下），直接刪除；
+    主檔 header 補上 base_id 後寫入 manifest，之後查詢端才會不持鎖讀取（見 _read_committed_vector_store）。
+    """
+    from services import vector_segments
+    from services.chunk_store import migrate_pickle_metadata, update_chunk_store_header
+
+    prefix = _vector_store_prefix(aid)
+    manifest = vector_segments.read_manifest(prefix)
+    if manifest.base_id is not None:
+        return
+    _, metadata_path = _vector_store_paths(aid)
+    chunk_path = _chunk_store_path(aid)
+    if not os.path.exists(chunk_path) and not os.path.exists(metadata_path):
+        return
+    t_stamp = time.perf_counter()
+    if os.path.exists(vector_segments.manifest_path(prefix)):
+        stale = vector_segments.remove_deltas_after(prefix, manifest.last_seq)
+    else:
+        stale = len([path for path in vector_segments.segment_files(prefix) if os.path.exists(path)])
+        vector_segments.remove_segments(prefix)
+    base_id = uuid.uuid4().hex
+    if os.path.exists(chunk_path):
+        update_chunk_store_header(chunk_path, {"base_id": base_id})
+    else:
+        count = migrate_pickle_metadata(
+            metadata_path, chunk_path, remove_pickle=True, header={"base_seq": manifest.base_seq, "base_id": base_id}
+        )
+        logger.info("[向量庫] 舊版 pickle docstore 已轉為 chunk 檔 assistant_id=%s chunks=%d", aid, count)
+    manifest.base_id = base_id
+    if manifest.tombstone_bytes is None:
+        manifest.tombstone_bytes = vector_segments.tombstone_size(prefix)
+    vector_segments.write_manifest(prefix, manifest)
+    logger.info(
+        "[向量庫] 舊版向量庫已寫入初始 manifest assistant_id=%s last_seq=%d 清除未提交檔案=%d (耗時=%.3f s)",
+        aid, manifest.last_seq, stale, time.perf_counter() - t_stamp,
+    )
 
 
-def _read_vector_store_from_disk(assistant_id: int):
+def _read_vector_store_from_disk(assistant_id: int, manifest=None):
+    """
+    寫入路徑（持有 faiss_disk_lock，並已呼叫 _ensure_segment_manifest）與 _read_committed_vector_store 共用。
+    manifest 為讀取前取得的提交點，未提供時讀取目前的 manifest。
+    """
+    from services import faiss_index, vector_segments
+    from services.chunk_store import MmapDocstore, index_to_docstore_id_from
+
     aid = normalize_assistant_id(assistant_id)
-    load_path, metadata_path = _vector_store_paths(aid)
+    load_path, _ = _vector_store_paths(aid)
+    chunk_path = _chunk_store_path(aid)
+    generation = _disk_generation(aid)
     index = faiss.read_index(load_path)
-    embeddings = _bge_embeddings or HuggingFaceEmbeddings(
-        model_name=BGE_EMBEDDINGS_MODEL_NAME
-    )
-    with open(metadata_path, "rb") as f:
-        metadata = pickle.load(f)
-        docstore = metadata["docstore"]
-        index_to_docstore_id = metadata["index_to_docstore_id"]
-    return FAISS(
+    faiss_index.apply_search_params(index)
+    embeddings = _get_bge_embeddings()
+    vectors_path = None
+    if faiss_index.index_quantization(index) != "none":
+        vectors_path = vector_segments.base_vectors_path(_vector_store_prefix(aid))
+    docstore = MmapDocstore.open(chunk_path, vectors_path)
+    vs = FAISS(
         index=index,
         docstore=docstore,
-        index_to_docstore_id=index_to_docstore_id,
+        index_to_docstore_id=index_to_docstore_id_from(docstore),
         embedding_function=embeddings,
     )
+    # 先包上重新排序，重播墓碑時 HNSW 重建才能使用原始向量
+    _attach_reranking(vs)
+    _replay_vector_segments(aid, vs, manifest)
+    _attach_shared_index(aid, vs)
+    vs._disk_generation = generation
+    if len(vs.index_to_docstore_id) != vs.index.ntotal:
+        logger.warning(
+            "[向量庫] chunk 檔筆數與 FAISS index 不一致 assistant_id=%s chunks=%d vectors=%d",
+            aid, len(vs.index_to_docstore_id), vs.index.ntotal,
+        )
+    return vs
+
+
+def _apply_tombstones(vs, ids) -> None:
+    if not ids:
+        return
+    from services import faiss_index
+
+    present = set(vs.index_to_docstore_id.values())
+    to_delete = [doc_id for doc_id in ids if doc_id in present]
+    if to_delete:
+        faiss_index.delete_documents(vs, to_delete)
+
+
+def _replay_vector_segments(aid: int, vs, manifest=None) -> int:
+    """主檔之後依序套用 manifest 已提交的墓碑與增量區段；回傳套用的增量區段數。"""
+    from services import vector_segments
+
+    prefix = _vector_store_prefix(aid)
+    if manifest is None:
+        manifest = vector_segments.read_manifest(prefix)
+    base_seq = vs.docstore.base_seq
+    deltas = [d for d in vector_segments.list_deltas(prefix) if base_seq < d[0] <= manifest.last_seq]
+    tombstones = vector_segments.read_tombstones(prefix, manifest.tombstone_bytes)
+    _apply_tombstones(vs, tombstones.get(base_seq))
+    for seq, vectors_path, chunks_path in deltas:
+        vectors = vector_segments.load_delta_vectors(vectors_path)
+        if getattr(vs, "_normalize_L2", False):
+            faiss.normalize_L2(vectors)
+        start = vs.index.ntotal
+        vs.index.add(vectors)
+        ids = vs.docstore.attach(chunks_path, vectors_path)
+        vs.index_to_docstore_id.update({start + i: doc_id for i, doc_id in enumerate(ids)})
+        _apply_tombstones(vs, tombstones.get(seq))
+    if deltas or tombstones:
+        logger.info(
+            "[向量庫] 重播增量區段 assistant_id=%s base_seq=%d deltas=%d tombstone_batches=%d",
+            aid, base_seq, len(deltas), len(tombstones),
+        )
+    return len(deltas)
+
+
+def _read_committed_vector_store(aid: int):
+    """
+    不持 faiss_disk_lock 讀取最後一次提交的向量庫：進行中的上傳 / 合併不會阻塞查詢，也看不到未提交的內容。
+    讀取前後的 manifest 相同、且 chunk 檔的 base_id 與 manifest 相符，才代表讀到同一次提交的檔案，否則重讀；
+    持續寫入導致多次重讀仍不一致時改為持鎖讀取。舊版向量庫（無 manifest / base_id，含需遷移的 pickle）無法辨認
+    讀到的檔案屬於哪一次提交，一律持鎖讀取並補寫初始 manifest（見 _ensure_segment_manifest），之後即可不持鎖讀取。
+    磁碟上已無向量庫時回傳 None。
+    """
+    from services import vector_segments
+
+    prefix = _vector_store_prefix(aid)
+    if os.path.exists(_chunk_store_path(aid)):
+        for attempt in range(1, _COMMITTED_READ_ATTEMPTS + 1):
+            manifest = vector_segments.read_manifest(prefix)
+            if manifest.base_id is None:
+                logger.info("[向量庫] 舊版向量庫尚無提交紀錄，改為持鎖載入 assistant_id=%s", aid)
+                break
+            try:
+                vs = _read_vector_store_from_disk(aid, manifest)
+            except (OSError, RuntimeError, ValueError) as e:
+                # 讀取期間檔案被替換 / 刪除（faiss 讀檔失敗為 RuntimeError）
+                if not disk_vector_store_exists(aid):
+                    return None
+                logger.info("[向量庫] 讀取時檔案已變動，重新讀取 assistant_id=%s attempt=%d error=%s", aid, attempt, e)
+                continue
+            if vs.docstore.base_id == manifest.base_id and vector_segments.read_manifest(prefix) == manifest:
+                return vs
+            logger.info("[向量庫] 讀取期間有新的提交，重新讀取 assistant_id=%s attempt=%d", aid, attempt)
+    with faiss_disk_lock(aid):
+        if not disk_vector_store_exists(aid):
+            return None
+        _ensure_segment_manifest(aid)
+        return _read_vector_store_from_disk(aid)
+
+
+def _get_load_lock(aid: int) -> threading.Lock:
+    with _faiss_thread_locks_guard:
+        lock = _load_locks.get(aid)
+        if lock is None:
+            lock = threading.Lock()
+            _load_locks[aid] = lock
+        return lock
 
 
 def load_vector_store(assistant_id: int):
     aid = normalize_assistant_id(assistant_id)
-    load_path, metadata_path = _vector_store_paths(aid)
+    if disk_vector_store_exists(aid):
+        # 只讀已提交的檔案、不持寫入鎖；同一 worker 內同一助理同時只由一個執行緒載入
+        with _get_load_lock(aid):
+            # 等待期間可能已由其他執行緒載入（或重新載入），避免同一助理重複讀檔
+            cached = vector_store.get(aid)
+            if cached is not None and _snapshot_is_current(aid, cached):
+                return cached
+            if cached is not None:
+                _sync_disk_generation(aid)
+                logger.info("[向量庫] 磁碟版本已由其他 worker 更新，重新載入 assistant_id=%s", aid)
+            t_load = time.perf_counter()
+            loaded = _read_committed_vector_store(aid)
+            if loaded is not None:
+                vector_store[aid] = loaded
+                logger.info(
+                    "[向量庫] 自磁碟載入 assistant_id=%s vectors=%d (耗時=%.3f s)",
+                    aid, loaded.index.ntotal, time.perf_counter() - t_load,
+                )
+                return loaded
+    if vector_store.get(aid) is not None:
+        # 其他 worker 已清空此助理的向量庫
+        invalidate_vector_store_cache(aid)
+        _sync_disk_generation(aid)
+    # 傳回空的 FAISS 物件
+    return None
+    #embeddings = OpenAIEmbeddings()
+    #return FAISS.from_texts([], embeddings)  # 空的文字列表
+    #raise ValueError(f"Vector store for assistant {assistant_id} is not initialized.")
 
-    if os.path.exists(load_path) and os.path.exists(metadata_path):
-        with faiss_disk_lock(aid):
-            loaded = _read_vector_store_from_disk(aid)
-            vector_store[aid] = loaded
-            return loaded
-    else:
-        # 傳回空的 FAISS 物件
+
+def _bm25_in_sync(index, vs) -> bool:
+    ntotal = getattr(getattr(vs, "index", None), "ntotal", None)
+    return ntotal is None or len(index) == int(ntotal)
+
+
+def _read_bm25_file(aid: int, generation: str | None):
+    """讀取磁碟上的 BM25 索引；版本 token 與快照不同（屬於其他版本的向量庫）時回傳 None。舊檔沒有 token 時照用。"""
+    from services.bm25_index import BM25Index
+
+    index = BM25Index.load(_bm25_index_path(aid))
+    if index is not None and index.generation is not None and index.generation != generation:
         return None
-        #embeddings = OpenAIEmbeddings()
-        #return FAISS.from_texts([], embeddings)  # 空的文字列表
-        #raise ValueError(f"Vector store for assistant {assistant_id} is not initialized.")
+    return index
+
+
+def get_bm25_index(assistant_id, vs=None):
+    """
+    取得快照對應的 BM25 倒排索引：快照上已掛載 → 磁碟 → 由 docstore 重建（舊助理遷移）。
+    索引隨快照發布，查詢中的舊快照繼續使用舊索引；無向量庫時回傳 None。
+    """
+    from services.bm25_index import BM25Index
+
+    aid = normalize_assistant_id(assistant_id)
+    if vs is None:
+        vs = get_vector_store(aid)
+    if vs is None:
+        return None
+    index = getattr(vs, "_bm25_index", None)
+    if index is not None:
+        return index
+
+    generation = getattr(vs, "_disk_generation", None)
+    index = _read_bm25_file(aid, generation)
+    if index is None or not _bm25_in_sync(index, vs):
+        t_build = time.perf_counter()
+        index = BM25Index.from_docstore(getattr(vs, "docstore", None))
+        index.generation = generation
+        # 不持鎖：原子替換，且帶版本 token，與其他寫入競爭而覆蓋時只會讓之後的載入判定不符而重建
+        if _snapshot_is_current(aid, vs):
+            index.save(_bm25_index_path(aid))
+        logger.info(
+            "[BM25] 由 docstore 重建索引 assistant_id=%s docs=%d terms=%d (耗時=%.3f s)",
+            aid, len(index), len(index.postings), time.perf_counter() - t_build,
+        )
+    # 多個查詢同時載入時後者覆蓋前者，兩者內容相同
+    vs._bm25_index = index
+    return index
+
+
+def _apply_bm25_changes(
+    assistant_id: int,
+    vs,
+    *,
+    added_documents=None,
+    removed_ids=None,
+    reset: bool = False,
+) -> None:
+    """
+    增量維護 copy-on-write 草稿的 BM25 索引（vs._bm25_index）；呼叫方需已持有 faiss_disk_lock。
+    已發布的索引不受影響，由 _publish_vector_store 與向量一起發布並寫入磁碟。
+    reset=True 表示向量庫為全新建立，捨棄舊索引。
+    """
+    from services.bm25_index import BM25Index
+
+    aid = normalize_assistant_id(assistant_id)
+    index = None if reset else getattr(vs, "_bm25_index", None)
+    if index is None and not reset:
+        # 草稿來源快照尚未載入 BM25：磁碟檔對應同一版本時可直接作為草稿（新讀入的物件，不與他人共用）
+        index = _read_bm25_file(aid, getattr(vs, "_disk_generation", None))
+    if index is None:
+        index = BM25Index()
+
+    removed = index.remove_documents(removed_ids or [])
+    added = index.add_documents(
+        (doc.metadata["doc_id"], doc.page_content or "") for doc in (added_documents or [])
+    )
+    if not _bm25_in_sync(index, vs):
+        logger.warning("[BM25] 索引與向量庫筆數不一致，由 docstore 重建 assistant_id=%s", aid)
+        index = BM25Index.from_docstore(getattr(vs, "docstore", None))
+
+    vs._bm25_index = index
+    logger.info(
+        "[BM25] 草稿索引已更新 assistant_id=%s added=%d removed=%d total=%d",
+        aid, added, removed, len(index),
+    )
+
+
+def _write_ingested_batch(
+    aid: int, vs, batch, texts, vectors, batch_ids, embeddings, manifest, after_seq, pending_ids, pending_vectors
+):
+    """index-write 階段：把已 embedding 的一批加入草稿索引並寫成增量區段；回傳 (vs, manifest, after_seq)。"""
+    from services import vector_segments
+
+    if vs is None:
+        vs = FAISS.from_embeddings(
+            list(zip(texts, vectors.tolist())), embeddings,
+            metadatas=[doc.metadata for doc in batch], ids=batch_ids,
+        )
+        if VECTOR_STORE_INCREMENTAL:
+            # 新向量庫：主檔於發布前才寫入（之前查詢端看不到此向量庫），各批先寫成未提交的增量區段，文字改由 mmap 提供
+            from services.chunk_store import MmapDocstore
+
+            docstore = MmapDocstore()
+            docstore.add(dict(vs.docstore._dict))
+            vs.docstore = docstore
+            manifest = vector_segments.read_manifest(_vector_store_prefix(aid))
+            after_seq = manifest.last_seq
+            _write_delta_batch(_vector_store_prefix(aid), manifest, vs, batch_ids, vectors)
+        return vs, manifest, after_seq
+    _add_documents_with_vectors(vs, batch, embeddings, batch_ids, vectors=vectors)
+    if manifest is None and _can_write_incrementally(aid, vs):
+        manifest = vector_segments.read_manifest(_vector_store_prefix(aid))
+        after_seq = manifest.last_seq
+    if manifest is not None:
+        _write_delta_batch(_vector_store_prefix(aid), manifest, vs, batch_ids, vectors)
+    else:
+        pending_ids.extend(batch_ids)
+        pending_vectors.append(vectors)
+    return vs, manifest, after_seq
+
+
+def _ingest_chunk_batches(
+    aid: int, vs, batches, embeddings, *, removed_ids=(), progress=None, upload_job_id: str | None = None
+):
+    """
+    串流寫入（呼叫端持有 faiss_disk_lock）：vs 為 copy-on-write 草稿（已刪除 removed_ids）或 None（新建）。
+    每批 chunk 在背景執行緒 embedding（再以 UPLOAD_EMBED_BATCH_SIZE 分段，見 services.ingest_pipeline），
+    本執行緒依序加入草稿索引並寫成增量區段（文字改由 mmap 提供），與下一批的 embedding 重疊；
+    每批同時加入草稿自己的 BM25 複本（已發布的索引不受影響，查詢不會看到一半的上傳）；
+    階段間的佇列有界，記憶體只保留數批；全部完成後才提交 manifest，BM25 隨 _publish_vector_store 與向量一起發布，
+    失敗時已寫的區段不會被重播，草稿連同其 BM25 直接丟棄。
+    新向量庫的各批同樣先寫成增量區段，全部完成後才全量寫入主檔（寫入前查詢端看不到此向量庫）；
+    無法增量寫入時（VECTOR_STORE_INCREMENTAL=false 等）退回累積後全量寫入。
+    progress 為 services.upload_progress.UploadProgress（可為 None），每段 embedding 完成後更新。
+    upload_job_id 寫入每個 chunk 的 metadata（UPLOAD_JOB_METADATA_KEY），與增量區段一起落地、早於 manifest 提交。
+    回傳 (vs, doc_ids, token_count, summary_source)。
+    """
+    from services import document_ingest, ingest_pipeline
+
+    manifest = after_seq = None
+    doc_ids: list[str] = []
+    token_count = 0
+    summary_source = ""
+    is_new_store = vs is None
+    pending_ids: list[str] = []
+    pending_vectors: list[np.ndarray] = []
+    t_start = time.perf_counter()
+    embed_s = 0.0
+    ingested = 0.0
+    embedded = 0
+
+    def _embed(batch):
+        """embed 階段（背景執行緒）：指定 doc_id、embedding 並回報進度。"""
+        nonlocal embed_s, ingested, embedded
+        batch = process_documents_with_id(batch)
+        if upload_job_id:
+            for doc in batch:
+                doc.metadata[UPLOAD_JOB_METADATA_KEY] = upload_job_id
+        texts = [doc.page_content for doc in batch]
+        # 此批最後一頁所在的來源位置；批次內依已 embedding 筆數內插
+        target = progress.parsed_fraction() if progress is not None else 0.0
+        base_fraction, done_before = ingested, embedded
+
+        def _on_embedded(done: int) -> None:
+            if progress is not None:
+                elapsed = embed_s + time.perf_counter() - t_embed
+                progress.set_ingested(
+                    base_fraction + (target - base_fraction) * done / len(texts),
+                    done_before + done,
+                    (done_before + done) / elapsed if elapsed > 0 else None,
+                )
+
+        with ingest_pipeline.embed_stage.slot():
+            t_embed = time.perf_counter()
+            vectors = np.asarray(
+                document_ingest.embed_in_batches(embeddings, texts, on_batch=_on_embedded), dtype=np.float32
+            )
+            batch_embed_s = time.perf_counter() - t_embed
+        embed_s += batch_embed_s
+        embedded += len(texts)
+        ingested = max(ingested, target)
+        return batch, texts, vectors, batch_embed_s
+
+    embedded_batches = ingest_pipeline.pipelined(batches, _embed, name=f"ingest-{aid}")
+    try:
+        for batch_no, (batch, texts, vectors, batch_embed_s) in enumerate(embedded_batches, start=1):
+            batch_ids = [doc.metadata["doc_id"] for doc in batch]
+            t_write = time.perf_counter()
+            with ingest_pipeline.index_write_stage.slot():
+                vs, manifest, after_seq = _write_ingested_batch(
+                    aid, vs, batch, texts, vectors, batch_ids, embeddings, manifest, after_seq,
+                    pending_ids, pending_vectors,
+                )
+                _apply_bm25_changes(
+                    aid, vs, added_documents=batch,
+                    removed_ids=removed_ids if batch_no == 1 else None,
+                    reset=is_new_store and batch_no == 1,
+                )
+            doc_ids.extend(batch_ids)
+            batch_tokens = getattr(batch, "token_count", None)
+            token_count += batch_tokens if batch_tokens is not None else calculate_token_count(batch)
+            if len(summary_source) < _SUMMARY_SOURCE_CHARS:
+                summary_source += " ".join(doc.page_content for doc in batch)[:_SUMMARY_SOURCE_CHARS]
+            logger.info(
+                "[上傳檔案] 批次寫入 assistant_id=%s batch=%d chunks=%d total=%d embedding=%.3f s (%.1f chunks/s) "
+                "write=%.3f s (已耗時=%.3f s)",
+                aid, batch_no, len(batch), len(doc_ids), batch_embed_s,
+                len(batch) / batch_embed_s if batch_embed_s > 0 else 0.0,
+                time.perf_counter() - t_write, time.perf_counter() - t_start,
+            )
+
+        if vs is None:
+            raise ValueError("File has no indexable content")
+        if is_new_store:
+            # 全量寫入主檔（由已寫的增量區段合併），接著由呼叫端發布
+            _write_vector_store_to_disk(aid, vs)
+        elif manifest is not None:
+            _commit_segments(aid, vs, manifest, removed_ids=removed_ids, after_seq=after_seq)
+        elif pending_ids or removed_ids:
+            _persist_vector_store_changes(
+                aid, vs, added_ids=pending_ids,
+                added_vectors=np.concatenate(pending_vectors) if pending_vectors else None,
+                removed_ids=removed_ids,
+            )
+        if not doc_ids and removed_ids:
+            # 檔案沒有任何 chunk 時仍需套用刪除
+            _apply_bm25_changes(aid, vs, removed_ids=removed_ids)
+        if doc_ids:
+            logger.info(
+                "[上傳檔案] embedding 吞吐 assistant_id=%s chunks=%d embedding=%.3f s (%.1f chunks/s) "
+                "batch_size=%d",
+                aid, len(doc_ids), embed_s, len(doc_ids) / embed_s if embed_s > 0 else 0.0,
+                document_ingest.embed_batch_size(),
+            )
+    except Exception:
+        # 先停止 embed 執行緒；未提交：草稿（含其 BM25）直接丟棄，新向量庫已寫的區段（或寫到一半的主檔）一併清除，
+        # 既有向量庫刪除 manifest 之後的增量區段（下一次寫入會重用這些序號）
+        embedded_batches.close()
+        if is_new_store:
+            _remove_vector_store_files(aid)
+        elif manifest is not None:
+            from services import vector_segments
+
+            prefix = _vector_store_prefix(aid)
+            vector_segments.remove_deltas_after(prefix, vector_segments.read_manifest(prefix).last_seq)
+        raise
+    return vs, doc_ids, token_count, summary_source[:_SUMMARY_SOURCE_CHARS]
 
 
 # 依檔案類型選擇載入器
@@ -390,36 +1324,40 @@ def _process_and_store_file_heavy_sync(
     filename: str,
     file_extension: str,
     vs,  # FAISS vector store or None
+    old_doc_ids=(),  # 同檔名重新上傳時要取代的舊 doc_id
+    job_id: str | None = None,  # services.upload_progress 的工作 ID
+    source_path: str | None = None,  # 從暫存檔解析時，chunk metadata 記錄的最終路徑
+    upload_job_id: str | None = None,  # 背景上傳工作 ID（services.upload_jobs）
 ):
     """
-    執行緒池中執行的重活操作：載入檔案、切塊、embedding、寫入向量庫與摘要產生。
-    DB 寫入由呼叫方在主執行緒處理。
+    RAG 佇列執行緒中執行的重活操作：載入檔案、切塊、embedding、寫入向量庫。
+    逐頁解析、逐批 embedding 並寫入增量區段（見 services.document_ingest / ingest_pipeline），峰值記憶體與檔案大小無關；
+    向量庫的刪除 / 新增都在 copy-on-write 草稿上進行，寫入磁碟後才發布；
+    背景上傳工作的 chunk 帶有 upload_job_id，向量庫中已帶此 ID 的 chunk（前次執行已發布，但當機或取消使 DB
+    未記錄）與舊版本一起刪除；
+    DB 寫入由呼叫方在釋放佇列 slot 後處理，摘要（回傳的 summary_source）於提交後延後產生。
     """
+    from services import document_ingest, faiss_index, upload_progress
+
     t_start = time.perf_counter()
+    progress = upload_progress.get_upload(job_id) if job_id else None
     try:
-        loader = get_loader(file_location, file_extension)
-        t_load = time.perf_counter()
-        documents = loader.load()
-        if not documents:
-            logger.warning("[上傳檔案] 載入後無檔案內容 path=%s ext=%s", file_location, file_extension)
-        t_load_s = time.perf_counter() - t_load
-        logger.info("[上傳檔案] loader.load 完成 doc_count=%d (耗時=%.3f s)", len(documents), t_load_s)
-
-        t_split = time.perf_counter()
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=300,
-            chunk_overlap=50,
-            separators=["\n\n", "\n", "。", "！", "？", ".", "!", "?", " ", ""]
+        if progress is not None:
+            progress.set_stage("ingesting")
+        content_hash = document_ingest.file_sha256(file_location)
+        # 解析 / 切塊 / token 計數於子行程池執行（INGEST_PROCESS_WORKERS），本行程只做 embedding 與寫入
+        batches = document_ingest.iter_source_chunk_batches(
+            file_location, file_extension, get_loader,
+            on_progress=progress.set_parsed if progress is not None else None,
+            source=source_path,
         )
-        documents = text_splitter.split_documents(documents)
-        documents = process_documents_with_id(documents)
-        logger.info("[上傳檔案] 切chunk完成 chunks=%d (耗時=%.3f s)", len(documents), time.perf_counter() - t_split)
 
-        embeddings = _bge_embeddings or HuggingFaceEmbeddings(
-            model_name=BGE_EMBEDDINGS_MODEL_NAME
-        )
+        embeddings = _get_bge_embeddings()
         t_faiss = time.perf_counter()
-        with faiss_disk_lock(assistant_id):
+        aid = normalize_assistant_id(assistant_id)
+        with faiss_disk_lock(aid):
+            vs = _latest_snapshot_for_write(aid, vs)
+            removed_ids: list[str] = []
             if vs:
                 test_emb = embeddings.embed_query("test")
                 if len(test_emb) != vs.index.d:
@@ -427,35 +1365,59 @@ def _process_and_store_file_heavy_sync(
                         f"Vector store dimension mismatch (Index: {vs.index.d}, Model: {len(test_emb)}). "
                         "Please reset knowledge base for this assistant."
                     )
-                doc_ids = [doc.metadata["doc_id"] for doc in documents]
-                vs.add_documents(documents, ids=doc_ids)
-                vector_store[normalize_assistant_id(assistant_id)] = vs
-            else:
-                doc_ids = [doc.metadata["doc_id"] for doc in documents]
-                aid = normalize_assistant_id(assistant_id)
-                vector_store[aid] = FAISS.from_documents(documents, embeddings, ids=doc_ids)
-                vs = vector_store[aid]
-
-            _write_vector_store_to_disk(assistant_id, vs)
-        logger.info("[上傳檔案] FAISS embedding+寫入完成 chunks=%d (耗時=%.3f s)", len(documents), time.perf_counter() - t_faiss)
-
-        token_count = calculate_token_count(documents)
-        full_text = " ".join([doc.page_content for doc in documents])
-        t_llm = time.perf_counter()
-        summary, keyword_lines = generate_summary_and_keywords(full_text)
-        logger.info("[上傳檔案] LLM摘要完成 (耗時=%.3f s)", time.perf_counter() - t_llm)
+                if upload_job_id:
+                    listed = set(old_doc_ids)
+                    leftover = [
+                        did for did in _doc_ids_with_metadata(vs, UPLOAD_JOB_METADATA_KEY, upload_job_id)
+                        if did not in listed
+                    ]
+                    if leftover:
+                        logger.info(
+                            "[上傳檔案] 清除前次執行已發布、未提交的 chunk job_id=%s count=%d",
+                            upload_job_id, len(leftover),
+                        )
+                        old_doc_ids = list(old_doc_ids) + leftover
+                draft = _copy_for_write(vs)
+                present = set(draft.index_to_docstore_id.values())
+                ids_to_delete = [did for did in old_doc_ids if did in present]
+                if ids_to_delete:
+                    try:
+                        faiss_index.delete_documents(draft, ids_to_delete)
+                        removed_ids = ids_to_delete
+                        logger.info("[上傳檔案] 刪除舊向量 完成 filename=%s removed_count=%d (original_db_count=%d)",
+                                    filename, len(ids_to_delete), len(old_doc_ids))
+                    except Exception as e:
+                        logger.warning("[上傳檔案] 刪除舊向量失敗（非致命，繼續上傳） filename=%s error=%s", filename, e)
+                        draft = _copy_for_write(vs)
+                elif old_doc_ids:
+                    logger.info("[上傳檔案] 無舊向量需刪除 (舊 ID 不存在於向量庫，可能是庫已重置) filename=%s", filename)
+                vs = draft
+
+            vs, doc_ids, token_count, summary_source = _ingest_chunk_batches(
+                aid, vs, batches, embeddings, removed_ids=removed_ids, progress=progress,
+                upload_job_id=upload_job_id,
+            )
+            if not doc_ids:
+                logger.warning("[上傳檔案] 載入後無檔案內容 path=%s ext=%s", file_location, file_extension)
+            _publish_vector_store(aid, vs)
+        logger.info(
+            "[上傳檔案] 解析+切chunk+embedding+寫入完成 chunks=%d (耗時=%.3f s)",
+            len(doc_ids), time.perf_counter() - t_faiss,
+        )
+
         doc_ids_string = ", ".join(doc_ids)
 
         t_total_s = time.perf_counter() - t_start
         logger.info(
             "[上傳檔案] 處理邏輯完成 assistant_id=%s filename=%s chunks=%d token_count=%d 耗時=%.3f s",
-            assistant_id, filename, len(documents), token_count, t_total_s
+            assistant_id, filename, len(doc_ids), token_count, t_total_s
         )
         return {
+            "vs": vs,
             "doc_ids": doc_ids,
             "doc_ids_string": doc_ids_string,
-            "summary": summary,
-            "keyword_lines": keyword_lines,
+            "summary_source": summary_source,
+            "content_hash": content_hash,
             "token_count": token_count,
             "file_extension": file_extension,
         }
@@ -464,6 +1426,18 @@ def _process_and_store_file_heavy_sync(
         raise
 
 
+def _delete_knowledge_vectors_heavy_sync(aid: int, vs, old_doc_ids: list[str]) -> None:
+    """RAG 佇列 small 通道執行：從 copy-on-write 草稿移除向量並發布（不佔用事件迴圈）。"""
+    from services import faiss_index
+
+    with faiss_disk_lock(aid):
+        draft = _copy_for_write(_latest_snapshot_for_write(aid, vs))
+        faiss_index.delete_documents(draft, old_doc_ids)
+        _persist_vector_store_changes(aid, draft, removed_ids=old_doc_ids)
+        _apply_bm25_changes(aid, draft, removed_ids=old_doc_ids)
+        _publish_vector_store(aid, draft)
+
+
 def _update_knowledge_base_heavy_sync(
     assistant_id: int,
     new_file_path: str,
@@ -472,7 +1446,9 @@ def _update_knowledge_base_heavy_sync(
     old_doc_ids: list[str],
     vs,
 ):
-    """執行緒池執行：更新知識庫的 embedding / FAISS / 摘要（與上傳 heavy 路徑一致）。"""
+    """RAG 佇列執行緒執行：更新知識庫的 embedding / FAISS（與上傳 heavy 路徑一致；摘要由呼叫方另外產生）。"""
+    from services import faiss_index, ingest_pipeline
+
     loader = TextLoader(new_file_path, encoding="utf-8")
     documents = loader.load()
     text_splitter = RecursiveCharacterTextSplitter(
@@ -483,18 +1459,27 @@ def _update_knowledge_base_heavy_sync(
     documents = text_splitter.split_documents(documents)
     documents = process_documents_with_id(documents)
 
-    embeddings = _bge_embeddings or HuggingFaceEmbeddings(
-        model_name=BGE_EMBEDDINGS_MODEL_NAME
-    )
+    embeddings = _get_bge_embeddings()
     aid = normalize_assistant_id(assistant_id)
-
-    with faiss_disk_lock(aid):
+    texts = [doc.page_content for doc in documents]
+    doc_ids = [doc.metadata["doc_id"] for doc in documents]
+    with ingest_pipeline.embed_stage.slot():
+        vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+
+    with faiss_disk_lock(aid), ingest_pipeline.index_write_stage.slot():
+        vs = _latest_snapshot_for_write(aid, vs)
+        is_new_store = not vs
+        removed_ids = []
+        if vs:
+            snapshot, vs = vs, _copy_for_write(vs)
         if vs and old_doc_ids:
             try:
                 logger.info("Attempting to delete old vectors: %s", old_doc_ids)
-                vs.delete(old_doc_ids)
+                faiss_index.delete_documents(vs, old_doc_ids)
+                removed_ids = old_doc_ids
             except Exception as e:
                 logger.warning("Could not delete old vectors (continuing anyway): %s", e)
+                vs = _copy_for_write(snapshot)
 
         if vs:
             test_emb = embeddings.embed_query("test")
@@ -503,183 +1488,83 @@ def _update_knowledge_base_heavy_sync(
                     f"Vector store dimension mismatch (Index: {vs.index.d}, Model: {len(test_emb)}). "
                     "Please reset knowledge base for this assistant."
                 )
-            doc_ids = [doc.metadata["doc_id"] for doc in documents]
-            vs.add_documents(documents, ids=doc_ids)
+            _add_documents_with_vectors(vs, documents, embeddings, doc_ids, vectors=vectors)
+            _persist_vector_store_changes(
+                aid, vs, added_ids=doc_ids, added_vectors=vectors, removed_ids=removed_ids
+            )
         else:
-            doc_ids = [doc.metadata["doc_id"] for doc in documents]
-            vector_store[aid] = FAISS.from_documents(documents, embeddings, ids=doc_ids)
-            vs = vector_store[aid]
-
-        _write_vector_store_to_disk(assistant_id, vs)
+            vs = FAISS.from_embeddings(
+                list(zip(texts, vectors.tolist())), embeddings,
+                metadatas=[doc.metadata for doc in documents], ids=doc_ids,
+            )
+            _write_vector_store_to_disk(aid, vs)
+        _apply_bm25_changes(
+            aid, vs, added_documents=documents, removed_ids=removed_ids, reset=is_new_store
+        )
+        _publish_vector_store(aid, vs)
 
     token_count = calculate_token_count(documents)
-    summary, keyword_lines = generate_summary_and_keywords(new_content)
-    new_doc_ids = [doc.metadata["doc_id"] for doc in documents]
 
     return {
         "vs": vs,
-        "doc_ids_string": ", ".join(new_doc_ids),
-        "summary": summary,
-        "keyword_lines": keyword_lines,
+        "doc_ids_string": ", ".join(doc_ids),
         "token_count": token_count,
     }
 
 
+def _rag_tenant(db: Session, aid: int) -> str:
+    """RAG 佇列公平排程的租戶鍵（預設為助理擁有者）。"""
+    from services.rag_queue import tenant_key
+
+    owner_id = db.query(AIAssistant.owner_id).filter(AIAssistant.assistant_id == aid).scalar()
+    return tenant_key(aid, owner_id)
+
+
 # 處理並儲存檔案嵌入至向量資料庫
-async def process_and_store_file(assistant_id: int, file: UploadFile, db: Session):
+async def process_and_store_file(assistant_id: int, file: UploadFile, db: Session, job_id: str | None = None):
+    """
+    同步上傳（請求等待處理完成）；API 的上傳走 services.upload_jobs 背景工作。
+    job_id：services.upload_progress 的工作 ID；未提供時自動產生。
+    """
+    from services import upload_progress
+    from services.document_ingest import spool_upload
+
     t_start = time.perf_counter()
     filename = file.filename or "(unnamed)"
+    progress = upload_progress.start_upload(assistant_id, filename, job_id)
     logger.info(
-        "[上傳檔案 開始] assistant_id=%s filename=%s content_type=%s",
-        assistant_id, filename, getattr(file, "content_type", None)
+        "[上傳檔案 開始] assistant_id=%s filename=%s content_type=%s job_id=%s",
+        assistant_id, filename, getattr(file, "content_type", None), progress.job_id
     )
 
     try:
         aid = normalize_assistant_id(assistant_id)
         async with assistant_vector_write_lock(aid):
-            # 輕量步驟留在主執行緒：查詢 DB 與向量庫
-            t_q = time.perf_counter()
-            existing_entry = db.query(KnowledgeBase).filter(
-                KnowledgeBase.assistant_id == aid,
-                KnowledgeBase.file_name == filename
-            ).first()
-            kb_count = db.query(KnowledgeBase).filter(
-                KnowledgeBase.assistant_id == aid
-            ).count()
-            if kb_count == 0 and disk_vector_store_exists(aid):
-                logger.warning(
-                    "[上傳檔案] 磁碟上存在向量庫但 DB 無知識庫紀錄（可能是刪除舊 ID 重用），將清空 assistant_id=%s",
-                    aid,
-                )
-                clear_vector_store_files(aid)
-                vs = None
-            else:
-                vs = get_vector_store(aid)
-            t_q_s = time.perf_counter() - t_q
-            logger.info(
-                "[上傳檔案] 查詢既有紀錄與向量庫狀態完成 existing=%s vs_exists=%s (耗時=%.3f s)",
-                existing_entry is not None, vs is not None, t_q_s
-            )
-
-            if existing_entry and vs:
-                old_doc_ids = [did.strip() for did in (existing_entry.doc_ids or "").split(",") if did.strip()]
-                if old_doc_ids:
-                    try:
-                        with faiss_disk_lock(aid):
-                            if hasattr(vs, 'index_to_docstore_id'):
-                                current_doc_ids = set(vs.index_to_docstore_id.values())
-                                ids_to_delete = [did for did in old_doc_ids if did in current_doc_ids]
-                            else:
-                                ids_to_delete = old_doc_ids
-
-                            if ids_to_delete:
-                                vs.delete(ids_to_delete)
-                                logger.info("[上傳檔案] 刪除舊向量 完成 filename=%s removed_count=%d (original_db_count=%d)",
-                                            filename, len(ids_to_delete), len(old_doc_ids))
-                            else:
-                                logger.info("[上傳檔案] 無舊向量需刪除 (舊 ID 不存在於向量庫，可能是庫已重置) filename=%s", filename)
-
-                    except Exception as e:
-                        logger.warning("[上傳檔案] 刪除舊向量失敗（非致命，繼續上傳） filename=%s error=%s", filename, e)
-
             save_directory = f"./uploaded_files/assistant_{aid}"
             os.makedirs(save_directory, exist_ok=True)
             file_location = os.path.join(save_directory, filename)
 
             t_read = time.perf_counter()
-            content = await file.read()
-            file_size = len(content)
-            logger.info("[上傳檔案] 讀取上傳內容 完成 size=%d bytes (耗時=%.3f s)", file_size, time.perf_counter() - t_read)
-
-            with open(file_location, "wb+") as f:
-                f.write(content)
-            logger.info("[上傳檔案] 寫入磁碟 完成 path=%s", file_location)
-
-            file_extension = filename.split(".")[-1].lower() if "." in filename else ""
-            if not file_extension:
-                raise ValueError("File must have an extension")
+            # 分段寫入磁碟，不把整個上傳檔讀進記憶體
+            file_size = await spool_upload(file, file_location)
+            logger.info(
+                "[上傳檔案] 上傳內容寫入磁碟 完成 path=%s size=%d bytes (耗時=%.3f s)",
+                file_location, file_size, time.perf_counter() - t_read,
+            )
 
             from services.rag_queue import enqueue_rag
-            t_heavy = time.perf_counter()
-            heavy_result = await enqueue_rag(
-                _process_and_store_file_heavy_sync,
-                aid,
-                file_location,
-                filename,
-                file_extension,
-                vs,
-            )
-            logger.info("[上傳檔案] enqueue_rag完成 (耗時=%.3f s)", time.perf_counter() - t_heavy)
-
-            doc_ids_string = heavy_result["doc_ids_string"]
-            summary = heavy_result["summary"]
-            keyword_lines = heavy_result["keyword_lines"]
-            token_count = heavy_result["token_count"]
-            file_extension = heavy_result["file_extension"]
-
-            MAX_SUMMARY_LEN = 10000
-            MAX_KEYWORDS_LEN = 1000
-
-            if len(summary) > MAX_SUMMARY_LEN:
-                 logger.warning("[上傳檔案] Summary 過長 (%d chars)，進行截斷。", len(summary))
-                 summary = summary[:MAX_SUMMARY_LEN] + "...(truncated)"
-
-            if len(keyword_lines) > MAX_KEYWORDS_LEN:
-                 logger.warning("[上傳檔案] Keywords 過長 (%d chars)，進行截斷。", len(keyword_lines))
-                 keyword_lines = keyword_lines[:MAX_KEYWORDS_LEN]
-
-            t_db = time.perf_counter()
-            if existing_entry:
-                logger.info("[上傳檔案] 更新既有 DB 紀錄 filename=%s", filename)
-                existing_entry.summary = summary
-                existing_entry.keywords = keyword_lines
-                existing_entry.doc_ids = doc_ids_string
-                existing_entry.token_count = token_count
-                existing_entry.upload_date = datetime.utcnow()
-                db.commit()
-                db.refresh(existing_entry)
-                entry_to_return = existing_entry
-            else:
-                logger.info("[上傳檔案] 新增 DB 紀錄 filename=%s", filename)
-                new_entry = KnowledgeBase(
-                    assistant_id=aid,
-                    file_name=filename,
-                    file_type=f"{file_extension.upper()}",
-                    summary=summary,
-                    keywords=keyword_lines,
-                    doc_ids=doc_ids_string,
-                    description=f"Uploaded file {filename} by assistant {assistant_id}",
-                    token_count=token_count,
-                    upload_date=datetime.utcnow()
-                )
-                db.add(new_entry)
-                db.commit()
-                db.refresh(new_entry)
-                entry_to_return = new_entry
-            logger.info("[上傳檔案] DB寫入完成 (耗時=%.3f s)", time.perf_counter() - t_db)
-
-            set_vector_store_cache(aid, vector_store.get(aid))
-            vs = vector_store.get(aid)
+
+            result = await _store_uploaded_file_locked(aid, filename, file_location, db, progress, enqueue_rag)
+            progress.finish()
             t_total_s = time.perf_counter() - t_start
             logger.info(
                 "[上傳檔案] 全流程完成 assistant_id=%s filename=%s token_count=%d 總耗時=%.3f s",
-                aid, filename, token_count, t_total_s
+                aid, filename, result["km"]["token_count"], t_total_s
             )
-            return {
-                "vector_store": vs,
-                "km": {
-                    "file_name": entry_to_return.file_name,
-                    "description": entry_to_return.description,
-                    "token_count": entry_to_return.token_count,
-                    "file_type": entry_to_return.file_type,
-                    "summary": entry_to_return.summary,
-                    "keywords": entry_to_return.keywords,
-                    "doc_ids": entry_to_return.doc_ids,
-                    "upload_date": entry_to_return.upload_date
-                }
-            }
+            return {"job_id": progress.job_id, **result}
 
     except Exception as e:
+        progress.fail(str(getattr(e, "detail", None) or e))
         t_total_s = time.perf_counter() - t_start
         logger.exception(
             "[上傳檔案 失敗] assistant_id=%s filename=%s 總耗時=%.3f s error=%s",
@@ -688,6 +1573,188 @@ async def process_and_store_file(assistant_id: int, file: UploadFile, db: Sessio
         raise
 
 
+async def store_uploaded_file(
+    assistant_id: int,
+    filename: str,
+    file_location: str,
+    db: Session,
+    progress=None,
+    *,
+    stale_doc_ids=(),
+    upload_job_id: str | None = None,
+    on_vectors_published=None,
+    before_commit=None,
+):
+    """
+    背景上傳工作（services.upload_jobs）：處理已寫入暫存檔的上傳並提交至 knowledge_base。
+    stale_doc_ids：先前中斷的執行已寫入向量庫、尚未提交的 doc_id，與舊版本一起刪除；
+    upload_job_id：寫入 chunk metadata；向量庫中已帶此 ID（前次執行已發布但未記入 stale_doc_ids）的 chunk 一併刪除；
+    on_vectors_published(doc_ids_string)：向量庫發布後、DB 提交前呼叫（記錄未提交的 doc_id）；
+    before_commit(entry)：knowledge_base 紀錄 flush 後、commit 前呼叫（同一交易更新工作狀態）。
+    """
+    from services.rag_queue import run_rag_job
+
+    aid = normalize_assistant_id(assistant_id)
+    async with assistant_vector_write_lock(aid):
+        return await _store_uploaded_file_locked(
+            aid, filename, file_location, db, progress, run_rag_job,
+            stale_doc_ids=stale_doc_ids, upload_job_id=upload_job_id,
+            on_vectors_published=on_vectors_published, before_commit=before_commit,
+        )
+
+
+async def _store_uploaded_file_locked(
+    aid: int,
+    filename: str,
+    file_location: str,
+    db: Session,
+    progress,
+    run_heavy,
+    *,
+    stale_doc_ids=(),
+    upload_job_id: str | None = None,
+    on_vectors_published=None,
+    before_commit=None,
+):
+    """呼叫端持有 assistant_vector_write_lock：heavy 處理 → 移入正式路徑 → 寫入 knowledge_base。"""
+    # 輕量步驟留在主執行緒：查詢 DB 與向量庫
+    t_q = time.perf_counter()
+    existing_entry = db.query(KnowledgeBase).filter(
+        KnowledgeBase.assistant_id == aid,
+        KnowledgeBase.file_name == filename
+    ).first()
+    kb_count = db.query(KnowledgeBase).filter(
+        KnowledgeBase.assistant_id == aid
+    ).count()
+    if kb_count == 0 and disk_vector_store_exists(aid):
+        logger.warning(
+            "[上傳檔案] 磁碟上存在向量庫但 DB 無知識庫紀錄（可能是刪除舊 ID 重用），將清空 assistant_id=%s",
+            aid,
+        )
+        clear_vector_store_files(aid)
+        vs = None
+    else:
+        vs = get_vector_store(aid)
+    t_q_s = time.perf_counter() - t_q
+    logger.info(
+        "[上傳檔案] 查詢既有紀錄與向量庫狀態完成 existing=%s vs_exists=%s (耗時=%.3f s)",
+        existing_entry is not None, vs is not None, t_q_s
+    )
+
+    # 舊向量於 heavy 路徑的 copy-on-write 草稿中與新 chunk 一起替換，查詢期間看到的一律是完整快照
+    old_doc_ids: list[str] = []
+    if vs:
+        if existing_entry:
+            old_doc_ids = [did.strip() for did in (existing_entry.doc_ids or "").split(",") if did.strip()]
+        old_doc_ids.extend(stale_doc_ids)
+
+    file_extension = filename.split(".")[-1].lower() if "." in filename else ""
+    if not file_extension:
+        raise ValueError("File must have an extension")
+    final_location = os.path.join(f"./uploaded_files/assistant_{aid}", filename)
+
+    from services.rag_queue import is_small_upload
+
+    t_heavy = time.perf_counter()
+    if progress is not None:
+        progress.set_stage("queued")
+    heavy_result = await run_heavy(
+        _process_and_store_file_heavy_sync,
+        aid,
+        file_location,
+        filename,
+        file_extension,
+        vs,
+        old_doc_ids,
+        progress.job_id if progress is not None else None,
+        final_location,
+        upload_job_id,
+        tenant=_rag_tenant(db, aid),
+        small=is_small_upload(file_extension, os.path.getsize(file_location)),
+    )
+    logger.info("[上傳檔案] RAG 佇列處理完成 (耗時=%.3f s)", time.perf_counter() - t_heavy)
+    bump_knowledge_generation(aid)
+
+    doc_ids_string = heavy_result["doc_ids_string"]
+    token_count = heavy_result["token_count"]
+    file_extension = heavy_result["file_extension"]
+    if on_vectors_published is not None:
+        on_vectors_published(doc_ids_string)
+    if os.path.abspath(file_location) != os.path.abspath(final_location):
+        os.replace(file_location, final_location)
+
+    # 向量已發布、可被搜尋；摘要於 knowledge_base 提交後由 services.knowledge_summary 批次產生，
+    # 內容與既有紀錄相同（重新上傳同一檔案）時沿用既有摘要
+    from services import knowledge_summary
+
+    content_hash = heavy_result["content_hash"]
+    reused = knowledge_summary.reusable_summary(existing_entry, content_hash)
+    if reused is not None:
+        summary, keyword_lines = reused
+        summary_status = knowledge_summary.SUMMARY_DONE
+    else:
+        summary, keyword_lines = "", ""
+        summary_status = knowledge_summary.SUMMARY_RUNNING
+
+    t_db = time.perf_counter()
+    if progress is not None:
+        progress.set_stage("saving")
+    if existing_entry:
+        logger.info("[上傳檔案] 更新既有 DB 紀錄 filename=%s", filename)
+        existing_entry.summary = summary
+        existing_entry.keywords = keyword_lines
+        existing_entry.summary_status = summary_status
+        existing_entry.content_hash = content_hash
+        existing_entry.doc_ids = doc_ids_string
+        existing_entry.token_count = token_count
+        existing_entry.upload_date = datetime.utcnow()
+        entry_to_return = existing_entry
+    else:
+        logger.info("[上傳檔案] 新增 DB 紀錄 filename=%s", filename)
+        entry_to_return = KnowledgeBase(
+            assistant_id=aid,
+            file_name=filename,
+            file_type=f"{file_extension.upper()}",
+            summary=summary,
+            keywords=keyword_lines,
+            summary_status=summary_status,
+            content_hash=content_hash,
+            doc_ids=doc_ids_string,
+            description=f"Uploaded file {filename} by assistant {aid}",
+            token_count=token_count,
+            upload_date=datetime.utcnow()
+        )
+        db.add(entry_to_return)
+    if reused is None:
+        knowledge_summary.claim_entry(entry_to_return)
+    db.flush()
+    if before_commit is not None:
+        before_commit(entry_to_return)
+    db.commit()
+    db.refresh(entry_to_return)
+    logger.info("[上傳檔案] DB寫入完成 (耗時=%.3f s)", time.perf_counter() - t_db)
+    if reused is None:
+        knowledge_summary.schedule_summary(entry_to_return.id, content_hash, heavy_result["summary_source"])
+
+    vs = heavy_result["vs"]
+    set_vector_store_cache(aid, vs)
+    return {
+        "vector_store": vs,
+        "km": {
+            "id": entry_to_return.id,
+            "file_name": entry_to_return.file_name,
+            "description": entry_to_return.description,
+            "token_count": entry_to_return.token_count,
+            "file_type": entry_to_return.file_type,
+            "summary": entry_to_return.summary,
+            "keywords": entry_to_return.keywords,
+            "summary_status": entry_to_return.summary_status,
+            "doc_ids": entry_to_return.doc_ids,
+            "upload_date": entry_to_return.upload_date
+        }
+    }
+
+
 def get_vector_store_status(assistant_id: int):
     """
     取得向量儲存狀態與統計資訊
@@ -710,11 +1777,17 @@ def get_vector_store_status(assistant_id: int):
     
     # Get all doc IDs and metadata
     try:
-        # LangChain FAISS stores docs in docstore
-        for doc_id, doc in vs.docstore._dict.items():
-            fname = doc.metadata.get("file_name") or os.path.basename(doc.metadata.get("source", "unknown"))
+        # LangChain FAISS stores docs in docstore；mmap chunk 檔只讀 metadata，預覽的 5 筆才解碼文字
+        docstore = vs.docstore
+        if hasattr(docstore, "iter_metadata"):
+            metadata_items = docstore.iter_metadata()
+        else:
+            metadata_items = ((doc_id, doc.metadata) for doc_id, doc in docstore._dict.items())
+        for doc_id, metadata in metadata_items:
+            fname = metadata.get("file_name") or os.path.basename(metadata.get("source", "unknown"))
             filenames.add(fname)
             if len(sample_docs) < 5:
+                doc = docstore.search(doc_id)
                 sample_docs.append({
                     "id": doc_id,
                     "file": fname,
@@ -745,6 +1818,7 @@ def list_knowledge(assistant_id: int, db: Session):
             "file_type": record.file_type,
             "summary": record.summary,
             "keywords": record.keywords,
+            "summary_status": record.summary_status,
             "doc_ids": record.doc_ids,
             "upload_date": record.upload_date
         }
@@ -759,9 +1833,12 @@ def get_vector_store(assistant_id):
     if stale is not None and aid not in vector_store:
         vector_store[aid] = stale
         logger.info("[向量庫] 已將 str key 快取遷移為 int assistant_id=%s", aid)
-    if aid not in vector_store:
+    # 以單次 get 取值：檢查與取值之間可能被 LRU 淘汰
+    cached = vector_store.get(aid)
+    # 多 worker：快取的快照與磁碟版本 token 不同時，由 load_vector_store 持鎖重新載入（同一變動只載入一次）
+    if cached is None or not _snapshot_is_current(aid, cached):
         return load_vector_store(aid)
-    return vector_store[aid]
+    return cached
 
 
 def get_knowledge_content(assistant_id: int, knowledge_id: int, db: Session):
@@ -785,10 +1862,51 @@ def get_knowledge_content(assistant_id: int, knowledge_id: int, db: Session):
         return f.read()
 
 
+def read_committed_chunk_texts(assistant_id, doc_ids, max_chars: int | None = None) -> list[str]:
+    """由磁碟上已提交的 chunk 檔讀取 doc_ids 的文字（摘要補做用）；不載入向量庫、不經快取、不取 faiss_disk_lock。"""
+    from services import vector_segments
+
+    return vector_segments.read_committed_texts(_vector_store_prefix(assistant_id), doc_ids, max_chars)
+
+
+async def delete_uncommitted_vectors(
+    assistant_id: int, doc_ids, db: Session, upload_job_id: str | None = None
+) -> None:
+    """
+    上傳工作失敗時（services.upload_jobs）移除已發布、但 knowledge_base 未提交的向量，
+    經 RAG 佇列 small 通道執行；已不在向量庫中的 doc_id（例如先前已清除）略過。
+    upload_job_id：一併移除 metadata 帶有此工作 ID 的 chunk（發布後、記錄 doc_id 前中斷的執行）。
+    """
+    from services.rag_queue import run_rag_job
+
+    aid = normalize_assistant_id(assistant_id)
+    async with assistant_vector_write_lock(aid):
+        vs = get_vector_store(aid)
+        if not vs:
+            return
+        present = set(vs.index_to_docstore_id.values())
+        doc_ids = [did for did in doc_ids if did in present]
+        if upload_job_id:
+            listed = set(doc_ids)
+            doc_ids += [
+                did for did in _doc_ids_with_metadata(vs, UPLOAD_JOB_METADATA_KEY, upload_job_id) if did not in listed
+            ]
+        if not doc_ids:
+            return
+        logger.info("[上傳檔案] 清除未提交的向量 assistant_id=%s doc_count=%d", aid, len(doc_ids))
+        await run_rag_job(
+            _delete_knowledge_vectors_heavy_sync, aid, vs, doc_ids,
+            tenant=_rag_tenant(db, aid), small=True,
+        )
+        bump_knowledge_generation(aid)
+
+
 async def delete_knowledge_base_item(assistant_id: int, knowledge_id: int, db: Session):
     """
     依 knowledge_base.id 刪除一筆知識庫：FAISS 移除對應 doc_ids、刪除實體檔案、刪除 DB 紀錄。
     """
+    from services.rag_queue import enqueue_rag
+
     aid = normalize_assistant_id(assistant_id)
     async with assistant_vector_write_lock(aid):
         record = db.query(KnowledgeBase).filter(
@@ -808,10 +1926,14 @@ async def delete_knowledge_base_item(assistant_id: int, knowledge_id: int, db: S
                     knowledge_id,
                     len(old_doc_ids),
                 )
-                with faiss_disk_lock(aid):
-                    vs.delete(old_doc_ids)
-                    _write_vector_store_to_disk(assistant_id, vs)
-                set_vector_store_cache(assistant_id, vs)
+                await enqueue_rag(
+                    _delete_knowledge_vectors_heavy_sync, aid, vs, old_doc_ids,
+                    tenant=_rag_tenant(db, aid), small=True,
+                )
+                bump_knowledge_generation(aid)
+            except HTTPException:
+                # 佇列滿 / 逾時：不刪 DB 紀錄，避免留下無紀錄可對應的向量
+                raise
             except Exception as e:
                 logger.warning("Could not delete vectors (continuing DB/file delete): %s", e)
         elif vs and not old_doc_ids:
@@ -869,24 +1991,36 @@ async def update_knowledge_base_item(assistant_id: int, knowledge_id: int, new_c
             new_content,
             old_doc_ids,
             vs,
+            tenant=_rag_tenant(db, aid),
+            small=True,
         )
 
         set_vector_store_cache(assistant_id, heavy_result["vs"])
+        bump_knowledge_generation(aid)
+
+        # 摘要於提交後延後產生；編輯後內容未變時沿用既有摘要
+        from services import knowledge_summary
 
-        record.summary = heavy_result["summary"]
-        record.keywords = heavy_result["keyword_lines"]
+        content_hash = hashlib.sha256(new_content.encode("utf-8")).hexdigest()
+        reused = knowledge_summary.reusable_summary(record, content_hash)
+        if reused is None:
+            knowledge_summary.claim_entry(record)
+        record.content_hash = content_hash
         record.doc_ids = heavy_result["doc_ids_string"]
         record.token_count = heavy_result["token_count"]
         record.upload_date = datetime.utcnow()
         
         db.commit()
         db.refresh(record)
+        if reused is None:
+            knowledge_summary.schedule_summary(record.id, content_hash, new_content)
 
         return {
             "id": record.id,
             "file_name": record.file_name,
             "summary": record.summary,
             "keywords": record.keywords,
+            "summary_status": record.summary_status,
             "doc_ids": record.doc_ids,
             "token_count": record.token_count,
             "upload_date": record.upload_date
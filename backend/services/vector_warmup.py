@@ -0,0 +1,179 @@
+"""啟動後於背景預先載入最近活躍助理的向量庫（FAISS index + chunk 檔 + BM25），不阻塞服務就緒。
+
+部署 / 重啟後每個助理的第一個問題都要在對話中同步付出 load_vector_store 成本；
+此處依 conversations / messages 的最近活動時間排序，取前 N 個助理以有限併發載入快取。
+
+  - 在背景執行緒執行，startup 立即返回；與對話請求同時載入同一助理時由 load_vector_store
+    的每助理鎖與快取再檢查去重；
+  - 向量庫記憶體快取接近上限（VECTOR_STORE_CACHE_MAX_MB 的 90%）時停止，避免預熱把彼此淘汰；
+  - 進度寫入日誌並可由 GET /integration/rag/vector-warmup-status 查詢。
+
+環境變數：
+  VECTOR_WARMUP_ASSISTANTS      預熱助理數（預設 20；0 = 關閉）
+  VECTOR_WARMUP_CONCURRENCY     同時載入數（預設 2）
+  VECTOR_WARMUP_LOOKBACK_DAYS   只計入最近 N 天有活動的助理（預設 30；0 = 不限）
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import func  # pyright: ignore[reportMissingImports]
+from sqlalchemy.orm import Session  # pyright: ignore[reportMissingImports]
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+VECTOR_WARMUP_ASSISTANTS = max(0, int(os.getenv("VECTOR_WARMUP_ASSISTANTS", "20")))
+VECTOR_WARMUP_CONCURRENCY = max(1, int(os.getenv("VECTOR_WARMUP_CONCURRENCY", "2")))
+VECTOR_WARMUP_LOOKBACK_DAYS = max(0, int(os.getenv("VECTOR_WARMUP_LOOKBACK_DAYS", "30")))
+# 快取使用量達上限此比例即停止預熱
+_CACHE_FILL_RATIO = 0.9
+
+_status: Dict[str, Any] = {"state": "idle"}
+_status_lock = threading.Lock()
+_stop_event = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+
+def rank_recent_assistants(db: Session, limit: int, lookback_days: int = 0) -> List[int]:
+    """依最後一則訊息時間（無訊息時為對話建立時間）由新到舊排序的 assistant_id。"""
+    from models.models import Conversation, Message
+
+    last_active = func.coalesce(func.max(Message.timestamp), func.max(Conversation.created_at))
+    query = (
+        db.query(Conversation.assistant_id, last_active.label("last_active"))
+        .outerjoin(Message, Message.conversation_id == Conversation.conversation_id)
+        .group_by(Conversation.assistant_id)
+    )
+    if lookback_days > 0:
+        query = query.having(last_active >= datetime.utcnow() - timedelta(days=lookback_days))
+    rows = query.order_by(last_active.desc(), Conversation.assistant_id).limit(limit).all()
+    return [int(row.assistant_id) for row in rows]
+
+
+def _update(**fields) -> None:
+    with _status_lock:
+        _status.update(fields)
+
+
+def warmup_status() -> Dict[str, Any]:
+    with _status_lock:
+        status = dict(_status)
+        status["assistants"] = list(status.get("assistants", []))
+        status["failed_ids"] = list(status.get("failed_ids", []))
+    return status
+
+
+def _cache_full() -> bool:
+    from services.vector_service import vector_store
+
+    stats = vector_store.stats()
+    return bool(stats["max_bytes"]) and stats["bytes"] >= _CACHE_FILL_RATIO * stats["max_bytes"]
+
+
+def _warm_one(assistant_id: int) -> str:
+    """回傳 loaded / cached / missing / skipped。"""
+    from services import vector_service
+
+    if _stop_event.is_set() or _cache_full():
+        return "skipped"
+    if not vector_service.disk_vector_store_exists(assistant_id):
+        return "missing"
+    if vector_service.vector_store.get(assistant_id) is not None:
+        return "cached"
+    vs = vector_service.load_vector_store(assistant_id)
+    if vs is None:
+        return "missing"
+    vector_service.get_bm25_index(assistant_id, vs)
+    return "loaded"
+
+
+def _run(limit: int, concurrency: int, lookback_days: int) -> None:
+    from models.database import SessionLocal
+
+    t_start = time.perf_counter()
+    try:
+        db = SessionLocal()
+        try:
+            assistant_ids = rank_recent_assistants(db, limit, lookback_days)
+        finally:
+            db.close()
+        _update(state="running", total=len(assistant_ids), assistants=assistant_ids)
+        logger.info("[向量庫預熱] 開始 assistants=%d concurrency=%d", len(assistant_ids), concurrency)
+        counts = {"loaded": 0, "cached": 0, "missing": 0, "skipped": 0, "failed": 0}
+        failed_ids: List[int] = []
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="vector-warmup") as pool:
+            futures = {pool.submit(_warm_one, aid): aid for aid in assistant_ids}
+            for done, future in enumerate(as_completed(futures), start=1):
+                aid = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = "failed"
+                    failed_ids.append(aid)
+                    logger.warning("[向量庫預熱] 載入失敗 assistant_id=%s error=%s", aid, e)
+                counts[result] += 1
+                _update(done=done, failed_ids=failed_ids, **counts)
+                logger.info(
+                    "[向量庫預熱] %d/%d assistant_id=%s %s (已耗時=%.2f s)",
+                    done, len(assistant_ids), aid, result, time.perf_counter() - t_start,
+                )
+        elapsed = time.perf_counter() - t_start
+        _update(
+            state="stopped" if _stop_event.is_set() else "done",
+            finished_at=time.time(),
+            elapsed_s=round(elapsed, 3),
+        )
+        logger.info(
+            "[向量庫預熱] 完成 loaded=%d cached=%d missing=%d skipped=%d failed=%d (耗時=%.2f s)",
+            counts["loaded"], counts["cached"], counts["missing"], counts["skipped"], counts["failed"], elapsed,
+        )
+    except Exception as e:
+        _update(state="failed", error=str(e), finished_at=time.time())
+        logger.warning("[向量庫預熱] 失敗（不影響服務）：%s", e)
+
+
+def start_vector_warmup(
+    limit: Optional[int] = None,
+    concurrency: Optional[int] = None,
+    lookback_days: Optional[int] = None,
+) -> bool:
+    """啟動背景預熱；已在執行或設定為 0 時回傳 False。"""
+    global _thread
+    limit = VECTOR_WARMUP_ASSISTANTS if limit is None else max(0, limit)
+    if limit == 0:
+        _update(state="disabled")
+        return False
+    with _status_lock:
+        if _thread is not None and _thread.is_alive():
+            return False
+        _stop_event.clear()
+        _status.clear()
+        _status.update(
+            state="ranking", started_at=time.time(), total=0, done=0, assistants=[], failed_ids=[],
+            loaded=0, cached=0, missing=0, skipped=0, failed=0,
+        )
+        _thread = threading.Thread(
+            target=_run,
+            args=(
+                limit,
+                VECTOR_WARMUP_CONCURRENCY if concurrency is None else max(1, concurrency),
+                VECTOR_WARMUP_LOOKBACK_DAYS if lookback_days is None else max(0, lookback_days),
+            ),
+            name="vector-warmup",
+            daemon=True,
+        )
+        _thread.start()
+    return True
+
+
+def stop_vector_warmup() -> None:
+    """停止排程新的載入（進行中的載入會完成）。"""
+    _stop_event.set()
@@ -90,6 +90,50 @@ def _build_test_app() -> FastAPI:
     return app
 
 
+_real_faiss = None
+
+
+def _import_real_faiss():
+    # faiss 只能真正匯入一次：重複執行 faiss/__init__ 會再次包裝 SWIG 類別而無限遞迴
+    global _real_faiss
+    if _real_faiss is None:
+        stub = sys.modules.pop("faiss", None)
+        try:
+            import faiss as real  # pyright: ignore[reportMissingImports]
+        except ImportError:
+            real = None
+        finally:
+            if stub is not None:
+                sys.modules["faiss"] = stub
+        _real_faiss = real if real is not None and not isinstance(real, MagicMock) else False
+    return _real_faiss or None
+
+
+@pytest.fixture(scope="session")
+def load_with_real_faiss():
+    """以真正的 faiss 載入 services 下的單一模組檔（其餘測試仍使用 MagicMock stub）；未安裝則略過。"""
+    import importlib.util
+
+    def _load(filename: str, module_name: str):
+        real = _import_real_faiss()
+        if real is None:
+            pytest.skip("faiss not installed")
+        stub = sys.modules.get("faiss")
+        sys.modules["faiss"] = real
+        try:
+            spec = importlib.util.spec_from_file_location(
+                module_name, os.path.join(_BACKEND_ROOT, "services", filename)
+            )
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            return module
+        finally:
+            if stub is not None:
+                sys.modules["faiss"] = stub
+
+    return _load
+
+
 @pytest.fixture(scope="session")
 def test_engine():
     engine = create_engine(
@@ -0,0 +1,65 @@
+"""Tests for the per-assistant answer cache."""
+
+from services.answer_cache import AnswerCache, assistant_fingerprint, normalize_query
+
+FP = assistant_fingerprint("你是便當店客服", "繁體中文", "m")
+
+
+def test_normalize_query_ignores_case_width_spacing_and_trailing_punctuation():
+    assert normalize_query("  營業時間？ ") == normalize_query("營業時間?")
+    assert normalize_query("Ｄｅｌｉｖｅｒｙ   Hours!") == "delivery hours"
+
+
+def test_exact_hit_requires_same_generation_and_fingerprint():
+    cache = AnswerCache()
+    cache.store(1, "營業時間？", "早上十點到晚上八點", generation=3, fingerprint=FP)
+
+    assert cache.lookup(1, "營業時間", generation=3, fingerprint=FP) == "早上十點到晚上八點"
+    assert cache.lookup(2, "營業時間", generation=3, fingerprint=FP) is None
+    other_fp = assistant_fingerprint("你是便當店客服", "English", "m")
+    assert cache.lookup(1, "營業時間", generation=3, fingerprint=other_fp) is None
+    # 失效的項目會被移除，之後即使版本號相符也不再命中
+    assert cache.lookup(1, "營業時間", generation=4, fingerprint=FP) is None
+    assert cache.lookup(1, "營業時間", generation=3, fingerprint=FP) is None
+
+
+def test_lru_eviction_and_ttl():
+    cache = AnswerCache(max_entries=2)
+    for q in ("a", "b"):
+        cache.store(1, q, q.upper(), generation=0, fingerprint=FP)
+    cache.lookup(1, "a", generation=0, fingerprint=FP)
+    cache.store(1, "c", "C", generation=0, fingerprint=FP)
+
+    assert cache.lookup(1, "b", generation=0, fingerprint=FP) is None
+    assert cache.lookup(1, "a", generation=0, fingerprint=FP) == "A"
+    assert cache.stats()["evictions"] == 1
+
+    expired = AnswerCache(ttl_seconds=0)
+    expired.store(1, "a", "A", generation=0, fingerprint=FP)
+    assert expired.lookup(1, "a", generation=0, fingerprint=FP) is None
+
+
+def test_semantic_tier_matches_similar_embedding():
+    cache = AnswerCache(semantic_threshold=0.95)
+    cache.store(1, "幾點開門", "十點", generation=0, fingerprint=FP, embedding=[1.0, 0.0, 0.1])
+
+    hit = cache.lookup_semantic(1, [0.98, 0.0, 0.12], generation=0, fingerprint=FP)
+    assert hit is not None and hit[0] == "十點" and hit[1] >= 0.95
+    assert cache.lookup_semantic(1, [0.0, 1.0, 0.0], generation=0, fingerprint=FP) is None
+    assert cache.lookup_semantic(1, [0.98, 0.0, 0.12], generation=1, fingerprint=FP) is None
+
+    disabled = AnswerCache()
+    disabled.store(1, "幾點開門", "十點", generation=0, fingerprint=FP, embedding=[1.0, 0.0, 0.1])
+    assert disabled.lookup_semantic(1, [1.0, 0.0, 0.1], generation=0, fingerprint=FP) is None
+
+
+def test_stats_hit_rate():
+    cache = AnswerCache()
+    cache.record_miss()
+    cache.store(1, "q", "a", generation=0, fingerprint=FP)
+    cache.lookup(1, "q", generation=0, fingerprint=FP)
+    stats = cache.stats()
+    assert stats["exact_hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["hit_rate"] == 0.5
+    assert stats["entries"] == 1
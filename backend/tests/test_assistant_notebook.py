@@ -165,3 +165,46 @@ def test_list_notebooks_http_500_raises_email_not_found(monkeypatch):
         assert False, "expected JarvisEmailNotFoundError"
     except client_mod.JarvisEmailNotFoundError as exc:
         assert str(exc) == client_mod.JARVIS_EMAIL_NOT_FOUND_MSG
+
+
+def test_asearch_knowledge_http_posts_payload(monkeypatch):
+    import asyncio
+
+    import httpx
+
+    from services import jarvis_knowledge_client as client_mod
+
+    monkeypatch.setenv("NOTEBOOK_KNOWLEDGE_MODE", "http")
+    monkeypatch.setenv("JARVIS_BASE_URL", "https://jarvis.example")
+    monkeypatch.setenv("INTEGRATION_API_KEY", "test-key")
+    monkeypatch.setenv("RAG_TOP_K", "2")
+
+    calls = []
+    mock_resp = httpx.Response(
+        200,
+        json={"results": [{"content": "備份保留 30 天"}]},
+        request=httpx.Request("POST", "https://jarvis.example/x"),
+    )
+
+    class _FakeAsyncClient:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *args):
+            return False
+
+        async def post(self, url, json=None, headers=None):
+            calls.append((url, json, headers))
+            return mock_resp
+
+    monkeypatch.setattr(client_mod.httpx, "AsyncClient", _FakeAsyncClient)
+
+    results = asyncio.run(client_mod.asearch_knowledge([1, 2], " 備份保留幾天？ "))
+    assert results == [{"content": "備份保留 30 天"}]
+    url, payload, headers = calls[0]
+    assert url == "https://jarvis.example/api/integration/knowledge/search"
+    assert payload == {"notebook_ids": [1, 2], "ask": "備份保留幾天？", "top_k": 2}
+    assert headers == {"X-API-Key": "test-key"}
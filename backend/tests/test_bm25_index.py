@@ -0,0 +1,110 @@
+"""Tests for the per-assistant BM25 inverted index."""
+
+import math
+import random
+
+from services.bm25_index import BM25Index, bm25_score, tokenize_for_bm25
+
+CORPUS = [
+    ("d1", "招牌雞排便當 附湯 一百二十元"),
+    ("d2", "冠軍冷泡茶 無糖 大杯"),
+    ("d3", "筷子豬肉條飯 110元 小資首選"),
+    ("d4", "雞腿飯 醬烤去骨雞腿 飯少不加醬"),
+    ("d5", "Delivery hours: 10am to 8pm, order via app"),
+    ("d6", "鮭魚飯 鱈魚飯 海鮮 過敏請留意"),
+]
+
+
+def _brute_force_rank(corpus, query):
+    tokenized = [(doc_id, tokenize_for_bm25(text)) for doc_id, text in corpus]
+    n = len(tokenized)
+    avgdl = sum(len(t) for _, t in tokenized) / n
+    df = {}
+    for _, toks in tokenized:
+        for t in set(toks):
+            df[t] = df.get(t, 0) + 1
+    idf = {t: math.log(1.0 + (n - f + 0.5) / (f + 0.5)) for t, f in df.items()}
+    scored = [
+        (doc_id, bm25_score(tokenize_for_bm25(query), toks, idf, avgdl))
+        for doc_id, toks in tokenized
+    ]
+    return sorted([x for x in scored if x[1] > 0], key=lambda x: x[1], reverse=True)
+
+
+def _assert_same_ranking(actual, expected):
+    assert [d for d, _ in actual] == [d for d, _ in expected]
+    for (_, a), (_, e) in zip(actual, expected):
+        assert math.isclose(a, e, rel_tol=1e-9)
+
+
+def test_search_matches_full_scan():
+    index = BM25Index.from_documents(CORPUS)
+    for query in ("雞腿飯", "order app", "鮭魚 過敏", "冷泡茶"):
+        _assert_same_ranking(index.search(query, 10), _brute_force_rank(CORPUS, query))
+
+
+def test_incremental_add_remove_matches_rebuild():
+    index = BM25Index.from_documents(CORPUS[:3])
+    index.add_documents(CORPUS[3:])
+    index.remove_documents(["d2", "missing"])
+    remaining = [item for item in CORPUS if item[0] != "d2"]
+    rebuilt = BM25Index.from_documents(remaining)
+
+    assert len(index) == len(remaining)
+    assert index.postings == rebuilt.postings
+    assert index.total_length == rebuilt.total_length
+    _assert_same_ranking(index.search("飯", 10), rebuilt.search("飯", 10))
+    assert "冷" not in index.postings
+
+
+def test_save_and_load_roundtrip(tmp_path):
+    path = str(tmp_path / "assistant_1_bm25.pkl")
+    index = BM25Index.from_documents(CORPUS)
+    index.save(path)
+
+    loaded = BM25Index.load(path)
+    assert loaded is not None
+    assert len(loaded) == len(CORPUS)
+    _assert_same_ranking(loaded.search("雞排 附湯", 5), index.search("雞排 附湯", 5))
+
+
+def test_load_missing_file_returns_none(tmp_path):
+    assert BM25Index.load(str(tmp_path / "nope.pkl")) is None
+
+
+def test_maxscore_pruning_matches_exhaustive_search():
+    rng = random.Random(7)
+    vocab = [chr(c) for c in range(0x4E00, 0x4E00 + 200)] + [f"w{i}" for i in range(50)]
+    weights = [1.0 / (i + 1) for i in range(len(vocab))]
+    corpus = [
+        (f"d{i}", " ".join(rng.choices(vocab, weights=weights, k=40)))
+        for i in range(300)
+    ]
+    index = BM25Index.from_documents(corpus)
+    for _ in range(30):
+        _, text = rng.choice(corpus)
+        query = " ".join(text.split()[:6])
+        pruned = index.search(query, 5, prune=True)
+        full = index.search(query, 5, prune=False)
+        assert [round(s, 9) for _, s in pruned] == [round(s, 9) for _, s in full]
+
+
+def test_sparse_backend_matches_reference_scorer():
+    index = BM25Index.from_documents(CORPUS)
+    for query in ("雞腿飯", "order app hours", "鮭魚 過敏", "冷泡茶 無糖", "飯 飯"):
+        _assert_same_ranking(
+            index.search(query, 10, backend="sparse"),
+            _brute_force_rank(CORPUS, query),
+        )
+
+
+def test_sparse_backend_refreshes_after_mutation():
+    index = BM25Index.from_documents(CORPUS)
+    assert index.search("冷泡茶", 3, backend="sparse")[0][0] == "d2"
+    index.remove_documents(["d2"])
+    index.add_documents([("d7", "冷泡茶 買一送一")])
+    remaining = [item for item in CORPUS if item[0] != "d2"] + [("d7", "冷泡茶 買一送一")]
+    _assert_same_ranking(
+        index.search("冷泡茶", 10, backend="sparse"),
+        _brute_force_rank(remaining, "冷泡茶"),
+    )
@@ -0,0 +1,33 @@
+"""Tests for incremental Simplified→Traditional conversion used by streaming replies."""
+
+from utils.chinese_convert import IncrementalTraditionalConverter, to_traditional_tw
+
+
+def test_incremental_output_matches_whole_text_conversion():
+    text = "我们的软件支持网络打印，请联系客服。营业时间为早上十点到晚上八点！谢谢"
+    converter = IncrementalTraditionalConverter()
+    out = []
+    for i in range(0, len(text), 3):
+        out.append(converter.feed(text[i:i + 3]))
+    out.append(converter.flush())
+    assert "".join(out) == to_traditional_tw(text)
+
+
+def test_feed_holds_text_until_safe_boundary():
+    converter = IncrementalTraditionalConverter()
+    assert converter.feed("软件") == ""
+    assert converter.feed("支持，网") == to_traditional_tw("软件支持，")
+    assert converter.flush() == to_traditional_tw("网")
+
+
+def test_feed_forces_output_when_pending_exceeds_limit():
+    converter = IncrementalTraditionalConverter(max_pending_chars=4)
+    assert converter.feed("软件支") == ""
+    assert converter.feed("持") == to_traditional_tw("软件支持")
+    assert converter.flush() == ""
+
+
+def test_disabled_converter_passes_text_through():
+    converter = IncrementalTraditionalConverter(enabled=False)
+    assert converter.feed("软件") == "软件"
+    assert converter.flush() == ""
@@ -0,0 +1,174 @@
+"""Tests for the mmap chunk store that replaces the pickled docstore."""
+
+from types import SimpleNamespace
+
+import pytest
+
+from services import chunk_store
+from services.chunk_store import (
+    MmapDocstore,
+    index_to_docstore_id_from,
+    ordered_documents,
+    write_chunk_store,
+)
+
+
+class _Doc(SimpleNamespace):
+    def __init__(self, page_content, metadata=None):
+        super().__init__(page_content=page_content, metadata=metadata or {})
+
+
+class _DictDocstore:
+    def __init__(self, docs):
+        self._dict = docs
+
+    def search(self, doc_id):
+        return self._dict.get(doc_id, f"ID {doc_id} not found.")
+
+
+@pytest.fixture(autouse=True)
+def _document_class(monkeypatch):
+    monkeypatch.setattr(chunk_store, "Document", _Doc)
+
+
+def _write(tmp_path, docs):
+    path = str(tmp_path / "assistant_1_chunks.bin")
+    write_chunk_store(path, list(docs.items()))
+    return path
+
+
+def test_round_trip_text_and_columnar_metadata(tmp_path):
+    path = _write(tmp_path, {
+        "a": _Doc("營業時間：週一至週五", {"doc_id": "a", "source": "faq.txt", "page": 1}),
+        "b": _Doc("", {"doc_id": "b"}),
+        "c": _Doc("退貨須於 7 日內 🙂", {"doc_id": "c", "source": "policy.pdf"}),
+    })
+
+    store = MmapDocstore.open(path)
+
+    assert len(store) == 3
+    assert store.search("a").page_content == "營業時間：週一至週五"
+    assert store.search("a").metadata == {"doc_id": "a", "source": "faq.txt", "page": 1}
+    assert store.search("b").page_content == ""
+    assert store.search("b").metadata == {"doc_id": "b"}
+    assert store.search("c").page_content == "退貨須於 7 日內 🙂"
+    assert store.search("zzz") == "ID zzz not found."
+    assert index_to_docstore_id_from(store) == {0: "a", 1: "b", 2: "c"}
+
+
+def test_ordered_documents_follow_index_positions(tmp_path):
+    legacy = _DictDocstore({"x": _Doc("第二"), "y": _Doc("第一")})
+    path = str(tmp_path / "chunks.bin")
+
+    write_chunk_store(path, ordered_documents(legacy, {0: "y", 1: "x"}))
+
+    store = MmapDocstore.open(path)
+    assert list(store.iter_ids()) == ["y", "x"]
+    with pytest.raises(ValueError):
+        list(ordered_documents(legacy, {0: "missing"}))
+
+
+def test_overlay_add_delete_and_reload(tmp_path):
+    path = _write(tmp_path, {"a": _Doc("A"), "b": _Doc("B")})
+    store = MmapDocstore.open(path)
+
+    store.delete(["a"])
+    store.add({"n": _Doc("N", {"doc_id": "n"})})
+
+    assert list(store.iter_ids()) == ["b", "n"]
+    assert store.search("a") == "ID a not found."
+    assert dict(store.iter_metadata())["n"] == {"doc_id": "n"}
+    with pytest.raises(ValueError):
+        store.add({"b": _Doc("dup")})
+    with pytest.raises(ValueError):
+        store.delete(["a"])
+
+    write_chunk_store(path, ordered_documents(store, {0: "b", 1: "n"}))
+    store.reload(path)
+
+    assert len(store) == 2
+    assert store.search("n").page_content == "N"
+    assert sorted(store._dict) == ["b", "n"]
+
+
+def test_attach_delta_segment_moves_overlay_to_mmap(tmp_path):
+    path = _write(tmp_path, {"a": _Doc("A")})
+    store = MmapDocstore.open(path)
+    store.add({"d": _Doc("D", {"doc_id": "d"})})
+    delta_path = str(tmp_path / "delta_chunks.bin")
+    write_chunk_store(delta_path, [("d", store.search("d"))])
+
+    assert store.attach(delta_path) == ["d"]
+
+    assert store.segment_count == 2
+    assert store._added == {}
+    assert store.search("d").page_content == "D"
+    store.delete(["a"])
+    assert list(store.iter_ids()) == ["d"]
+
+
+def test_copy_isolates_overlay_from_the_original(tmp_path):
+    path = _write(tmp_path, {"a": _Doc("A"), "b": _Doc("B")})
+    store = MmapDocstore.open(path)
+    store.add({"n": _Doc("N")})
+    draft = store.copy()
+
+    draft.delete(["a", "n"])
+    draft.add({"m": _Doc("M")})
+    delta_path = str(tmp_path / "delta_chunks.bin")
+    write_chunk_store(delta_path, [("d", _Doc("D"))])
+    draft.attach(delta_path)
+
+    assert list(store.iter_ids()) == ["a", "b", "n"]
+    assert store.segment_count == 1
+    assert list(draft.iter_ids()) == ["b", "d", "m"]
+    assert draft.search("b").page_content == "B"
+
+
+def test_base_seq_round_trips_through_header(tmp_path):
+    path = str(tmp_path / "chunks.bin")
+    write_chunk_store(path, [("a", _Doc("A"))], header={"base_seq": 7})
+
+    assert MmapDocstore.open(path).base_seq == 7
+
+
+def test_ids_with_metadata_cover_segments_and_overlay(tmp_path):
+    path = _write(tmp_path, {"a": _Doc("A", {"job": "j1"}), "b": _Doc("B", {"job": "j2"}), "c": _Doc("C")})
+    store = MmapDocstore.open(path)
+    store.delete(["a"])
+    store.add({"d": _Doc("D", {"job": "j2"})})
+
+    assert store.ids_with_metadata("job", "j2") == ["b", "d"]
+    assert store.ids_with_metadata("job", "j1") == []
+    assert store.ids_with_metadata("missing", "j1") == []
+
+
+def test_header_update_keeps_chunks_and_existing_fields(tmp_path):
+    path = str(tmp_path / "chunks.bin")
+    write_chunk_store(path, [("a", _Doc("甲", {"page": 1})), ("b", _Doc("乙"))], header={"base_seq": 3})
+    before = MmapDocstore.open(path)
+
+    chunk_store.update_chunk_store_header(path, {"base_id": "base-1"})
+
+    store = MmapDocstore.open(path)
+    assert (store.base_seq, store.base_id) == (3, "base-1")
+    assert [store.search(doc_id).page_content for doc_id in store.iter_ids()] == ["甲", "乙"]
+    assert store.search("a").metadata == {"page": 1}
+    # 已開啟舊檔的讀取端不受影響
+    assert before.base_id is None and before.search("b").page_content == "乙"
+
+
+def test_raw_vectors_follow_segment_positions(tmp_path):
+    np = pytest.importorskip("numpy")
+    path = _write(tmp_path, {"a": _Doc("A"), "b": _Doc("B")})
+    vectors_path = str(tmp_path / "vectors.npy")
+    np.save(vectors_path, np.array([[1.0, 0.0], [0.0, 1.0]], dtype=np.float32))
+    store = MmapDocstore.open(path, vectors_path)
+    store.add({"n": _Doc("N")})
+
+    assert store.raw_vectors(["b", "a"]).tolist() == [[0.0, 1.0], [1.0, 0.0]]
+    assert store.raw_vector("n") is None
+    assert store.raw_vectors(["a", "n"]) is None
+    # 筆數不符的向量檔不採用
+    np.save(vectors_path, np.zeros((3, 2), dtype=np.float32))
+    assert MmapDocstore.open(path, vectors_path).raw_vector("a") is None
@@ -0,0 +1,128 @@
+"""Tests for streaming upload spooling, page iteration and chunk batching."""
+
+import asyncio
+import io
+from types import SimpleNamespace
+
+import pytest
+
+from services import document_ingest
+
+
+class _Doc(SimpleNamespace):
+    def __init__(self, page_content, metadata=None):
+        super().__init__(page_content=page_content, metadata=metadata or {})
+
+
+class _Upload:
+    def __init__(self, data):
+        self._buf = io.BytesIO(data)
+        self.reads = 0
+
+    async def read(self, size=-1):
+        self.reads += 1
+        return self._buf.read(size)
+
+
+class _LineSplitter:
+    def split_documents(self, docs):
+        return [_Doc(line) for doc in docs for line in doc.page_content.split("\n") if line]
+
+
+@pytest.fixture(autouse=True)
+def _document_class(monkeypatch):
+    monkeypatch.setattr(document_ingest, "Document", _Doc)
+
+
+def test_spool_upload_writes_in_chunks_without_leaving_temp_files(tmp_path):
+    path = tmp_path / "a.txt"
+    upload = _Upload(b"x" * 200_000)
+
+    size = asyncio.run(document_ingest.spool_upload(upload, str(path), chunk_bytes=64 * 1024))
+
+    assert size == 200_000
+    assert path.read_bytes() == b"x" * 200_000
+    assert upload.reads == 5
+    assert [p.name for p in tmp_path.iterdir()] == ["a.txt"]
+
+
+def test_text_pages_cut_at_paragraph_boundaries(tmp_path):
+    paragraphs = [f"p{i} " + "字" * 3000 for i in range(20)]
+    path = tmp_path / "a.txt"
+    path.write_text("\n\n".join(paragraphs), encoding="utf-8")
+
+    pages = list(document_ingest.iter_text_pages(str(path), block_chars=10_000))
+
+    assert len(pages) > 1
+    assert "".join(page.page_content for page in pages) == "\n\n".join(paragraphs)
+    assert all(page.page_content.rstrip().endswith("字") for page in pages)
+    assert pages[0].metadata == {"source": str(path)}
+
+
+def test_chunk_batches_are_bounded_and_cover_every_chunk():
+    pages = (_Doc("\n".join(f"c{page}-{i}" for i in range(7))) for page in range(5))
+
+    batches = list(document_ingest.iter_chunk_batches(pages, _LineSplitter(), batch_size=10))
+
+    assert [len(batch) for batch in batches] == [10, 10, 10, 5]
+    assert batches[0][0].page_content == "c0-0"
+    assert batches[-1][-1].page_content == "c4-6"
+    assert list(document_ingest.iter_chunk_batches(iter(()), _LineSplitter(), batch_size=10)) == []
+
+
+def test_text_pages_report_source_progress(tmp_path):
+    path = tmp_path / "a.txt"
+    path.write_text("\n\n".join("段落" * 2000 for _ in range(10)), encoding="utf-8")
+    fractions = []
+
+    list(document_ingest.iter_text_pages(str(path), block_chars=10_000, on_progress=fractions.append))
+
+    assert fractions == sorted(fractions)
+    assert 0 < fractions[0] < 1
+    assert fractions[-1] == 1.0
+
+
+def test_embed_in_batches_preserves_order_and_reports_counts():
+    calls = []
+
+    class _Embeddings:
+        def embed_documents(self, texts):
+            calls.append(len(texts))
+            return [[float(t)] for t in texts]
+
+    done = []
+    vectors = document_ingest.embed_in_batches(
+        _Embeddings(), [str(i) for i in range(10)], batch_size=4, on_batch=done.append
+    )
+
+    assert vectors == [[float(i)] for i in range(10)]
+    assert calls == [4, 4, 2]
+    assert done == [4, 8, 10]
+
+
+def test_pool_chunk_batches_keep_source_order_and_token_counts(tmp_path, monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+
+    def split_pages(pages):
+        chunks = [(line, dict(meta)) for text, meta in pages for line in text.split("\n") if line]
+        return chunks, [len(text) for text, _ in chunks]
+
+    paragraphs = [f"p{i}\n" + "字" * 3000 for i in range(12)]
+    path = tmp_path / "a.txt"
+    path.write_text("\n\n".join(paragraphs), encoding="utf-8")
+    monkeypatch.setattr(document_ingest.document_chunking, "split_pages", split_pages)
+    monkeypatch.setenv("INGEST_TEXT_BLOCK_CHARS", "10000")
+    fractions = []
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        monkeypatch.setattr(document_ingest, "_get_pool", lambda: pool)
+        batches = list(document_ingest.iter_source_chunk_batches(
+            str(path), "txt", None, on_progress=fractions.append, source="final/a.txt", batch_size=5,
+        ))
+
+    chunks = [doc.page_content for batch in batches for doc in batch]
+    assert [c for c in chunks if c.startswith("p")] == [f"p{i}" for i in range(12)]
+    assert [len(batch) for batch in batches] == [5] * 4 + [4]
+    assert sum(batch.token_count for batch in batches) == sum(len(c) for c in chunks)
+    assert {doc.metadata["source"] for batch in batches for doc in batch} == {"final/a.txt"}
+    assert fractions == sorted(fractions) and fractions[-1] == 1.0
@@ -0,0 +1,69 @@
+"""Tests for the in-process embedding micro-batcher."""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from services.embedding_batcher import BatchingEmbeddings, EmbeddingBatcher
+
+
+class _RecordingModel:
+    def __init__(self, delay=0.0):
+        self.batches = []
+        self.delay = delay
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        with self._lock:
+            self.batches.append(list(texts))
+        time.sleep(self.delay)
+        return [[float(len(t)), float(sum(map(ord, t)) % 97)] for t in texts]
+
+
+def test_concurrent_queries_share_one_forward_pass():
+    model = _RecordingModel()
+    batcher = EmbeddingBatcher(model.embed_documents, max_batch_size=32, max_wait_ms=50)
+    embeddings = BatchingEmbeddings(model, batcher)
+    queries = [f"問題{i}" for i in range(8)]
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(embeddings.embed_query, queries))
+
+    forward_passes = len(model.batches)
+    assert results == _RecordingModel().embed_documents(queries)
+    assert forward_passes < len(queries)
+    assert batcher.stats()["max_batch"] > 1
+    batcher.close()
+
+
+def test_documents_are_chunked_and_queries_jump_ahead():
+    model = _RecordingModel(delay=0.02)
+    batcher = EmbeddingBatcher(model.embed_documents, max_batch_size=4, max_wait_ms=0)
+    docs = [f"chunk{i}" for i in range(16)]
+
+    futures = [batcher.submit(docs[i:i + 4]) for i in range(0, 16, 4)]
+    time.sleep(0.005)
+    query_future = batcher.submit(["急件"], query=True)
+    query_future.result(timeout=5)
+    for f in futures:
+        f.result(timeout=5)
+
+    assert all(len(b) <= 4 for b in model.batches)
+    query_batch = next(i for i, b in enumerate(model.batches) if "急件" in b)
+    assert query_batch < len(model.batches) - 1
+    assert BatchingEmbeddings(model, batcher).embed_documents(docs) == _RecordingModel().embed_documents(docs)
+    batcher.close()
+
+
+def test_model_error_reaches_every_caller():
+    def _boom(texts):
+        raise RuntimeError("model failed")
+
+    batcher = EmbeddingBatcher(_boom, max_batch_size=8, max_wait_ms=0)
+    with pytest.raises(RuntimeError, match="model failed"):
+        batcher.embed(["a"], query=True)
+    with pytest.raises(RuntimeError, match="model failed"):
+        batcher.embed(["a", "b"])
+    batcher.close()
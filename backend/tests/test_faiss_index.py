@@ -0,0 +1,156 @@
+"""Tests for FAISS index-type selection and position-preserving deletes."""
+
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture(scope="module")
+def fi(load_with_real_faiss):
+    return load_with_real_faiss("faiss_index.py", "faiss_index_under_test")
+
+
+def _vectors(n, d=16, seed=0):
+    return np.random.default_rng(seed).standard_normal((n, d)).astype(np.float32)
+
+
+def test_auto_kind_uses_threshold_with_hysteresis(fi, monkeypatch):
+    monkeypatch.delenv("VECTOR_INDEX_TYPE", raising=False)
+    monkeypatch.setenv("VECTOR_ANN_MIN_VECTORS", "1000")
+    monkeypatch.setenv("VECTOR_INDEX_OVERRIDES", "7:hnsw, bad, 8:nope")
+
+    assert fi.desired_index_kind(1, 999) == "flat"
+    assert fi.desired_index_kind(1, 1000) == "ivf"
+    assert fi.desired_index_kind(1, 600, current="ivf") == "ivf"
+    assert fi.desired_index_kind(1, 400, current="ivf") == "flat"
+    assert fi.desired_index_kind(7, 10) == "hnsw"
+    assert fi.desired_index_kind(8, 10) == "flat"
+
+
+@pytest.mark.parametrize("kind", ["flat", "ivf", "hnsw"])
+def test_remove_positions_shifts_labels_like_flat(fi, kind):
+    vectors = _vectors(400)
+    index = fi.build_index(kind, vectors, 16)
+    if kind == "ivf":
+        fi.faiss.extract_index_ivf(index).nprobe = fi.ivf_nlist(400)
+    if kind == "hnsw":
+        index.hnsw.efSearch = 400
+
+    index = fi.remove_positions(index, [0, 5, 6])
+
+    assert fi.index_kind(index) == kind
+    assert index.ntotal == 397
+    # 原本位置 10 的向量刪除 3 筆之後應位於位置 7
+    _, ids = index.search(vectors[[10]], 1)
+    assert ids[0][0] == 7
+
+
+def test_ensure_index_kind_preserves_order(fi):
+    vectors = _vectors(300)
+    flat = fi.build_index("flat", vectors, 16)
+
+    ivf = fi.ensure_index_kind(flat, "ivf")
+
+    assert fi.index_kind(ivf) == "ivf"
+    assert np.allclose(fi.extract_vectors(ivf), vectors)
+    assert fi.ensure_index_kind(ivf, "ivf") is ivf
+
+
+def test_delete_documents_keeps_mapping_contiguous(fi):
+    vectors = _vectors(50)
+    deleted = []
+    vs = SimpleNamespace(
+        index=fi.build_index("ivf", vectors, 16),
+        index_to_docstore_id={i: f"d{i}" for i in range(50)},
+        docstore=SimpleNamespace(delete=deleted.extend),
+    )
+
+    fi.delete_documents(vs, ["d1", "d3"])
+
+    assert vs.index.ntotal == 48
+    assert vs.index_to_docstore_id[1] == "d2"
+    assert vs.index_to_docstore_id[47] == "d49"
+    assert sorted(deleted) == ["d1", "d3"]
+    with pytest.raises(ValueError):
+        fi.delete_documents(vs, ["d1"])
+
+
+def test_desired_quantization_is_sticky_unless_configured(fi, monkeypatch):
+    monkeypatch.delenv("VECTOR_QUANTIZATION", raising=False)
+    monkeypatch.setenv("VECTOR_QUANTIZATION_OVERRIDES", "7:pq, 8:none, 9:bogus")
+
+    assert fi.desired_quantization(1, 100) == "none"
+    assert fi.desired_quantization(1, 100, current="sq8") == "sq8"
+    assert fi.desired_quantization(7, 100_000) == "pq"
+    # PQ 訓練樣本不足時退回 sq8
+    assert fi.desired_quantization(7, 100) == "sq8"
+    assert fi.desired_quantization(8, 100, current="sq8") == "none"
+    monkeypatch.setenv("VECTOR_QUANTIZATION", "sq8")
+    assert fi.desired_quantization(1, 100) == "sq8"
+
+
+@pytest.mark.parametrize("kind", ["flat", "ivf", "hnsw"])
+@pytest.mark.parametrize("quantization", ["sq8", "pq"])
+def test_quantized_index_kinds_and_code_size(fi, kind, quantization, monkeypatch):
+    monkeypatch.setenv("VECTOR_PQ_M", "4")
+    index = fi.build_index(kind, _vectors(600), 16, quantization)
+
+    assert fi.index_kind(index) == kind
+    assert fi.index_quantization(index) == quantization
+    assert fi.vector_code_size(index) == (16 if quantization == "sq8" else 4)
+
+
+def test_reranking_restores_exact_order(fi, monkeypatch):
+    monkeypatch.setenv("VECTOR_PQ_M", "2")
+    monkeypatch.setenv("VECTOR_RERANK_FACTOR", "50")
+    vectors = _vectors(500)
+    index = fi.with_reranking(fi.build_index("flat", vectors, 16, "pq"), lambda labels: vectors[labels])
+    exact = fi.build_index("flat", vectors, 16)
+
+    queries = vectors[:20] + 0.01
+    _, truth = exact.search(queries, 3)
+    distances, found = index.search(queries, 3)
+
+    assert isinstance(index, fi.RerankingIndex)
+    assert np.array_equal(found, truth)
+    assert np.all(np.diff(distances, axis=1) >= 0)
+
+
+def test_remove_positions_on_quantized_hnsw_uses_raw_vectors(fi):
+    vectors = _vectors(300)
+    index = fi.with_reranking(fi.build_index("hnsw", vectors, 16, "sq8"), lambda labels: vectors[labels])
+
+    index = fi.remove_positions(index, [0, 1])
+
+    assert isinstance(index, fi.RerankingIndex)
+    assert fi.index_quantization(index) == "sq8"
+    assert index.ntotal == 298
+    rebuilt = fi.extract_vectors(index)
+    assert np.allclose(rebuilt, vectors[2:], atol=0.05)
+
+
+@pytest.mark.parametrize("kind,quantization", [("flat", "none"), ("ivf", "none"), ("hnsw", "sq8")])
+def test_clone_index_is_independent_of_the_snapshot(fi, kind, quantization):
+    vectors = _vectors(300)
+    snapshot = fi.with_reranking(fi.build_index(kind, vectors, 16, quantization), lambda labels: vectors[labels])
+
+    draft = fi.clone_index(snapshot)
+    draft = fi.remove_positions(draft, [0, 1, 2])
+    draft.add(_vectors(5, seed=1))
+
+    assert not isinstance(draft, fi.RerankingIndex)
+    assert (fi.index_kind(draft), fi.index_quantization(draft)) == (kind, quantization)
+    assert draft.ntotal == 302
+    assert snapshot.ntotal == 300
+
+
+def test_quantization_report_measures_savings_and_recall(fi):
+    report = fi.quantization_report(_vectors(400), "flat", "sq8", k=5, queries=50)
+
+    assert report["quantization"] == "sq8"
+    assert report["float32_bytes"] == 400 * 16 * 4
+    assert report["quantized_bytes"] == 400 * 16
+    assert report["saved_bytes"] == 400 * 16 * 3
+    assert report["recall_at_k"] >= report["recall_at_k_without_rerank"]
+    assert report["recall_at_k"] > 0.9
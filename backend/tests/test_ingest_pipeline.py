@@ -0,0 +1,95 @@
+"""Tests for the staged upload pipeline helpers."""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from services import ingest_pipeline
+from services.ingest_pipeline import StageSlots, pipelined, run_summary
+
+
+def test_pipelined_preserves_order_and_overlaps_with_consumer():
+    produced = []
+
+    def _slow_double(x):
+        time.sleep(0.02)
+        produced.append(x)
+        return x * 2
+
+    results = []
+    t_start = time.perf_counter()
+    for value in pipelined(range(6), _slow_double, depth=2):
+        time.sleep(0.02)
+        results.append(value)
+    elapsed = time.perf_counter() - t_start
+
+    assert results == [0, 2, 4, 6, 8, 10]
+    # 生產與消費重疊：遠少於 6 * (0.02 + 0.02)
+    assert elapsed < 0.2
+
+
+def test_pipelined_reraises_stage_errors():
+    def _fail_on_three(x):
+        if x == 3:
+            raise ValueError("bad batch")
+        return x
+
+    with pytest.raises(ValueError, match="bad batch"):
+        list(pipelined(range(5), _fail_on_three))
+
+
+def test_pipelined_close_stops_producer_and_closes_source():
+    closed = threading.Event()
+
+    def _source():
+        try:
+            for i in range(1000):
+                yield i
+        finally:
+            closed.set()
+
+    calls = []
+    results = pipelined(_source(), lambda x: calls.append(x) or x, depth=1)
+    assert next(results) == 0
+    results.close()
+
+    assert closed.is_set()
+    assert len(calls) < 10
+
+
+def test_stage_slots_limit_concurrency():
+    stage = StageSlots("embed", 2)
+    peak = []
+    lock = threading.Lock()
+
+    def _work():
+        with stage.slot():
+            with lock:
+                peak.append(stage.active)
+            time.sleep(0.02)
+
+    threads = [threading.Thread(target=_work) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert max(peak) <= 2
+    assert stage.stats()["completed"] == 6
+    assert stage.stats()["active"] == 0
+
+
+def test_run_summary_runs_off_the_event_loop_thread():
+    loop_thread = []
+
+    async def _go():
+        loop_thread.append(threading.get_ident())
+        return await asyncio.gather(*(run_summary(lambda t: (threading.get_ident(), t.upper()), s) for s in "ab"))
+
+    results = asyncio.run(_go())
+    ingest_pipeline.shutdown_ingest_pipeline()
+
+    assert [text for _, text in results] == ["A", "B"]
+    assert all(ident != loop_thread[0] for ident, _ in results)
@@ -1,6 +1,5 @@
 """Access-control tests for knowledge base and static asset exposure."""
 
-from datetime import datetime
 from unittest.mock import AsyncMock, patch
 
 import pytest
@@ -176,28 +175,38 @@ def test_owner_can_delete_knowledge(client, owner_context):
     assert response.json()["data"]["deleted_id"] == knowledge_id
 
 
-def test_owner_can_upload_knowledge(client, owner_context):
+def test_owner_upload_returns_202_with_a_pollable_job(client, owner_context):
     headers = auth_header(owner_context["owner_token"])
     assistant_id = owner_context["assistant_id"]
-    km = {
-        "id": 99,
-        "file_name": "doc.txt",
-        "upload_date": datetime.utcnow(),
-    }
 
-    with patch(
-        "routers.assistant.process_and_store_file",
-        new_callable=AsyncMock,
-        return_value={"km": km},
-    ):
+    with patch("services.upload_jobs._start") as start:
         response = client.post(
             f"/assistant/{assistant_id}/upload",
             files={"file": ("doc.txt", b"training data", "text/plain")},
+            data={"job_id": "client-job-0001"},
             headers=headers,
         )
 
-    assert response.status_code == 200
-    assert "上傳完成" in response.json()["message"]
+    assert response.status_code == 202
+    body = response.json()
+    assert body["job_id"] == "client-job-0001"
+    start.assert_called_once_with("client-job-0001")
+
+    status = client.get(body["status_url"], headers=headers).json()["data"]
+    assert (status["status"], status["filename"]) == ("queued", "doc.txt")
+    assert client.get(f"/assistant/{assistant_id}/uploads", headers=headers).json()["data"][0]["job_id"] == "client-job-0001"
+    other = auth_header(owner_context["other_token"])
+    assert client.get(body["status_url"], headers=other).status_code == 403
+    assert client.get(f"/assistant/{assistant_id}/uploads/unknown-job-1", headers=headers).status_code == 404
+
+
+def test_upload_rejects_unsupported_file_types(client, owner_context):
+    response = client.post(
+        f"/assistant/{owner_context['assistant_id']}/upload",
+        files={"file": ("doc.exe", b"MZ", "application/octet-stream")},
+        headers=auth_header(owner_context["owner_token"]),
+    )
+    assert response.status_code == 400
 
 
 def test_public_image_is_anonymous(client, app_dirs):
@@ -0,0 +1,161 @@
+"""Tests for deferred, batched knowledge-base summary generation."""
+
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import models.database as database
+from models.database import Base
+from models.models import KnowledgeBase
+from services import ingest_pipeline, knowledge_summary, vector_service
+
+
+@pytest.fixture
+def sessions(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'kb.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine)
+    monkeypatch.setattr(database, "SessionLocal", factory)
+    monkeypatch.setattr(knowledge_summary, "KNOWLEDGE_SUMMARY_BATCH_WAIT_MS", 50.0)
+    yield factory
+    engine.dispose()
+    ingest_pipeline.shutdown_ingest_pipeline()
+
+
+def _add_entry(db, content_hash, status="pending", **kwargs):
+    entry = KnowledgeBase(
+        assistant_id=1, file_name=f"{content_hash}.txt", file_type="TXT", description="d",
+        summary="", keywords="", doc_ids=kwargs.pop("doc_ids", "d1"), token_count=1,
+        content_hash=content_hash, summary_status=status, **kwargs,
+    )
+    db.add(entry)
+    db.commit()
+    return entry.id
+
+
+def _fake_batch_llm(calls, fail_texts=()):
+    def generate_summaries_and_keywords(texts):
+        calls.append(list(texts))
+        return [None if text in fail_texts else (f"摘要:{text}", "k1, k2") for text in texts]
+
+    return generate_summaries_and_keywords
+
+
+def _run_scheduled(requests):
+    async def _go():
+        for knowledge_id, content_hash, text in requests:
+            knowledge_summary.schedule_summary(knowledge_id, content_hash, text)
+        await knowledge_summary._queue.join()
+        await knowledge_summary.stop_knowledge_summary()
+
+    asyncio.run(_go())
+
+
+def test_requests_are_batched_and_written_back(sessions, monkeypatch):
+    calls = []
+    monkeypatch.setattr(
+        vector_service, "generate_summaries_and_keywords", _fake_batch_llm(calls, {"bad"}), raising=False
+    )
+    db = sessions()
+    ids = [_add_entry(db, h) for h in ("h1", "h2", "h3")]
+    db.close()
+
+    _run_scheduled([(ids[0], "h1", "a"), (ids[1], "h2", "b"), (ids[2], "h3", "bad")])
+
+    assert calls == [["a", "b", "bad"]]
+    db = sessions()
+    rows = {row.id: row for row in db.query(KnowledgeBase)}
+    assert (rows[ids[0]].summary, rows[ids[0]].summary_status) == ("摘要:a", "done")
+    assert rows[ids[1]].keywords == "k1, k2"
+    assert (rows[ids[2]].summary, rows[ids[2]].summary_status) == (knowledge_summary.SUMMARY_UNAVAILABLE, "failed")
+    db.close()
+
+
+def test_results_for_changed_or_deleted_entries_are_skipped(sessions, monkeypatch):
+    monkeypatch.setattr(vector_service, "generate_summaries_and_keywords", _fake_batch_llm([]), raising=False)
+    db = sessions()
+    changed = _add_entry(db, "new-hash")
+    db.close()
+
+    _run_scheduled([(changed, "old-hash", "stale text"), (9999, "h", "deleted")])
+
+    db = sessions()
+    row = db.get(KnowledgeBase, changed)
+    assert (row.summary, row.summary_status) == ("", "pending")
+    db.close()
+
+
+def test_unchanged_content_reuses_existing_summary():
+    entry = SimpleNamespace(id=1, content_hash="abc", summary_status="done", summary="舊摘要", keywords="k")
+
+    assert knowledge_summary.reusable_summary(entry, "abc") == ("舊摘要", "k")
+    assert knowledge_summary.reusable_summary(entry, "other") is None
+    assert knowledge_summary.reusable_summary(SimpleNamespace(**{**vars(entry), "summary_status": "pending"}), "abc") is None
+    assert knowledge_summary.reusable_summary(None, "abc") is None
+
+
+def test_stale_summaries_are_claimed_once_and_rebuilt_from_chunk_files(sessions, monkeypatch):
+    calls = []
+    read = []
+    chunks = {"d1": "第一段", "d2": "第二段"}
+
+    def read_committed_chunk_texts(assistant_id, doc_ids, max_chars=None):
+        read.append(list(doc_ids))
+        return [chunks[did] for did in doc_ids if did in chunks]
+
+    monkeypatch.setattr(vector_service, "generate_summaries_and_keywords", _fake_batch_llm(calls), raising=False)
+    monkeypatch.setattr(vector_service, "read_committed_chunk_texts", read_committed_chunk_texts, raising=False)
+    old = datetime.utcnow() - timedelta(hours=1)
+    db = sessions()
+    orphan = _add_entry(db, "h-orphan", status="running", doc_ids="d1, d2, d3",
+                        summary_worker="gone", summary_heartbeat_at=old)
+    unowned = _add_entry(db, "h-unowned", doc_ids="d2")
+    _add_entry(db, "h-alive", status="running", summary_worker="alive", summary_heartbeat_at=datetime.utcnow())
+    _add_entry(db, "h-done", status="done")
+
+    # 同時檢查的第二個 worker 拿不到已被認領的紀錄
+    assert knowledge_summary.claim_stale_summaries(db, stale_seconds=300, exclude={unowned}) == [orphan]
+    assert knowledge_summary.claim_stale_summaries(db, stale_seconds=300, exclude={unowned}) == []
+    # 認領者在送出前結束：心跳逾時後可再被認領
+    db.query(KnowledgeBase).filter(KnowledgeBase.id == orphan).update(
+        {KnowledgeBase.summary_heartbeat_at: old}, synchronize_session=False
+    )
+    db.commit()
+    db.close()
+
+    async def _go():
+        count = await knowledge_summary.recover_pending_summaries(stale_seconds=300)
+        await knowledge_summary._queue.join()
+        await knowledge_summary.stop_knowledge_summary()
+        return count
+
+    assert asyncio.run(_go()) == 2
+    assert sorted(calls[0]) == ["第一段 第二段", "第二段"]
+    assert read == [["d1", "d2", "d3"], ["d2"]]
+    db = sessions()
+    rows = {row.content_hash: row for row in db.query(KnowledgeBase)}
+    assert rows["h-orphan"].summary_status == rows["h-unowned"].summary_status == "done"
+    assert rows["h-alive"].summary_status == "running"
+    db.close()
+
+
+def test_heartbeat_keeps_queued_entries_from_being_claimed(sessions):
+    db = sessions()
+    entry = KnowledgeBase(
+        assistant_id=1, file_name="a.txt", file_type="TXT", description="d", summary="x", keywords="",
+        doc_ids="d1", token_count=1, content_hash="h",
+    )
+    knowledge_summary.claim_entry(entry)
+    entry.summary_heartbeat_at = datetime.utcnow() - timedelta(hours=1)
+    db.add(entry)
+    db.commit()
+
+    knowledge_summary._heartbeat(db, {entry.id})
+
+    assert (entry.summary, entry.summary_status) == ("", "running")
+    assert knowledge_summary.claim_stale_summaries(db, stale_seconds=300) == []
+    db.close()
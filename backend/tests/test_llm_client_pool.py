@@ -0,0 +1,105 @@
+"""Tests for the shared, connection-pooled LLM client registry."""
+
+import json
+import sys
+import threading
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from services import llm_client_pool
+
+
+class _FakeChatCompletions(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+        body = json.dumps(
+            {
+                "id": "cmpl-1",
+                "object": "chat.completion",
+                "created": 0,
+                "model": request.get("model", ""),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": "ok"},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+            }
+        ).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def fake_vllm():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _FakeChatCompletions)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/v1"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def _reset_registry():
+    llm_client_pool._pools.clear()
+    llm_client_pool._chat_models.clear()
+    yield
+    for pool in llm_client_pool._pools.values():
+        pool.http_client.close()
+    llm_client_pool._pools.clear()
+    llm_client_pool._chat_models.clear()
+
+
+def test_same_key_returns_shared_client(fake_vllm, monkeypatch):
+    created = []
+
+    class _FakeChatOpenAI:
+        def __init__(self, **kwargs):
+            created.append(kwargs)
+
+    monkeypatch.setitem(
+        sys.modules,
+        "langchain_community.chat_models",
+        types.SimpleNamespace(ChatOpenAI=_FakeChatOpenAI),
+    )
+    kwargs = dict(base_url=fake_vllm, api_key="EMPTY", model="m", temperature=0.3, top_p=0.9)
+    llm = llm_client_pool.get_chat_model(**kwargs)
+
+    assert llm_client_pool.get_chat_model(**kwargs) is llm
+    llm_client_pool.get_chat_model(**{**kwargs, "temperature": 0.1})
+    assert len(created) == 2
+    # 不同模型 / 溫度共用同一 base_url 的連線池
+    pool = llm_client_pool._get_pool(fake_vllm, "EMPTY")
+    assert len(llm_client_pool._pools) == 1
+    assert created[0]["model_kwargs"] == {"top_p": 0.9}
+    assert created[1]["client"]._client is pool.client
+    assert created[1]["async_client"]._client is pool.async_client
+
+
+def test_keepalive_connection_is_reused(fake_vllm):
+    pool = llm_client_pool._get_pool(fake_vllm, "EMPTY")
+
+    for model in ("m", "m", "s"):
+        result = pool.client.chat.completions.create(
+            model=model, messages=[{"role": "user", "content": "hi"}]
+        )
+        assert result.choices[0].message.content == "ok"
+
+    metrics = llm_client_pool.get_pool_metrics()
+    assert metrics["requests"] == 3
+    assert metrics["connections_created"] == 1
+    assert metrics["connections_reused"] == 2
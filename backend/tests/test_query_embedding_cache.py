@@ -0,0 +1,78 @@
+"""Tests for the shared query-embedding LRU cache."""
+
+import numpy as np
+
+from services.query_embedding_cache import CachedQueryEmbeddings, QueryEmbeddingCache
+
+DIM = 8
+ENTRY_BYTES = QueryEmbeddingCache._entry_bytes("q0", np.zeros(DIM, dtype=np.float32))
+
+
+class _CountingEmbeddings:
+    def __init__(self):
+        self.calls = 0
+
+    def embed_query(self, text):
+        self.calls += 1
+        return [float(len(text))] * DIM
+
+    def embed_documents(self, texts):
+        return [self.embed_query(t) for t in texts]
+
+
+def test_repeated_query_skips_model():
+    base = _CountingEmbeddings()
+    embeddings = CachedQueryEmbeddings(base, QueryEmbeddingCache(max_bytes=1 << 20))
+
+    first = embeddings.embed_query("營業時間")
+    second = embeddings.embed_query("營業時間")
+
+    assert base.calls == 1
+    assert np.allclose(first, second)
+    stats = embeddings.cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+
+
+def test_embed_documents_is_not_cached():
+    base = _CountingEmbeddings()
+    embeddings = CachedQueryEmbeddings(base, QueryEmbeddingCache(max_bytes=1 << 20))
+    embeddings.embed_documents(["a", "a"])
+    assert base.calls == 2
+    assert embeddings.cache.stats()["entries"] == 0
+
+
+def test_memory_cap_evicts_least_recently_used():
+    cache = QueryEmbeddingCache(max_bytes=ENTRY_BYTES * 2)
+    cache.put("q0", np.zeros(DIM))
+    cache.put("q1", np.ones(DIM))
+    cache.get("q0")
+    cache.put("q2", np.ones(DIM))
+
+    assert cache.get("q1") is None
+    assert cache.get("q0") is not None
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["bytes"] <= stats["max_bytes"]
+
+
+def test_disabled_cache_passes_through():
+    base = _CountingEmbeddings()
+    embeddings = CachedQueryEmbeddings(base, QueryEmbeddingCache(max_bytes=0))
+    embeddings.embed_query("q")
+    embeddings.embed_query("q")
+    assert base.calls == 2
+
+
+def test_save_and_load_roundtrip(tmp_path):
+    path = str(tmp_path / "query_embedding_cache.pkl")
+    cache = QueryEmbeddingCache(max_bytes=1 << 20, model_name="bge")
+    cache.put("q0", np.arange(DIM))
+    cache.put("q1", np.ones(DIM))
+    assert cache.save(path) == 2
+
+    restored = QueryEmbeddingCache(max_bytes=1 << 20, model_name="bge")
+    assert restored.load(path) == 2
+    assert np.allclose(restored.get("q0"), np.arange(DIM))
+
+    other_model = QueryEmbeddingCache(max_bytes=1 << 20, model_name="other")
+    assert other_model.load(path) == 0
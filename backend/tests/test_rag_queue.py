@@ -0,0 +1,84 @@
+"""Tests for the fair RAG queue scheduler."""
+
+import asyncio
+
+import pytest
+
+from services.rag_queue import FairScheduler, RAGJob, LANE_BULK, LANE_SMALL
+
+
+def _job(tenant, lane=LANE_BULK, name=None):
+    future = asyncio.get_running_loop().create_future()
+    return RAGJob(fn=None, args=(name or tenant,), future=future, tenant=tenant, lane=lane)
+
+
+async def _drain(scheduler, n):
+    order = []
+    for _ in range(n):
+        job = await scheduler.get()
+        order.append(job.args[0])
+        await scheduler.done(job, ok=True)
+    return order
+
+
+def test_tenants_are_served_round_robin():
+    async def _go():
+        scheduler = FairScheduler(max_size=50, max_per_tenant=10, bulk_max_running=1)
+        for i in range(4):
+            await scheduler.put(_job("owner:1", name=f"a{i}"))
+        await scheduler.put(_job("owner:2", name="b0"))
+        await scheduler.put(_job("owner:3", name="c0"))
+        return await _drain(scheduler, 6)
+
+    assert asyncio.run(_go()) == ["a0", "b0", "c0", "a1", "a2", "a3"]
+
+
+def test_small_lane_keeps_a_worker_free_from_bulk():
+    async def _go():
+        scheduler = FairScheduler(max_size=50, max_per_tenant=10, bulk_max_running=1, small_burst=4)
+        await scheduler.put(_job("owner:1", name="bulk0"))
+        await scheduler.put(_job("owner:1", name="bulk1"))
+        running = await scheduler.get()
+        await scheduler.put(_job("owner:2", LANE_SMALL, name="edit"))
+        # bulk 已達上限：下一件只能是 small，bulk1 等 bulk0 完成
+        small = await scheduler.get()
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(scheduler.get(), timeout=0.05)
+        await scheduler.done(running, ok=True)
+        after = await scheduler.get()
+        return running.args[0], small.args[0], after.args[0]
+
+    assert asyncio.run(_go()) == ("bulk0", "edit", "bulk1")
+
+
+def test_small_burst_lets_bulk_through():
+    async def _go():
+        scheduler = FairScheduler(max_size=50, max_per_tenant=10, bulk_max_running=1, small_burst=2)
+        for i in range(4):
+            await scheduler.put(_job("owner:1", LANE_SMALL, name=f"s{i}"))
+        await scheduler.put(_job("owner:2", name="bulk"))
+        return await _drain(scheduler, 5)
+
+    assert asyncio.run(_go()) == ["s0", "s1", "bulk", "s2", "s3"]
+
+
+def test_per_tenant_cap_rejects_only_that_tenant_and_stats():
+    async def _go():
+        scheduler = FairScheduler(max_size=50, max_per_tenant=2)
+        await scheduler.put(_job("owner:1"), wait=False)
+        await scheduler.put(_job("owner:1"), wait=False)
+        with pytest.raises(asyncio.QueueFull):
+            await scheduler.put(_job("owner:1"), wait=False)
+        await scheduler.put(_job("owner:2", LANE_SMALL), wait=False)
+        cancelled = _job("owner:2")
+        await scheduler.put(cancelled, wait=False)
+        cancelled.future.cancel()
+        await _drain(scheduler, 3)
+        return scheduler.stats()
+
+    stats = asyncio.run(_go())
+    owner1, owner2 = stats["tenants"]["owner:1"], stats["tenants"]["owner:2"]
+    assert stats["queued"] == 0
+    assert (owner1["enqueued"], owner1["completed"], owner1["rejected"]) == (2, 2, 1)
+    assert (owner2["completed"], owner2["cancelled"], owner2["queued"]) == (1, 1, 0)
+    assert owner1["max_wait_ms"] >= owner1["avg_wait_ms"] >= 0
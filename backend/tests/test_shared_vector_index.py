@@ -0,0 +1,120 @@
+"""Tests for the shared multi-tenant FAISS pool."""
+
+import gc
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture(scope="module")
+def svi(load_with_real_faiss):
+    return load_with_real_faiss("shared_vector_index.py", "shared_vector_index_under_test")
+
+
+def _vectors(n, d=8, seed=0):
+    return np.random.default_rng(seed).standard_normal((n, d)).astype(np.float32)
+
+
+def _flat(svi, vectors):
+    index = svi.faiss.IndexFlatL2(vectors.shape[1])
+    index.add(vectors)
+    return index
+
+
+def _assert_same_results(svi, view, own, queries, k=4):
+    d1, i1 = view.search(queries, k)
+    d2, i2 = own.search(queries, k)
+    assert np.array_equal(i1, i2)
+    assert np.array_equal(d1, d2)
+
+
+def test_views_match_per_assistant_indexes_through_adds_and_deletes(svi):
+    pool = svi.SharedIndexPool(shard_vectors=10_000)
+    own = {aid: _flat(svi, _vectors(30 + aid, seed=aid)) for aid in range(1, 4)}
+    views = {aid: pool.adopt(aid, index) for aid, index in own.items()}
+    queries = _vectors(5, seed=99)
+
+    # 新增 / 刪除：新內容寫入空閒範圍後替換指向，其他助理的區段不動
+    extra = _vectors(7, seed=42)
+    views[1].add(extra)
+    own[1].add(extra)
+    views[2].remove_ids(np.array([0, 5, 6]))
+    own[2].remove_ids(np.array([0, 5, 6], dtype=np.int64))
+
+    for aid, view in views.items():
+        assert view.ntotal == own[aid].ntotal
+        assert np.array_equal(view.reconstruct_n(0, view.ntotal), own[aid].reconstruct_n(0, own[aid].ntotal))
+        _assert_same_results(svi, view, own[aid], queries)
+    assert pool.stats()["vectors"] == sum(index.ntotal for index in own.values())
+
+
+def test_released_views_free_their_block(svi):
+    pool = svi.SharedIndexPool(shard_vectors=10_000)
+    keep = pool.adopt(1, _flat(svi, _vectors(20, seed=1)))
+    dropped = pool.adopt(2, _flat(svi, _vectors(10, seed=2)))
+    del dropped
+    gc.collect()
+
+    stats = pool.stats()
+
+    assert stats["vectors"] == 20
+    assert stats["assistants"] == 1
+    _assert_same_results(svi, keep, _flat(svi, _vectors(20, seed=1)), _vectors(3, seed=5))
+
+
+def test_released_block_is_reused_without_touching_other_blocks(svi):
+    pool = svi.SharedIndexPool(shard_vectors=10_000)
+    keep = pool.adopt(1, _flat(svi, _vectors(20, seed=1)))
+    dropped = pool.adopt(2, _flat(svi, _vectors(10, seed=2)))
+    shard = keep._shard
+    capacity = shard.capacity
+    start = shard.blocks[keep._block_id][0]
+    del dropped
+    gc.collect()
+
+    again = pool.adopt(3, _flat(svi, _vectors(10, seed=3)))
+
+    assert again._shard is shard
+    assert shard.capacity == capacity
+    assert shard.blocks[keep._block_id][0] == start
+    _assert_same_results(svi, keep, _flat(svi, _vectors(20, seed=1)), _vectors(3, seed=5))
+    _assert_same_results(svi, again, _flat(svi, _vectors(10, seed=3)), _vectors(3, seed=5))
+
+
+def test_mostly_free_shard_is_defragmented(svi):
+    pool = svi.SharedIndexPool(shard_vectors=100_000)
+    keep = pool.adopt(1, _flat(svi, _vectors(50, seed=1)))
+    dropped = [pool.adopt(aid, _flat(svi, _vectors(500, seed=aid))) for aid in range(2, 8)]
+    capacity = keep._shard.capacity
+    del dropped
+    gc.collect()
+
+    stats = pool.stats()
+
+    assert stats["vectors"] == 50
+    assert stats["shards"][0]["capacity"] < capacity
+    assert stats["shards"][0]["free_vectors"] == 0
+    _assert_same_results(svi, keep, _flat(svi, _vectors(50, seed=1)), _vectors(3, seed=5))
+
+
+def test_search_does_not_wait_for_writers(svi):
+    pool = svi.SharedIndexPool(shard_vectors=10_000)
+    view = pool.adopt(1, _flat(svi, _vectors(20, seed=1)))
+
+    # 寫入者之間串行，O(n) 的複製不持寫鎖，查詢照常進行
+    with view._shard._mutate:
+        _assert_same_results(svi, view, _flat(svi, _vectors(20, seed=1)), _vectors(3, seed=5))
+
+
+def test_empty_view_and_materialize(svi):
+    pool = svi.SharedIndexPool(shard_vectors=10_000)
+    view = pool.adopt(1, svi.faiss.IndexFlatL2(8))
+
+    distances, labels = view.search(_vectors(1), 3)
+    assert labels.tolist() == [[-1, -1, -1]]
+    assert np.isinf(distances).all()
+
+    view.add(_vectors(4))
+    standalone = view.materialize()
+    assert standalone.ntotal == 4
+    assert np.array_equal(standalone.reconstruct_n(0, 4), _vectors(4))
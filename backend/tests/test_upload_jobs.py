@@ -0,0 +1,214 @@
+"""Tests for durable background upload jobs: submit, completion, failure and stale-job recovery."""
+
+import asyncio
+import io
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import models.database as database
+from models.database import Base
+from models.models import KnowledgeBase, UploadJob
+from services import upload_jobs, vector_service
+
+
+class _Upload:
+    def __init__(self, filename, data):
+        self.filename = filename
+        self._buf = io.BytesIO(data)
+
+    async def read(self, size=-1):
+        return self._buf.read(size)
+
+
+@pytest.fixture
+def sessions(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    engine = create_engine(f"sqlite:///{tmp_path / 'jobs.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine)
+    monkeypatch.setattr(database, "SessionLocal", factory)
+    yield factory
+    engine.dispose()
+
+
+def _fake_store(calls, fail=False, fail_commit=False):
+    async def store_uploaded_file(assistant_id, filename, file_location, db, progress=None, *,
+                                  stale_doc_ids=(), upload_job_id=None, on_vectors_published=None,
+                                  before_commit=None):
+        calls.append({"path": file_location, "stale": list(stale_doc_ids), "job_id": upload_job_id})
+        on_vectors_published("d1, d2")
+        if fail:
+            raise RuntimeError("embedding failed")
+        entry = KnowledgeBase(
+            assistant_id=assistant_id, file_name=filename, file_type="TXT", description="d",
+            summary="s", keywords="k", doc_ids="d1, d2", token_count=3,
+        )
+        db.add(entry)
+        db.flush()
+        before_commit(entry)
+        if fail_commit:
+            raise RuntimeError("database is locked")
+        db.commit()
+        return {"km": {"id": entry.id}}
+
+    return store_uploaded_file
+
+
+def _fake_delete(deleted, fail=False, job_ids=None):
+    async def delete_uncommitted_vectors(assistant_id, doc_ids, db, upload_job_id=None):
+        if fail:
+            raise RuntimeError("rag queue unavailable")
+        deleted.append(list(doc_ids))
+        if job_ids is not None:
+            job_ids.append(upload_job_id)
+
+    return delete_uncommitted_vectors
+
+
+def _submit_and_wait(sessions, data=b"hello"):
+    async def _go():
+        db = sessions()
+        try:
+            job = await upload_jobs.submit_upload(1, _Upload("a.txt", data), db)
+            job_id, path = job.job_id, job.file_path
+        finally:
+            db.close()
+        await upload_jobs._tasks[job_id]
+        return job_id, path
+
+    return asyncio.run(_go())
+
+
+def test_job_commits_knowledge_base_and_finishes(sessions, monkeypatch):
+    calls = []
+    monkeypatch.setattr(vector_service, "store_uploaded_file", _fake_store(calls), raising=False)
+
+    job_id, path = _submit_and_wait(sessions)
+
+    db = sessions()
+    job = db.get(UploadJob, job_id)
+    assert (job.status, job.percent, job.attempts, job.pending_doc_ids) == ("done", 100, 1, None)
+    assert db.get(KnowledgeBase, job.knowledge_id).doc_ids == "d1, d2"
+    assert calls == [{"path": path, "stale": [], "job_id": job_id}]
+    assert upload_jobs.job_to_dict(job)["chunks_embedded"] == 2
+    db.close()
+
+
+def test_failed_job_records_error_and_removes_staged_file(sessions, monkeypatch):
+    deleted = []
+    monkeypatch.setattr(vector_service, "store_uploaded_file", _fake_store([], fail=True), raising=False)
+    monkeypatch.setattr(vector_service, "delete_uncommitted_vectors", _fake_delete(deleted), raising=False)
+
+    job_id, path = _submit_and_wait(sessions)
+
+    db = sessions()
+    job = db.get(UploadJob, job_id)
+    assert job.status == "failed"
+    assert job.error == "embedding failed"
+    assert job.pending_doc_ids is None
+    assert deleted == [["d1", "d2"]]
+    assert not os.path.exists(path)
+    assert db.query(KnowledgeBase).count() == 0
+    db.close()
+
+
+def test_commit_failure_after_publish_removes_published_vectors(sessions, monkeypatch):
+    deleted = []
+    monkeypatch.setattr(vector_service, "store_uploaded_file", _fake_store([], fail_commit=True), raising=False)
+    monkeypatch.setattr(vector_service, "delete_uncommitted_vectors", _fake_delete(deleted), raising=False)
+
+    job_id, _ = _submit_and_wait(sessions)
+
+    db = sessions()
+    job = db.get(UploadJob, job_id)
+    assert (job.status, job.error, job.pending_doc_ids) == ("failed", "database is locked", None)
+    assert deleted == [["d1", "d2"]]
+    assert db.query(KnowledgeBase).count() == 0
+    db.close()
+
+
+def test_job_stays_active_for_recovery_when_cleanup_fails(sessions, monkeypatch):
+    monkeypatch.setattr(vector_service, "store_uploaded_file", _fake_store([], fail_commit=True), raising=False)
+    monkeypatch.setattr(vector_service, "delete_uncommitted_vectors", _fake_delete([], fail=True), raising=False)
+
+    job_id, path = _submit_and_wait(sessions)
+
+    db = sessions()
+    job = db.get(UploadJob, job_id)
+    assert (job.status, job.pending_doc_ids) == ("running", "d1, d2")
+    assert os.path.exists(path)
+    db.close()
+
+
+def test_stale_jobs_are_claimed_once_and_rerun_with_pending_doc_ids(sessions, monkeypatch):
+    db = sessions()
+    old = datetime.utcnow() - timedelta(minutes=10)
+    final = upload_jobs.final_path(1, "b.txt")
+    os.makedirs(os.path.dirname(final), exist_ok=True)
+    with open(final, "w") as f:
+        f.write("moved before the crash")
+    db.add_all([
+        UploadJob(job_id="stale-job-1", assistant_id=1, file_name="b.txt", file_path="missing.txt",
+                  status="running", attempts=1, pending_doc_ids="x1, x2", worker_id="gone", heartbeat_at=old),
+        UploadJob(job_id="fresh-job-1", assistant_id=1, file_name="c.txt", file_path="c.txt",
+                  status="running", worker_id="alive", heartbeat_at=datetime.utcnow()),
+        UploadJob(job_id="done-job-01", assistant_id=1, file_name="d.txt", file_path="d.txt",
+                  status="done", heartbeat_at=old),
+    ])
+    db.commit()
+
+    assert upload_jobs.claim_stale_jobs(db, stale_seconds=60) == ["stale-job-1"]
+    assert upload_jobs.claim_stale_jobs(db, stale_seconds=60) == []
+
+    calls = []
+    monkeypatch.setattr(vector_service, "store_uploaded_file", _fake_store(calls), raising=False)
+    asyncio.run(upload_jobs._run_job("stale-job-1"))
+
+    db.expire_all()
+    job = db.get(UploadJob, "stale-job-1")
+    assert (job.status, job.attempts) == ("done", 2)
+    assert calls == [{"path": final, "stale": ["x1", "x2"], "job_id": "stale-job-1"}]
+    db.close()
+
+
+def test_failure_cleanup_covers_chunks_published_before_doc_ids_were_recorded(sessions, monkeypatch):
+    # 上次執行發布後、pending_doc_ids 提交前當機：只能以 job_id 找到這些 chunk
+    deleted, job_ids = [], []
+    monkeypatch.setattr(vector_service, "delete_uncommitted_vectors", _fake_delete(deleted, job_ids=job_ids),
+                        raising=False)
+    db = sessions()
+    db.add(UploadJob(job_id="crashed-job-1", assistant_id=1, file_name="f.txt", file_path="missing.txt",
+                     status="running", attempts=1))
+    db.commit()
+
+    asyncio.run(upload_jobs._run_job("crashed-job-1"))
+
+    db.expire_all()
+    assert db.get(UploadJob, "crashed-job-1").status == "failed"
+    assert (deleted, job_ids) == ([[]], ["crashed-job-1"])
+    db.close()
+
+
+def test_job_stops_after_max_attempts(sessions, monkeypatch):
+    deleted = []
+    monkeypatch.setattr(vector_service, "delete_uncommitted_vectors", _fake_delete(deleted), raising=False)
+    db = sessions()
+    db.add(UploadJob(job_id="crashy-job-1", assistant_id=1, file_name="e.txt", file_path="e.txt",
+                     status="running", attempts=upload_jobs.UPLOAD_JOB_MAX_ATTEMPTS, pending_doc_ids="p1, p2"))
+    db.commit()
+    with open("e.txt", "w") as f:
+        f.write("x")
+
+    asyncio.run(upload_jobs._run_job("crashy-job-1"))
+
+    db.expire_all()
+    job = db.get(UploadJob, "crashy-job-1")
+    assert job.status == "failed"
+    assert "attempts" in job.error
+    assert job.pending_doc_ids is None
+    assert deleted == [["p1", "p2"]]
+    db.close()
@@ -0,0 +1,47 @@
+"""Tests for per-job upload progress tracking."""
+
+from services import upload_progress
+
+
+def test_progress_moves_through_stages_and_interpolates_ingest():
+    job = upload_progress.start_upload(7, "a.pdf")
+
+    job.set_stage("queued")
+    assert job.to_dict()["percent"] == 5.0
+    job.set_parsed(0.5)
+    job.set_ingested(0.5, 100, 40.0)
+    data = job.to_dict()
+    assert data["stage"] == "ingesting"
+    assert data["percent"] == 47.5
+    assert (data["chunks_embedded"], data["chunks_per_sec"]) == (100, 40.0)
+
+    # 進度不倒退
+    job.set_ingested(0.2, 120)
+    assert job.to_dict()["percent"] == 47.5
+    job.set_stage("saving")
+    assert job.to_dict()["percent"] == 97.0
+    job.finish()
+    assert job.to_dict()["state"] == "done"
+    assert job.to_dict()["percent"] == 100.0
+
+
+def test_client_job_ids_are_validated_and_listed_per_assistant():
+    kept = upload_progress.start_upload(8, "a.txt", "client-job-0001")
+    generated = upload_progress.start_upload(8, "b.txt", "bad id!")
+    upload_progress.start_upload(9, "c.txt")
+
+    assert kept.job_id == "client-job-0001"
+    assert generated.job_id != "bad id!" and upload_progress.valid_job_id(generated.job_id)
+    assert upload_progress.get_upload("client-job-0001") is kept
+    assert {job["filename"] for job in upload_progress.list_uploads(8)} == {"a.txt", "b.txt"}
+
+
+def test_finished_jobs_expire_after_ttl(monkeypatch):
+    job = upload_progress.start_upload(10, "a.txt")
+    job.fail("boom")
+    assert upload_progress.list_uploads(10)[0]["error"] == "boom"
+
+    monkeypatch.setenv("UPLOAD_PROGRESS_TTL_SECONDS", "0")
+    job.finished_at -= 1
+    assert upload_progress.list_uploads(10) == []
+    assert upload_progress.get_upload(job.job_id) is None
@@ -0,0 +1,135 @@
+"""Tests for append-only delta segments and the tombstone log."""
+
+import numpy as np
+
+from services import vector_segments
+from services.vector_segments import SegmentManifest
+
+
+class _Doc:
+    def __init__(self, text):
+        self.page_content = text
+        self.metadata = {}
+
+
+def _prefix(tmp_path):
+    return str(tmp_path / "assistant_1")
+
+
+def test_manifest_defaults_and_round_trip(tmp_path):
+    prefix = _prefix(tmp_path)
+    assert vector_segments.read_manifest(prefix) == SegmentManifest()
+
+    vector_segments.write_manifest(prefix, SegmentManifest(base_seq=2, last_seq=5, tombstones=3))
+
+    manifest = vector_segments.read_manifest(prefix)
+    assert (manifest.base_seq, manifest.last_seq, manifest.tombstones) == (2, 5, 3)
+    assert manifest.delta_count == 3
+
+
+def test_only_complete_deltas_are_listed(tmp_path):
+    prefix = _prefix(tmp_path)
+    vector_segments.write_delta(prefix, 2, np.ones((1, 4)), [("x", _Doc("X"))])
+    vector_segments.write_delta(prefix, 1, np.zeros((2, 4)), [("a", _Doc("A")), ("b", _Doc("B"))])
+    # 只寫到 chunk 檔就中斷的區段不算完成
+    _, orphan_chunks = vector_segments.delta_paths(prefix, 3)
+    open(orphan_chunks, "wb").close()
+
+    deltas = vector_segments.list_deltas(prefix)
+
+    assert [seq for seq, _, _ in deltas] == [1, 2]
+    vectors = vector_segments.load_delta_vectors(deltas[0][1])
+    assert vectors.dtype == np.float32 and vectors.shape == (2, 4)
+    # 無 manifest 時磁碟上的區段都未提交
+    assert vector_segments.read_manifest(prefix).last_seq == 0
+
+
+def test_tombstones_group_by_sequence_and_skip_torn_line(tmp_path):
+    prefix = _prefix(tmp_path)
+    vector_segments.append_tombstones(prefix, 0, ["a"])
+    vector_segments.append_tombstones(prefix, 2, ["b", "c"])
+    vector_segments.append_tombstones(prefix, 0, ["d"])
+    vector_segments.append_tombstones(prefix, 3, [])
+    with open(vector_segments.tombstone_path(prefix), "a", encoding="utf-8") as f:
+        f.write('{"after": 4, "ids": ["tor')
+
+    assert vector_segments.read_tombstones(prefix) == {0: ["a", "d"], 2: ["b", "c"]}
+
+
+def test_only_committed_tombstones_are_read(tmp_path):
+    prefix = _prefix(tmp_path)
+    vector_segments.append_tombstones(prefix, 1, ["a"])
+    manifest = SegmentManifest(last_seq=1, base_id="base-1", tombstone_bytes=vector_segments.tombstone_size(prefix))
+    vector_segments.write_manifest(prefix, manifest)
+    # 寫入中的下一批墓碑：manifest 尚未提交
+    vector_segments.append_tombstones(prefix, 1, ["b"])
+
+    committed = vector_segments.read_manifest(prefix)
+
+    assert committed == manifest
+    assert vector_segments.read_tombstones(prefix, committed.tombstone_bytes) == {1: ["a"]}
+    assert vector_segments.read_tombstones(prefix) == {1: ["a", "b"]}
+
+
+def test_remove_segments_keeps_manifest_and_other_assistants(tmp_path):
+    prefix = _prefix(tmp_path)
+    other = str(tmp_path / "assistant_10")
+    vector_segments.write_delta(prefix, 1, np.zeros((1, 4)), [("a", _Doc("A"))])
+    vector_segments.write_delta(other, 1, np.zeros((1, 4)), [("a", _Doc("A"))])
+    vector_segments.append_tombstones(prefix, 1, ["a"])
+    vector_segments.write_manifest(prefix, SegmentManifest(base_seq=1, last_seq=1))
+
+    vector_segments.remove_segments(prefix)
+
+    assert vector_segments.list_deltas(prefix) == []
+    assert vector_segments.read_tombstones(prefix) == {}
+    assert vector_segments.read_manifest(prefix).last_seq == 1
+    assert len(vector_segments.list_deltas(other)) == 1
+
+
+def test_remove_deltas_after_keeps_committed_segments(tmp_path):
+    prefix = _prefix(tmp_path)
+    for seq in (1, 2, 3):
+        vector_segments.write_delta(prefix, seq, np.zeros((1, 4)), [(f"d{seq}", _Doc("D"))])
+    # 寫入中斷留下的暫存檔
+    open(f"{vector_segments.delta_paths(prefix, 4)[0]}.123.tmp", "wb").close()
+    vector_segments.append_tombstones(prefix, 1, ["d1"])
+
+    removed = vector_segments.remove_deltas_after(prefix, 1)
+
+    assert removed == 5
+    assert [seq for seq, _, _ in vector_segments.list_deltas(prefix)] == [1]
+    assert vector_segments.segment_files(prefix) == sorted(
+        [*vector_segments.delta_paths(prefix, 1), vector_segments.tombstone_path(prefix)]
+    )
+
+
+def test_generation_token_changes_on_every_write_and_survives_segment_cleanup(tmp_path):
+    prefix = _prefix(tmp_path)
+    assert vector_segments.read_generation(prefix) is None
+
+    first = vector_segments.write_generation(prefix)
+    second = vector_segments.write_generation(prefix)
+    vector_segments.remove_segments(prefix)
+
+    assert first != second
+    assert vector_segments.read_generation(prefix) == second
+
+
+def test_committed_texts_are_read_from_base_and_manifest_deltas(tmp_path, monkeypatch):
+    from types import SimpleNamespace
+
+    from services import chunk_store
+
+    monkeypatch.setattr(chunk_store, "Document", SimpleNamespace)
+    prefix = _prefix(tmp_path)
+    assert vector_segments.read_committed_texts(prefix, ["a"]) == []
+
+    chunk_store.write_chunk_store(vector_segments.base_chunks_path(prefix), [("a", _Doc("甲")), ("b", _Doc("乙"))])
+    vector_segments.write_delta(prefix, 1, np.ones((1, 4)), [("c", _Doc("丙"))])
+    # manifest 之外的區段（寫入中、尚未提交）不讀
+    vector_segments.write_delta(prefix, 2, np.ones((1, 4)), [("d", _Doc("丁"))])
+    vector_segments.write_manifest(prefix, SegmentManifest(base_seq=0, last_seq=1))
+
+    assert vector_segments.read_committed_texts(prefix, ["c", "missing", "a", "d"]) == ["丙", "甲"]
+    assert vector_segments.read_committed_texts(prefix, ["a", "b", "c"], max_chars=3) == ["甲", "乙"]
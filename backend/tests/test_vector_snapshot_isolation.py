@@ -0,0 +1,20 @@
+"""Pytest wrapper: 以子程序執行向量庫快照隔離測試（需要實際的 faiss / langchain，避免 conftest stub 衝突）。"""
+
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_ROOT = Path(__file__).resolve().parents[1]
+SCRIPT = BACKEND_ROOT / "load_tests" / "test_vector_snapshot_isolation.py"
+
+
+def test_vector_snapshot_isolation_suite():
+    result = subprocess.run(
+        [sys.executable, str(SCRIPT)],
+        cwd=BACKEND_ROOT,
+        capture_output=True,
+        text=True,
+        timeout=300,
+    )
+    output = (result.stdout or "") + (result.stderr or "")
+    assert result.returncode == 0, output
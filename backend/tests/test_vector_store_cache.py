@@ -0,0 +1,77 @@
+"""Tests for the memory-bounded vector-store LRU."""
+
+from types import SimpleNamespace
+
+from utils.vector_store_cache import VectorStoreCache, estimate_store_bytes
+
+
+def _store(vectors, dim=4, docs=()):
+    index = SimpleNamespace(ntotal=vectors, d=dim)
+    docstore = SimpleNamespace(_dict={
+        str(i): SimpleNamespace(page_content=text, metadata={"doc_id": str(i)})
+        for i, text in enumerate(docs)
+    })
+    return SimpleNamespace(index=index, docstore=docstore)
+
+
+def test_estimate_counts_vectors_and_documents():
+    empty = estimate_store_bytes(_store(0))
+    vectors_only = estimate_store_bytes(_store(10, dim=4))
+    with_docs = estimate_store_bytes(_store(10, dim=4, docs=["營業時間為九點到六點"]))
+
+    assert empty == 0
+    assert vectors_only == 10 * 4 * 4
+    assert with_docs > vectors_only
+
+
+def test_evicts_least_recently_used_over_budget():
+    evicted = []
+    cache = VectorStoreCache(max_bytes=100, on_evict=evicted.append, size_fn=lambda s: s.size)
+    cache[1] = SimpleNamespace(size=40)
+    cache[2] = SimpleNamespace(size=40)
+    assert cache.get(1) is not None  # 1 變成最近使用
+
+    cache[3] = SimpleNamespace(size=40)
+
+    assert evicted == [2]
+    assert 2 not in cache and 1 in cache and 3 in cache
+    stats = cache.stats()
+    assert stats["bytes"] == 80
+    assert stats["evictions_total"] == 1
+    assert stats["evicted"] == {2: 1}
+
+
+def test_oversized_entry_is_kept_alone():
+    evicted = []
+    cache = VectorStoreCache(max_bytes=50, on_evict=evicted.append, size_fn=lambda s: s.size)
+    cache[1] = SimpleNamespace(size=20)
+    big = SimpleNamespace(size=80)
+
+    cache[2] = big
+
+    assert evicted == [1]
+    assert cache.get(2) is big
+    assert len(cache) == 1
+
+
+def test_refresh_size_after_in_place_growth():
+    cache = VectorStoreCache(max_bytes=0, size_fn=lambda s: s.size)
+    store = SimpleNamespace(size=10)
+    cache[7] = store
+    store.size = 30
+
+    cache.refresh_size(7)
+
+    stats = cache.stats()
+    assert stats["bytes"] == 30
+    assert stats["resident"][0]["loads"] == 1
+
+
+def test_pop_releases_bytes():
+    cache = VectorStoreCache(max_bytes=0, size_fn=lambda s: s.size)
+    cache[1] = SimpleNamespace(size=10)
+
+    assert cache.pop(1) is not None
+    assert cache.pop(1) is None
+    assert cache.stats()["bytes"] == 0
+    assert 1 not in cache
@@ -0,0 +1,95 @@
+"""Tests for ranking and warming the most recently active assistants' vector stores."""
+
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from models.models import Conversation, Message
+from services import vector_warmup
+
+
+def _conversation(db, assistant_id, created_at, message_times=()):
+    conv = Conversation(assistant_id=assistant_id, customer_id="c", created_at=created_at)
+    db.add(conv)
+    db.flush()
+    for ts in message_times:
+        db.add(Message(conversation_id=conv.conversation_id, sender="客戶", content="hi", timestamp=ts))
+    db.commit()
+
+
+@pytest.fixture
+def activity(db_session):
+    now = datetime.utcnow()
+    _conversation(db_session, 1, now - timedelta(days=3), [now - timedelta(days=3), now - timedelta(hours=5)])
+    _conversation(db_session, 2, now - timedelta(days=1), [now - timedelta(minutes=10)])
+    _conversation(db_session, 3, now - timedelta(hours=1))  # 尚無訊息：以對話建立時間排序
+    _conversation(db_session, 4, now - timedelta(days=90), [now - timedelta(days=90)])
+    return db_session
+
+
+def test_rank_recent_assistants_orders_by_last_activity(activity):
+    assert vector_warmup.rank_recent_assistants(activity, 10) == [2, 3, 1, 4]
+    assert vector_warmup.rank_recent_assistants(activity, 2) == [2, 3]
+    assert vector_warmup.rank_recent_assistants(activity, 10, lookback_days=30) == [2, 3, 1]
+
+
+class _Cache(dict):
+    def __init__(self, max_bytes=0):
+        super().__init__()
+        self.max_bytes = max_bytes
+
+    def stats(self):
+        return {"max_bytes": self.max_bytes, "bytes": 100 * len(self)}
+
+
+def test_run_loads_ranked_assistants_and_reports_progress(activity, monkeypatch):
+    import models.database
+    from services import vector_service
+
+    cache = _Cache()
+    cache[2] = object()
+    loaded = []
+
+    def _load(aid):
+        loaded.append(aid)
+        cache[aid] = object()
+        return cache[aid]
+
+    monkeypatch.setattr(models.database, "SessionLocal", lambda: SimpleNamespace(
+        query=activity.query, close=lambda: None,
+    ))
+    monkeypatch.setattr(vector_service, "vector_store", cache, raising=False)
+    monkeypatch.setattr(vector_service, "disk_vector_store_exists", lambda aid: aid != 3, raising=False)
+    monkeypatch.setattr(vector_service, "load_vector_store", _load, raising=False)
+    monkeypatch.setattr(vector_service, "get_bm25_index", lambda aid, vs: None, raising=False)
+    monkeypatch.setattr(vector_warmup, "_status", {})
+
+    vector_warmup._run(limit=10, concurrency=2, lookback_days=0)
+
+    status = vector_warmup.warmup_status()
+    assert sorted(loaded) == [1, 4]
+    assert status["state"] == "done"
+    assert status["assistants"] == [2, 3, 1, 4]
+    assert (status["done"], status["loaded"], status["cached"], status["missing"]) == (4, 2, 1, 1)
+
+
+def test_run_stops_when_cache_budget_is_nearly_full(activity, monkeypatch):
+    import models.database
+    from services import vector_service
+
+    cache = _Cache(max_bytes=150)
+    monkeypatch.setattr(models.database, "SessionLocal", lambda: SimpleNamespace(
+        query=activity.query, close=lambda: None,
+    ))
+    monkeypatch.setattr(vector_service, "vector_store", cache, raising=False)
+    monkeypatch.setattr(vector_service, "disk_vector_store_exists", lambda aid: True, raising=False)
+    monkeypatch.setattr(vector_service, "load_vector_store", lambda aid: cache.setdefault(aid, object()), raising=False)
+    monkeypatch.setattr(vector_service, "get_bm25_index", lambda aid, vs: None, raising=False)
+    monkeypatch.setattr(vector_warmup, "_status", {})
+
+    vector_warmup._run(limit=10, concurrency=1, lookback_days=0)
+
+    status = vector_warmup.warmup_status()
+    assert status["loaded"] == 2
+    assert status["skipped"] == 2
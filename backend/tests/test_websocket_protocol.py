@@ -0,0 +1,138 @@
+"""Chat WebSocket framing: protocol v2 JSON frames and the legacy @@@ / ### flow."""
+
+import importlib
+import json
+import sys
+import types
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from models.database import Base
+from models.models import AIAssistant, Message, User
+
+ASSISTANT_ID = 7
+NOIDEA = "我不知道"
+
+
+class FakeLLMConnectionError(Exception):
+    pass
+
+
+@pytest.fixture
+def ws(monkeypatch):
+    """載入 routers.websocket（以 stub 取代需要 langchain 的 services.llm_service），回傳 (client, session factory, state)。"""
+    state = {"deltas": ["你", "好"], "fail": None}
+
+    async def stream_message_through_llm(*args):
+        for delta in state["deltas"]:
+            yield delta
+        if state["fail"] is not None:
+            raise state["fail"]
+
+    async def process_message_through_llm(*args):
+        if state["fail"] is not None:
+            raise state["fail"]
+        return "".join(state["deltas"])
+
+    llm_stub = types.ModuleType("services.llm_service")
+    llm_stub.stream_message_through_llm = stream_message_through_llm
+    llm_stub.process_message_through_llm = process_message_through_llm
+    llm_stub._is_llm_connection_error = lambda e: isinstance(e, FakeLLMConnectionError)
+    monkeypatch.setitem(sys.modules, "services.llm_service", llm_stub)
+    sys.modules.pop("routers.websocket", None)
+    module = importlib.import_module("routers.websocket")
+
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine)
+    db = factory()
+    owner = User(email="ws-owner@example.com", password="test-hash")
+    db.add(owner)
+    db.commit()
+    db.add(AIAssistant(
+        assistant_id=ASSISTANT_ID, name="WS", description="desc", owner_id=owner.user_id,
+        language="zh-TW", link="ws-test", message_welcome="歡迎", message_noidea=NOIDEA,
+    ))
+    db.commit()
+    db.close()
+    monkeypatch.setattr(module, "SessionLocal", factory)
+    monkeypatch.setattr(module, "setting", {"model": "test-model"})
+
+    app = FastAPI()
+    app.include_router(module.router)
+    with TestClient(app) as client:
+        yield client, factory, state
+    sys.modules.pop("routers.websocket", None)
+    engine.dispose()
+
+
+def _turn_frames(conn):
+    frames = [json.loads(conn.receive_text())]
+    while frames[-1]["type"] not in ("end", "error"):
+        frames.append(json.loads(conn.receive_text()))
+    return frames
+
+
+def test_protocol_2_streams_start_deltas_and_one_end_frame(ws):
+    client, factory, _ = ws
+    with client.websocket_connect(f"/ws/assistant/{ASSISTANT_ID}/c1?protocol=2") as conn:
+        conn.send_text("嗨")
+        frames = _turn_frames(conn)
+        conn.send_text("再一次")
+        second = _turn_frames(conn)
+
+    assert [f["type"] for f in frames] == ["start", "delta", "delta", "end"]
+    assert all(f["v"] == 2 and f["channel"] == "chat" for f in frames)
+    assert [f["text"] for f in frames[1:]] == ["你", "好", "你好"]
+    assert [f["type"] for f in second] == ["start", "delta", "delta", "end"]
+    db = factory()
+    assert [m.content for m in db.query(Message).filter(Message.sender == "助理")] == ["你好", "你好"]
+    db.close()
+
+
+def test_protocol_2_connection_error_sends_error_instead_of_end(ws):
+    client, _, state = ws
+    state["deltas"], state["fail"] = ["部分"], FakeLLMConnectionError("vLLM down")
+    with client.websocket_connect(f"/ws/assistant/{ASSISTANT_ID}/c2?protocol=2") as conn:
+        conn.send_text("嗨")
+        frames = _turn_frames(conn)
+        # 下一回合仍從 start 開始：上一回合沒有殘留的 end 訊框
+        state["deltas"], state["fail"] = ["好"], None
+        conn.send_text("再一次")
+        second = _turn_frames(conn)
+
+    assert [f["type"] for f in frames] == ["start", "delta", "error"]
+    assert frames[-1]["text"] == NOIDEA
+    assert [f["type"] for f in second] == ["start", "delta", "end"]
+
+
+def test_protocol_2_unexpected_error_sends_single_error_frame(ws):
+    client, _, state = ws
+    state["fail"] = RuntimeError("boom")
+    with client.websocket_connect(f"/ws/assistant/{ASSISTANT_ID}/c3?protocol=2") as conn:
+        conn.send_text("嗨")
+        frames = _turn_frames(conn)
+        state["fail"] = None
+        conn.send_text("再一次")
+        second = _turn_frames(conn)
+
+    assert [f["type"] for f in frames] == ["start", "delta", "delta", "error"]
+    assert second[0]["type"] == "start"
+
+
+def test_legacy_clients_keep_plain_text_markers(ws):
+    client, _, state = ws
+    with client.websocket_connect(f"/ws/assistant/{ASSISTANT_ID}/c4") as conn:
+        conn.send_text("嗨")
+        legacy = [conn.receive_text() for _ in range(3)]
+        state["fail"] = FakeLLMConnectionError("vLLM down")
+        conn.send_text("再一次")
+        legacy_error = [conn.receive_text() for _ in range(3)]
+
+    assert legacy == ["@@@", "###", "你好"]
+    assert legacy_error == ["@@@", "###", NOIDEA]
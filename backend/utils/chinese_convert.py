@@ -45,3 +45,43 @@ def to_traditional_tw(text: str) -> str:
     except Exception:
         logger.exception("[簡轉繁] 轉換失敗，回傳原始文字")
         return text
+
+
+# 詞組轉換需看到完整詞：只在標點、空白等邊界切段，避免一個詞被拆在兩段各自轉換
+_SAFE_BOUNDARY_CHARS = frozenset("，。！？；：、,.!?;:\n\r\t )）」』】》")
+
+
+class IncrementalTraditionalConverter:
+    """
+    串流回覆用的增量簡轉繁：feed() 累積 token，僅輸出到最後一個安全邊界為止的已轉換文字，
+    其餘暫存；超過 max_pending_chars 仍無邊界時強制輸出。結束時呼叫 flush()。
+    """
+
+    def __init__(self, *, enabled: bool = True, max_pending_chars: int = 64):
+        self._enabled = enabled
+        self._max_pending_chars = max(1, max_pending_chars)
+        self._pending = ""
+
+    def feed(self, text: str) -> str:
+        if not text:
+            return ""
+        if not self._enabled:
+            return text
+        self._pending += text
+        cut = -1
+        for i in range(len(self._pending) - 1, -1, -1):
+            if self._pending[i] in _SAFE_BOUNDARY_CHARS:
+                cut = i + 1
+                break
+        if cut < 0:
+            if len(self._pending) < self._max_pending_chars:
+                return ""
+            cut = len(self._pending)
+        ready, self._pending = self._pending[:cut], self._pending[cut:]
+        return to_traditional_tw(ready)
+
+    def flush(self) -> str:
+        ready, self._pending = self._pending, ""
+        if not ready:
+            return ""
+        return to_traditional_tw(ready) if self._enabled else ready
@@ -0,0 +1,111 @@
+"""文件解析 / 切塊 / token 計數的純 CPU 工作，可於 services.document_ingest 的子行程池中執行。
+
+輸入與輸出都是 (page_content, metadata) tuple 等可 pickle 的資料，不依賴 langchain_core 的 Document。
+放在 utils 而非 services：子行程以 spawn 啟動並重新 import 此模組，若經由 services 套件會連帶載入
+llm_service / vector_service（torch、摘要模型、FAISS），每個子行程多出數 GB 記憶體。
+
+切塊參數與上傳路徑一致：chunk_size=300、chunk_overlap=50，分隔符依序為段落、換行、中英文句號。
+"""
+
+from __future__ import annotations
+
+import copy
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+CHUNK_SIZE = 300
+CHUNK_OVERLAP = 50
+SEPARATORS = ["\n\n", "\n", "。", "！", "？", ".", "!", "?", " ", ""]
+
+Chunk = Tuple[str, Dict[str, Any]]
+
+_splitters: Dict[Tuple[int, int], Any] = {}
+_tokenizer = None
+
+
+def build_text_splitter(chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP):
+    from langchain_text_splitters import RecursiveCharacterTextSplitter  # pyright: ignore[reportMissingImports]
+
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        separators=SEPARATORS,
+    )
+
+
+def _splitter(chunk_size: int, chunk_overlap: int):
+    key = (chunk_size, chunk_overlap)
+    if key not in _splitters:
+        _splitters[key] = build_text_splitter(chunk_size, chunk_overlap)
+    return _splitters[key]
+
+
+def count_tokens(texts: Sequence[str]) -> int:
+    """與 vector_service.calculate_token_count 相同的 cl100k_base 計數。"""
+    global _tokenizer
+    if _tokenizer is None:
+        import tiktoken  # pyright: ignore[reportMissingImports]
+
+        _tokenizer = tiktoken.get_encoding("cl100k_base")
+    return sum(len(_tokenizer.encode(text)) for text in texts)
+
+
+def split_pages(
+    pages: Sequence[Chunk],
+    chunk_size: int = CHUNK_SIZE,
+    chunk_overlap: int = CHUNK_OVERLAP,
+) -> Tuple[List[Chunk], List[int]]:
+    """逐頁切 chunk（結果與 splitter.split_documents 相同），回傳 (chunks, 每個 chunk 的 token 數)。"""
+    splitter = _splitter(chunk_size, chunk_overlap)
+    chunks: List[Chunk] = []
+    for text, metadata in pages:
+        chunks.extend((chunk, copy.deepcopy(metadata)) for chunk in splitter.split_text(text))
+    return chunks, [count_tokens([text]) for text, _ in chunks]
+
+
+def pdf_page_count(path: str) -> int:
+    import pypdf  # pyright: ignore[reportMissingImports]
+
+    with open(path, "rb") as f:
+        return len(pypdf.PdfReader(f).pages)
+
+
+def read_pdf_pages(path: str, start: int = 0, end: Optional[int] = None, source: Optional[str] = None) -> List[Chunk]:
+    """擷取 [start, end) 頁的文字；metadata 與 PyPDFLoader 相同（source / page）。"""
+    import pypdf  # pyright: ignore[reportMissingImports]
+
+    with open(path, "rb") as f:
+        reader = pypdf.PdfReader(f)
+        end = len(reader.pages) if end is None else min(end, len(reader.pages))
+        return [
+            (reader.pages[n].extract_text(), {"source": source or path, "page": n})
+            for n in range(start, end)
+        ]
+
+
+def chunk_pdf_range(
+    path: str,
+    start: int,
+    end: int,
+    source: Optional[str] = None,
+    chunk_size: int = CHUNK_SIZE,
+    chunk_overlap: int = CHUNK_OVERLAP,
+) -> Tuple[List[Chunk], List[int]]:
+    return split_pages(read_pdf_pages(path, start, end, source), chunk_size, chunk_overlap)
+
+
+def chunk_docx(
+    path: str,
+    source: Optional[str] = None,
+    chunk_size: int = CHUNK_SIZE,
+    chunk_overlap: int = CHUNK_OVERLAP,
+) -> Tuple[List[Chunk], List[int]]:
+    """UnstructuredWordDocumentLoader 一次載入整份 DOCX（預設單一 Document）後切塊。"""
+    from langchain_community.document_loaders import UnstructuredWordDocumentLoader  # pyright: ignore[reportMissingImports]
+
+    pages = []
+    for doc in UnstructuredWordDocumentLoader(path).lazy_load():
+        metadata = dict(doc.metadata)
+        if source is not None:
+            metadata["source"] = source
+        pages.append((doc.page_content, metadata))
+    return split_pages(pages, chunk_size, chunk_overlap)
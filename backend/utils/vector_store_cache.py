@@ -0,0 +1,209 @@
+"""有記憶體上限的向量庫快取（取代 vector_service 原本無上限的 dict）。
+
+每個已載入助理的 FAISS 向量庫估算位元組數（index 向量 + docstore 文字 / metadata），
+總量超過 VECTOR_STORE_CACHE_MAX_MB 時淘汰最久未使用的助理；之後再被查詢時由
+vector_service.load_vector_store 從磁碟延遲載回。
+
+介面與 dict 相容（get / pop / [] / in / len），vector_service 既有寫法不需改動。
+放在 utils 而非 services：vector_service 於模組載入時即需建立實例，避免經由 services 套件循環匯入。
+
+環境變數：
+  VECTOR_STORE_CACHE_MAX_MB   記憶體預算 MB（預設 2048；0 = 不限制）
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from utils.logger import get_logger
+
+logger = get_logger(__name__)
+
+# docstore 每筆 Document 物件本身（含 metadata dict、index_to_docstore_id 對應）的估計額外開銷
+_DOC_OVERHEAD_BYTES = 400
+
+
+def estimate_store_bytes(store: Any) -> int:
+    """估算 LangChain FAISS 向量庫常駐記憶體：index 編碼大小 + docstore 內容。"""
+    total = 0
+    index = getattr(store, "index", None)
+    if index is not None:
+        ntotal = int(getattr(index, "ntotal", 0) or 0)
+        code_size = getattr(index, "code_size", None)
+        storage = getattr(index, "storage", None)
+        if not code_size and storage is not None:
+            # HNSW：向量編碼位於 storage 子索引（含 sq8 / pq 量化）
+            try:
+                import faiss  # pyright: ignore[reportMissingImports]
+
+                code_size = getattr(faiss.downcast_index(storage), "code_size", None)
+            except Exception:
+                code_size = None
+        if not code_size:
+            code_size = int(getattr(index, "d", 0) or 0) * 4
+        total += ntotal * int(code_size)
+    docstore = getattr(store, "docstore", None)
+    memory_bytes = getattr(docstore, "memory_bytes", None)
+    if callable(memory_bytes):
+        # mmap chunk 檔：文字位於 page cache，只計常駐的 id / metadata
+        return total + int(memory_bytes())
+    docs = getattr(docstore, "_dict", None)
+    if isinstance(docs, dict):
+        for doc in docs.values():
+            total += _DOC_OVERHEAD_BYTES
+            content = getattr(doc, "page_content", None)
+            if isinstance(content, str):
+                # CPython str 依內容使用 1/2/4 bytes per char；以 sys.getsizeof 取實際大小
+                total += sys.getsizeof(content)
+            metadata = getattr(doc, "metadata", None)
+            if isinstance(metadata, dict):
+                total += sum(sys.getsizeof(v) for v in metadata.values())
+    return total
+
+
+@dataclass
+class _Residency:
+    bytes: int
+    loaded_at: float
+    last_access: float
+    hits: int = 0
+
+
+class VectorStoreCache:
+    """執行緒安全 LRU；插入或更新時重新估算大小並依預算淘汰（剛寫入的項目不會被淘汰）。"""
+
+    def __init__(
+        self,
+        *,
+        max_bytes: int = 0,
+        on_evict: Optional[Callable[[Hashable], None]] = None,
+        size_fn: Callable[[Any], int] = estimate_store_bytes,
+    ):
+        self.max_bytes = max(0, int(max_bytes))
+        self._on_evict = on_evict
+        self._size_fn = size_fn
+        self._lock = threading.RLock()
+        self._stores: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._residency: Dict[Hashable, _Residency] = {}
+        self._bytes = 0
+        self._evictions: Dict[Hashable, int] = {}
+        self._loads: Dict[Hashable, int] = {}
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._stores
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._stores)
+
+    def __getitem__(self, key: Hashable) -> Any:
+        store = self.get(key)
+        if store is None:
+            raise KeyError(key)
+        return store
+
+    def __setitem__(self, key: Hashable, store: Any) -> None:
+        self.put(key, store)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            store = self._stores.get(key)
+            if store is None:
+                return default
+            self._stores.move_to_end(key)
+            info = self._residency[key]
+            info.hits += 1
+            info.last_access = time.time()
+            return store
+
+    def put(self, key: Hashable, store: Any) -> None:
+        size = self._size_fn(store)
+        evicted = []
+        with self._lock:
+            now = time.time()
+            old = self._residency.get(key)
+            if old is not None:
+                self._bytes -= old.bytes
+                if self._stores.get(key) is not store:
+                    self._loads[key] = self._loads.get(key, 0) + 1
+                old.bytes = size
+                old.last_access = now
+            else:
+                self._residency[key] = _Residency(bytes=size, loaded_at=now, last_access=now)
+                self._loads[key] = self._loads.get(key, 0) + 1
+            self._stores[key] = store
+            self._stores.move_to_end(key)
+            self._bytes += size
+            if self.max_bytes:
+                while self._bytes > self.max_bytes and len(self._stores) > 1:
+                    victim, _ = self._stores.popitem(last=False)
+                    info = self._residency.pop(victim)
+                    self._bytes -= info.bytes
+                    self._evictions[victim] = self._evictions.get(victim, 0) + 1
+                    evicted.append((victim, info.bytes))
+        for victim, victim_bytes in evicted:
+            logger.info(
+                "[向量庫快取] 淘汰 assistant_id=%s bytes=%d (預算=%d 目前=%d)",
+                victim, victim_bytes, self.max_bytes, self._bytes,
+            )
+            if self._on_evict is not None:
+                try:
+                    self._on_evict(victim)
+                except Exception as e:
+                    logger.warning("[向量庫快取] on_evict 失敗 assistant_id=%s error=%s", victim, e)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            store = self._stores.pop(key, None)
+            if store is None:
+                return default
+            self._bytes -= self._residency.pop(key).bytes
+            return store
+
+    def refresh_size(self, key: Hashable) -> None:
+        """向量庫就地修改（add_documents / delete）後重新估算大小。"""
+        with self._lock:
+            store = self._stores.get(key)
+        if store is not None:
+            self.put(key, store)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            resident = [
+                {
+                    "assistant_id": key,
+                    "bytes": info.bytes,
+                    "hits": info.hits,
+                    "loads": self._loads.get(key, 0),
+                    "evictions": self._evictions.get(key, 0),
+                    "loaded_at": info.loaded_at,
+                    "last_access": info.last_access,
+                }
+                for key, info in ((k, self._residency[k]) for k in reversed(self._stores))
+            ]
+            evicted_only = {
+                key: count for key, count in self._evictions.items() if key not in self._stores
+            }
+            return {
+                "max_bytes": self.max_bytes,
+                "bytes": self._bytes,
+                "resident_count": len(resident),
+                "evictions_total": sum(self._evictions.values()),
+                "resident": resident,
+                "evicted": evicted_only,
+            }
+
+
+def vector_store_cache_max_bytes() -> int:
+    try:
+        max_mb = float(os.getenv("VECTOR_STORE_CACHE_MAX_MB", "2048"))
+    except ValueError:
+        max_mb = 2048.0
+    return int(max(0.0, max_mb) * 1024 * 1024)
@@ -227,9 +227,15 @@ export default function KnowledgeExistingPage() {
                       摘要
                     </Typography>
                     <Box>
-                      <ReactMarkdown remarkPlugins={[remarkGfm]}>
-                        {item.summary ?? ''}
-                      </ReactMarkdown>
+                      {['pending', 'running'].includes(item.summary_status) ? (
+                        <Typography variant="body2" color="text.secondary">
+                          摘要產生中…
+                        </Typography>
+                      ) : (
+                        <ReactMarkdown remarkPlugins={[remarkGfm]}>
+                          {item.summary ?? ''}
+                        </ReactMarkdown>
+                      )}
                     </Box>
                     {item.keywords && (
                       <>
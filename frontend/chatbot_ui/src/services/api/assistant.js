@@ -24,10 +24,41 @@ async function getDescriptionTemplate() {
   return data?.template ?? '';
 }
 
-async function uploadFile(assistantId, formData) {
-  return formDataApi.post(`${PATH}/${assistantId}/upload`, formData, {
-    timeout: 600000,
-  });
+const UPLOAD_JOB_POLL_INTERVAL_MS = 2000;
+
+function sleep(ms) {
+  return new Promise((resolve) => setTimeout(resolve, ms));
+}
+
+async function getUploadJob(assistantId, jobId) {
+  return api.get(`${PATH}/${assistantId}/uploads/${jobId}`);
+}
+
+// 上傳回 202 後於背景處理；輪詢工作狀態直到完成（失敗時拋出錯誤）
+async function waitForUploadJob(assistantId, jobId, onProgress) {
+  for (;;) {
+    const { data: job } = await getUploadJob(assistantId, jobId);
+    onProgress?.(job);
+    if (job.status === 'done') {
+      return job;
+    }
+    if (job.status === 'failed') {
+      const error = new Error(job.error || 'Upload job failed');
+      error.uploadJob = job;
+      throw error;
+    }
+    await sleep(UPLOAD_JOB_POLL_INTERVAL_MS);
+  }
+}
+
+async function uploadFile(assistantId, formData, onProgress) {
+  const accepted = await formDataApi.post(
+    `${PATH}/${assistantId}/upload`,
+    formData,
+    { timeout: 600000 }
+  );
+  const job = await waitForUploadJob(assistantId, accepted.job_id, onProgress);
+  return { ...accepted, data: job };
 }
 
 async function uploadUrl(assistantId, url) {
@@ -54,9 +85,7 @@ async function submitText(assistantId, text, fileName = '') {
 
   formData.append('file', blob, finalFileName);
 
-  return formDataApi.post(`${PATH}/${assistantId}/upload`, formData, {
-    timeout: 600000,
-  });
+  return uploadFile(assistantId, formData);
 }
 
 async function listAvailableNotebooks() {
@@ -78,6 +107,7 @@ export const assistant = {
   toggleStatus,
   getDescriptionTemplate,
   uploadFile,
+  getUploadJob,
   uploadUrl,
   submitText,
   listAvailableNotebooks,